@@ -6,6 +6,25 @@ from dotenv import load_dotenv
 
 logger = logging.getLogger(__name__)
 
+def _mark_engines_failed(detail):
+    """Settles any component the loader never reached, so routes stop returning 503."""
+    from app.services.engine_status import engine_status, FAILED
+    for component, info in engine_status.snapshot().items():
+        if info['state'] not in ('ready', 'disabled'):
+            engine_status.set(component, FAILED, detail)
+
+def _warm_query_engines(app):
+    """Builds the default RAG query engine once every component has settled."""
+    from app.services.engine_status import engine_status
+    if not engine_status.loading_finished():
+        return
+    vector_index = app.config.get('VECTOR_INDEX')
+    kg_index = app.config.get('KG_INDEX')
+    if vector_index or kg_index:
+        from app.services.query_engines import query_engine_registry
+        query_engine_registry.warm(vector_index, kg_index)
+        logger.info("Default RAG query engine built.")
+
 def create_app():
     """Application factory for the Flask backend."""
     logger.info("Creating Flask app instance...")
@@ -36,28 +55,47 @@ def create_app():
     # -----------------------------
     # Load RAG engines (FAISS + KG)
     # -----------------------------
+    # RAG_LOAD_MODE=background (default) loads in daemon threads so the worker
+    # serves /healthz, /readyz and non-RAG routes immediately; 'sync' blocks here.
     app.config['VECTOR_INDEX'] = None # Initialize as None
     app.config['KG_INDEX'] = None    # Initialize as None
+    rag_load_mode = os.getenv('RAG_LOAD_MODE', 'background').lower()
     try:
-        from app.services.rag_service import load_rag_engines
-        logger.info("Imported load_rag_engines. Attempting to load...")
-        vector_index_loaded, kg_index_loaded = load_rag_engines()
-        app.config['VECTOR_INDEX'] = vector_index_loaded
-        app.config['KG_INDEX'] = kg_index_loaded
-        
-        if vector_index_loaded and kg_index_loaded:
-            logger.info("RAG Engines (Vector Index + KG Index) loaded successfully.")
-        elif vector_index_loaded:
-            logger.warning("RAG Engines: Vector Index loaded, KG Index FAILED.")
-        elif kg_index_loaded:
-             logger.warning("RAG Engines: KG Index loaded, Vector Index FAILED.")
+        from app.services.rag_service import load_rag_engines, start_background_load, vector_index_manager
+
+        # Hot reloads of storage/ swap the vector index without a restart; keep app.config in step
+        def _on_vector_index_swap(vector_index_loaded):
+            app.config['VECTOR_INDEX'] = vector_index_loaded
+            _warm_query_engines(app)
+
+        vector_index_manager.add_listener(_on_vector_index_swap)
+        vector_index_manager.start_watcher_from_env()
+
+        if rag_load_mode == 'sync':
+            logger.info("Imported load_rag_engines. Attempting to load synchronously...")
+            vector_index_loaded, kg_index_loaded = load_rag_engines()
+            app.config['VECTOR_INDEX'] = vector_index_loaded
+            app.config['KG_INDEX'] = kg_index_loaded
+            _warm_query_engines(app)
         else:
-             logger.error("CRITICAL: Both Vector Index and KG Index FAILED to load.")
+            def _set_vector_index(vector_index_loaded):
+                app.config['VECTOR_INDEX'] = vector_index_loaded
+                logger.info("Vector Index " + ("loaded in background." if vector_index_loaded else "FAILED to load in background."))
+                _warm_query_engines(app)
+
+            def _set_kg_index(kg_index_loaded):
+                app.config['KG_INDEX'] = kg_index_loaded
+                logger.info("KG Index " + ("loaded in background." if kg_index_loaded else "not available (failed or disabled)."))
+                _warm_query_engines(app)
+
+            start_background_load(_set_vector_index, _set_kg_index)
 
     except ImportError as e:
         logger.error(f"ImportError: Failed to import 'load_rag_engines' from 'app.services.rag_service'. Check file and function names. Error: {e}", exc_info=True)
+        _mark_engines_failed(f"rag_service import failed: {e}")
     except Exception as e:
         logger.error(f"Error during RAG engine loading in __init__: {e}", exc_info=True)
+        _mark_engines_failed(str(e))
 
     # -----------------------------
     # Import & register blueprints
@@ -89,6 +127,24 @@ def create_app():
     except Exception as e:
          logger.error(f"Error registering chat blueprint: {e}", exc_info=True)
 
+    try:
+        from app.routes_health import health_bp
+        app.register_blueprint(health_bp)
+        logger.info("Health blueprint (/healthz, /readyz) registered.")
+    except ImportError as e:
+        logger.error(f"Health blueprint FAILED to load (routes_health.py missing or error): {e}", exc_info=True)
+    except Exception as e:
+         logger.error(f"Error registering health blueprint: {e}", exc_info=True)
+
+    try:
+        from app.routes_metrics import metrics_bp
+        app.register_blueprint(metrics_bp)
+        logger.info("Metrics blueprint (/metrics) registered.")
+    except ImportError as e:
+        logger.error(f"Metrics blueprint FAILED to load (routes_metrics.py missing or error): {e}", exc_info=True)
+    except Exception as e:
+         logger.error(f"Error registering metrics blueprint: {e}", exc_info=True)
+
     # --- NEW: Register the Misc (Location) Blueprint ---
     try:
         from app.routes_misc import misc_bp
@@ -0,0 +1,329 @@
+"""
+ASGI entry point (async serving mode), alongside the WSGI app in main.py.
+
+    uvicorn app.asgi:app --host 0.0.0.0 --port 5050
+
+The LLM-bound routes (/api/chat/message, /api/chat/report and
+/api/rag/rag_query) are served natively with async handlers that await
+acomplete / aquery, so one process holds many in-flight Gemini calls
+without a thread each. They take and return the same Pydantic models as
+the Flask routes. Every other route (auth, misc, health, stats) is the
+unchanged Flask app, mounted through a WSGI adapter.
+"""
+import os
+import asyncio
+import logging
+import threading
+from typing import Any, AsyncIterator, Callable, Iterator, Optional, Tuple
+
+from a2wsgi import WSGIMiddleware
+from fastapi import FastAPI, Request
+from fastapi.routing import APIRoute
+from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import JSONResponse, StreamingResponse
+from pydantic import ValidationError
+
+from app import create_app
+from app.models import ChatRequest, ChatResponse, ReportRequest, ReportResponse, RAGRequest, RAGResponse
+from app.services.engine_status import engine_status, LLM, EMBEDDER, VECTOR_INDEX, KG
+from app.services.streaming import EVENT_STREAM_MIMETYPE, format_sse
+from app.services.session_store import session_history, unknown_session
+from app.routes_health import RETRY_AFTER_SECONDS
+from app.services.metrics import stage_timer, record_fallback, request_started, request_finished, VALIDATION
+
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(name)s - %(message)s')
+logger = logging.getLogger(__name__)
+
+logger.info("Creating Flask app instance for the ASGI app...")
+flask_app = create_app()
+
+# Imported after create_app() so the services see the loaded .env
+from app.services.chat_service import ahandle_chat_message, agenerate_report, stream_chat_message
+from app.services.rag_service import (
+    aquery_rag, stream_query_rag, retrieve_chunks, chunk_sources, llm_synthesis_slot, RETRIEVAL_FALLBACK_ANSWER,
+    retrieval_fallback_events, LLMSynthesisError, LLM_ERROR, vector_index_manager
+)
+
+app = FastAPI(title="CuraAI backend (async)", docs_url=None, redoc_url=None, openapi_url=None)
+app.add_middleware(CORSMiddleware, allow_origins=["*"], allow_methods=["*"], allow_headers=["*"])
+
+
+@app.middleware("http")
+async def _request_metrics(request: Request, call_next):
+    """In-flight / latency metrics for the native routes; the mounted Flask app records its own."""
+    path = request.url.path
+    if path not in _NATIVE_PATHS:
+        return await call_next(request)
+    started = request_started()
+    status = 500
+    try:
+        response = await call_next(request)
+        status = response.status_code
+        return response
+    finally:
+        # For SSE responses this is the time until the stream starts
+        request_finished(started, path, status)
+
+
+# --- Helpers ---
+def _engines_unavailable(*components) -> Optional[JSONResponse]:
+    """ASGI counterpart of routes_health.engines_unavailable()."""
+    pending = engine_status.unsettled(components)
+    if not pending:
+        return None
+    logger.info(f"Rejecting request while engine components load: {pending}")
+    return JSONResponse(
+        {'error': 'Service is starting up, please retry shortly', 'pending_components': pending},
+        status_code=503,
+        headers={'Retry-After': RETRY_AFTER_SECONDS},
+    )
+
+
+def _wants_stream(request: Request, data: Optional[dict]) -> bool:
+    if data and data.get("stream") is not None:
+        return bool(data.get("stream"))
+    return EVENT_STREAM_MIMETYPE in request.headers.get("accept", "")
+
+
+# Frames a stream may buffer ahead of a slow client before its producer waits
+SSE_MAX_BUFFERED_FRAMES = int(os.getenv("SSE_MAX_BUFFERED_FRAMES", "256"))
+
+
+async def _stream_in_thread(make_events: Callable[[], Iterator[Tuple[str, Any]]]) -> AsyncIterator[str]:
+    """
+    Runs a synchronous (event, data) generator on one worker thread, inside a
+    Flask app context, and relays its SSE frames to the event loop.
+
+    When the client disconnects (the consumer is cancelled or closed) the
+    producer stops at its next event and closes the generator, which releases
+    the index lease and LLM slot it holds instead of finishing the answer for
+    nobody. At most SSE_MAX_BUFFERED_FRAMES frames wait for the client.
+    """
+    loop = asyncio.get_running_loop()
+    frames: "asyncio.Queue[Optional[str]]" = asyncio.Queue()
+    room = threading.Semaphore(SSE_MAX_BUFFERED_FRAMES)
+    stop = threading.Event()
+
+    def emit(frame: Optional[str]) -> bool:
+        # Waits for buffer room, but gives up as soon as the consumer has gone
+        while not room.acquire(timeout=0.5):
+            if stop.is_set():
+                return False
+        if stop.is_set():
+            return False
+        loop.call_soon_threadsafe(frames.put_nowait, frame)
+        return True
+
+    def produce():
+        try:
+            with flask_app.app_context():
+                events = make_events()
+                for event, data in events:
+                    if not emit(format_sse(event, data)):
+                        logger.info("Client disconnected; stopping the response stream.")
+                        break
+                # Closed here, in the app context and on this thread: runs the generator's cleanup
+                events.close()
+        except Exception as e:
+            logger.error(f"Error while streaming response: {e}", exc_info=True)
+            emit(format_sse("error", {"error": "Internal server error"}))
+        finally:
+            if not stop.is_set():
+                loop.call_soon_threadsafe(frames.put_nowait, None)
+
+    threading.Thread(target=produce, name="sse-stream", daemon=True).start()
+    try:
+        while True:
+            frame = await frames.get()
+            if frame is None:
+                break
+            room.release()
+            yield frame
+    finally:
+        stop.set()
+
+
+def _sse(make_events) -> StreamingResponse:
+    return StreamingResponse(
+        _stream_in_thread(make_events),
+        media_type=EVENT_STREAM_MIMETYPE,
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+
+async def _json_body(request: Request) -> Optional[dict]:
+    try:
+        data = await request.json()
+    except Exception:
+        return None
+    return data if isinstance(data, dict) else None
+
+
+# --- Async routes (same contracts as routes_chat / routes_rag) ---
+@app.post('/api/chat/message')
+async def handle_message_route(request: Request):
+    not_ready = _engines_unavailable(LLM)
+    if not_ready is not None:
+        return not_ready
+
+    data = await _json_body(request)
+    if not data:
+        return JSONResponse({'error': 'No JSON data provided'}, status_code=400)
+    try:
+        with stage_timer(VALIDATION):
+            chat_request = ChatRequest(**data)
+    except ValidationError as e:
+        logger.error(f"Chat message validation error: {e.json()}")
+        return JSONResponse({'error': 'Invalid request data', 'details': e.errors(include_url=False)}, status_code=400)
+
+    logger.info(f"Received chat message (async), session: {chat_request.session_id}")
+    if await asyncio.to_thread(unknown_session, chat_request.session_id, chat_request.history):
+        return JSONResponse({'error': 'Unknown or expired session_id'}, status_code=404)
+    if _wants_stream(request, data):
+        return _sse(lambda: stream_chat_message(
+            message=chat_request.message,
+            history=chat_request.history,
+            session_id=chat_request.session_id
+        ))
+
+    try:
+        with flask_app.app_context():
+            answer, sources, chat_type, session_id = await ahandle_chat_message(
+                message=chat_request.message,
+                history=chat_request.history,
+                session_id=chat_request.session_id
+            )
+        response_data = ChatResponse(answer=answer, sources=sources, type=chat_type, session_id=session_id)
+        return JSONResponse(response_data.model_dump())
+    except Exception as e:
+        logger.error(f"Error handling chat message: {e}", exc_info=True)
+        return JSONResponse({'error': 'Internal server error'}, status_code=500)
+
+
+@app.post('/api/chat/report')
+async def generate_report_route(request: Request):
+    not_ready = _engines_unavailable(LLM)
+    if not_ready is not None:
+        return not_ready
+
+    data = await _json_body(request)
+    if not data:
+        return JSONResponse({'error': 'No JSON data provided'}, status_code=400)
+    try:
+        with stage_timer(VALIDATION):
+            report_request = ReportRequest(**data)
+    except ValidationError as e:
+        logger.error(f"Report request validation error: {e.json()}")
+        return JSONResponse({'error': 'Invalid request data', 'details': e.errors(include_url=False)}, status_code=400)
+
+    history = report_request.history
+    if history is None:
+        history = await asyncio.to_thread(session_history, report_request.session_id)
+        if history is None:
+            return JSONResponse({'error': 'Unknown or expired session_id'}, status_code=404)
+
+    try:
+        disease_list, question_list = await agenerate_report(history=history, session_id=report_request.session_id)
+        response_data = ReportResponse(disease_list=disease_list, question_list=question_list)
+        return JSONResponse(response_data.model_dump())
+    except Exception as e:
+        logger.error(f"Error generating report: {e}", exc_info=True)
+        return JSONResponse({'error': 'Internal server error'}, status_code=500)
+
+
+@app.post('/api/rag/rag_query')
+async def rag_query_route(request: Request):
+    data = await _json_body(request)
+    retrieve_only = bool(data) and data.get("mode") == "retrieve"
+    not_ready = _engines_unavailable(EMBEDDER, VECTOR_INDEX) if retrieve_only else _engines_unavailable(EMBEDDER, VECTOR_INDEX, KG)
+    if not_ready is not None:
+        return not_ready
+
+    kg_index = flask_app.config.get("KG_INDEX")
+    if not vector_index_manager.current and not kg_index:
+        logger.error("RAG query failed: Indexes not loaded.")
+        return JSONResponse({"error": "RAG indexes not loaded"}, status_code=500)
+
+    try:
+        with stage_timer(VALIDATION):
+            req_data = RAGRequest(**(data or {}))
+    except ValidationError as e:
+        logger.error(f"RAG request validation error: {e.json()}")
+        return JSONResponse({"error": "Invalid request data", "details": e.errors(include_url=False)}, status_code=400)
+
+    if _wants_stream(request, data) and req_data.mode != "retrieve":
+        def events():
+            # The lease keeps this index generation open until the stream ends, across hot reloads
+            with vector_index_manager.lease() as vector_index, llm_synthesis_slot() as fallback_reason:
+                if fallback_reason is None:
+                    try:
+                        yield from stream_query_rag(
+                            vector_index, kg_index, req_data.user_question,
+                            top_k=req_data.top_k, ef_search=req_data.ef_search, nprobe=req_data.nprobe
+                        )
+                    except LLMSynthesisError:
+                        record_fallback(LLM_ERROR)
+                        fallback_reason = LLM_ERROR
+                if fallback_reason is not None:
+                    yield from retrieval_fallback_events(
+                        vector_index, req_data.user_question,
+                        top_k=req_data.top_k, ef_search=req_data.ef_search, nprobe=req_data.nprobe
+                    )
+            yield "done", {"fallback_reason": fallback_reason} if fallback_reason is not None else {}
+        return _sse(events)
+
+    with vector_index_manager.lease() as vector_index:
+        if req_data.mode == "retrieve":
+            return await _retrieval_response(vector_index, req_data)
+
+        try:
+            with llm_synthesis_slot() as fallback_reason:
+                if fallback_reason is not None:
+                    return await _retrieval_response(vector_index, req_data, fallback_reason)
+                answer, sources = await aquery_rag(
+                    vector_index, kg_index, req_data.user_question,
+                    top_k=req_data.top_k, ef_search=req_data.ef_search, nprobe=req_data.nprobe
+                )
+            return JSONResponse(RAGResponse(answer=answer, sources=sources).model_dump())
+        except LLMSynthesisError:
+            record_fallback(LLM_ERROR)
+            return await _retrieval_response(vector_index, req_data, LLM_ERROR)
+        except Exception as e:
+            logger.error(f"Error during RAG query in route: {e}", exc_info=True)
+            return JSONResponse({"error": "Internal server error"}, status_code=500)
+
+
+async def _retrieval_response(vector_index, req_data: RAGRequest, fallback_reason: Optional[str] = None) -> JSONResponse:
+    """ASGI counterpart of routes_rag._retrieval_response()."""
+    if not vector_index:
+        logger.error("Retrieval-only query failed: vector index not loaded.")
+        return JSONResponse({"error": "Vector index not loaded"}, status_code=500)
+    try:
+        chunks = await asyncio.to_thread(
+            retrieve_chunks, vector_index, req_data.user_question,
+            top_k=req_data.top_k, ef_search=req_data.ef_search, nprobe=req_data.nprobe
+        )
+        response_data = RAGResponse(
+            answer=RETRIEVAL_FALLBACK_ANSWER if fallback_reason else "",
+            sources=chunk_sources(chunks),
+            mode="retrieve",
+            chunks=chunks,
+            fallback_reason=fallback_reason,
+        )
+        return JSONResponse(response_data.model_dump())
+    except Exception as e:
+        logger.error(f"Error during retrieval-only query: {e}", exc_info=True)
+        return JSONResponse({"error": "Internal server error"}, status_code=500)
+
+
+_NATIVE_PATHS = frozenset(route.path for route in app.routes if isinstance(route, APIRoute))
+
+# Everything else is served by the Flask app
+app.mount("/", WSGIMiddleware(flask_app))
+
+
+if __name__ == '__main__':
+    import uvicorn
+    port = int(os.environ.get('PORT', 5050))
+    logger.info(f"Starting ASGI server on http://0.0.0.0:{port}")
+    uvicorn.run(app, host='0.0.0.0', port=port)
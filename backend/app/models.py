@@ -1,6 +1,6 @@
 # backend/app/models.py
 
-from pydantic import BaseModel, Field, EmailStr
+from pydantic import BaseModel, Field, EmailStr, model_validator
 from typing import List, Optional, Literal
 
 
@@ -38,8 +38,9 @@ class ChatMessage(BaseModel):
 
 class ChatRequest(BaseModel):
     message: str = Field(..., description="User's input message")
-    history: List[ChatMessage] = Field(..., description="Conversation history")
+    history: Optional[List[ChatMessage]] = Field(None, description="Conversation history (omit to use the server-side session)")
     session_id: Optional[str] = Field(None, description="Optional session ID")
+    stream: Optional[bool] = Field(None, description="Stream the answer as Server-Sent Events")
 
 
 class SourceNode(BaseModel):
@@ -59,8 +60,14 @@ class ChatResponse(BaseModel):
 # -----------------------------
 
 class ReportRequest(BaseModel):
-    # session_id: str = Field(..., description="Session ID for which report is requested") # 👈 GUTTED
-    history: List[ChatMessage] = Field(..., description="Full chat history to generate report from") # 👈 NEW
+    session_id: Optional[str] = Field(None, description="Session whose stored history the report is generated from")
+    history: Optional[List[ChatMessage]] = Field(None, description="Full chat history to generate report from") # 👈 NEW
+
+    @model_validator(mode='after')
+    def _history_or_session(self):
+        if self.history is None and not self.session_id:
+            raise ValueError("Either 'history' or 'session_id' is required")
+        return self
 
 
 class ReportResponse(BaseModel):
@@ -78,8 +85,26 @@ class ReportResponse(BaseModel):
 
 class RAGRequest(BaseModel):
     user_question: str = Field(..., description="User's question for RAG engine")
+    top_k: Optional[int] = Field(None, ge=1, le=50, description="Number of chunks to retrieve (default 5)")
+    ef_search: Optional[int] = Field(None, ge=1, le=1024, description="HNSW search depth (HNSW indexes only)")
+    nprobe: Optional[int] = Field(None, ge=1, le=1024, description="IVF lists to probe (IVF indexes only)")
+    stream: Optional[bool] = Field(None, description="Stream the answer as Server-Sent Events")
+    mode: Literal['answer', 'retrieve'] = Field('answer', description="'retrieve' returns the top chunks without calling the LLM")
+
+
+class RetrievedChunk(BaseModel):
+    text: str = Field(..., description="Chunk text")
+    doc_id: str = Field(..., description="ID of the source document")
+    entity_type: Optional[str] = Field(None, description="Entity type of the source (e.g. disease)")
+    type: Optional[str] = Field(None, description="Chunk type (e.g. faq, overview)")
+    score: float = Field(..., description="Cosine similarity to the question")
+    name: Optional[str] = Field(None, description="Title of the source document")
+    url: Optional[str] = Field(None, description="URL of the source document")
 
 
 class RAGResponse(BaseModel):
-    answer: str = Field(..., description="RAG engine's generated answer")
-    sources: List[SourceNode] = Field(..., description="List of cited sources")
\ No newline at end of file
+    answer: str = Field(..., description="RAG engine's generated answer (empty in retrieve mode)")
+    sources: List[SourceNode] = Field(..., description="List of cited sources")
+    mode: Literal['answer', 'retrieve'] = Field('answer', description="How the response was produced")
+    chunks: Optional[List[RetrievedChunk]] = Field(None, description="Top chunks (retrieve mode and LLM fallback)")
+    fallback_reason: Optional[str] = Field(None, description="Why an answer request was served retrieval-only")
\ No newline at end of file
@@ -7,7 +7,12 @@ from functools import wraps
 from app.models import ChatRequest, ChatResponse, ReportRequest, ReportResponse
 
 # Import the service functions at the top level
-from app.services.chat_service import handle_chat_message, generate_report
+from app.services.chat_service import handle_chat_message, stream_chat_message, generate_report
+from app.services.streaming import wants_stream, sse_response
+from app.services.session_store import session_history, unknown_session
+from app.services.engine_status import LLM
+from app.services.metrics import stage_timer, VALIDATION
+from app.routes_health import engines_unavailable
 
 logger = logging.getLogger(__name__)
 
@@ -32,14 +37,29 @@ def token_required(f):
 # @token_required
 def handle_message_route():
     """Handles incoming chat messages, routes them, saves history."""
-    # (This route is untouched, it was already correct)
+    # Every chat turn needs the LLM (router + nurse), so wait for it to load
+    not_ready = engines_unavailable(LLM)
+    if not_ready is not None:
+        return not_ready
+
     try:
         data = request.get_json()
         if not data:
             return jsonify({'error': 'No JSON data provided'}), 400
 
-        chat_request = ChatRequest(**data)
+        with stage_timer(VALIDATION):
+            chat_request = ChatRequest(**data)
         logger.info(f"Received chat message, session: {chat_request.session_id}") 
+        if unknown_session(chat_request.session_id, chat_request.history):
+            return jsonify({'error': 'Unknown or expired session_id'}), 404
+
+        if wants_stream(data):
+            # sources -> answer tokens -> done (with session_id) as Server-Sent Events
+            return sse_response(stream_chat_message(
+                message=chat_request.message,
+                history=chat_request.history,
+                session_id=chat_request.session_id
+            ))
 
         answer, sources, chat_type, session_id = handle_chat_message(
             message=chat_request.message,
@@ -67,18 +87,29 @@ def handle_message_route():
 # @token_required
 def generate_report_route():
     """Generates the final report based on a chat session."""
+    not_ready = engines_unavailable(LLM)
+    if not_ready is not None:
+        return not_ready
+
     try:
         data = request.get_json()
         if not data:
             return jsonify({'error': 'No JSON data provided'}), 400
 
-        # 1. Use new ReportRequest (expects 'history')
-        report_request = ReportRequest(**data)
-        logger.info(f"Received report request, history length: {len(report_request.history)}")
+        # 1. Use new ReportRequest ('history', or a 'session_id' kept server-side)
+        with stage_timer(VALIDATION):
+            report_request = ReportRequest(**data)
+        history = report_request.history
+        if history is None:
+            history = session_history(report_request.session_id)
+            if history is None:
+                return jsonify({'error': 'Unknown or expired session_id'}), 404
+        logger.info(f"Received report request, history length: {len(history)}")
 
         # 2. Call generate_report with 'history'
         disease_list, question_list = generate_report(
-            history=report_request.history
+            history=history,
+            session_id=report_request.session_id
         )
 
         # 3. Use new ReportResponse (returns 'disease_list' and 'question_list')
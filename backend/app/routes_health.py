@@ -0,0 +1,59 @@
+import os
+import logging
+from flask import Blueprint, jsonify
+
+from app.services.engine_status import engine_status, READY, LLM, EMBEDDER, VECTOR_INDEX
+
+logger = logging.getLogger(__name__)
+
+# No url_prefix: load balancers probe /healthz and /readyz at the root
+health_bp = Blueprint('health', __name__)
+
+# Components that must be READY before /readyz reports ready (comma separated)
+READINESS_COMPONENTS = [
+    name.strip()
+    for name in os.getenv('READINESS_COMPONENTS', f"{LLM},{EMBEDDER},{VECTOR_INDEX}").split(',')
+    if name.strip()
+]
+
+# Seconds clients should wait before retrying a 503 from a warming-up worker
+RETRY_AFTER_SECONDS = os.getenv('ENGINE_RETRY_AFTER_SECONDS', '5')
+
+
+def engines_unavailable(*components):
+    """
+    Returns a 503 response if any of the given components is still loading,
+    or None if they have all settled (ready, failed or disabled).
+    Routes handle the failed/disabled cases themselves, as before.
+    """
+    pending = engine_status.unsettled(components)
+    if not pending:
+        return None
+    logger.info(f"Rejecting request while engine components load: {pending}")
+    response = jsonify({
+        'error': 'Service is starting up, please retry shortly',
+        'pending_components': pending,
+    })
+    response.status_code = 503
+    response.headers['Retry-After'] = RETRY_AFTER_SECONDS
+    return response
+
+
+@health_bp.route('/healthz', methods=['GET'])
+def healthz():
+    """Liveness: the process is up and serving requests."""
+    return jsonify({'status': 'ok'}), 200
+
+
+@health_bp.route('/readyz', methods=['GET'])
+def readyz():
+    """Readiness: the components in READINESS_COMPONENTS are loaded."""
+    components = engine_status.snapshot()
+    not_ready = [name for name in READINESS_COMPONENTS if components.get(name, {}).get('state') != READY]
+    body = {
+        'status': 'ready' if not not_ready else 'not_ready',
+        'loading_finished': engine_status.loading_finished(),
+        'not_ready': not_ready,
+        'components': components,
+    }
+    return jsonify(body), (200 if not not_ready else 503)
@@ -0,0 +1,42 @@
+import logging
+from flask import Blueprint, Response, g, jsonify, request
+
+from app.services.metrics import METRICS_ENABLED, render_metrics, request_started, request_finished
+
+logger = logging.getLogger(__name__)
+
+# No url_prefix: Prometheus scrapes /metrics at the root
+metrics_bp = Blueprint('metrics', __name__)
+
+
+@metrics_bp.before_app_request
+def _start_request_metrics():
+    if request.path != '/metrics':
+        g.metrics_started = request_started()
+
+
+@metrics_bp.after_app_request
+def _record_response_status(response):
+    g.metrics_status = response.status_code
+    return response
+
+
+@metrics_bp.teardown_app_request
+def _finish_request_metrics(exc):
+    # Teardown also runs for unhandled errors (no after_request) and after SSE streams end
+    started = g.pop('metrics_started', None)
+    endpoint = request.url_rule.rule if request.url_rule else 'unmatched'
+    request_finished(started, endpoint, g.pop('metrics_status', 500))
+
+
+@metrics_bp.route('/metrics', methods=['GET'])
+def metrics():
+    """Prometheus scrape endpoint (aggregated over all workers in multiprocess mode)."""
+    if not METRICS_ENABLED:
+        return jsonify({'error': 'Metrics disabled (prometheus_client not installed or METRICS_ENABLED off)'}), 404
+    try:
+        body, content_type = render_metrics()
+    except Exception as e:
+        logger.error(f"Failed to render metrics: {e}", exc_info=True)
+        return jsonify({'error': 'Internal server error'}), 500
+    return Response(body, content_type=content_type)
@@ -5,6 +5,9 @@ import googlemaps
 from pydantic import BaseModel, Field, ValidationError
 from typing import List
 
+from app.services.fakes import FakeMapsClient, env_flag
+from app.services.metrics import stage_timer, MAPS_API, VALIDATION
+
 logger = logging.getLogger(__name__)
 
 # --- Pydantic Model for Request ---
@@ -29,7 +32,8 @@ def find_nearby_hospitals():
     Finds nearby hospitals based on user's latitude and longitude.
     """
     try:
-        data = LocationRequest(**request.get_json())
+        with stage_timer(VALIDATION):
+            data = LocationRequest(**request.get_json())
     except ValidationError as e:
         logger.error(f"Location request validation error: {e.json()}")
         return jsonify({'error': 'Invalid request data', 'details': e.errors()}), 400
@@ -37,21 +41,24 @@ def find_nearby_hospitals():
         logger.error(f"Invalid JSON data: {e}")
         return jsonify({"error": f"Invalid JSON data: {e}"}), 400
 
+    use_fake_maps = env_flag('FAKE_MAPS')
     api_key = os.getenv('GOOGLE_API_KEY')
-    if not api_key:
+    if not api_key and not use_fake_maps:
         logger.error("GOOGLE_API_KEY is not set. Cannot search for hospitals.")
         return jsonify({'error': 'Server configuration error: Missing API key'}), 500
 
     try:
-        gmaps = googlemaps.Client(key=api_key)
+        # FAKE_MAPS=true serves deterministic results offline (load tests)
+        gmaps = FakeMapsClient.from_env() if use_fake_maps else googlemaps.Client(key=api_key)
         
         logger.info(f"Searching for hospitals near ({data.latitude}, {data.longitude})")
         
-        places_result = gmaps.places_nearby(
-            location=(data.latitude, data.longitude),
-            radius=10000,  # 10km radius
-            type='hospital'
-        )
+        with stage_timer(MAPS_API):
+            places_result = gmaps.places_nearby(
+                location=(data.latitude, data.longitude),
+                radius=10000,  # 10km radius
+                type='hospital'
+            )
 
         results = places_result.get('results', [])
         hospital_list = []
@@ -1,8 +1,20 @@
+import os
+import hmac
 import logging
 from flask import Blueprint, request, jsonify, current_app
 from pydantic import ValidationError
 from app.models import RAGRequest, RAGResponse
-from app.services.rag_service import query_rag
+from app.services.rag_service import (
+    cached_query_rag, stream_query_rag, semantic_answer_cache,
+    retrieve_chunks, chunk_sources, llm_synthesis_slot, rag_llm_budget, RETRIEVAL_FALLBACK_ANSWER,
+    retrieval_fallback_events, LLMSynthesisError, LLM_ERROR, vector_index_manager
+)
+from app.services.streaming import wants_stream, sse_response
+from app.services.embedding_batcher import get_embedding_batcher
+from llama_index.core import Settings
+from app.services.engine_status import EMBEDDER, VECTOR_INDEX, KG
+from app.services.metrics import stage_timer, record_fallback, VALIDATION
+from app.routes_health import engines_unavailable
 
 logger = logging.getLogger(__name__)
 
@@ -13,15 +25,22 @@ rag_bp = Blueprint('rag', __name__, url_prefix='/api/rag')
 # TODO: Add @token_required decorator in Phase 3
 def rag_query_route():
     logger.info("RAG query route hit.")
-    vector_index = current_app.config.get("VECTOR_INDEX")
+    data = request.get_json(silent=True)
+    # Retrieval-only requests never touch the LLM, so they don't wait for it to load
+    retrieve_only = isinstance(data, dict) and data.get("mode") == "retrieve"
+    not_ready = engines_unavailable(EMBEDDER, VECTOR_INDEX) if retrieve_only else engines_unavailable(EMBEDDER, VECTOR_INDEX, KG)
+    if not_ready is not None:
+        return not_ready
+
     kg_index = current_app.config.get("KG_INDEX")
 
-    if not vector_index and not kg_index:
+    if not vector_index_manager.current and not kg_index:
         logger.error("RAG query failed: Indexes not loaded.")
         return jsonify({"error": "RAG indexes not loaded"}), 500
 
     try:
-        req_data = RAGRequest(**request.json)
+        with stage_timer(VALIDATION):
+            req_data = RAGRequest(**request.json)
     except ValidationError as e:
         logger.error(f"RAG request validation error: {e.json()}")
         return jsonify({"error": "Invalid request data", "details": e.errors()}), 400
@@ -29,10 +48,147 @@ def rag_query_route():
         logger.error(f"Invalid JSON data: {e}")
         return jsonify({"error": f"Invalid JSON data: {e}"}), 400
 
+    if wants_stream(request.json) and req_data.mode != "retrieve":
+        def events():
+            # The lease keeps this index generation open until the stream ends, across hot reloads
+            with vector_index_manager.lease() as vector_index, llm_synthesis_slot() as fallback_reason:
+                if fallback_reason is None:
+                    try:
+                        yield from stream_query_rag(
+                            vector_index, kg_index, req_data.user_question,
+                            top_k=req_data.top_k, ef_search=req_data.ef_search, nprobe=req_data.nprobe
+                        )
+                    except LLMSynthesisError:
+                        record_fallback(LLM_ERROR)
+                        fallback_reason = LLM_ERROR
+                if fallback_reason is not None:
+                    yield from retrieval_fallback_events(
+                        vector_index, req_data.user_question,
+                        top_k=req_data.top_k, ef_search=req_data.ef_search, nprobe=req_data.nprobe
+                    )
+            yield "done", {"fallback_reason": fallback_reason} if fallback_reason is not None else {}
+        return sse_response(events())
+
+    with vector_index_manager.lease() as vector_index:
+        if req_data.mode == "retrieve":
+            return _retrieval_response(vector_index, req_data)
+
+        try:
+            with llm_synthesis_slot() as fallback_reason:
+                if fallback_reason is not None:
+                    return _retrieval_response(vector_index, req_data, fallback_reason)
+                answer, sources = cached_query_rag(
+                    vector_index, kg_index, req_data.user_question,
+                    top_k=req_data.top_k, ef_search=req_data.ef_search, nprobe=req_data.nprobe
+                )
+            response_data = RAGResponse(answer=answer, sources=sources)
+            return jsonify(response_data.model_dump()) # Use .model_dump()
+        except LLMSynthesisError:
+            record_fallback(LLM_ERROR)
+            return _retrieval_response(vector_index, req_data, LLM_ERROR)
+        except Exception as e:
+            logger.error(f"Error during RAG query in route: {e}", exc_info=True)
+            return jsonify({"error": "Internal server error"}), 500
+
+
+def _retrieval_response(vector_index, req_data: RAGRequest, fallback_reason: str = None):
+    """Top chunks without an LLM answer: retrieve mode, or the fallback when the LLM can't be used."""
+    if not vector_index:
+        logger.error("Retrieval-only query failed: vector index not loaded.")
+        return jsonify({"error": "Vector index not loaded"}), 500
     try:
-        answer, sources = query_rag(vector_index, kg_index, req_data.user_question)
-        response_data = RAGResponse(answer=answer, sources=sources)
-        return jsonify(response_data.model_dump()) # Use .model_dump()
+        chunks = retrieve_chunks(
+            vector_index, req_data.user_question,
+            top_k=req_data.top_k, ef_search=req_data.ef_search, nprobe=req_data.nprobe
+        )
+        response_data = RAGResponse(
+            answer=RETRIEVAL_FALLBACK_ANSWER if fallback_reason else "",
+            sources=chunk_sources(chunks),
+            mode="retrieve",
+            chunks=chunks,
+            fallback_reason=fallback_reason,
+        )
+        return jsonify(response_data.model_dump())
     except Exception as e:
-        logger.error(f"Error during RAG query in route: {e}", exc_info=True)
-        return jsonify({"error": "Internal server error"}), 500
\ No newline at end of file
+        logger.error(f"Error during retrieval-only query: {e}", exc_info=True)
+        return jsonify({"error": "Internal server error"}), 500
+
+
+@rag_bp.route('/cache_stats', methods=['GET'])
+def cache_stats_route():
+    """Hit/miss counters and size of the semantic answer cache."""
+    if semantic_answer_cache is None:
+        return jsonify({"enabled": False})
+    return jsonify({"enabled": True, **semantic_answer_cache.stats()})
+
+
+@rag_bp.route('/llm_cache_stats', methods=['GET'])
+def llm_cache_stats_route():
+    """Entries and hit/miss counters of the on-disk LLM prompt cache (this worker's counters)."""
+    cache = getattr(Settings.llm, "cache", None) if Settings.llm else None
+    if cache is None:
+        return jsonify({"enabled": False})
+    return jsonify({"enabled": True, **cache.stats()})
+
+
+@rag_bp.route('/faq_stats', methods=['GET'])
+def faq_stats_route():
+    """Size, threshold and hit rate of the FAQ fast path (this worker's counters)."""
+    faq_index = getattr(vector_index_manager.current, "faq_index", None)
+    if faq_index is None:
+        return jsonify({"enabled": False})
+    return jsonify({"enabled": True, **faq_index.stats()})
+
+
+@rag_bp.route('/llm_budget_stats', methods=['GET'])
+def llm_budget_stats_route():
+    """In-flight RAG synthesis calls and requests served retrieval-only for lack of budget."""
+    return jsonify(rag_llm_budget.stats())
+
+
+@rag_bp.route('/batcher_stats', methods=['GET'])
+def batcher_stats_route():
+    """Queue depth and batch size histograms of the embedding micro-batcher."""
+    batcher = get_embedding_batcher()
+    if batcher is None:
+        return jsonify({"enabled": False})
+    return jsonify({"enabled": True, **batcher.stats()})
+
+
+@rag_bp.route('/index/stats', methods=['GET'])
+def index_stats_route():
+    """Live and draining vector index generations, their memory and the last reload (this worker)."""
+    return jsonify(vector_index_manager.stats())
+
+
+@rag_bp.route('/index/reload', methods=['POST'])
+def index_reload_route():
+    """
+    Rebuilds the vector index from storage/ and swaps it in without dropping
+    requests (this worker only; the storage watcher reaches every worker).
+    Needs the INDEX_ADMIN_TOKEN in an X-Admin-Token header. ?wait=true
+    blocks until the new generation is live or the reload failed.
+    """
+    admin_token = os.getenv("INDEX_ADMIN_TOKEN")
+    if not admin_token:
+        return jsonify({"error": "Index reload endpoint disabled (INDEX_ADMIN_TOKEN not set)"}), 403
+    if not hmac.compare_digest(request.headers.get("X-Admin-Token", ""), admin_token):
+        return jsonify({"error": "Invalid admin token"}), 403
+
+    wait = request.args.get("wait", "false").lower() in ("1", "true", "yes")
+    if not vector_index_manager.reload("admin endpoint", wait=wait):
+        return jsonify({"error": "A reload is already in progress", **vector_index_manager.stats()}), 409
+    if not wait:
+        return jsonify({"started": True}), 202
+    stats = vector_index_manager.stats()
+    status_code = 200 if (stats["last_reload"] or {}).get("status") == "swapped" else 500
+    return jsonify(stats), status_code
+
+
+@rag_bp.route('/shard_stats', methods=['GET'])
+def shard_stats_route():
+    """Per-shard sizes, latency, timeouts and partial answers of the sharded vector index (this worker)."""
+    vector_index = vector_index_manager.current
+    if not hasattr(vector_index, "shards"):
+        return jsonify({"enabled": False})
+    return jsonify({"enabled": True, **vector_index.stats()})
@@ -0,0 +1,43 @@
+"""
+Atomic writes for the files the build scripts publish to storage/.
+
+atomic_path() hands out a temporary name in the target's directory; the
+file is renamed over the target with os.replace only once it is complete,
+so a server (or its hot-reload watcher) sees either the old file or the
+whole new one, never a truncated one.
+"""
+import os
+import json
+import tempfile
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Any, Iterator, Union
+
+
+def published_file_mode() -> int:
+    """0644 minus the umask: mkstemp creates 0600, which a server running as another user can't read."""
+    umask = os.umask(0)
+    os.umask(umask)
+    return 0o644 & ~umask
+
+
+@contextmanager
+def atomic_path(path: Union[str, Path]) -> Iterator[str]:
+    """Yields a temporary file name to write; on success it replaces path, on error it is removed."""
+    path = Path(path)
+    fd, tmp_name = tempfile.mkstemp(dir=path.parent, prefix=path.name, suffix=".tmp")
+    os.close(fd)
+    try:
+        yield tmp_name
+        os.chmod(tmp_name, published_file_mode())
+        os.replace(tmp_name, path)
+    except BaseException:
+        if os.path.exists(tmp_name):
+            os.remove(tmp_name)
+        raise
+
+
+def write_json(path: Union[str, Path], data: Any, **dump_kwargs: Any) -> None:
+    with atomic_path(path) as tmp_name:
+        with open(tmp_name, "w", encoding="utf-8") as f:
+            json.dump(data, f, **dump_kwargs)
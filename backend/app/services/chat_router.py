@@ -0,0 +1,218 @@
+"""
+Local RAG / SYMPTOM routing for chat messages.
+
+handle_chat_message() used to spend a full LLM round trip per message just
+to pick a mode. Most messages are decided here instead: keyword rules catch
+the obvious cases, then the message embedding is compared against labeled
+example utterances (per-class kNN). Only when neither is confident does the
+caller fall back to the LLM router.
+"""
+import os
+import re
+import logging
+import threading
+from typing import Dict, List, NamedTuple, Optional, Sequence, Tuple
+
+import numpy as np
+
+from app.services.embedding_batcher import encode_texts, get_embedding_batcher, BATCH_RESULT_TIMEOUT
+from app.services.engine_status import engine_status, EMBEDDER
+
+logger = logging.getLogger(__name__)
+
+RAG = "RAG"
+SYMPTOM = "SYMPTOM"
+
+# --- Keyword rules (see keyword_route() for the order) ---
+_GREETING = re.compile(r"^\s*(hi|hello|hey|good (morning|afternoon|evening)|thanks|thank you|ok(ay)?)\b[\s!.,]*$", re.IGNORECASE)
+_FIRST_PERSON_SYMPTOM = re.compile(
+    r"\b(i|i'm|i've|im|ive|my|me)\b.*\b(pain|hurts?|hurting|ache|aching|sore|fever|cough|dizzy|nausea|nauseous|"
+    r"vomit\w*|rash|itch\w*|swollen|swelling|bleeding|tired|fatigue|headache|feel|feeling|suffer\w*|"
+    r"experienc\w*|sick|ill|can't sleep|short of breath)\b",
+    re.IGNORECASE,
+)
+_FACTUAL_QUESTION = re.compile(
+    r"^\s*((can|could|would)\s+you\s+(please\s+)?)?"
+    r"(what\s+(is|are|does|causes?)|define|definition of|explain(\s+to\s+me)?|tell me about|how\s+(is|are)\s+\w+.*\s+"
+    r"(treated|diagnosed|prevented|spread|transmitted)|what\s+are\s+the\s+(symptoms|causes|treatments|side effects|risk factors))\b",
+    re.IGNORECASE,
+)
+_FIRST_PERSON = re.compile(r"\b(i|i'm|i've|im|ive|my|me)\b", re.IGNORECASE)
+_INTERROGATIVE = re.compile(
+    r"^\s*(how|what|when|where|why|which|who|can|could|should|would|will|is|are|do|does|did|may|might)\b",
+    re.IGNORECASE,
+)
+
+# --- Labeled example utterances for the embedding classifier ---
+EXAMPLE_UTTERANCES: Dict[str, Tuple[str, ...]] = {
+    RAG: (
+        "What is an MRI?",
+        "What is diabetes?",
+        "What are the symptoms of asthma?",
+        "What causes migraines?",
+        "How is pneumonia treated?",
+        "What are the side effects of ibuprofen?",
+        "Is hepatitis B contagious?",
+        "What is the difference between type 1 and type 2 diabetes?",
+        "How is a colonoscopy performed?",
+        "What does a high white blood cell count mean?",
+        "Can high blood pressure be cured?",
+        "What are the risk factors for heart disease?",
+        "How long does the flu vaccine last?",
+        "Explain what an autoimmune disease is.",
+        "What is the normal range for cholesterol?",
+        "How is strep throat diagnosed?",
+        "What foods should people with gout avoid?",
+        "What is chemotherapy?",
+        "How do antibiotics work?",
+        "Tell me about Lyme disease.",
+    ),
+    SYMPTOM: (
+        "I have a headache and feel dizzy.",
+        "My stomach has been hurting since yesterday.",
+        "I've had a fever for three days.",
+        "I keep coughing at night.",
+        "My chest feels tight when I walk.",
+        "I feel very tired all the time.",
+        "There is a rash on my arm that itches.",
+        "My throat is sore and it hurts to swallow.",
+        "I threw up twice this morning.",
+        "My knee is swollen after I fell.",
+        "I can't sleep and my heart races.",
+        "It started two days ago.",
+        "The pain is sharp and on the left side.",
+        "It gets worse when I lie down.",
+        "I'm not feeling well today.",
+        "My child has a high temperature.",
+        "I have trouble breathing when I climb stairs.",
+        "My back hurts when I bend over.",
+        "I noticed blood when I cough.",
+        "Hello, I'm not feeling good.",
+    ),
+}
+
+
+class RouteDecision(NamedTuple):
+    mode: str                  # RAG or SYMPTOM
+    source: str                # "keyword" or "embedding"
+    confidence: float
+    embedding: Optional[List[float]] = None  # Message embedding, reusable by the RAG path
+
+
+def is_question(message: str) -> bool:
+    return message.rstrip().endswith("?") or bool(_INTERROGATIVE.match(message))
+
+
+def keyword_route(message: str) -> Optional[str]:
+    """Fast rules for unambiguous messages; None when no rule applies."""
+    if _GREETING.match(message):
+        return SYMPTOM
+    # Factual openers first: "Tell me about fever" names a symptom but asks for information
+    factual = _FACTUAL_QUESTION.match(message)
+    if factual:
+        # "What does it mean if I feel dizzy?" is both; leave it to the classifier / LLM
+        return RAG if not _FIRST_PERSON.search(message[factual.end():]) else None
+    # "Can I take ibuprofen for a headache?" asks for information about a symptom; only statements are reports
+    if _FIRST_PERSON_SYMPTOM.search(message) and not is_question(message):
+        return SYMPTOM
+    return None
+
+
+class ChatIntentRouter:
+    """Per-class kNN over embedded example utterances."""
+
+    def __init__(
+        self,
+        examples: Dict[str, Sequence[str]] = EXAMPLE_UTTERANCES,
+        k: int = 3,
+        min_similarity: float = 0.45,
+        min_margin: float = 0.05,
+    ):
+        self.examples = {label: tuple(texts) for label, texts in examples.items()}
+        self.k = k
+        self.min_similarity = min_similarity
+        self.min_margin = min_margin
+        self._lock = threading.Lock()
+        self._matrix: Optional[np.ndarray] = None
+        self._labels: Optional[np.ndarray] = None
+        self.decisions = {"keyword": 0, "embedding": 0, "uncertain": 0}
+
+    def _ensure_examples(self) -> None:
+        # Embedded lazily, once the embedder has loaded
+        if self._matrix is not None:
+            return
+        with self._lock:
+            if self._matrix is not None:
+                return
+            labels, texts = [], []
+            for label, utterances in self.examples.items():
+                labels.extend([label] * len(utterances))
+                texts.extend(utterances)
+            matrix = np.asarray(encode_texts(texts), dtype="float32")
+            matrix /= np.maximum(np.linalg.norm(matrix, axis=1, keepdims=True), 1e-12)
+            self._labels = np.asarray(labels)
+            self._matrix = matrix
+            logger.info(f"Chat router embedded {len(texts)} example utterances.")
+
+    def _embed(self, message: str) -> np.ndarray:
+        batcher = get_embedding_batcher()
+        if batcher is not None:
+            return batcher.embed(message, timeout=BATCH_RESULT_TIMEOUT)
+        return np.asarray(encode_texts([message])[0], dtype="float32")
+
+    def scores(self, embedding: np.ndarray) -> Dict[str, float]:
+        """Mean of the top-k example similarities per label."""
+        self._ensure_examples()
+        query = np.asarray(embedding, dtype="float32").ravel()
+        query = query / max(float(np.linalg.norm(query)), 1e-12)
+        similarities = self._matrix @ query
+        result = {}
+        for label in self.examples:
+            label_sims = np.sort(similarities[self._labels == label])[::-1][:self.k]
+            result[label] = float(label_sims.mean()) if len(label_sims) else 0.0
+        return result
+
+    def classify(self, message: str) -> Optional[RouteDecision]:
+        """Returns a confident RouteDecision, or None to defer to the LLM router."""
+        mode = keyword_route(message)
+        if mode is not None:
+            self.decisions["keyword"] += 1
+            return RouteDecision(mode, "keyword", 1.0)
+
+        if not engine_status.is_ready(EMBEDDER):
+            self.decisions["uncertain"] += 1
+            return None
+
+        try:
+            embedding = self._embed(message)
+            scores = self.scores(embedding)
+        except Exception as e:
+            logger.error(f"Local chat routing failed, deferring to LLM: {e}", exc_info=True)
+            self.decisions["uncertain"] += 1
+            return None
+
+        ranked = sorted(scores.items(), key=lambda item: item[1], reverse=True)
+        (best_label, best), (_, runner_up) = ranked[0], ranked[1]
+        logger.debug(f"Chat router scores: {scores}")
+        if best < self.min_similarity or best - runner_up < self.min_margin:
+            self.decisions["uncertain"] += 1
+            return None
+
+        self.decisions["embedding"] += 1
+        return RouteDecision(best_label, "embedding", best - runner_up, np.asarray(embedding).tolist())
+
+
+def router_from_env() -> Optional[ChatIntentRouter]:
+    """Router configured from CHAT_ROUTER_* env vars, or None when disabled."""
+    if os.getenv("CHAT_ROUTER_ENABLED", "true").lower() not in ("1", "true", "yes"):
+        logger.info("Local chat router disabled; every message is routed by the LLM.")
+        return None
+    return ChatIntentRouter(
+        k=int(os.getenv("CHAT_ROUTER_K", "3")),
+        min_similarity=float(os.getenv("CHAT_ROUTER_MIN_SIMILARITY", "0.45")),
+        min_margin=float(os.getenv("CHAT_ROUTER_MIN_MARGIN", "0.05")),
+    )
+
+
+# Process-wide router (None when CHAT_ROUTER_ENABLED is off)
+chat_router = router_from_env()
@@ -2,10 +2,20 @@ import logging
 import os
 import json
 import re 
+import time
+import asyncio
+import threading
 from flask import current_app
-from typing import List, Dict, Tuple, Any
+from typing import List, Dict, Tuple, Any, Optional, NamedTuple, Sequence, Iterator
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeoutError
+from contextlib import contextmanager
 
-from app.services.rag_service import query_rag
+from app.services.rag_service import cached_query_rag, stream_query_rag, aquery_rag, vector_index_manager, LLMSynthesisError
+from app.services.chat_router import chat_router
+from app.services.session_store import resolve_history, record_turn
+from app.services.history_compaction import compact_history, ROUTER, NURSE, REPORT
+from app.services.metrics import stage_timer, record_llm_error, ROUTE, ROUTER_LLM, REPORT_SECTION
+from app.services.llm_cache import llm_cache_site
 from llama_index.core import Settings 
 
 try:
@@ -32,119 +42,399 @@ def _parse_json_list(llm_output: str) -> List[str]:
         logger.error(f"Failed to parse JSON from LLM output: {e}. Output was: {llm_output}")
         return []
 
-def handle_chat_message(message: str, history: List[ChatMessage], session_id: str) -> Tuple[str, List[Dict[str, Any]], str, str]:
-    logger.info(f"Handling smart chat message for session {session_id}...")
-    llm = Settings.llm
-    if not llm:
-        logger.error("LLM (Settings.llm) is not available.")
-        return "Sorry, the AI service is not configured.", [], "SYMPTOM", session_id
-
-    history_str = "\n".join([f"{msg.role}: {msg.content}" for msg in history])
-    
-    router_prompt = f"""You are a routing agent. The user's latest message is: {message}
-The full chat history is:
+def _router_prompt(message: str, history_str: str) -> str:
+    return f"""You are a routing agent. The user's latest message is: {message}
+The chat history is:
 {history_str}
 Is the user asking a factual Q&A (e.g., 'What is an MRI?'), or are they describing their symptoms?
 Respond only with the word RAG or SYMPTOM."""
-    
+
+
+def _llm_route(llm, message: str, history_str: str) -> Optional[str]:
+    """Asks the LLM to pick RAG or SYMPTOM. Returns None if the call fails."""
     try:
-        response = llm.complete(router_prompt)
+        with stage_timer(ROUTER_LLM), llm_cache_site(ROUTER):
+            response = llm.complete(_router_prompt(message, history_str))
         chat_mode = str(response).strip().upper()
     except Exception as e:
         # --- NEW EXCEPTION HANDLING ---
+        record_llm_error("router")
         logger.error(f"Router LLM call failed. This is likely an API key or quota issue: {e}", exc_info=True)
+        return None
+    return "RAG" if "RAG" in chat_mode else "SYMPTOM"
+
+AI_SERVICE_ERROR = "Sorry, I'm having trouble connecting to the AI service. Please check the backend API key."
+
+
+def _nurse_prompt(history_str: str, message: str) -> str:
+    return f"""You are an empathetic nurse. The chat history is:
+{history_str}
+The user just said: {message}
+Ask one simple, clarifying question to better understand their symptoms (e.g., 'Where does it hurt?', 'How long have you felt this way?').
+If the history is vague, ask a clarifying question. Do not sound like a robot."""
+
+
+async def _allm_route(llm, message: str, history_str: str) -> Optional[str]:
+    """Async _llm_route()."""
+    try:
+        with stage_timer(ROUTER_LLM), llm_cache_site(ROUTER):
+            response = await llm.acomplete(_router_prompt(message, history_str))
+        chat_mode = str(response).strip().upper()
+    except Exception as e:
+        record_llm_error("router")
+        logger.error(f"Router LLM call failed. This is likely an API key or quota issue: {e}", exc_info=True)
+        return None
+    return "RAG" if "RAG" in chat_mode else "SYMPTOM"
+
+
+def _route_message(llm, message: str, history: List[ChatMessage], session_id: str):
+    """Returns (chat_mode, local RouteDecision or None); chat_mode is None if routing failed."""
+    with stage_timer(ROUTE):
+        decision = chat_router.classify(message) if chat_router else None
+        if decision is not None:
+            logger.info(f"Local router selected {decision.mode} ({decision.source}, confidence {decision.confidence:.2f})")
+            return decision.mode, decision
+        return _llm_route(llm, message, compact_history(history, ROUTER, session_id)), None
+
+
+@contextmanager
+def _rag_indexes():
+    """Yields (vector_index, kg_index); the vector index generation stays open until exit."""
+    kg_index = current_app.config.get('KG_INDEX')
+    with vector_index_manager.lease() as vector_index:
+        if not vector_index and not kg_index:
+            logger.error("Chat Router: RAG engines not loaded in app config.")
+        yield vector_index, kg_index
+
+
+def handle_chat_message(message: str, history: Optional[List[ChatMessage]], session_id: Optional[str]) -> Tuple[str, List[Dict[str, Any]], str, str]:
+    logger.info(f"Handling smart chat message for session {session_id}...")
+    if not session_id:
+        session_id = "session_" + os.urandom(8).hex()
+    client_history = history
+    history = resolve_history(session_id, history)
+    llm = Settings.llm
+    if not llm:
+        logger.error("LLM (Settings.llm) is not available.")
+        return "Sorry, the AI service is not configured.", [], "SYMPTOM", session_id
+
+    chat_mode, decision = _route_message(llm, message, history, session_id)
+    if chat_mode is None:
         # We can't route, so we'll just apologize.
-        return "Sorry, I'm having trouble connecting to the AI service. Please check the backend API key.", [], "SYMPTOM", session_id
+        return AI_SERVICE_ERROR, [], "SYMPTOM", session_id
 
     if "RAG" in chat_mode:
         chat_mode = "RAG"
         logger.info(f"Router selected: {chat_mode}")
-        vector_index = current_app.config.get('VECTOR_INDEX')
-        kg_index = current_app.config.get('KG_INDEX')
-
-        if not vector_index and not kg_index:
-             logger.error("Chat Router: RAG engines not loaded in app config.")
-             answer = "Sorry, the RAG system is not available right now."
-             sources = []
-        else:
-            logger.info(f"Routing message to RAG service...")
-            # This function (query_rag) already has its own try/except
-            answer, sources = query_rag(vector_index, kg_index, message)
-            logger.info("RAG service returned answer.")
+        with _rag_indexes() as (vector_index, kg_index):
+            if not vector_index and not kg_index:
+                 answer = "Sorry, the RAG system is not available right now."
+                 sources = []
+            else:
+                logger.info(f"Routing message to RAG service...")
+                query_embedding = decision.embedding if decision is not None else None
+                try:
+                    answer, sources = cached_query_rag(vector_index, kg_index, message, query_embedding=query_embedding)
+                    logger.info("RAG service returned answer.")
+                except LLMSynthesisError:
+                    answer, sources = AI_SERVICE_ERROR, []
 
     else:
         chat_mode = "SYMPTOM"
         logger.info(f"Router selected: {chat_mode}")
         
-        nurse_prompt = f"""You are an empathetic nurse. The chat history is:
-{history_str}
-The user just said: {message}
-Ask one simple, clarifying question to better understand their symptoms (e.g., 'Where does it hurt?', 'How long have you felt this way?').
-If the history is vague, ask a clarifying question. Do not sound like a robot."""
-        
         try:
-            nurse_response = llm.complete(nurse_prompt)
+            history_str = compact_history(history, NURSE, session_id)
+            with llm_cache_site(NURSE):
+                nurse_response = llm.complete(_nurse_prompt(history_str, message))
             answer = str(nurse_response).strip()
             sources = []
         except Exception as e:
             # --- NEW EXCEPTION HANDLING ---
+            record_llm_error("nurse")
             logger.error(f"Nurse LLM call failed. This is likely an API key or quota issue: {e}", exc_info=True)
-            answer = "Sorry, I'm having trouble connecting to the AI service. Please check the backend API key."
+            answer = AI_SERVICE_ERROR
             sources = []
 
+    record_turn(session_id, client_history, message, answer)
+    return answer, sources, chat_mode, session_id
+
+
+def stream_chat_message(message: str, history: Optional[List[ChatMessage]], session_id: Optional[str]) -> Iterator[Tuple[str, Any]]:
+    """
+    Streaming variant of handle_chat_message(). Yields ("sources", list),
+    then ("token", text) deltas, then ("done", {"type", "session_id"}).
+    """
+    logger.info(f"Streaming smart chat message for session {session_id}...")
+    if not session_id:
+        session_id = "session_" + os.urandom(8).hex()
+    client_history = history
+    history = resolve_history(session_id, history)
+
+    llm = Settings.llm
+    if not llm:
+        logger.error("LLM (Settings.llm) is not available.")
+        yield "sources", []
+        yield "token", "Sorry, the AI service is not configured."
+        yield "done", {"type": "SYMPTOM", "session_id": session_id}
+        return
+
+    chat_mode, decision = _route_message(llm, message, history, session_id)
+    answer_parts = []
+
+    if chat_mode is None:
+        yield "sources", []
+        yield "token", AI_SERVICE_ERROR
+        chat_mode = "SYMPTOM"
+    elif chat_mode == "RAG":
+        logger.info(f"Router selected: {chat_mode}")
+        with _rag_indexes() as (vector_index, kg_index):
+            if not vector_index and not kg_index:
+                yield "sources", []
+                yield "token", "Sorry, the RAG system is not available right now."
+            else:
+                query_embedding = decision.embedding if decision is not None else None
+                try:
+                    for event, data in stream_query_rag(vector_index, kg_index, message, query_embedding=query_embedding):
+                        if event == "token":
+                            answer_parts.append(data)
+                        yield event, data
+                except LLMSynthesisError:
+                    yield "sources", []
+                    yield "token", AI_SERVICE_ERROR
+    else:
+        logger.info(f"Router selected: {chat_mode}")
+        yield "sources", []
+        try:
+            history_str = compact_history(history, NURSE, session_id)
+            with llm_cache_site(NURSE):  # The cache is consulted when the stream starts
+                nurse_stream = llm.stream_complete(_nurse_prompt(history_str, message))
+            for chunk in nurse_stream:
+                if chunk.delta:
+                    answer_parts.append(chunk.delta)
+                    yield "token", chunk.delta
+        except Exception as e:
+            # --- NEW EXCEPTION HANDLING ---
+            record_llm_error("nurse")
+            logger.error(f"Nurse LLM stream failed. This is likely an API key or quota issue: {e}", exc_info=True)
+            yield "token", AI_SERVICE_ERROR
+
+    if answer_parts:
+        record_turn(session_id, client_history, message, "".join(answer_parts))
+    yield "done", {"type": chat_mode, "session_id": session_id}
+
+
+async def ahandle_chat_message(message: str, history: Optional[List[ChatMessage]], session_id: Optional[str]) -> Tuple[str, List[Dict[str, Any]], str, str]:
+    """
+    Async handle_chat_message() for the ASGI app: LLM calls are awaited
+    (acomplete / aquery) so no thread is held while Gemini responds.
+    Needs an active Flask app context for the RAG indexes.
+    """
+    logger.info(f"Handling smart chat message (async) for session {session_id}...")
     if not session_id:
         session_id = "session_" + os.urandom(8).hex()
+    client_history = history
+    history = await asyncio.to_thread(resolve_history, session_id, history)
+    llm = Settings.llm
+    if not llm:
+        logger.error("LLM (Settings.llm) is not available.")
+        return "Sorry, the AI service is not configured.", [], "SYMPTOM", session_id
+
+    with stage_timer(ROUTE):
+        # Local routing embeds the message (CPU); run it off the event loop
+        decision = await asyncio.to_thread(chat_router.classify, message) if chat_router else None
+        if decision is not None:
+            chat_mode = decision.mode
+            logger.info(f"Local router selected {chat_mode} ({decision.source}, confidence {decision.confidence:.2f})")
+        else:
+            chat_mode = await _allm_route(llm, message, compact_history(history, ROUTER, session_id))
+    if chat_mode is None:
+        return AI_SERVICE_ERROR, [], "SYMPTOM", session_id
+
+    sources = []
+    if chat_mode == "RAG":
+        with _rag_indexes() as (vector_index, kg_index):
+            if not vector_index and not kg_index:
+                answer = "Sorry, the RAG system is not available right now."
+            else:
+                query_embedding = decision.embedding if decision is not None else None
+                try:
+                    answer, sources = await aquery_rag(vector_index, kg_index, message, query_embedding=query_embedding)
+                except LLMSynthesisError:
+                    answer = AI_SERVICE_ERROR
+    else:
+        try:
+            history_str = compact_history(history, NURSE, session_id)
+            with llm_cache_site(NURSE):
+                nurse_response = await llm.acomplete(_nurse_prompt(history_str, message))
+            answer = str(nurse_response).strip()
+        except Exception as e:
+            record_llm_error("nurse")
+            logger.error(f"Nurse LLM call failed. This is likely an API key or quota issue: {e}", exc_info=True)
+            answer = AI_SERVICE_ERROR
 
+    await asyncio.to_thread(record_turn, session_id, client_history, message, answer)
     return answer, sources, chat_mode, session_id
 
-def generate_report(history: List[ChatMessage]) -> Tuple[List[str], List[str]]:
+
+class ReportSection(NamedTuple):
+    """One independent LLM call of the report; its prompt only sees history_str."""
+    name: str
+    prompt: str             # Formatted with history_str
+    error_fallback: str     # Used when the call fails or times out
+    empty_fallback: str     # Used when the call returns no list items
+
+
+REPORT_SECTIONS: Tuple[ReportSection, ...] = (
+    ReportSection(
+        name="disease_list",
+        prompt="""You are a medical analyst. Analyze this chat history:
+{history_str}
+Based only on the symptoms, what are the top 3-5 possible diseases or conditions?
+Respond with only a JSON list of strings, like ["Migraine", "Tension Headache"].""",
+        error_fallback="Error processing medical analysis. Check API key.",
+        empty_fallback="No specific conditions identified.",
+    ),
+    ReportSection(
+        name="question_list",
+        prompt="""You are a helpful patient advocate. Based on this chat history:
+{history_str}
+Generate a JSON list of 5 concise questions the patient should ask their doctor, like ["What are the possible side effects?", "Are there alternative treatments?"].""",
+        error_fallback="Error processing patient questions. Check API key.",
+        empty_fallback="No specific questions generated. Be sure to describe all symptoms to your doctor.",
+    ),
+)
+
+# Report LLM calls run concurrently on a bounded, process-wide pool. Every
+# request thread of the worker (gunicorn `threads`) may be generating a report
+# at once, so the pool never has fewer threads than threads x sections.
+REPORT_MAX_WORKERS = max(
+    int(os.getenv("REPORT_MAX_WORKERS", "0")),
+    int(os.getenv("GUNICORN_THREADS", "4")) * len(REPORT_SECTIONS),
+)
+REPORT_LLM_TIMEOUT_SECONDS = float(os.getenv("REPORT_LLM_TIMEOUT_SECONDS", "30"))
+_report_executor = ThreadPoolExecutor(max_workers=REPORT_MAX_WORKERS, thread_name_prefix="report-llm")
+
+
+class _SectionCall:
+    """Records when a queued report call starts running, so its timeout starts then too."""
+
+    def __init__(self):
+        self.started = threading.Event()
+        self.started_at = 0.0
+
+    def mark_started(self) -> None:
+        self.started_at = time.monotonic()
+        self.started.set()
+
+    def remaining(self, timeout: float) -> float:
+        return max(0.0, self.started_at + timeout - time.monotonic())
+
+
+def _run_report_section(llm, section: ReportSection, history_str: str, call: Optional[_SectionCall] = None) -> List[str]:
+    if call is not None:
+        call.mark_started()
+    # Runs on a report pool thread, so the site is entered here rather than by the caller
+    with stage_timer(REPORT_SECTION), llm_cache_site(REPORT):
+        response = llm.complete(section.prompt.format(history_str=history_str))
+    items = _parse_json_list(str(response))
+    logger.info(f"Report section '{section.name}' call successful, found {len(items)} items.")
+    return items
+
+
+def generate_report_sections(llm, history_str: str, sections: Sequence[ReportSection] = REPORT_SECTIONS,
+                             timeout: float = REPORT_LLM_TIMEOUT_SECONDS) -> Dict[str, List[str]]:
+    """
+    Issues one LLM call per section concurrently, so the report takes as long
+    as the slowest call rather than their sum. Each section falls back to its
+    own error text on failure or when it misses the timeout. The timeout runs
+    from when the call starts; a call still queued after `timeout` is dropped.
+    """
+    calls = {}
+    for section in sections:
+        call = _SectionCall()
+        calls[section.name] = (call, _report_executor.submit(_run_report_section, llm, section, history_str, call))
+    results = {}
+    for section in sections:
+        call, future = calls[section.name]
+        try:
+            if not call.started.wait(timeout) and future.cancel():
+                raise FutureTimeoutError()
+            call.started.wait()  # cancel() lost the race: the call has just started
+            items = future.result(timeout=call.remaining(timeout))
+        except FutureTimeoutError:
+            # A running worker thread keeps going until the HTTP call returns; its result is dropped
+            future.cancel()
+            record_llm_error("report_section")
+            logger.error(f"Report section '{section.name}' LLM call timed out after {timeout}s.")
+            items = [section.error_fallback]
+        except Exception as e:
+            # --- NEW EXCEPTION HANDLING ---
+            record_llm_error("report_section")
+            logger.error(f"Report section '{section.name}' LLM call failed: {e}", exc_info=True)
+            items = [section.error_fallback]
+        results[section.name] = items or [section.empty_fallback]
+    return results
+
+
+def _report_history_str(history: List[ChatMessage], session_id: Optional[str]) -> str:
+    relevant = [msg for msg in history if msg.role == 'user' or 'symptom' in msg.content.lower()]
+    return compact_history(relevant, REPORT, f"{session_id}/report" if session_id else None)
+
+
+def generate_report(history: List[ChatMessage], session_id: Optional[str] = None) -> Tuple[List[str], List[str]]:
     logger.info(f"Generating smart report from history ({len(history)} messages)...")
     llm = Settings.llm
     if not llm:
         logger.error("LLM (Settings.llm) is not available for report generation.")
         return ["Error: AI service not configured"], ["Error: AI service not configured"]
 
-    history_str = "\n".join([f"{msg.role}: {msg.content}" for msg in history if msg.role == 'user' or 'symptom' in msg.content.lower()])
+    history_str = _report_history_str(history, session_id)
 
     if not history_str:
         logger.warning("Report generated with no usable history.")
         return ["No symptom data provided."], ["No questions generated."]
 
-    disease_list = []
-    question_list = []
+    sections = generate_report_sections(llm, history_str)
+    return sections["disease_list"], sections["question_list"]
 
-    try:
-        doctor_prompt = f"""You are a medical analyst. Analyze this chat history:
-{history_str}
-Based only on the symptoms, what are the top 3-5 possible diseases or conditions?
-Respond with only a JSON list of strings, like ["Migraine", "Tension Headache"]."""
-        
-        disease_response = llm.complete(doctor_prompt)
-        disease_list = _parse_json_list(str(disease_response))
-        logger.info(f"Doctor Report call successful, found {len(disease_list)} diseases.")
-        
-    except Exception as e:
-        # --- NEW EXCEPTION HANDLING ---
-        logger.error(f"Doctor Report LLM call failed: {e}", exc_info=True)
-        disease_list = ["Error processing medical analysis. Check API key."]
 
-    try:
-        patient_prompt = f"""You are a helpful patient advocate. Based on this chat history:
-{history_str}
-Generate a JSON list of 5 concise questions the patient should ask their doctor, like ["What are the possible side effects?", "Are there alternative treatments?"]."""
-        
-        question_response = llm.complete(patient_prompt)
-        question_list = _parse_json_list(str(question_response))
-        logger.info(f"Patient Report call successful, found {len(question_list)} questions.")
+async def agenerate_report_sections(llm, history_str: str, sections: Sequence[ReportSection] = REPORT_SECTIONS,
+                                    timeout: float = REPORT_LLM_TIMEOUT_SECONDS) -> Dict[str, List[str]]:
+    """Async generate_report_sections(): one awaited acomplete per section, gathered."""
+    async def run(section: ReportSection) -> List[str]:
+        try:
+            with stage_timer(REPORT_SECTION), llm_cache_site(REPORT):
+                response = await asyncio.wait_for(llm.acomplete(section.prompt.format(history_str=history_str)), timeout)
+            items = _parse_json_list(str(response))
+            logger.info(f"Report section '{section.name}' call successful, found {len(items)} items.")
+        except asyncio.TimeoutError:
+            record_llm_error("report_section")
+            logger.error(f"Report section '{section.name}' LLM call timed out after {timeout}s.")
+            items = [section.error_fallback]
+        except Exception as e:
+            record_llm_error("report_section")
+            logger.error(f"Report section '{section.name}' LLM call failed: {e}", exc_info=True)
+            items = [section.error_fallback]
+        return items or [section.empty_fallback]
+
+    results = await asyncio.gather(*(run(section) for section in sections))
+    return {section.name: items for section, items in zip(sections, results)}
 
-    except Exception as e:
-        # --- NEW EXCEPTION HANDLING ---
-        logger.error(f"Patient Report LLM call failed: {e}", exc_info=True)
-        question_list = ["Error processing patient questions. Check API key."]
 
-    if not disease_list:
-        disease_list = ["No specific conditions identified."]
-    if not question_list:
-        question_list = ["No specific questions generated. Be sure to describe all symptoms to your doctor."]
+async def agenerate_report(history: List[ChatMessage], session_id: Optional[str] = None) -> Tuple[List[str], List[str]]:
+    """Async generate_report() for the ASGI app."""
+    logger.info(f"Generating smart report (async) from history ({len(history)} messages)...")
+    llm = Settings.llm
+    if not llm:
+        logger.error("LLM (Settings.llm) is not available for report generation.")
+        return ["Error: AI service not configured"], ["Error: AI service not configured"]
+
+    history_str = _report_history_str(history, session_id)
+
+    if not history_str:
+        logger.warning("Report generated with no usable history.")
+        return ["No symptom data provided."], ["No questions generated."]
 
-    return disease_list, question_list
+    sections = await agenerate_report_sections(llm, history_str)
+    return sections["disease_list"], sections["question_list"]
@@ -0,0 +1,270 @@
+"""
+Compact, memory-mapped chunk store for the vector index.
+
+Replaces vector_metadata.json at serve time. Layout (little endian):
+
+    header   : magic (8s) | version (u32) | codec (u32) | count (u64)
+    ids      : int64[count]   FAISS ids, sorted ascending
+    offsets  : uint64[count]  record offset into the blob
+    lengths  : uint32[count]  record length in bytes
+    (v2 only) dict_length (u64) | zstd dictionary bytes
+    blob     : concatenated UTF-8 JSON records {"doc_id", "text", "metadata"}
+
+The file is opened read-only with mmap, so every gunicorn worker shares the
+same page-cache pages and only the records for top-k hits are ever decoded.
+
+CHUNK_STORE_COMPRESSION=zstd (needs the optional `zstandard` package)
+writes version 2: every record is its own zstd frame, compressed against a
+dictionary trained on a sample of the records, so random access still
+decodes a single record. The default (none) writes version 1.
+"""
+import os
+import json
+import mmap
+import struct
+import logging
+import tempfile
+import threading
+from pathlib import Path
+from typing import Any, Dict, Iterable, List, Optional, Tuple, Union
+
+import numpy as np
+
+from app.services.atomic_files import atomic_path
+
+logger = logging.getLogger(__name__)
+
+CHUNK_STORE_MAGIC = b"CURACHK1"
+CHUNK_STORE_VERSION = 1
+CHUNK_STORE_VERSION_COMPRESSED = 2
+_HEADER = struct.Struct("<8sIIQ")
+_DICT_LENGTH = struct.Struct("<Q")
+
+CODEC_NONE = 0
+CODEC_ZSTD = 1
+_CODECS = {"none": CODEC_NONE, "zstd": CODEC_ZSTD}
+_DICT_SAMPLE_RECORDS = 5000
+_DICT_SIZE = 112 * 1024
+
+ChunkRecord = Dict[str, Any]  # {"doc_id": str, "text": str, "metadata": dict}
+
+
+def _zstd():
+    try:
+        import zstandard
+    except ImportError as e:
+        raise ImportError("CHUNK_STORE_COMPRESSION=zstd needs the 'zstandard' package (pip install zstandard).") from e
+    return zstandard
+
+
+def _compress_blob(blob, out, offsets: List[int], lengths: List[int], level: int):
+    """
+    Compresses every record of the raw blob into its own zstd frame in out.
+    Returns (new offsets, new lengths, dictionary bytes).
+    """
+    zstandard = _zstd()
+    rng = np.random.default_rng(0)
+    sample_rows = rng.choice(len(offsets), size=min(len(offsets), _DICT_SAMPLE_RECORDS), replace=False)
+    samples = []
+    for row in sorted(sample_rows):
+        blob.seek(offsets[row])
+        samples.append(blob.read(lengths[row]))
+    dict_data = b""
+    try:
+        dictionary = zstandard.train_dictionary(_DICT_SIZE, samples, level=level)
+        dict_data = dictionary.as_bytes()
+    except zstandard.ZstdError as e:
+        dictionary = None  # Too few records to train on; frames are compressed without one
+        logger.warning(f"zstd dictionary training failed ({e}); compressing records without a dictionary.")
+    compressor = zstandard.ZstdCompressor(level=level, dict_data=dictionary)
+
+    new_offsets, new_lengths, position = [], [], 0
+    for offset, length in zip(offsets, lengths):
+        blob.seek(offset)
+        frame = compressor.compress(blob.read(length))
+        out.write(frame)
+        new_offsets.append(position)
+        new_lengths.append(len(frame))
+        position += len(frame)
+    return new_offsets, new_lengths, dict_data
+
+
+def write_chunk_store(path: Union[str, Path], records: Iterable[Tuple[int, ChunkRecord]],
+                      compression: Optional[str] = None) -> int:
+    """
+    Writes (faiss_id, record) pairs to a chunk store file and returns the count.
+    Records are streamed into a temporary blob, so memory stays bounded by the
+    id/offset tables. The final file is swapped in atomically with os.replace.
+    compression: "none" or "zstd" (default: CHUNK_STORE_COMPRESSION, else none).
+    """
+    compression = (compression or os.getenv("CHUNK_STORE_COMPRESSION", "none")).lower()
+    if compression not in _CODECS:
+        raise ValueError(f"Unknown chunk store compression '{compression}' (expected one of {tuple(_CODECS)}).")
+    path = Path(path)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    ids: List[int] = []
+    offsets: List[int] = []
+    lengths: List[int] = []
+
+    with tempfile.TemporaryFile(dir=path.parent) as blob, tempfile.TemporaryFile(dir=path.parent) as zstd_blob:
+        position = 0
+        for faiss_id, record in records:
+            payload = json.dumps({
+                "doc_id": record.get("doc_id"),
+                "text": record.get("text", ""),
+                "metadata": record.get("metadata", {}),
+            }, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+            blob.write(payload)
+            ids.append(int(faiss_id))
+            offsets.append(position)
+            lengths.append(len(payload))
+            position += len(payload)
+
+        raw_size = position
+        dict_data = b""
+        if compression == "zstd" and ids:
+            level = int(os.getenv("CHUNK_STORE_ZSTD_LEVEL", "9"))
+            offsets, lengths, dict_data = _compress_blob(blob, zstd_blob, offsets, lengths, level)
+            blob = zstd_blob
+            logger.info(f"zstd-compressed chunk records: {raw_size} -> {sum(lengths) + len(dict_data)} bytes "
+                        f"(dictionary {len(dict_data)} bytes).")
+
+        ids_arr = np.asarray(ids, dtype="<i8")
+        order = np.argsort(ids_arr, kind="stable")
+        ids_arr = ids_arr[order]
+        if len(ids_arr) > 1 and np.any(ids_arr[1:] == ids_arr[:-1]):
+            raise ValueError("Duplicate FAISS ids in chunk store records.")
+        offsets_arr = np.asarray(offsets, dtype="<u8")[order]
+        lengths_arr = np.asarray(lengths, dtype="<u4")[order]
+
+        with atomic_path(path) as tmp_name:
+            with open(tmp_name, "wb") as out:
+                if compression == "zstd":
+                    out.write(_HEADER.pack(CHUNK_STORE_MAGIC, CHUNK_STORE_VERSION_COMPRESSED, CODEC_ZSTD, len(ids_arr)))
+                else:
+                    out.write(_HEADER.pack(CHUNK_STORE_MAGIC, CHUNK_STORE_VERSION, CODEC_NONE, len(ids_arr)))
+                out.write(ids_arr.tobytes())
+                out.write(offsets_arr.tobytes())
+                out.write(lengths_arr.tobytes())
+                if compression == "zstd":
+                    out.write(_DICT_LENGTH.pack(len(dict_data)))
+                    out.write(dict_data)
+                blob.seek(0)
+                while True:
+                    block = blob.read(1 << 20)
+                    if not block:
+                        break
+                    out.write(block)
+
+    logger.info(f"Wrote chunk store with {len(ids_arr)} records to {path}.")
+    return len(ids_arr)
+
+
+def convert_metadata_json(json_path: Union[str, Path], store_path: Union[str, Path]) -> int:
+    """One-time migration from the old vector_metadata.json map to a chunk store."""
+    logger.info(f"Converting legacy metadata map {json_path} -> {store_path}...")
+    with open(json_path, "r", encoding="utf-8") as f:
+        doc_metadata = json.load(f)
+    records = (
+        (int(faiss_id), meta_info)
+        for faiss_id, meta_info in doc_metadata.items()
+        if isinstance(meta_info, dict)
+    )
+    return write_chunk_store(store_path, records)
+
+
+class ChunkStore:
+    """Read-only, memory-mapped view over a chunk store file."""
+
+    def __init__(self, path: Union[str, Path]):
+        self.path = Path(path)
+        self._file = open(self.path, "rb")
+        try:
+            self._mm = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+        except Exception:
+            self._file.close()
+            raise
+        self._lock = threading.Lock()
+
+        magic, version, codec, count = _HEADER.unpack_from(self._mm, 0)
+        if magic != CHUNK_STORE_MAGIC:
+            self.close()
+            raise ValueError(f"{self.path} is not a chunk store (bad magic {magic!r}).")
+        if version not in (CHUNK_STORE_VERSION, CHUNK_STORE_VERSION_COMPRESSED):
+            self.close()
+            raise ValueError(f"Unsupported chunk store version {version} in {self.path}.")
+        self.codec = codec if version == CHUNK_STORE_VERSION_COMPRESSED else CODEC_NONE
+        if self.codec not in (CODEC_NONE, CODEC_ZSTD):
+            self.close()
+            raise ValueError(f"Unsupported chunk store codec {codec} in {self.path}.")
+
+        self._count = count
+        pos = _HEADER.size
+        self.ids = np.frombuffer(self._mm, dtype="<i8", count=count, offset=pos)
+        pos += 8 * count
+        self._offsets = np.frombuffer(self._mm, dtype="<u8", count=count, offset=pos)
+        pos += 8 * count
+        self._lengths = np.frombuffer(self._mm, dtype="<u4", count=count, offset=pos)
+        pos += 4 * count
+        self._dict_data = None
+        if version == CHUNK_STORE_VERSION_COMPRESSED:
+            (dict_length,) = _DICT_LENGTH.unpack_from(self._mm, pos)
+            pos += _DICT_LENGTH.size
+            self._dict_data = bytes(self._mm[pos:pos + dict_length])
+            pos += dict_length
+        self._blob_start = pos
+        self._local = threading.local()  # zstd decompressors are not thread-safe
+        if self.codec == CODEC_ZSTD:
+            _zstd()  # Fail at load time, not on the first query
+
+    def __len__(self) -> int:
+        return self._count
+
+    @property
+    def nbytes(self) -> int:
+        return len(self._mm)
+
+    def row_of(self, faiss_id: int) -> int:
+        """Returns the row of a FAISS id in this store, or -1 if absent."""
+        row = int(np.searchsorted(self.ids, faiss_id))
+        if row < self._count and self.ids[row] == faiss_id:
+            return row
+        return -1
+
+    def _decompressor(self):
+        decompressor = getattr(self._local, "decompressor", None)
+        if decompressor is None:
+            zstandard = _zstd()
+            dictionary = zstandard.ZstdCompressionDict(self._dict_data) if self._dict_data else None
+            decompressor = self._local.decompressor = zstandard.ZstdDecompressor(dict_data=dictionary)
+        return decompressor
+
+    def record_at(self, row: int) -> ChunkRecord:
+        start = self._blob_start + int(self._offsets[row])
+        end = start + int(self._lengths[row])
+        payload = self._mm[start:end]
+        if self.codec == CODEC_ZSTD:
+            payload = self._decompressor().decompress(payload)
+        return json.loads(payload.decode("utf-8"))
+
+    def get(self, faiss_id: int) -> Optional[ChunkRecord]:
+        row = self.row_of(faiss_id)
+        return self.record_at(row) if row >= 0 else None
+
+    def iter_records(self):
+        """Yields (faiss_id, record) in id order. Used by offline tooling."""
+        for row in range(self._count):
+            yield int(self.ids[row]), self.record_at(row)
+
+    def close(self) -> None:
+        with self._lock:
+            # Drop numpy views before closing the mmap they point into
+            self.ids = self._offsets = self._lengths = None
+            if self._mm is not None:
+                try:
+                    self._mm.close()
+                except BufferError:
+                    logger.warning(f"Chunk store {self.path} still has live views; leaving mmap open.")
+                self._mm = None
+            if not self._file.closed:
+                self._file.close()
@@ -0,0 +1,326 @@
+"""
+Pluggable CPU embedding backends for all-MiniLM-L6-v2.
+
+  - "torch": SentenceTransformer on PyTorch (the original setup).
+  - "onnx":  the same model exported to ONNX (optionally dynamic int8
+             quantized) and run with onnxruntime + a fast tokenizer.
+  - "hashing": offline stand-in (feature hashing of words and bigrams) for
+             load tests and laptops without the model weights.
+
+Both the server (rag_service) and the offline build scripts pick a backend
+with get_embedding_backend(), configured by EMBEDDING_* env vars.
+All backends return L2-normalized float32 vectors.
+"""
+import os
+import re
+import asyncio
+import inspect
+import time
+import hashlib
+import logging
+from pathlib import Path
+from typing import Any, Dict, List, Optional
+
+import numpy as np
+from llama_index.core.bridge.pydantic import PrivateAttr
+from llama_index.core.embeddings import BaseEmbedding
+
+logger = logging.getLogger(__name__)
+
+EMBEDDING_MODEL_NAME = "sentence-transformers/all-MiniLM-L6-v2"
+EMBEDDING_DIMENSION = 384
+MAX_SEQ_LENGTH = 256  # all-MiniLM-L6-v2's max_seq_length
+
+DEFAULT_ONNX_MODEL_DIR = Path(__file__).resolve().parent.parent.parent / "storage" / "onnx_minilm"
+ONNX_MODEL_FILE = "model.onnx"
+ONNX_QUANTIZED_MODEL_FILE = "model.int8.onnx"
+
+
+def _normalize(vectors: np.ndarray) -> np.ndarray:
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return (vectors / norms).astype("float32")
+
+
+class EmbeddingBackend:
+    """Interface: encode(texts) -> (n, dimension) float32, L2-normalized."""
+
+    name = "base"
+    dimension = EMBEDDING_DIMENSION
+
+    def encode(self, texts: List[str], batch_size: int = 32, show_progress_bar: bool = False) -> np.ndarray:
+        raise NotImplementedError
+
+    def start_multi_process_pool(self, processes: int) -> bool:
+        """Spreads later encode() calls over worker processes; False when unsupported."""
+        return False
+
+    def stop_multi_process_pool(self) -> None:
+        pass
+
+
+def _pool_worker(threads: int, model: Any, input_queue: Any, output_queue: Any) -> None:
+    """Pool process: sentence-transformers' own worker loop, on its share of the cores."""
+    import torch
+
+    torch.set_num_threads(threads)
+    # Named _encode_multi_process_worker before sentence-transformers 5
+    worker = getattr(type(model), "_multi_process_worker", None) or type(model)._encode_multi_process_worker
+    worker("cpu", model, input_queue, output_queue)
+
+
+class TorchEmbeddingBackend(EmbeddingBackend):
+    name = "torch"
+
+    def __init__(self, model_name: str = EMBEDDING_MODEL_NAME, num_threads: Optional[int] = None):
+        import torch
+        from sentence_transformers import SentenceTransformer
+
+        if num_threads:
+            torch.set_num_threads(num_threads)
+        self.model = SentenceTransformer(model_name, device="cpu")
+        self.dimension = self.model.get_sentence_embedding_dimension()
+        self._pool = None
+        self._encode_takes_pool = "pool" in inspect.signature(self.model.encode).parameters
+        logger.info(f"Torch embedding backend ready ({model_name}, threads={torch.get_num_threads()}).")
+
+    def encode(self, texts: List[str], batch_size: int = 32, show_progress_bar: bool = False) -> np.ndarray:
+        if self._pool is not None and self._encode_takes_pool:
+            vectors = self.model.encode(texts, pool=self._pool, batch_size=batch_size, normalize_embeddings=True,
+                                        convert_to_numpy=True)
+        elif self._pool is not None:
+            # sentence-transformers before encode(pool=...)
+            vectors = self.model.encode_multi_process(texts, self._pool, batch_size=batch_size, normalize_embeddings=True)
+        else:
+            vectors = self.model.encode(
+                texts,
+                batch_size=batch_size,
+                normalize_embeddings=True,
+                show_progress_bar=show_progress_bar,
+                convert_to_numpy=True,
+            )
+        return np.asarray(vectors, dtype="float32")
+
+    def start_multi_process_pool(self, processes: int) -> bool:
+        # One CPU worker process per slot, fed by sentence-transformers' queues (the pool dict encode(pool=...)
+        # and stop_multi_process_pool() expect). Each worker would otherwise start one torch thread per core,
+        # so the cores are split between them.
+        import torch.multiprocessing as mp
+
+        threads = max(1, (os.cpu_count() or 1) // processes)
+        self.model.to("cpu")
+        self.model.share_memory()
+        ctx = mp.get_context("spawn")
+        pool = {"input": ctx.Queue(), "output": ctx.Queue(), "processes": []}
+        for _ in range(processes):
+            process = ctx.Process(target=_pool_worker, args=(threads, self.model, pool["input"], pool["output"]), daemon=True)
+            process.start()
+            pool["processes"].append(process)
+        self._pool = pool
+        logger.info(f"Started sentence-transformers pool with {processes} CPU processes, {threads} threads each.")
+        return True
+
+    def stop_multi_process_pool(self) -> None:
+        if self._pool is not None:
+            self.model.stop_multi_process_pool(self._pool)
+            self._pool = None
+
+
+class OnnxEmbeddingBackend(EmbeddingBackend):
+    """Runs an export from export_onnx_model(): transformer graph + mean pooling in numpy."""
+
+    name = "onnx"
+
+    def __init__(self, model_dir: Path = DEFAULT_ONNX_MODEL_DIR, quantized: bool = True, num_threads: Optional[int] = None):
+        import onnxruntime as ort
+        from tokenizers import Tokenizer
+
+        model_dir = Path(model_dir)
+        model_path = model_dir / (ONNX_QUANTIZED_MODEL_FILE if quantized else ONNX_MODEL_FILE)
+        if not model_path.exists():
+            raise FileNotFoundError(f"ONNX model not found at {model_path}. Run scripts/export_onnx_embedder.py first.")
+
+        options = ort.SessionOptions()
+        options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+        if num_threads:
+            options.intra_op_num_threads = num_threads
+            options.inter_op_num_threads = 1
+        self.session = ort.InferenceSession(str(model_path), sess_options=options, providers=["CPUExecutionProvider"])
+        self._input_names = {inp.name for inp in self.session.get_inputs()}
+
+        self.tokenizer = Tokenizer.from_file(str(model_dir / "tokenizer.json"))
+        self.tokenizer.enable_truncation(max_length=MAX_SEQ_LENGTH)
+        self.tokenizer.enable_padding()
+        logger.info(f"ONNX embedding backend ready ({model_path.name}, threads={num_threads or 'default'}).")
+
+    def _encode_batch(self, texts: List[str]) -> np.ndarray:
+        encodings = self.tokenizer.encode_batch(texts)
+        input_ids = np.asarray([e.ids for e in encodings], dtype="int64")
+        attention_mask = np.asarray([e.attention_mask for e in encodings], dtype="int64")
+        feeds = {"input_ids": input_ids, "attention_mask": attention_mask}
+        if "token_type_ids" in self._input_names:
+            feeds["token_type_ids"] = np.asarray([e.type_ids for e in encodings], dtype="int64")
+
+        token_embeddings = self.session.run(None, feeds)[0]  # (batch, seq, hidden)
+        # Mean pooling over real tokens, as in the sentence-transformers Pooling module
+        mask = attention_mask[..., None].astype("float32")
+        summed = (token_embeddings * mask).sum(axis=1)
+        counts = np.clip(mask.sum(axis=1), 1e-9, None)
+        return _normalize(summed / counts)
+
+    def encode(self, texts: List[str], batch_size: int = 32, show_progress_bar: bool = False) -> np.ndarray:
+        if not texts:
+            return np.zeros((0, self.dimension), dtype="float32")
+        batches = [self._encode_batch(texts[i:i + batch_size]) for i in range(0, len(texts), batch_size)]
+        return np.vstack(batches)
+
+
+class HashingEmbeddingBackend(EmbeddingBackend):
+    """
+    Deterministic, dependency-free stand-in: signed feature hashing of word
+    unigrams and bigrams. Texts sharing words get similar vectors, which is
+    enough for offline load tests; it is not a semantic model.
+    """
+
+    name = "hashing"
+    _TOKEN = re.compile(r"\w+")
+
+    def __init__(self, dimension: int = EMBEDDING_DIMENSION, latency_ms: float = 0.0):
+        self.dimension = dimension
+        self.latency_ms = latency_ms  # Simulated forward-pass cost per batch
+        logger.info(f"Hashing embedding backend ready (dimension={dimension}, latency={latency_ms}ms).")
+
+    def _encode_one(self, text: str) -> np.ndarray:
+        vector = np.zeros(self.dimension, dtype="float32")
+        words = self._TOKEN.findall(text.lower())
+        for feature in words + [f"{a} {b}" for a, b in zip(words, words[1:])]:
+            digest = hashlib.blake2b(feature.encode("utf-8"), digest_size=8).digest()
+            bucket = int.from_bytes(digest[:4], "little") % self.dimension
+            vector[bucket] += 1.0 if digest[4] & 1 else -1.0
+        return vector
+
+    def encode(self, texts: List[str], batch_size: int = 32, show_progress_bar: bool = False) -> np.ndarray:
+        if self.latency_ms:
+            time.sleep(self.latency_ms / 1000.0)
+        if not texts:
+            return np.zeros((0, self.dimension), dtype="float32")
+        return _normalize(np.vstack([self._encode_one(text) for text in texts]))
+
+
+def get_embedding_backend(name: Optional[str] = None) -> EmbeddingBackend:
+    """
+    Builds the configured backend:
+      EMBEDDING_BACKEND        torch (default) | onnx | hashing (offline stand-in)
+      EMBEDDING_NUM_THREADS    intra-op threads (default: library default)
+      EMBEDDING_ONNX_MODEL_DIR directory written by scripts/export_onnx_embedder.py
+      EMBEDDING_ONNX_QUANTIZED use the int8 model (default true)
+    """
+    name = (name or os.getenv("EMBEDDING_BACKEND", "torch")).lower()
+    num_threads = int(os.getenv("EMBEDDING_NUM_THREADS", "0")) or None
+    if name == "torch":
+        return TorchEmbeddingBackend(num_threads=num_threads)
+    if name == "onnx":
+        return OnnxEmbeddingBackend(
+            model_dir=Path(os.getenv("EMBEDDING_ONNX_MODEL_DIR", str(DEFAULT_ONNX_MODEL_DIR))),
+            quantized=os.getenv("EMBEDDING_ONNX_QUANTIZED", "true").lower() in ("1", "true", "yes"),
+            num_threads=num_threads,
+        )
+    if name == "hashing":
+        return HashingEmbeddingBackend(latency_ms=float(os.getenv("EMBEDDING_HASHING_LATENCY_MS", "0")))
+    raise ValueError(f"Unknown EMBEDDING_BACKEND '{name}' (expected 'torch', 'onnx' or 'hashing').")
+
+
+class BackendEmbedding(BaseEmbedding):
+    """LlamaIndex embedding model (Settings.embed_model) backed by an EmbeddingBackend."""
+
+    _backend: EmbeddingBackend = PrivateAttr()
+
+    def __init__(self, backend: EmbeddingBackend, **kwargs: Any):
+        super().__init__(model_name=f"{EMBEDDING_MODEL_NAME} ({backend.name})", **kwargs)
+        self._backend = backend
+
+    @property
+    def backend(self) -> EmbeddingBackend:
+        return self._backend
+
+    @classmethod
+    def class_name(cls) -> str:
+        return "BackendEmbedding"
+
+    def _get_query_embedding(self, query: str) -> List[float]:
+        return self._backend.encode([query])[0].tolist()
+
+    async def _aget_query_embedding(self, query: str) -> List[float]:
+        # Inference is CPU-bound; a worker thread keeps the event loop serving other requests
+        return await asyncio.to_thread(self._get_query_embedding, query)
+
+    async def _aget_text_embedding(self, text: str) -> List[float]:
+        return await asyncio.to_thread(self._get_text_embedding, text)
+
+    async def _aget_text_embeddings(self, texts: List[str]) -> List[List[float]]:
+        return await asyncio.to_thread(self._get_text_embeddings, texts)
+
+    def _get_text_embedding(self, text: str) -> List[float]:
+        return self._backend.encode([text])[0].tolist()
+
+    def _get_text_embeddings(self, texts: List[str]) -> List[List[float]]:
+        return self._backend.encode(texts, batch_size=max(len(texts), 1)).tolist()
+
+
+def export_onnx_model(output_dir: Path = DEFAULT_ONNX_MODEL_DIR, model_name: str = EMBEDDING_MODEL_NAME, quantize: bool = True) -> Path:
+    """
+    Exports the transformer of the sentence-transformers model to ONNX (dynamic
+    batch/sequence axes), saves its tokenizer.json and, optionally, a dynamically
+    int8-quantized copy. Pooling/normalization stay in OnnxEmbeddingBackend.
+    """
+    import torch
+    from transformers import AutoModel, AutoTokenizer
+
+    output_dir = Path(output_dir)
+    output_dir.mkdir(parents=True, exist_ok=True)
+
+    tokenizer = AutoTokenizer.from_pretrained(model_name)
+    model = AutoModel.from_pretrained(model_name)
+    model.eval()
+    tokenizer.save_pretrained(str(output_dir))  # writes tokenizer.json for the fast tokenizer
+
+    sample = tokenizer(["export sample"], return_tensors="pt")
+    input_names = ["input_ids", "attention_mask", "token_type_ids"]
+    dynamic_axes = {name: {0: "batch", 1: "sequence"} for name in input_names}
+    dynamic_axes["last_hidden_state"] = {0: "batch", 1: "sequence"}
+
+    model_path = output_dir / ONNX_MODEL_FILE
+    with torch.no_grad():
+        torch.onnx.export(
+            model,
+            (sample["input_ids"], sample["attention_mask"], sample["token_type_ids"]),
+            str(model_path),
+            input_names=input_names,
+            output_names=["last_hidden_state"],
+            dynamic_axes=dynamic_axes,
+            opset_version=14,
+        )
+    logger.info(f"Exported ONNX model to {model_path}.")
+
+    if quantize:
+        from onnxruntime.quantization import QuantType, quantize_dynamic
+        quantized_path = output_dir / ONNX_QUANTIZED_MODEL_FILE
+        quantize_dynamic(str(model_path), str(quantized_path), weight_type=QuantType.QInt8)
+        logger.info(f"Wrote int8 dynamically quantized model to {quantized_path}.")
+    return output_dir
+
+
+def check_parity(reference: EmbeddingBackend, candidate: EmbeddingBackend, texts: List[str], batch_size: int = 32) -> Dict[str, float]:
+    """Cosine agreement between two backends on the same texts (vectors are unit norm)."""
+    ref = reference.encode(texts, batch_size=batch_size)
+    cand = candidate.encode(texts, batch_size=batch_size)
+    if ref.shape != cand.shape:
+        raise ValueError(f"Backend output shapes differ: {ref.shape} vs {cand.shape}")
+    cosines = np.sum(ref * cand, axis=1)
+    return {
+        "n": int(len(texts)),
+        "mean_cosine": float(np.mean(cosines)),
+        "min_cosine": float(np.min(cosines)),
+        "p01_cosine": float(np.percentile(cosines, 1)),
+        "p50_cosine": float(np.percentile(cosines, 50)),
+    }
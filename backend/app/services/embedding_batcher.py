@@ -0,0 +1,240 @@
+"""
+In-process micro-batcher for query embedding and FAISS search.
+
+Concurrent requests each used to run their own single-text forward pass and
+their own index.search. The batcher collects queries for a few milliseconds
+(or until max_batch_size), encodes them in one forward pass, runs one
+batched search per (index, k) group and resolves each caller's Future.
+"""
+import os
+import time
+import queue
+import logging
+import threading
+from concurrent.futures import Future
+from typing import Any, Callable, Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+from llama_index.core import Settings
+
+logger = logging.getLogger(__name__)
+
+BATCH_SIZE_BUCKETS = (1, 2, 4, 8, 16, 32, 64, 128)
+QUEUE_DEPTH_BUCKETS = (0, 1, 2, 4, 8, 16, 32, 64, 128, 256)
+
+
+class Histogram:
+    """Minimal fixed-bucket histogram (count per upper bound, plus +Inf)."""
+
+    def __init__(self, buckets: Sequence[float]):
+        self.buckets = tuple(buckets)
+        self._counts = [0] * (len(self.buckets) + 1)
+        self._sum = 0.0
+        self._count = 0
+        self._lock = threading.Lock()
+
+    def observe(self, value: float) -> None:
+        with self._lock:
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    self._counts[i] += 1
+                    break
+            else:
+                self._counts[-1] += 1
+            self._sum += value
+            self._count += 1
+
+    def snapshot(self) -> Dict[str, Any]:
+        with self._lock:
+            labels = [str(bound) for bound in self.buckets] + ["+Inf"]
+            return {
+                "buckets": dict(zip(labels, self._counts)),
+                "count": self._count,
+                "sum": self._sum,
+                "mean": (self._sum / self._count) if self._count else 0.0,
+            }
+
+
+def encode_texts(texts: List[str]) -> np.ndarray:
+    """
+    Encodes texts with the configured embedding model in a single forward pass.
+    LlamaIndex re-splits batches by embed_batch_size, so the underlying
+    backend / SentenceTransformer is called directly when available.
+    """
+    embed_model = Settings.embed_model
+    backend = getattr(embed_model, "backend", None)
+    if backend is not None:
+        return backend.encode(texts, batch_size=len(texts))
+    st_model = getattr(embed_model, "_model", None)
+    if st_model is not None and hasattr(st_model, "encode"):
+        vectors = st_model.encode(
+            texts,
+            batch_size=len(texts),
+            normalize_embeddings=getattr(embed_model, "normalize", True),
+            show_progress_bar=False,
+        )
+    else:
+        vectors = embed_model.get_text_embedding_batch(texts)
+    return np.asarray(vectors, dtype="float32")
+
+
+class _Request:
+    __slots__ = ("text", "vector", "faiss_index", "k", "search_params", "future")
+
+    def __init__(self, text, vector, faiss_index, k, search_params):
+        self.text = text
+        self.vector = vector
+        self.faiss_index = faiss_index
+        self.k = k
+        self.search_params = search_params
+        self.future: Future = Future()
+
+
+class EmbeddingBatcher:
+    """Collects embed / search requests from many threads and serves them in batches."""
+
+    def __init__(
+        self,
+        encode_fn: Callable[[List[str]], np.ndarray] = encode_texts,
+        max_batch_size: int = 32,
+        max_wait_ms: float = 3.0,
+    ):
+        self._encode_fn = encode_fn
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait_ms / 1000.0
+        self._queue: "queue.Queue[_Request]" = queue.Queue()
+        self._thread: Optional[threading.Thread] = None
+        self._start_lock = threading.Lock()
+
+        self.batch_sizes = Histogram(BATCH_SIZE_BUCKETS)
+        self.queue_depths = Histogram(QUEUE_DEPTH_BUCKETS)
+        self.batches = 0
+        self.errors = 0
+
+    # --- Lifecycle ---
+    def _ensure_started(self) -> None:
+        # Started lazily so the thread lives in the serving (post-fork) process
+        if self._thread is not None and self._thread.is_alive():
+            return
+        with self._start_lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._run, name="embedding-batcher", daemon=True)
+                self._thread.start()
+                logger.info(f"Embedding batcher started (max_batch_size={self.max_batch_size}, window={self.max_wait * 1000:.1f}ms).")
+
+    # --- Public API ---
+    def submit(self, text: Optional[str] = None, vector: Any = None, faiss_index: Any = None,
+               k: int = 0, search_params: Any = None) -> Future:
+        """
+        Queues a request. Resolves to the query vector, or to
+        (vector, distances, ids) when faiss_index is given.
+        """
+        if text is None and vector is None:
+            raise ValueError("Either text or vector is required.")
+        self._ensure_started()
+        request = _Request(text, vector, faiss_index, k, search_params)
+        self.queue_depths.observe(self._queue.qsize())
+        self._queue.put(request)
+        return request.future
+
+    def embed(self, text: str, timeout: Optional[float] = None) -> np.ndarray:
+        return self.submit(text=text).result(timeout=timeout)
+
+    def search(self, faiss_index: Any, k: int, text: Optional[str] = None, vector: Any = None,
+               search_params: Any = None, timeout: Optional[float] = None) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+        return self.submit(text=text, vector=vector, faiss_index=faiss_index, k=k,
+                           search_params=search_params).result(timeout=timeout)
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "queue_depth": self._queue.qsize(),
+            "batches": self.batches,
+            "errors": self.errors,
+            "max_batch_size": self.max_batch_size,
+            "window_ms": self.max_wait * 1000.0,
+            "batch_size_histogram": self.batch_sizes.snapshot(),
+            "queue_depth_histogram": self.queue_depths.snapshot(),
+        }
+
+    # --- Worker ---
+    def _collect(self) -> List[_Request]:
+        batch = [self._queue.get()]
+        deadline = time.monotonic() + self.max_wait
+        while len(batch) < self.max_batch_size:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                batch.append(self._queue.get(timeout=remaining))
+            except queue.Empty:
+                break
+        return batch
+
+    def _run(self) -> None:
+        while True:
+            batch = self._collect()
+            self.batches += 1
+            self.batch_sizes.observe(len(batch))
+            try:
+                self._process(batch)
+            except Exception as e:
+                self.errors += 1
+                logger.error(f"Embedding batch of {len(batch)} failed: {e}", exc_info=True)
+                for request in batch:
+                    if not request.future.done():
+                        request.future.set_exception(e)
+
+    def _process(self, batch: List[_Request]) -> None:
+        # 1. One forward pass for every request that still needs embedding
+        to_encode = [request for request in batch if request.vector is None]
+        if to_encode:
+            vectors = self._encode_fn([request.text for request in to_encode])
+            for request, vector in zip(to_encode, vectors):
+                request.vector = vector
+
+        # 2. One search per (index, k, params) group
+        groups: Dict[Tuple[int, int, int], List[_Request]] = {}
+        for request in batch:
+            if request.faiss_index is None:
+                request.future.set_result(np.asarray(request.vector, dtype="float32"))
+            else:
+                key = (id(request.faiss_index), request.k, id(request.search_params))
+                groups.setdefault(key, []).append(request)
+
+        for group in groups.values():
+            head = group[0]
+            matrix = np.asarray([request.vector for request in group], dtype="float32")
+            try:
+                if head.search_params is not None:
+                    distances, ids = head.faiss_index.search(matrix, head.k, params=head.search_params)
+                else:
+                    distances, ids = head.faiss_index.search(matrix, head.k)
+            except Exception as e:
+                for request in group:
+                    request.future.set_exception(e)
+                continue
+            for row, request in enumerate(group):
+                request.future.set_result((matrix[row], distances[row:row + 1], ids[row:row + 1]))
+
+
+_batcher: Optional[EmbeddingBatcher] = None
+_batcher_lock = threading.Lock()
+
+
+def get_embedding_batcher() -> Optional[EmbeddingBatcher]:
+    """Process-wide batcher configured from EMBEDDING_BATCH_* env vars, or None if disabled."""
+    global _batcher
+    if os.getenv("EMBEDDING_BATCHER_ENABLED", "true").lower() not in ("1", "true", "yes"):
+        return None
+    if _batcher is None:
+        with _batcher_lock:
+            if _batcher is None:
+                _batcher = EmbeddingBatcher(
+                    max_batch_size=int(os.getenv("EMBEDDING_BATCH_MAX_SIZE", "32")),
+                    max_wait_ms=float(os.getenv("EMBEDDING_BATCH_WINDOW_MS", "3")),
+                )
+    return _batcher
+
+
+# Upper bound on how long a caller waits for its batch
+BATCH_RESULT_TIMEOUT = float(os.getenv("EMBEDDING_BATCH_TIMEOUT_SECONDS", "30"))
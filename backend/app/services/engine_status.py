@@ -0,0 +1,71 @@
+import time
+import logging
+import threading
+from typing import Dict, Any, Iterable, List
+
+logger = logging.getLogger(__name__)
+
+# --- Component states ---
+PENDING = "pending"    # Not started yet
+LOADING = "loading"    # Loader is working on it
+READY = "ready"        # Loaded and usable
+FAILED = "failed"      # Loader gave up (see 'detail')
+DISABLED = "disabled"  # Intentionally off (e.g. missing credentials)
+
+SETTLED_STATES = (READY, FAILED, DISABLED)
+
+# --- Components loaded by rag_service.load_rag_engines() ---
+LLM = "llm"
+EMBEDDER = "embedder"
+VECTOR_INDEX = "vector_index"
+KG = "kg"
+COMPONENTS = (LLM, EMBEDDER, VECTOR_INDEX, KG)
+
+
+class EngineStatus:
+    """
+    Thread-safe registry of per-component load state.
+    The background loader writes to it; routes and health checks read from it.
+    """
+
+    def __init__(self, components: Iterable[str] = COMPONENTS):
+        self._lock = threading.Lock()
+        self._components: Dict[str, Dict[str, Any]] = {}
+        for name in components:
+            self._components[name] = {"state": PENDING, "detail": None, "updated_at": time.time()}
+
+    def set(self, component: str, state: str, detail: str = None) -> None:
+        with self._lock:
+            self._components[component] = {"state": state, "detail": detail, "updated_at": time.time()}
+        logger.info(f"Engine component '{component}' -> {state}" + (f" ({detail})" if detail else ""))
+
+    def get(self, component: str) -> str:
+        with self._lock:
+            return self._components.get(component, {}).get("state", PENDING)
+
+    def is_ready(self, component: str) -> bool:
+        return self.get(component) == READY
+
+    def is_settled(self, component: str) -> bool:
+        return self.get(component) in SETTLED_STATES
+
+    def unsettled(self, components: Iterable[str]) -> List[str]:
+        """Returns the components that are still pending or loading."""
+        return [name for name in components if not self.is_settled(name)]
+
+    def loading_finished(self) -> bool:
+        with self._lock:
+            return all(info["state"] in SETTLED_STATES for info in self._components.values())
+
+    def snapshot(self) -> Dict[str, Dict[str, Any]]:
+        with self._lock:
+            return {name: dict(info) for name, info in self._components.items()}
+
+    def reset(self) -> None:
+        with self._lock:
+            for name in self._components:
+                self._components[name] = {"state": PENDING, "detail": None, "updated_at": time.time()}
+
+
+# Process-wide instance (each gunicorn worker has its own)
+engine_status = EngineStatus()
@@ -0,0 +1,207 @@
+"""
+FAISS index construction and search knobs shared by the build scripts and
+the server.
+
+Build time: FAISS_INDEX_TYPE selects flat (exact, the original
+IndexIDMap(IndexFlatL2)), fp16 (flat with half-precision codes), hnsw,
+ivf_flat, ivf_pq or sq8. Quantized/IVF types are trained on a random
+sample of the vectors.
+
+Serve time: efSearch (HNSW) and nprobe (IVF) are passed per search via
+faiss SearchParameters, so concurrent requests can use different values.
+Optional exact re-scoring re-ranks the approximate candidates against the
+vectors saved next to the index (float32, or float16/int8 per
+VECTOR_STORAGE_DTYPE; see vector_storage.py).
+"""
+import os
+import json
+import logging
+from functools import lru_cache
+from pathlib import Path
+from typing import Any, Dict, Optional, Tuple
+
+import numpy as np
+import faiss
+
+from app.services.atomic_files import atomic_path, write_json
+from app.services.vector_storage import load_vectors, vector_dtype_from_env, write_vectors
+
+logger = logging.getLogger(__name__)
+
+INDEX_TYPES = ("flat", "fp16", "hnsw", "ivf_flat", "ivf_pq", "sq8")
+
+# Sidecar describing how vector_index.faiss was built (read by rag_service)
+INDEX_INFO_FILENAME = "vector_index.json"
+# Vectors in chunk-store row order (ids ascending), for exact re-scoring
+RESCORE_VECTORS_FILENAME = "vector_embeddings.npy"
+
+
+def index_options_from_env() -> Dict[str, Any]:
+    """Build options for build_faiss_index(), from FAISS_* env vars."""
+    return {
+        "index_type": os.getenv("FAISS_INDEX_TYPE", "flat").lower(),
+        "nlist": int(os.getenv("FAISS_NLIST", "0")) or None,
+        "pq_m": int(os.getenv("FAISS_PQ_M", "48")),
+        "pq_nbits": int(os.getenv("FAISS_PQ_NBITS", "8")),
+        "hnsw_m": int(os.getenv("FAISS_HNSW_M", "32")),
+        "ef_construction": int(os.getenv("FAISS_HNSW_EF_CONSTRUCTION", "200")),
+        "train_sample": int(os.getenv("FAISS_TRAIN_SAMPLE", "50000")),
+        "write_rescore_vectors": os.getenv("FAISS_WRITE_RESCORE_VECTORS", "true").lower() in ("1", "true", "yes"),
+    }
+
+
+def _default_nlist(n_vectors: int) -> int:
+    # ~4*sqrt(n) lists, while keeping >= 39 training points per centroid
+    return max(1, min(int(4 * np.sqrt(n_vectors)), n_vectors // 39 or 1))
+
+
+def build_faiss_index(
+    vectors: np.ndarray,
+    ids: np.ndarray,
+    index_type: str = "flat",
+    nlist: Optional[int] = None,
+    pq_m: int = 48,
+    pq_nbits: int = 8,
+    hnsw_m: int = 32,
+    ef_construction: int = 200,
+    train_sample: int = 50000,
+    seed: int = 0,
+    **_unused: Any,
+) -> Tuple[Any, Dict[str, Any]]:
+    """
+    Builds an index over (vectors, ids) using L2 distance.
+    Returns (index, info) where info records the type and parameters.
+    """
+    if index_type not in INDEX_TYPES:
+        raise ValueError(f"Unknown FAISS index type '{index_type}' (expected one of {INDEX_TYPES}).")
+    vectors = np.ascontiguousarray(vectors, dtype="float32")
+    ids = np.asarray(ids, dtype="int64")
+    n_vectors, dimension = vectors.shape
+    info: Dict[str, Any] = {"index_type": index_type, "dimension": int(dimension), "metric": "l2"}
+
+    if index_type == "flat":
+        index = faiss.IndexIDMap(faiss.IndexFlatL2(dimension))
+    elif index_type == "hnsw":
+        hnsw = faiss.IndexHNSWFlat(dimension, hnsw_m)
+        hnsw.hnsw.efConstruction = ef_construction
+        index = faiss.IndexIDMap(hnsw)
+        info.update(hnsw_m=hnsw_m, ef_construction=ef_construction)
+    elif index_type == "sq8":
+        index = faiss.index_factory(dimension, "IDMap,SQ8")
+    elif index_type == "fp16":
+        index = faiss.index_factory(dimension, "IDMap,SQfp16")
+    else:
+        nlist = nlist or _default_nlist(n_vectors)
+        if index_type == "ivf_flat":
+            index = faiss.index_factory(dimension, f"IVF{nlist},Flat")
+        else:
+            if dimension % pq_m != 0:
+                raise ValueError(f"FAISS_PQ_M={pq_m} must divide the dimension {dimension}.")
+            index = faiss.index_factory(dimension, f"IVF{nlist},PQ{pq_m}x{pq_nbits}")
+            info.update(pq_m=pq_m, pq_nbits=pq_nbits)
+        info.update(nlist=nlist)
+
+    if not index.is_trained:
+        sample_size = min(train_sample, n_vectors)
+        rng = np.random.default_rng(seed)
+        sample = vectors[rng.choice(n_vectors, size=sample_size, replace=False)] if sample_size < n_vectors else vectors
+        logger.info(f"Training {index_type} index on {len(sample)} sampled vectors...")
+        index.train(sample)
+        info["train_sample"] = int(len(sample))
+
+    index.add_with_ids(vectors, ids)
+    info["ntotal"] = int(index.ntotal)
+    logger.info(f"Built {index_type} FAISS index with {index.ntotal} vectors.")
+    return index, info
+
+
+def write_index_artifacts(
+    index: Any,
+    info: Dict[str, Any],
+    index_path: Path,
+    vectors: Optional[np.ndarray] = None,
+    ids: Optional[np.ndarray] = None,
+    vector_dtype: Optional[str] = None,
+) -> None:
+    """
+    Writes the index, its JSON sidecar and (when vectors are given and the
+    index is approximate) the re-scoring vectors in id order, stored as
+    vector_dtype (default: VECTOR_STORAGE_DTYPE). Each file is swapped in
+    whole; the build publishes them together afterwards (index_manager.publish_index).
+    """
+    index_path = Path(index_path)
+    with atomic_path(index_path) as tmp_name:
+        faiss.write_index(index, tmp_name)
+    logger.info(f"FAISS index saved to {index_path}.")
+
+    info = dict(info)
+    if vectors is not None and ids is not None and info.get("index_type") != "flat":
+        order = np.argsort(np.asarray(ids, dtype="int64"), kind="stable")
+        rescore_path = index_path.parent / RESCORE_VECTORS_FILENAME
+        info["rescore_dtype"] = vector_dtype or vector_dtype_from_env()
+        write_vectors(rescore_path, vectors, dtype=info["rescore_dtype"], order=order)
+        info["rescore_vectors"] = RESCORE_VECTORS_FILENAME
+        logger.info(f"Re-scoring vectors saved to {rescore_path}.")
+
+    write_json(index_path.parent / INDEX_INFO_FILENAME, info, indent=2)
+
+
+def read_index_info(index_path: Path) -> Dict[str, Any]:
+    info_path = Path(index_path).parent / INDEX_INFO_FILENAME
+    if not info_path.exists():
+        return {"index_type": "flat"}
+    with open(info_path, "r", encoding="utf-8") as f:
+        return json.load(f)
+
+
+def _base_index(index: Any) -> Any:
+    if isinstance(index, faiss.IndexIDMap):
+        return faiss.downcast_index(index.index)
+    return faiss.downcast_index(index)
+
+
+@lru_cache(maxsize=256)
+def _cached_params(kind: str, ef_search: Optional[int], nprobe: Optional[int]):
+    # Shared objects so the micro-batcher can group requests with equal knobs
+    if kind == "hnsw":
+        return faiss.SearchParametersHNSW(efSearch=ef_search)
+    return faiss.SearchParametersIVF(nprobe=nprobe)
+
+
+def make_search_params(index: Any, ef_search: Optional[int] = None, nprobe: Optional[int] = None):
+    """SearchParameters for this index type, or None when no knob applies."""
+    base = _base_index(index)
+    if ef_search and isinstance(base, faiss.IndexHNSW):
+        return _cached_params("hnsw", int(ef_search), None)
+    if nprobe:
+        try:
+            faiss.extract_index_ivf(index)
+        except RuntimeError:
+            return None
+        return _cached_params("ivf", None, int(nprobe))
+    return None
+
+
+class Rescorer:
+    """L2 re-ranking against memory-mapped stored vectors in chunk-store row order."""
+
+    def __init__(self, vectors_path: Path, chunk_store: Any, factor: int = 4):
+        self.vectors = load_vectors(vectors_path)
+        self.chunk_store = chunk_store
+        self.factor = max(1, factor)
+        if len(self.vectors) != len(chunk_store):
+            raise ValueError(f"Re-scoring vectors ({len(self.vectors)}) do not match chunk store ({len(chunk_store)}).")
+
+    def rescore(self, query_vector: np.ndarray, ids: np.ndarray, k: int) -> Tuple[np.ndarray, np.ndarray]:
+        """Returns (distances, ids) of shape (1, <=k) re-ranked by exact squared L2."""
+        candidate_ids = [int(i) for i in ids[0] if i >= 0]
+        rows = [self.chunk_store.row_of(i) for i in candidate_ids]
+        keep = [(i, r) for i, r in zip(candidate_ids, rows) if r >= 0]
+        if not keep:
+            return np.zeros((1, 0), dtype="float32"), np.zeros((1, 0), dtype="int64")
+        kept_ids = np.asarray([i for i, _ in keep], dtype="int64")
+        candidates = np.asarray(self.vectors[[r for _, r in keep]], dtype="float32")
+        query = np.asarray(query_vector, dtype="float32").ravel()
+        distances = np.sum((candidates - query) ** 2, axis=1)
+        order = np.argsort(distances)[:k]
+        return distances[order][None, :], kept_ids[order][None, :]
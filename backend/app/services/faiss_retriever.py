@@ -0,0 +1,234 @@
+"""
+LlamaIndex adapters over a raw FAISS index + memory-mapped ChunkStore.
+
+Instead of rebuilding a VectorStoreIndex (one TextNode per chunk held in every
+worker), nodes are materialized on demand for the FAISS top-k hits only.
+"""
+import time
+import asyncio
+import logging
+from typing import Any, Dict, List, Optional, Tuple
+
+import numpy as np
+from llama_index.core import Settings
+from llama_index.core.base.response.schema import RESPONSE_TYPE, AsyncStreamingResponse, StreamingResponse
+from llama_index.core.callbacks.schema import CBEventType, EventPayload
+from llama_index.core.query_engine import RetrieverQueryEngine
+from llama_index.core.retrievers import BaseRetriever
+from llama_index.core.schema import NodeWithScore, QueryBundle, TextNode
+
+from app.services.chunk_store import ChunkStore
+from app.services.embedding_batcher import get_embedding_batcher, BATCH_RESULT_TIMEOUT
+from app.services.faiss_factory import Rescorer, make_search_params
+from app.services.metrics import observe_stage, stage_timer, timed, EMBED, SYNTHESIS, VECTOR_SEARCH
+
+logger = logging.getLogger(__name__)
+
+
+def l2_to_cosine(distances: np.ndarray) -> np.ndarray:
+    """L2 indexes return squared L2; for unit vectors cos = 1 - d / 2."""
+    return 1.0 - np.asarray(distances, dtype="float32") / 2.0
+
+
+class LazyChunkDocstore:
+    """Docstore-style adapter that decodes chunk records only when asked for them."""
+
+    def __init__(self, chunk_store: ChunkStore):
+        self._chunk_store = chunk_store
+
+    def __len__(self) -> int:
+        return len(self._chunk_store)
+
+    def get_record(self, faiss_id: int) -> Optional[Dict[str, Any]]:
+        return self._chunk_store.get(int(faiss_id))
+
+    def get_node(self, faiss_id: int) -> Optional[TextNode]:
+        record = self.get_record(faiss_id)
+        if record is None:
+            return None
+        return TextNode(
+            id_=record.get("doc_id") or str(faiss_id),
+            text=record.get("text", ""),
+            metadata=record.get("metadata") or {},
+        )
+
+    def get_nodes(self, faiss_ids: List[int]) -> List[Optional[TextNode]]:
+        return [self.get_node(faiss_id) for faiss_id in faiss_ids]
+
+
+class FaissChunkRetriever(BaseRetriever):
+    """Embeds the query, searches FAISS and returns NodeWithScore for the hits."""
+
+    def __init__(
+        self,
+        faiss_index: Any,
+        docstore: LazyChunkDocstore,
+        similarity_top_k: int = 5,
+        embed_model: Any = None,
+        ef_search: Optional[int] = None,
+        nprobe: Optional[int] = None,
+        rescorer: Optional[Rescorer] = None,
+        **kwargs: Any,
+    ):
+        self._faiss_index = faiss_index
+        self._docstore = docstore
+        self._similarity_top_k = similarity_top_k
+        self._embed_model = embed_model
+        self._search_params = make_search_params(faiss_index, ef_search=ef_search, nprobe=nprobe)
+        self._rescorer = rescorer
+        super().__init__(**kwargs)
+
+    def _embed_query(self, query_bundle: QueryBundle) -> List[float]:
+        if query_bundle.embedding is not None:
+            return query_bundle.embedding
+        embed_model = self._embed_model or Settings.embed_model
+        with stage_timer(EMBED):
+            return embed_model.get_query_embedding(query_bundle.query_str)
+
+    @timed(VECTOR_SEARCH)
+    def _search(self, query_bundle: QueryBundle):
+        # Approximate indexes fetch extra candidates for exact re-scoring
+        fetch_k = self._similarity_top_k * (self._rescorer.factor if self._rescorer else 1)
+        batcher = get_embedding_batcher() if self._embed_model is None else None
+        if batcher is not None:
+            # Shares one forward pass / one index.search with concurrent requests
+            query_vector, distances, ids = batcher.search(
+                self._faiss_index,
+                fetch_k,
+                text=query_bundle.query_str if query_bundle.embedding is None else None,
+                vector=query_bundle.embedding,
+                search_params=self._search_params,
+                timeout=BATCH_RESULT_TIMEOUT,
+            )
+        else:
+            query_vector = np.asarray([self._embed_query(query_bundle)], dtype="float32")
+            if self._search_params is not None:
+                distances, ids = self._faiss_index.search(query_vector, fetch_k, params=self._search_params)
+            else:
+                distances, ids = self._faiss_index.search(query_vector, fetch_k)
+
+        if self._rescorer is not None:
+            distances, ids = self._rescorer.rescore(query_vector, ids, self._similarity_top_k)
+        return distances, ids
+
+    def _hits(self, query_bundle: QueryBundle) -> List[Tuple[int, float]]:
+        distances, ids = self._search(query_bundle)
+        scores = l2_to_cosine(distances[0])
+        # FAISS pads with -1 when fewer than k vectors exist
+        return [(int(faiss_id), float(score)) for faiss_id, score in zip(ids[0], scores) if faiss_id >= 0]
+
+    def _retrieve(self, query_bundle: QueryBundle) -> List[NodeWithScore]:
+        results = []
+        for faiss_id, score in self._hits(query_bundle):
+            node = self._docstore.get_node(faiss_id)
+            if node is None:
+                logger.warning(f"FAISS id {faiss_id} has no entry in the chunk store.")
+                continue
+            results.append(NodeWithScore(node=node, score=score))
+        return results
+
+    def retrieve_records(self, query_bundle: QueryBundle) -> List[Tuple[Dict[str, Any], float]]:
+        """(chunk record, cosine score) for the top hits, without building TextNodes or callback events."""
+        results = []
+        for faiss_id, score in self._hits(query_bundle):
+            record = self._docstore.get_record(faiss_id)
+            if record is None:
+                logger.warning(f"FAISS id {faiss_id} has no entry in the chunk store.")
+                continue
+            results.append((record, score))
+        return results
+
+    async def _aretrieve(self, query_bundle: QueryBundle) -> List[NodeWithScore]:
+        # Embedding, FAISS search and batcher waits all block; keep them off the event loop
+        return await asyncio.to_thread(self._retrieve, query_bundle)
+
+
+def _observe_synthesis(response: RESPONSE_TYPE, start: float) -> None:
+    # A streaming response returns before the LLM runs; its consumer times the token loop instead
+    if not isinstance(response, (StreamingResponse, AsyncStreamingResponse)):
+        observe_stage(SYNTHESIS, time.perf_counter() - start)
+
+
+class TimedRetrieverQueryEngine(RetrieverQueryEngine):
+    """RetrieverQueryEngine that reports the synthesis (LLM) stage separately from retrieval."""
+
+    def _query(self, query_bundle: QueryBundle) -> RESPONSE_TYPE:
+        with self.callback_manager.event(
+            CBEventType.QUERY, payload={EventPayload.QUERY_STR: query_bundle.query_str}
+        ) as query_event:
+            nodes = self.retrieve(query_bundle)
+            start = time.perf_counter()
+            response = self._response_synthesizer.synthesize(query=query_bundle, nodes=nodes)
+            _observe_synthesis(response, start)
+            query_event.on_end(payload={EventPayload.RESPONSE: response})
+        return response
+
+    async def _aquery(self, query_bundle: QueryBundle) -> RESPONSE_TYPE:
+        with self.callback_manager.event(
+            CBEventType.QUERY, payload={EventPayload.QUERY_STR: query_bundle.query_str}
+        ) as query_event:
+            nodes = await self.aretrieve(query_bundle)
+            start = time.perf_counter()
+            response = await self._response_synthesizer.asynthesize(query=query_bundle, nodes=nodes)
+            _observe_synthesis(response, start)
+            query_event.on_end(payload={EventPayload.RESPONSE: response})
+        return response
+
+
+class ChunkStoreVectorIndex:
+    """
+    Drop-in replacement for the VectorStoreIndex that load_rag_engines() used to
+    build: exposes as_retriever() / as_query_engine() over FAISS + ChunkStore.
+    """
+
+    def __init__(
+        self,
+        faiss_index: Any,
+        chunk_store: ChunkStore,
+        rescorer: Optional[Rescorer] = None,
+        default_ef_search: Optional[int] = None,
+        default_nprobe: Optional[int] = None,
+        faq_index: Optional[Any] = None,
+    ):
+        self.faiss_index = faiss_index
+        self.chunk_store = chunk_store
+        self.docstore = LazyChunkDocstore(chunk_store)
+        self.rescorer = rescorer
+        self.default_ef_search = default_ef_search
+        self.default_nprobe = default_nprobe
+        self.faq_index = faq_index  # FaqIndex over the same chunk store (FAQ fast path), or None
+
+    @property
+    def ntotal(self) -> int:
+        return int(self.faiss_index.ntotal)
+
+    def as_retriever(
+        self,
+        similarity_top_k: int = 5,
+        ef_search: Optional[int] = None,
+        nprobe: Optional[int] = None,
+        **kwargs: Any,
+    ) -> FaissChunkRetriever:
+        return FaissChunkRetriever(
+            self.faiss_index,
+            self.docstore,
+            similarity_top_k=similarity_top_k,
+            ef_search=ef_search or self.default_ef_search,
+            nprobe=nprobe or self.default_nprobe,
+            rescorer=self.rescorer,
+            **kwargs,
+        )
+
+    def as_query_engine(
+        self,
+        similarity_top_k: int = 5,
+        ef_search: Optional[int] = None,
+        nprobe: Optional[int] = None,
+        **kwargs: Any,
+    ) -> TimedRetrieverQueryEngine:
+        retriever = self.as_retriever(similarity_top_k=similarity_top_k, ef_search=ef_search, nprobe=nprobe)
+        return TimedRetrieverQueryEngine.from_args(retriever, **kwargs)
+
+    def close(self) -> None:
+        """Unmaps the chunk store (shared by the FAQ index and rescorer); the index must be unused."""
+        self.chunk_store.close()
@@ -0,0 +1,227 @@
+"""
+Offline stand-ins for the external services, for load tests and laptops.
+
+  FAKE_LLM=true    FakeLLM replaces Gemini in Settings.llm
+  FAKE_NEO4J=true  in-memory KnowledgeGraphIndex instead of Neo4j
+  FAKE_MAPS=true   FakeMapsClient replaces googlemaps.Client in /api/misc
+
+Combined with EMBEDDING_BACKEND=hashing, the server runs with no network and
+no API keys. Responses are deterministic for a given prompt; latency is
+sampled from a log-normal distribution and streamed at a fixed token rate so
+load tests see realistic request durations.
+"""
+import os
+import json
+import math
+import time
+import random
+import asyncio
+import hashlib
+import logging
+import threading
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Tuple
+
+import numpy as np
+from llama_index.core import KnowledgeGraphIndex, StorageContext
+from llama_index.core.base.llms.types import (
+    CompletionResponse,
+    CompletionResponseAsyncGen,
+    CompletionResponseGen,
+    LLMMetadata,
+)
+from llama_index.core.graph_stores import SimpleGraphStore
+from llama_index.core.llms import CustomLLM
+from pydantic import PrivateAttr
+
+logger = logging.getLogger(__name__)
+
+DATA_DIR = Path(__file__).resolve().parent.parent.parent / "data"
+FAKE_KG_SOURCE_FILE = DATA_DIR / "cleaned_disfaqs.json"
+
+_WORD_POOL = (
+    "condition symptoms treatment doctor rest fluids medication infection inflammation chronic acute "
+    "diagnosis test blood pressure pain fever fatigue therapy recovery risk prevention diet exercise"
+).split()
+_CONDITIONS = ("Migraine", "Tension Headache", "Common Cold", "Influenza", "Gastritis", "Sinusitis", "Anemia")
+_QUESTIONS = (
+    "What could be causing these symptoms?", "Which tests do I need?", "What are my treatment options?",
+    "Are there side effects?", "When should I come back?", "Should I change my diet?",
+)
+
+
+def env_flag(name: str) -> bool:
+    return os.getenv(name, "false").lower() in ("1", "true", "yes")
+
+
+class FakeLLM(CustomLLM):
+    """Deterministic LLM stand-in with configurable latency and token rate."""
+
+    latency_ms: float = 800.0        # Median time to first token
+    latency_sigma: float = 0.5       # Log-normal spread of the first-token latency
+    tokens_per_second: float = 50.0  # Streaming rate after the first token
+    response_tokens: int = 60        # Length of free-text answers
+
+    _rng: random.Random = PrivateAttr()
+    _rng_lock: threading.Lock = PrivateAttr()
+
+    def __init__(self, seed: int = 0, **kwargs: Any):
+        super().__init__(**kwargs)
+        self._rng = random.Random(seed)
+        self._rng_lock = threading.Lock()
+
+    @classmethod
+    def from_env(cls) -> "FakeLLM":
+        return cls(
+            latency_ms=float(os.getenv("FAKE_LLM_LATENCY_MS", "800")),
+            latency_sigma=float(os.getenv("FAKE_LLM_LATENCY_SIGMA", "0.5")),
+            tokens_per_second=float(os.getenv("FAKE_LLM_TOKENS_PER_SECOND", "50")),
+            response_tokens=int(os.getenv("FAKE_LLM_RESPONSE_TOKENS", "60")),
+            seed=int(os.getenv("FAKE_LLM_SEED", "0")),
+        )
+
+    @classmethod
+    def class_name(cls) -> str:
+        return "FakeLLM"
+
+    @property
+    def metadata(self) -> LLMMetadata:
+        return LLMMetadata(model_name="fake-llm", context_window=32768, num_output=self.response_tokens)
+
+    # --- Content ---
+    def respond(self, prompt: str) -> str:
+        """Deterministic answer shaped like what each call site expects."""
+        rng = np.random.default_rng(int.from_bytes(hashlib.sha256(prompt.encode("utf-8")).digest()[:8], "little"))
+        if "Respond only with the word RAG or SYMPTOM" in prompt:
+            latest = prompt.split("latest message is:", 1)[-1].split("\n", 1)[0]
+            return "RAG" if "?" in latest else "SYMPTOM"
+        if "choice that is most relevant" in prompt:
+            return json.dumps([{"choice": 1, "reason": "Offline fake LLM always picks the first tool."}])
+        if "'KEYWORDS: <keywords>'" in prompt:
+            question = prompt.split("---------------------")[1] if prompt.count("---------------------") >= 2 else prompt
+            words = [w.strip("?,.!").lower() for w in question.split() if len(w) > 3][:5]
+            return "KEYWORDS: " + ", ".join(words)
+        if "JSON list" in prompt:
+            pool = _QUESTIONS if "questions" in prompt else _CONDITIONS
+            picks = rng.choice(len(pool), size=min(len(pool), int(rng.integers(3, 6))), replace=False)
+            return json.dumps([pool[i] for i in picks])
+        words = rng.choice(_WORD_POOL, size=self.response_tokens)
+        return (" ".join(words)).capitalize() + "."
+
+    # --- Timing ---
+    def _first_token_delay(self) -> float:
+        if self.latency_ms <= 0:
+            return 0.0
+        with self._rng_lock:
+            sample = self._rng.lognormvariate(math.log(self.latency_ms), self.latency_sigma)
+        return sample / 1000.0
+
+    def _token_delay(self) -> float:
+        return 1.0 / self.tokens_per_second if self.tokens_per_second > 0 else 0.0
+
+    def _tokens(self, text: str) -> List[str]:
+        words = text.split(" ")
+        return [word + (" " if i < len(words) - 1 else "") for i, word in enumerate(words)]
+
+    # --- Sync ---
+    def complete(self, prompt: str, formatted: bool = False, **kwargs: Any) -> CompletionResponse:
+        text = self.respond(prompt)
+        time.sleep(self._first_token_delay() + len(self._tokens(text)) * self._token_delay())
+        return CompletionResponse(text=text)
+
+    def stream_complete(self, prompt: str, formatted: bool = False, **kwargs: Any) -> CompletionResponseGen:
+        text = self.respond(prompt)
+        first_delay = self._first_token_delay()
+
+        def gen() -> CompletionResponseGen:
+            time.sleep(first_delay)
+            so_far = ""
+            for token in self._tokens(text):
+                so_far += token
+                yield CompletionResponse(text=so_far, delta=token)
+                time.sleep(self._token_delay())
+
+        return gen()
+
+    # --- Async (sleeps without blocking the event loop) ---
+    async def acomplete(self, prompt: str, formatted: bool = False, **kwargs: Any) -> CompletionResponse:
+        text = self.respond(prompt)
+        await asyncio.sleep(self._first_token_delay() + len(self._tokens(text)) * self._token_delay())
+        return CompletionResponse(text=text)
+
+    async def astream_complete(self, prompt: str, formatted: bool = False, **kwargs: Any) -> CompletionResponseAsyncGen:
+        text = self.respond(prompt)
+        first_delay = self._first_token_delay()
+
+        async def gen() -> CompletionResponseAsyncGen:
+            await asyncio.sleep(first_delay)
+            so_far = ""
+            for token in self._tokens(text):
+                so_far += token
+                yield CompletionResponse(text=so_far, delta=token)
+                await asyncio.sleep(self._token_delay())
+
+        return gen()
+
+
+class FakeGraphStore(SimpleGraphStore):
+    """In-memory graph store that adds a fixed per-lookup latency, like a Neo4j round trip."""
+
+    _latency: float = PrivateAttr(default=0.0)
+
+    def set_latency_ms(self, latency_ms: float) -> None:
+        self._latency = latency_ms / 1000.0
+
+    def get(self, subj: str) -> List[List[str]]:
+        time.sleep(self._latency)
+        return super().get(subj)
+
+    def get_rel_map(self, subjs: Optional[List[str]] = None, depth: int = 2, limit: int = 30) -> Dict[str, List[List[str]]]:
+        time.sleep(self._latency)
+        return super().get_rel_map(subjs, depth, limit)
+
+
+def build_fake_kg_index(max_entities: Optional[int] = None) -> KnowledgeGraphIndex:
+    """KG index over (disease, HAS_FAQ, question) triplets from the shipped FAQ corpus."""
+    max_entities = max_entities or int(os.getenv("FAKE_NEO4J_MAX_ENTITIES", "300"))
+    graph_store = FakeGraphStore()
+    graph_store.set_latency_ms(float(os.getenv("FAKE_NEO4J_LATENCY_MS", "20")))
+    kg_index = KnowledgeGraphIndex(
+        nodes=[],
+        index_id="fake_kg",
+        storage_context=StorageContext.from_defaults(graph_store=graph_store),
+    )
+    with open(FAKE_KG_SOURCE_FILE, "r", encoding="utf-8") as f:
+        data = json.load(f)
+    count = 0
+    for item in data[:max_entities]:
+        name = str(item.get("disease_name", "")).strip()
+        for faq in item.get("faqs", [])[:3]:
+            if name and faq.get("question"):
+                graph_store.upsert_triplet(name.lower(), "HAS_FAQ", faq["question"])
+                count += 1
+    logger.info(f"Fake KG index built with {count} triplets (no Neo4j).")
+    return kg_index
+
+
+class FakeMapsClient:
+    """Stand-in for googlemaps.Client: deterministic hospitals around a location."""
+
+    def __init__(self, latency_ms: float = 150.0, results: int = 8):
+        self.latency = latency_ms / 1000.0
+        self.results = results
+
+    @classmethod
+    def from_env(cls) -> "FakeMapsClient":
+        return cls(latency_ms=float(os.getenv("FAKE_MAPS_LATENCY_MS", "150")))
+
+    def places_nearby(self, location: Tuple[float, float], radius: int = 10000, type: str = "hospital", **kwargs: Any) -> Dict[str, Any]:
+        time.sleep(self.latency)
+        lat, lng = location
+        rng = random.Random(f"{lat:.3f},{lng:.3f}")
+        return {
+            "results": [
+                {"name": f"Fake {type.title()} #{i + 1}", "vicinity": f"{rng.randint(1, 999)} Main Street ({lat:.3f}, {lng:.3f})"}
+                for i in range(self.results)
+            ]
+        }
@@ -0,0 +1,182 @@
+"""
+FAQ fast path: answer a question with a curated FAQ answer, skipping LLM
+synthesis, when it closely matches a stored FAQ question.
+
+build_faq_index() (run by scripts/build_faq_index.py and by every
+scripts/update_faiss_index.py run) embeds only the question half of every `faq`
+chunk ("Question: ... Answer: ...") into faq_index.faiss. Its ids are the
+chunk-store ids of those chunks, so a hit maps straight back to the stored
+answer and source URL. The match threshold is written to the faq_index.json
+sidecar (calibrate it with scripts/benchmark_retrieval.py --faq-calibration);
+FAQ_MATCH_THRESHOLD overrides it at serve time.
+
+  FAQ_FAST_PATH_ENABLED   default true (no-op when the index files are missing)
+  FAQ_MATCH_THRESHOLD     cosine similarity a match must reach
+"""
+import os
+import json
+import time
+import logging
+import threading
+from pathlib import Path
+from typing import Any, Dict, List, NamedTuple, Optional, Tuple
+
+import numpy as np
+import faiss
+
+from app.services.atomic_files import atomic_path, write_json
+from app.services.chunk_store import ChunkStore
+from app.services.embedding_backend import EMBEDDING_MODEL_NAME
+from app.services.faiss_factory import build_faiss_index
+from app.services.metrics import record_cache
+
+logger = logging.getLogger(__name__)
+
+FAQ_INDEX_FILENAME = "faq_index.faiss"
+FAQ_INFO_FILENAME = "faq_index.json"
+DEFAULT_FAQ_THRESHOLD = 0.92
+
+_QUESTION_PREFIX = "Question: "
+_ANSWER_SEPARATOR = " Answer: "
+
+
+def split_faq_text(text: str) -> Optional[Tuple[str, str]]:
+    """'Question: <q> Answer: <a>' -> (q, a), or None for other chunk texts."""
+    if not text.startswith(_QUESTION_PREFIX) or _ANSWER_SEPARATOR not in text:
+        return None
+    question, answer = text[len(_QUESTION_PREFIX):].split(_ANSWER_SEPARATOR, 1)
+    question, answer = question.strip(), answer.strip()
+    return (question, answer) if question and answer else None
+
+
+def iter_faq_questions(chunk_store: ChunkStore):
+    """Yields (faiss_id, question) for every faq chunk in the store."""
+    for faiss_id, record in chunk_store.iter_records():
+        if (record.get("metadata") or {}).get("type") != "faq":
+            continue
+        parts = split_faq_text(record.get("text", ""))
+        if parts:
+            yield faiss_id, parts[0]
+
+
+def build_faq_index(storage_dir: Path, chunk_store: ChunkStore, backend: Any, batch_size: int = 64,
+                    threshold: Optional[float] = None) -> Optional[Dict[str, Any]]:
+    """
+    Embeds the faq questions of chunk_store and writes faq_index.faiss plus
+    its sidecar to storage_dir (the caller publishes them). Keeps the
+    recorded threshold unless one is given. With no faq chunks left, removes
+    the old files so no stale index outlives them; returns the sidecar info,
+    or None then.
+    """
+    storage_dir = Path(storage_dir)
+    index_path = storage_dir / FAQ_INDEX_FILENAME
+    info_path = storage_dir / FAQ_INFO_FILENAME
+    faq_ids, questions = [], []
+    for faiss_id, question in iter_faq_questions(chunk_store):
+        faq_ids.append(faiss_id)
+        questions.append(question)
+    if not questions:
+        for path in (index_path, info_path):
+            if path.exists():
+                os.remove(path)
+        logger.info("No faq chunks in the chunk store; FAQ question index removed.")
+        return None
+
+    started = time.perf_counter()
+    vectors = np.asarray(backend.encode(questions, batch_size=batch_size), dtype="float32")
+    logger.info(f"Embedded {len(vectors)} FAQ questions in {time.perf_counter() - started:.1f}s ({backend.name} backend).")
+    index, _info = build_faiss_index(vectors, np.asarray(faq_ids, dtype="int64"), index_type="flat")
+    with atomic_path(index_path) as tmp_name:
+        faiss.write_index(index, tmp_name)
+
+    previous = {}
+    if info_path.exists():
+        with open(info_path, "r", encoding="utf-8") as f:
+            previous = json.load(f)
+    info = {
+        "threshold": threshold if threshold is not None else previous.get("threshold", DEFAULT_FAQ_THRESHOLD),
+        "questions": int(index.ntotal),
+        "embedding_model": EMBEDDING_MODEL_NAME,
+        "embedding_backend": backend.name,
+        "built_at": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()),
+        "calibration": previous.get("calibration"),
+    }
+    write_json(info_path, info, indent=2)
+    logger.info(f"FAQ index with {index.ntotal} questions saved to {index_path} (threshold {info['threshold']}).")
+    return info
+
+
+class FaqMatch(NamedTuple):
+    faiss_id: int
+    score: float
+    question: str
+    answer: str
+    sources: List[Dict[str, str]]
+
+
+class FaqIndex:
+    """Nearest stored FAQ question for a query embedding, accepted above a threshold."""
+
+    def __init__(self, faiss_index: Any, chunk_store: ChunkStore, threshold: float = DEFAULT_FAQ_THRESHOLD):
+        self.faiss_index = faiss_index
+        self.chunk_store = chunk_store
+        self.threshold = threshold
+        self.lookups = 0
+        self.hits = 0
+        self._lock = threading.Lock()
+
+    def match(self, query_embedding: List[float]) -> Optional[FaqMatch]:
+        query_vector = np.asarray([query_embedding], dtype="float32")
+        distances, ids = self.faiss_index.search(query_vector, 1)
+        faiss_id = int(ids[0][0])
+        # Unit vectors under L2: cos = 1 - d / 2
+        score = 1.0 - float(distances[0][0]) / 2.0
+        result = None
+        if faiss_id >= 0 and score >= self.threshold:
+            record = self.chunk_store.get(faiss_id)
+            parts = split_faq_text(record.get("text", "")) if record else None
+            if parts:
+                metadata = record.get("metadata") or {}
+                url = metadata.get("url", "")
+                sources = [{"name": metadata.get("name", f"Source ID: {record.get('doc_id')}"), "url": url}] if url else []
+                result = FaqMatch(faiss_id, score, parts[0], parts[1], sources)
+        with self._lock:
+            self.lookups += 1
+            if result is not None:
+                self.hits += 1
+        record_cache("faq", result is not None)
+        return result
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "questions": int(self.faiss_index.ntotal),
+                "threshold": self.threshold,
+                "lookups": self.lookups,
+                "hits": self.hits,
+                "hit_rate": self.hits / self.lookups if self.lookups else 0.0,
+            }
+
+
+def load_faq_index(storage_dir: Path, chunk_store: ChunkStore) -> Optional[FaqIndex]:
+    """Loads faq_index.faiss next to the main index; None when disabled or not built."""
+    if os.getenv("FAQ_FAST_PATH_ENABLED", "true").lower() not in ("1", "true", "yes"):
+        logger.info("FAQ fast path disabled.")
+        return None
+    index_path = Path(storage_dir) / FAQ_INDEX_FILENAME
+    if not index_path.exists():
+        logger.info(f"No FAQ question index at {index_path}; FAQ fast path off (run scripts/build_faq_index.py).")
+        return None
+    try:
+        info = {}
+        info_path = index_path.parent / FAQ_INFO_FILENAME
+        if info_path.exists():
+            with open(info_path, "r", encoding="utf-8") as f:
+                info = json.load(f)
+        threshold = float(os.getenv("FAQ_MATCH_THRESHOLD") or info.get("threshold", DEFAULT_FAQ_THRESHOLD))
+        faq_index = FaqIndex(faiss.read_index(str(index_path)), chunk_store, threshold=threshold)
+        logger.info(f"FAQ fast path enabled: {faq_index.faiss_index.ntotal} questions, threshold {threshold:.3f}.")
+        return faq_index
+    except Exception as e:
+        logger.error(f"Failed to load FAQ question index, FAQ fast path off: {e}", exc_info=True)
+        return None
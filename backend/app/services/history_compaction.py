@@ -0,0 +1,283 @@
+"""
+Bounds the chat history placed into LLM prompts.
+
+Every call site has its own token budget (router, nurse, report). A history
+within the budget goes into the prompt verbatim. Over budget, the fewest
+oldest messages needed are folded into a structured summary of what the
+patient said -- age, conditions, medications, allergies, symptoms, duration
+and severity -- extracted without an LLM call; everything after the fold
+stays verbatim. The fold point is cached per session and site, so each new
+turn only folds the messages that no longer fit. If even the summary and the
+last message are over budget, summary items are trimmed (oldest first, down
+to one per field), then the start of the verbatim text is cut.
+
+  HISTORY_COMPACTION_ENABLED     default true
+  HISTORY_TOKEN_BUDGET_ROUTER    default 400
+  HISTORY_TOKEN_BUDGET_NURSE     default 1500
+  HISTORY_TOKEN_BUDGET_REPORT    default 2000
+"""
+import os
+import re
+import hashlib
+import logging
+import threading
+from collections import OrderedDict
+from typing import Dict, List, Optional, Sequence, Tuple
+
+from llama_index.core.utils import get_tokenizer
+
+from app.models import ChatMessage
+
+logger = logging.getLogger(__name__)
+
+ROUTER = "router"
+NURSE = "nurse"
+REPORT = "report"
+
+COMPACTION_ENABLED = os.getenv("HISTORY_COMPACTION_ENABLED", "true").lower() in ("1", "true", "yes")
+TOKEN_BUDGETS: Dict[str, int] = {
+    ROUTER: int(os.getenv("HISTORY_TOKEN_BUDGET_ROUTER", "400")),
+    NURSE: int(os.getenv("HISTORY_TOKEN_BUDGET_NURSE", "1500")),
+    REPORT: int(os.getenv("HISTORY_TOKEN_BUDGET_REPORT", "2000")),
+}
+SUMMARY_CACHE_MAX_SESSIONS = 10000
+MAX_ITEMS_PER_FIELD = 12
+
+# --- Extraction rules (patient messages only) ---
+_AGE = re.compile(
+    r"\b(?:i'?m|i am|aged?:?) (\d{1,3})\b(?! ?(?:%|/|mg|kg|lbs?|degrees|times|minutes?|hours?|days?|weeks?|months?))|"
+    r"\b(\d{1,3})[- ](?:years?|yrs?)[- ]old\b",
+    re.IGNORECASE,
+)
+_CONDITION = re.compile(
+    r"\b(diabet\w*|type [12] diabetes|pre-?diabet\w*|hypertension|high blood pressure|high cholesterol|asthma\w*|"
+    r"copd|emphysema|heart (?:disease|failure|attack|condition)|atrial fibrillation|a-?fib|arrhythmia|"
+    r"(?:kidney|renal|liver) (?:disease|failure)|cirrhosis|hepatitis \w|hiv|cancer|chemo\w*|stroke|epilep\w*|"
+    r"seizures?|thyroid \w+|hypothyroid\w*|hyperthyroid\w*|anemi\w*|pregnan\w*|immunocompromised|transplant|"
+    r"depression|anxiety|dementia|(?:history|hx) of [\w-]+(?: [\w-]+)?)\b",
+    re.IGNORECASE,
+)
+_MEDICATION = re.compile(
+    r"\b(warfarin|coumadin|heparin|apixaban|eliquis|rivaroxaban|xarelto|clopidogrel|aspirin|ibuprofen|naproxen|"
+    r"paracetamol|acetaminophen|tylenol|insulin|metformin|prednisone?|prednisolone|steroids|levothyroxine|digoxin|"
+    r"lithium|methotrexate|opioids?|morphine|oxycodone|codeine|tramadol|antibiotics|birth control|blood thinners?|"
+    r"[a-z]+(?:pril|sartan|olol|dipine|statin|gliptin|gliflozin|prazole|cillin|mycin|floxacin|cycline|azepam|"
+    r"oxetine|aline|triptan)|(?:on|taking|take|prescribed) (?:a )?[\w-]+ (?:pills?|tablets?|inhaler|injections?))\b",
+    re.IGNORECASE,
+)
+_ALLERGY = re.compile(r"\ballergic to ([\w-]+(?: [\w-]+)?)|\b([\w-]+) allergy\b", re.IGNORECASE)
+_SYMPTOM = re.compile(
+    r"\b(head ?aches?|migraines?|fevers?|chills|(?:coughing|vomiting|spitting) (?:up )?blood|blood in (?:my )?\w+|"
+    r"bleed\w*|coughs?|coughing|sore throat|runny nose|congestion|sneez\w*|"
+    r"short(?:ness)? of breath|wheez\w*|chest (?:pain|tightness)|palpitations?|dizz\w*|lightheaded\w*|faint\w*|"
+    r"nause\w*|vomit\w*|diarrh\w*|constipat\w*|bloat\w*|cramps?|rash\w*|itch\w*|swell\w*|swollen \w+|"
+    r"numb\w*|tingl\w*|fatigue|tired\w*|weak\w*|insomnia|can't sleep|blurr\w* vision|"
+    r"(?:back|stomach|abdominal|joint|muscle|ear|tooth|neck|knee|shoulder|chest|eye|pelvic) ?(?:pain|ache)s?|"
+    r"pain in (?:my|the) \w+|(?:my|the) \w+ (?:hurts|aches))\b",
+    re.IGNORECASE,
+)
+_DURATION = re.compile(
+    r"\b(?:for|since|over|in) (?:the )?(?:past |last |about |almost |over |a |an |one |two |three |four |five |six |"
+    r"seven |few |several |couple of |\d+ )*(?:minutes?|hours?|days?|weeks?|months?|years?|nights?)\b|"
+    r"\bsince (?:yesterday|last \w+|this morning|this \w+|\w+day)\b|"
+    r"\b(?:yesterday|this morning|last night|a (?:few|couple of) days ago|\d+ (?:hours?|days?|weeks?|months?) ago)\b",
+    re.IGNORECASE,
+)
+_SEVERITY = re.compile(
+    r"\b(?:\d{1,2} ?(?:/|out of) ?10|mild\w*|moderate\w*|severe\w*|intense|unbearable|excruciating|sharp|dull|"
+    r"throbbing|burning|stabbing|constant|comes and goes|on and off|getting worse|worse|getting better|better)\b",
+    re.IGNORECASE,
+)
+
+_tokenizer = None
+_tokenizer_lock = threading.Lock()
+
+
+def count_tokens(text: str) -> int:
+    """Token count with the tiktoken tokenizer LlamaIndex uses (about 4 chars/token without it)."""
+    global _tokenizer
+    if _tokenizer is None:
+        with _tokenizer_lock:
+            if _tokenizer is None:
+                try:
+                    _tokenizer = get_tokenizer()
+                except Exception as e:
+                    logger.warning(f"Tokenizer unavailable, estimating tokens from length: {e}")
+                    _tokenizer = lambda value: range((len(value) + 3) // 4)
+    return len(_tokenizer(text)) if text else 0
+
+
+def format_messages(messages: Sequence[ChatMessage]) -> str:
+    return "\n".join(f"{msg.role}: {msg.content}" for msg in messages)
+
+
+def _matches(pattern: "re.Pattern", text: str) -> List[str]:
+    """findall() flattened over the pattern's alternative groups."""
+    return [next(group for group in match if group) if isinstance(match, tuple) else match
+            for match in pattern.findall(text)]
+
+
+class ConversationSummary:
+    """Facts the patient mentioned, per field, most recently mentioned last."""
+
+    # Field -> extraction rule; patient background first, it matters to every later answer
+    RULES = {
+        "age": _AGE,
+        "conditions": _CONDITION,
+        "medications": _MEDICATION,
+        "allergies": _ALLERGY,
+        "symptoms": _SYMPTOM,
+        "duration": _DURATION,
+        "severity": _SEVERITY,
+    }
+    FIELDS = tuple(RULES)
+
+    def __init__(self):
+        self.items: Dict[str, List[str]] = {field: [] for field in self.FIELDS}
+        self.messages = 0
+
+    def copy(self) -> "ConversationSummary":
+        other = ConversationSummary()
+        other.items = {field: list(values) for field, values in self.items.items()}
+        other.messages = self.messages
+        return other
+
+    @staticmethod
+    def _add(items: List[str], found: Sequence[str]) -> None:
+        for value in found:
+            value = " ".join(value.lower().split())
+            if value in items:
+                items.remove(value)  # Re-mentioned: move to the most recent position
+            items.append(value)
+        del items[:-MAX_ITEMS_PER_FIELD]
+
+    def update(self, messages: Sequence[ChatMessage]) -> "ConversationSummary":
+        for msg in messages:
+            self.messages += 1
+            if msg.role != "user":
+                continue
+            found = {field: _matches(pattern, msg.content) for field, pattern in self.RULES.items()}
+            # "allergic to penicillin" names a drug the patient must not be given, not one they take
+            allergies = {value.lower() for value in found["allergies"]}
+            found["medications"] = [value for value in found["medications"] if value.lower() not in allergies]
+            for field, values in found.items():
+                self._add(self.items[field], values)
+        return self
+
+    def render(self, max_items: int = MAX_ITEMS_PER_FIELD) -> str:
+        if not self.messages or max_items <= 0:
+            return ""
+        lines = [f"Summary of the {self.messages} earlier messages:"]
+        for field in self.FIELDS:
+            items = self.items[field][-max_items:]
+            if items:
+                lines.append(f"- {field.capitalize()}: {', '.join(items)}")
+        return "\n".join(lines)
+
+
+def _digest(messages: Sequence[ChatMessage]) -> str:
+    h = hashlib.blake2b(digest_size=16)
+    for msg in messages:
+        h.update(msg.role.encode("utf-8") + b"\x00" + msg.content.encode("utf-8") + b"\x01")
+    return h.hexdigest()
+
+
+class SummaryCache:
+    """session key -> (messages folded, digest of those messages, summary); LRU-bounded."""
+
+    def __init__(self, max_sessions: int = SUMMARY_CACHE_MAX_SESSIONS):
+        self.max_sessions = max_sessions
+        self._lock = threading.Lock()
+        self._entries: "OrderedDict[str, Tuple[int, str, ConversationSummary]]" = OrderedDict()
+
+    def resume(self, key: Optional[str], history: Sequence[ChatMessage]) -> Tuple[int, ConversationSummary]:
+        """(messages already folded, their summary) when history extends the cached fold, else (0, empty)."""
+        if key:
+            with self._lock:
+                entry = self._entries.get(key)
+                if entry is not None:
+                    self._entries.move_to_end(key)
+            if entry is not None:
+                covered, digest, cached = entry
+                # The last message always stays verbatim, so a fold never covers the whole history
+                if covered < len(history) and _digest(history[:covered]) == digest:
+                    return covered, cached.copy()
+        return 0, ConversationSummary()
+
+    def store(self, key: Optional[str], folded: Sequence[ChatMessage], summary: ConversationSummary) -> None:
+        if not key or not folded:
+            return
+        with self._lock:
+            self._entries[key] = (len(folded), _digest(folded), summary.copy())
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_sessions:
+                self._entries.popitem(last=False)
+
+    def delete(self, key: str) -> None:
+        with self._lock:
+            self._entries.pop(key, None)
+
+
+summary_cache = SummaryCache()
+
+
+def _fit(text: str, budget: int) -> str:
+    """Keeps the end of text (the most recent lines) within budget tokens."""
+    if count_tokens(text) <= budget:
+        return text
+    lo, hi = 0, len(text)
+    while lo < hi:
+        mid = (lo + hi) // 2
+        if count_tokens(text[mid:]) <= budget:
+            hi = mid
+        else:
+            lo = mid + 1
+    # Prefer dropping whole lines over starting mid-line
+    newline = text.find("\n", lo)
+    return text[newline + 1:] if newline != -1 else text[lo:]
+
+
+def compact_history(history: Sequence[ChatMessage], site: str, session_key: Optional[str] = None,
+                    budget: Optional[int] = None) -> str:
+    """
+    history_str for one prompt call site: the history verbatim when it fits
+    the site's token budget, else a summary of the oldest messages plus the
+    rest verbatim.
+    """
+    full = format_messages(history)
+    if not COMPACTION_ENABLED or not history:
+        return full
+    budget = TOKEN_BUDGETS.get(site, TOKEN_BUDGETS[NURSE]) if budget is None else budget
+    tokens_before = count_tokens(full)
+    if tokens_before <= budget:
+        return full
+
+    # Fold the fewest oldest messages that bring the text under budget. History
+    # only grows, so the next turn resumes from this turn's fold point.
+    cache_key = f"{session_key}:{site}" if session_key else None
+    split, summary = summary_cache.resume(cache_key, history)
+    line_tokens = [count_tokens(format_messages([msg])) + 1 for msg in history]  # +1: the joining newline
+    verbatim_tokens = sum(line_tokens[split:])
+    while split < len(history) - 1 and count_tokens(summary.render()) + verbatim_tokens > budget:
+        summary.update(history[split:split + 1])
+        verbatim_tokens -= line_tokens[split]
+        split += 1
+    summary_cache.store(cache_key, history[:split], summary)
+
+    recent_text = format_messages(history[split:])
+    max_items = MAX_ITEMS_PER_FIELD
+    summary_text = summary.render(max_items)
+    while max_items > 1 and count_tokens(summary_text) + count_tokens(recent_text) + 1 > budget:
+        max_items //= 2
+        summary_text = summary.render(max_items)
+    # Still over: the patient's facts outrank the start of the last message
+    room = budget - count_tokens(summary_text) - 1
+    if summary_text and room > 0:
+        text = "\n".join(part for part in (summary_text, _fit(recent_text, room)) if part)
+    else:
+        text = _fit("\n".join(part for part in (summary_text, recent_text) if part), budget)
+
+    tokens_after = count_tokens(text)
+    logger.info(f"History compaction [{site}]: {tokens_before} -> {tokens_after} tokens "
+                f"({split} of {len(history)} messages summarized, budget {budget}).")
+    return text
@@ -0,0 +1,454 @@
+"""
+Zero-downtime hot reload of the vector index.
+
+The FAISS index, chunk store, re-scoring vectors and FAQ index that the
+build scripts publish to storage/ are loaded together as one *generation*.
+IndexManager holds the current generation behind a single reference that
+is swapped under a lock, so a request sees either the old or the new
+generation, never a mix:
+
+  - lease() pins the current generation for the duration of a query; a
+    swap never touches a leased generation, so in-flight queries finish on
+    the index they started with.
+  - reload() builds the next generation in a background thread from the
+    files on disk, verifies it (see rag_service.verify_vector_index) and
+    only then swaps it in. A failed load or verification keeps serving the
+    current generation.
+  - A retired generation is closed (chunk store unmapped, references
+    dropped) as soon as its last lease is released.
+
+Reloads are triggered by the storage watcher or by POST /api/rag/index/reload.
+The build scripts write every index file (INDEX_ARTIFACT_FILENAMES) under a
+temporary name and swap it in whole, and only after the last one do they
+call publish_index(), which writes the publish marker (index_published.json)
+with the size/mtime of each artifact. The watcher (a thread polling the
+marker; INDEX_WATCH_ENABLED / INDEX_WATCH_INTERVAL_SECONDS) reacts to the
+marker alone, so a build in progress never triggers a reload, and a load
+whose files no longer match the marker -- before or after reading them --
+is refused rather than served as a mix of two builds. Every worker process
+has its own manager, so the watcher is what reaches all of them.
+
+Memory during a swap is bounded: a reload first waits for retired
+generations to drain (INDEX_RELOAD_DRAIN_TIMEOUT_SECONDS), so at most two
+generations are ever alive, and the heap the new one needs (the FAISS
+files are read into memory; the chunk store and vectors are mmapped page
+cache) is projected from the file sizes and refused above
+INDEX_RELOAD_MAX_OVERHEAD_MB (0 = no cap). Both, plus the process RSS
+around the last swap, are reported by stats().
+"""
+import os
+import json
+import time
+import logging
+import threading
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Any, Callable, Dict, Iterator, List, Optional, Sequence, Tuple
+
+from app.services.atomic_files import write_json
+from app.services.faiss_factory import INDEX_INFO_FILENAME, RESCORE_VECTORS_FILENAME
+from app.services.faq_index import FAQ_INDEX_FILENAME, FAQ_INFO_FILENAME
+from app.services.index_manifest import MANIFEST_FILENAME
+from app.services.vector_storage import scales_path
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_WATCH_INTERVAL = 10.0
+DEFAULT_DRAIN_TIMEOUT = 60.0
+
+# What the build scripts publish as one index. Nothing else in storage/
+# (runtime SQLite files, build scratch directories) may trigger a reload.
+INDEX_ARTIFACT_FILENAMES = (
+    "vector_index.faiss",
+    INDEX_INFO_FILENAME,
+    "vector_chunks.bin",
+    MANIFEST_FILENAME,
+    FAQ_INDEX_FILENAME,
+    FAQ_INFO_FILENAME,
+    RESCORE_VECTORS_FILENAME,
+    scales_path(Path(RESCORE_VECTORS_FILENAME)).name,
+)
+
+
+def storage_fingerprint(storage_dir: Path, filenames: Sequence[str] = INDEX_ARTIFACT_FILENAMES) -> Tuple:
+    """(name, size, mtime_ns) of each index artifact present in storage_dir."""
+    parts = []
+    for name in filenames:
+        try:
+            stat = (Path(storage_dir) / name).stat()
+        except OSError:
+            continue  # Not published (optional artifact) or mid-replace; the next poll sees it
+        parts.append((name, stat.st_size, stat.st_mtime_ns))
+    return tuple(parts)
+
+
+# Written by publish_index() after everything else; the only file the watcher polls
+PUBLISH_MARKER_FILENAME = "index_published.json"
+
+
+def publish_index(storage_dir: Path) -> None:
+    """Marks the artifacts now in storage_dir as one complete build. Call after the last one is written."""
+    storage_dir = Path(storage_dir)
+    artifacts = storage_fingerprint(storage_dir)
+    write_json(storage_dir / PUBLISH_MARKER_FILENAME, {
+        "published_at": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()),
+        "artifacts": [list(part) for part in artifacts],
+    }, indent=2)
+    logger.info(f"Published {len(artifacts)} index files in {storage_dir}.")
+
+
+def publish_fingerprint(storage_dir: Path) -> Tuple:
+    return storage_fingerprint(storage_dir, (PUBLISH_MARKER_FILENAME,))
+
+
+def check_published(storage_dir: Path) -> None:
+    """Raises ValueError if the artifacts differ from what the publish marker recorded (a build is running)."""
+    marker_path = Path(storage_dir) / PUBLISH_MARKER_FILENAME
+    try:
+        with open(marker_path, "r", encoding="utf-8") as f:
+            published = tuple(tuple(part) for part in json.load(f)["artifacts"])
+    except FileNotFoundError:
+        return  # Built before publish markers existed: nothing to compare against
+    except (OSError, ValueError, KeyError, TypeError) as e:
+        raise ValueError(f"Unreadable publish marker {marker_path}: {e}") from e
+    if storage_fingerprint(storage_dir) != published:
+        raise ValueError(f"Index files in {storage_dir} changed since they were published; waiting for the next publish.")
+
+
+def process_rss_bytes() -> Optional[int]:
+    """Resident set size of this process (Linux), or None where /proc is unavailable."""
+    try:
+        with open("/proc/self/statm", "r") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, IndexError):
+        return None
+
+
+def _file_size(path: Path) -> int:
+    try:
+        return Path(path).stat().st_size
+    except OSError:
+        return 0
+
+
+def close_vector_index(vector_index: Any) -> None:
+    """Releases what a vector index holds (mmapped chunk store, shard connections)."""
+    close = getattr(vector_index, "close", None)
+    if close is not None:
+        close()
+
+
+def _mapped_bytes(vector_index: Any) -> int:
+    """Bytes of the generation that are memory-mapped (shared page cache, not heap)."""
+    total = 0
+    chunk_store = getattr(vector_index, "chunk_store", None)
+    if chunk_store is not None:
+        total += chunk_store.nbytes
+    rescorer = getattr(vector_index, "rescorer", None)
+    if rescorer is not None:
+        total += rescorer.vectors.nbytes
+    return total
+
+
+class IndexGeneration:
+    """One loaded vector index plus the bookkeeping needed to retire it safely."""
+
+    def __init__(self, number: int, vector_index: Any, fingerprint: Tuple, reason: str,
+                 heap_bytes: int, mapped_bytes: int):
+        self.number = number
+        self.vector_index = vector_index
+        self.fingerprint = fingerprint
+        self.reason = reason
+        self.heap_bytes = heap_bytes
+        self.mapped_bytes = mapped_bytes
+        self.loaded_at = time.time()
+        self.retired_at: Optional[float] = None
+        self.leases = 0
+        self.closed = False
+
+    def close(self) -> None:
+        """Unmaps the chunk store and drops the index; only called once no lease is left."""
+        if self.closed:
+            return
+        try:
+            close_vector_index(self.vector_index)
+        except Exception as e:
+            logger.error(f"Failed to close index generation {self.number}: {e}", exc_info=True)
+        self.vector_index = None
+        self.closed = True
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "generation": self.number,
+            "reason": self.reason,
+            "loaded_at": self.loaded_at,
+            "retired_at": self.retired_at,
+            "vectors": getattr(self.vector_index, "ntotal", None),
+            "leases": self.leases,
+            "heap_bytes": self.heap_bytes,
+            "mapped_bytes": self.mapped_bytes,
+        }
+
+
+class IndexManager:
+    """
+    Owns the current vector index generation. loader() builds a fresh
+    vector index from storage_dir (raising on failure); verifier(index)
+    raises if a freshly built index must not be served. heap_files are the
+    files a load reads fully into memory, used to project swap overhead.
+    """
+
+    def __init__(
+        self,
+        storage_dir: Path,
+        loader: Callable[[], Any],
+        verifier: Optional[Callable[[Any], None]] = None,
+        heap_files: Sequence[Path] = (),
+        max_overhead_bytes: int = 0,
+        drain_timeout: float = DEFAULT_DRAIN_TIMEOUT,
+    ):
+        self.storage_dir = Path(storage_dir)
+        self._loader = loader
+        self._verifier = verifier
+        self._heap_files = [Path(path) for path in heap_files]
+        self.max_overhead_bytes = max_overhead_bytes
+        self.drain_timeout = drain_timeout
+
+        self._lock = threading.Lock()
+        self._drained = threading.Condition(self._lock)
+        self._reload_lock = threading.Lock()  # One load at a time
+        self._listeners: List[Callable[[Any], None]] = []
+        self._current: Optional[IndexGeneration] = None
+        self._retired: List[IndexGeneration] = []
+        self._next_number = 1
+        self._started = False                  # First load attempted (the watcher waits for it)
+        self._attempted_fingerprint: Tuple = ()  # Files of the last load, successful or not
+        self._watcher: Optional[threading.Thread] = None
+
+        self.swaps = 0
+        self.failed_reloads = 0
+        self.last_reload: Optional[Dict[str, Any]] = None
+
+    @classmethod
+    def from_env(cls, storage_dir: Path, loader: Callable[[], Any], **kwargs: Any) -> "IndexManager":
+        return cls(
+            storage_dir, loader,
+            max_overhead_bytes=int(float(os.getenv("INDEX_RELOAD_MAX_OVERHEAD_MB", "0")) * 1024 * 1024),
+            drain_timeout=float(os.getenv("INDEX_RELOAD_DRAIN_TIMEOUT_SECONDS", str(DEFAULT_DRAIN_TIMEOUT))),
+            **kwargs,
+        )
+
+    def add_listener(self, listener: Callable[[Any], None]) -> None:
+        """listener(vector_index) runs after every swap, outside the manager lock."""
+        self._listeners.append(listener)
+
+    # --- Readers ---
+    @property
+    def current(self) -> Any:
+        """The current vector index (None if none is loaded). Use lease() around queries."""
+        generation = self._current
+        return generation.vector_index if generation is not None else None
+
+    @contextmanager
+    def lease(self) -> Iterator[Any]:
+        """Yields the current vector index (or None), keeping its generation open until exit."""
+        with self._lock:
+            generation = self._current
+            if generation is not None:
+                generation.leases += 1
+        try:
+            yield generation.vector_index if generation is not None else None
+        finally:
+            if generation is not None:
+                self._release(generation)
+
+    def _release(self, generation: IndexGeneration) -> None:
+        with self._lock:
+            generation.leases -= 1
+            if generation.leases > 0 or generation.retired_at is None:
+                return
+            self._retired.remove(generation)
+            self._drained.notify_all()
+        self._close_retired(generation)
+
+    def _close_retired(self, generation: IndexGeneration) -> None:
+        generation.close()
+        logger.info(f"Index generation {generation.number} drained "
+                    f"{time.time() - generation.retired_at:.1f}s after retirement and was closed.")
+        if self.last_reload is not None and self.last_reload.get("replaced_generation") == generation.number:
+            self.last_reload["rss_after_drain_bytes"] = process_rss_bytes()
+
+    # --- Loading ---
+    def load(self, reason: str, verify: bool = True) -> Any:
+        """
+        Builds, verifies and swaps in a new generation in the calling thread.
+        Returns the new vector index, or None if the load failed (the current
+        generation keeps serving).
+        """
+        with self._reload_lock:
+            return self._load_locked(reason, verify)
+
+    def _load_locked(self, reason: str, verify: bool) -> Any:
+        started = time.perf_counter()
+        fingerprint = publish_fingerprint(self.storage_dir)  # Before reading: a later publish triggers another reload
+        report: Dict[str, Any] = {"reason": reason, "started_at": time.time(), "rss_before_bytes": process_rss_bytes()}
+        self.last_reload = report
+        self._started = True
+        self._attempted_fingerprint = fingerprint
+        vector_index = None
+        try:
+            self._wait_for_drain()
+            projected = sum(_file_size(path) for path in self._heap_files)
+            report["projected_overhead_bytes"] = projected if self._current is not None else 0
+            if self._current is not None and self.max_overhead_bytes and projected > self.max_overhead_bytes:
+                raise RuntimeError(
+                    f"New index generation needs ~{projected / 1e6:.1f} MB of heap next to the current one, "
+                    f"above INDEX_RELOAD_MAX_OVERHEAD_MB ({self.max_overhead_bytes / 1e6:.1f} MB); restart the workers instead."
+                )
+            self._check_published()
+            logger.info(f"Loading new index generation ({reason})...")
+            vector_index = self._loader()
+            if vector_index is None:
+                raise RuntimeError("loader returned no index")
+            if verify and self._verifier is not None:
+                self._verifier(vector_index)
+            self._check_published()  # Files replaced while they were being read
+        except Exception as e:
+            logger.error(f"Index reload ({reason}) failed; keeping the current generation: {e}", exc_info=True)
+            if vector_index is not None:
+                close_vector_index(vector_index)
+            self.failed_reloads += 1
+            report.update(status="failed", error=str(e), seconds=time.perf_counter() - started)
+            return None
+
+        previous = self._swap(vector_index, fingerprint, reason, projected)
+        report.update(
+            status="swapped",
+            generation=self._current.number,
+            replaced_generation=previous.number if previous is not None else None,
+            seconds=time.perf_counter() - started,
+            rss_after_swap_bytes=process_rss_bytes(),
+        )
+        logger.info(f"Index generation {self._current.number} ({vector_index.ntotal} vectors) is live "
+                    f"after {report['seconds']:.2f}s ({reason}).")
+        return vector_index
+
+    def _check_published(self) -> None:
+        try:
+            check_published(self.storage_dir)
+        except ValueError:
+            if self._current is not None:
+                raise
+            # Nothing is serving yet: a possibly mixed index beats no index
+            logger.warning(f"Loading {self.storage_dir} although it changed since its last publish.", exc_info=True)
+
+    def _wait_for_drain(self) -> None:
+        """Blocks until no retired generation is alive, so a load never makes it three."""
+        with self._lock:
+            deadline = time.monotonic() + self.drain_timeout
+            while self._retired:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    leases = sum(generation.leases for generation in self._retired)
+                    raise RuntimeError(f"previous index generation still has {leases} in-flight queries "
+                                       f"after {self.drain_timeout:.0f}s")
+                self._drained.wait(remaining)
+
+    def _swap(self, vector_index: Any, fingerprint: Tuple, reason: str, heap_bytes: int) -> Optional[IndexGeneration]:
+        generation = IndexGeneration(self._next_number, vector_index, fingerprint, reason,
+                                     heap_bytes=heap_bytes, mapped_bytes=_mapped_bytes(vector_index))
+        with self._lock:
+            self._next_number += 1
+            previous, self._current = self._current, generation
+            if previous is not None:
+                previous.retired_at = time.time()
+                self._retired.append(previous)
+            self.swaps += 1
+
+        for listener in self._listeners:
+            try:
+                listener(vector_index)
+            except Exception as e:
+                logger.error(f"Index swap listener {listener!r} failed: {e}", exc_info=True)
+
+        if previous is not None:
+            with self._lock:
+                drained = previous.leases == 0 and previous in self._retired
+                if drained:
+                    self._retired.remove(previous)
+                    self._drained.notify_all()
+                else:
+                    logger.info(f"Index generation {previous.number} retired with {previous.leases} in-flight queries.")
+            if drained:
+                self._close_retired(previous)
+        return previous
+
+    def reload(self, reason: str, wait: bool = False) -> bool:
+        """
+        Starts a background reload. Returns False if one is already running.
+        With wait=True, blocks until it finishes (see last_reload for the outcome).
+        """
+        if not self._reload_lock.acquire(blocking=False):
+            logger.info(f"Index reload ({reason}) skipped: another reload is in progress.")
+            return False
+
+        def _run():
+            try:
+                self._load_locked(reason, verify=True)
+            finally:
+                self._reload_lock.release()
+
+        thread = threading.Thread(target=_run, name="index-reload", daemon=True)
+        thread.start()
+        if wait:
+            thread.join()
+        return True
+
+    @property
+    def reloading(self) -> bool:
+        return self._reload_lock.locked()
+
+    # --- Storage watcher ---
+    def start_watcher(self, interval: float = DEFAULT_WATCH_INTERVAL) -> None:
+        if self._watcher is not None:
+            return
+        self._watcher = threading.Thread(target=self._watch, args=(interval,), name="index-watcher", daemon=True)
+        self._watcher.start()
+        logger.info(f"Watching {self.storage_dir} for new index builds every {interval:.0f}s.")
+
+    def start_watcher_from_env(self) -> None:
+        if os.getenv("INDEX_WATCH_ENABLED", "true").lower() not in ("1", "true", "yes"):
+            logger.info("Index storage watcher disabled (INDEX_WATCH_ENABLED).")
+            return
+        self.start_watcher(float(os.getenv("INDEX_WATCH_INTERVAL_SECONDS", str(DEFAULT_WATCH_INTERVAL))))
+
+    def _watch(self, interval: float) -> None:
+        while True:
+            time.sleep(interval)
+            try:
+                if not self._started or self.reloading:
+                    continue
+                fingerprint = publish_fingerprint(self.storage_dir)
+                if fingerprint and fingerprint != self._attempted_fingerprint:
+                    self.reload("index published")
+            except Exception as e:
+                logger.error(f"Index storage watcher error: {e}", exc_info=True)
+
+    # --- Reporting ---
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            current = self._current.stats() if self._current is not None else None
+            retired = [generation.stats() for generation in self._retired]
+        live_heap = (current["heap_bytes"] if current else 0) + sum(g["heap_bytes"] for g in retired)
+        return {
+            "current": current,
+            "retired": retired,
+            "reloading": self.reloading,
+            "watching": self._watcher is not None,
+            "swaps": self.swaps,
+            "failed_reloads": self.failed_reloads,
+            "live_heap_bytes": live_heap,
+            "max_overhead_bytes": self.max_overhead_bytes,
+            "rss_bytes": process_rss_bytes(),
+            "last_reload": dict(self.last_reload) if self.last_reload else None,
+        }
@@ -0,0 +1,123 @@
+"""
+Stable vector ids and the per-chunk manifest behind incremental index builds.
+
+Every chunk gets a 63-bit FAISS id derived from its doc_id (a repeated doc_id
+gets an occurrence suffix), so ids survive corpus changes. The manifest
+(vector_manifest.json next to the index) records, per chunk key, the id and
+content hashes of its text and metadata. Comparing it with a fresh chunking
+run tells which chunks need embedding (new or changed text), which only
+need their chunk-store record rewritten (metadata changes) and which ids
+must be removed from the index.
+"""
+import json
+import hashlib
+import logging
+from collections import Counter
+from pathlib import Path
+from typing import Any, Dict, List, NamedTuple, Optional, Sequence
+
+from app.services.atomic_files import write_json
+
+logger = logging.getLogger(__name__)
+
+MANIFEST_FILENAME = "vector_manifest.json"
+MANIFEST_VERSION = 1
+
+
+def stable_id(key: str) -> int:
+    """Non-negative int64 FAISS id for a chunk key (FAISS reserves -1)."""
+    digest = hashlib.blake2b(key.encode("utf-8"), digest_size=8).digest()
+    return int.from_bytes(digest, "little") & 0x7FFFFFFFFFFFFFFF
+
+
+def chunk_keys(doc_ids: Sequence[str]) -> List[str]:
+    """Unique keys in corpus order: doc_id, then doc_id#1, doc_id#2... for repeats."""
+    seen: Counter = Counter()
+    keys = []
+    for doc_id in doc_ids:
+        doc_id = str(doc_id)
+        keys.append(doc_id if seen[doc_id] == 0 else f"{doc_id}#{seen[doc_id]}")
+        seen[doc_id] += 1
+    return keys
+
+
+def assign_ids(keys: Sequence[str]) -> List[int]:
+    ids = [stable_id(key) for key in keys]
+    if len(set(ids)) != len(ids):
+        raise ValueError("Stable id collision between chunk keys; rename the colliding doc_ids.")
+    return ids
+
+
+def _hash(value: Any) -> str:
+    encoded = value if isinstance(value, str) else json.dumps(value, sort_keys=True, ensure_ascii=False)
+    return hashlib.sha256(encoded.encode("utf-8")).hexdigest()
+
+
+def build_manifest(chunks: Sequence[Dict[str, Any]], keys: Sequence[str], ids: Sequence[int],
+                   embedding_model: str, dimension: int, index_info: Dict[str, Any]) -> Dict[str, Any]:
+    return {
+        "version": MANIFEST_VERSION,
+        "embedding_model": embedding_model,
+        "dimension": int(dimension),
+        "index_type": index_info.get("index_type", "flat"),
+        "chunks": {
+            key: {"id": int(faiss_id), "text": _hash(chunk.get("text", "")), "metadata": _hash(chunk.get("metadata", {}))}
+            for key, faiss_id, chunk in zip(keys, ids, chunks)
+        },
+    }
+
+
+def load_manifest(path: Path) -> Optional[Dict[str, Any]]:
+    path = Path(path)
+    if not path.exists():
+        return None
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            manifest = json.load(f)
+    except (OSError, json.JSONDecodeError) as e:
+        logger.error(f"Could not read index manifest {path}: {e}")
+        return None
+    if manifest.get("version") != MANIFEST_VERSION:
+        logger.warning(f"Index manifest {path} has version {manifest.get('version')}, expected {MANIFEST_VERSION}.")
+        return None
+    return manifest
+
+
+def write_manifest(path: Path, manifest: Dict[str, Any]) -> None:
+    """Swapped in atomically; the build then publishes it with the index (index_manager.publish_index)."""
+    write_json(path, manifest, ensure_ascii=False, separators=(",", ":"))
+    logger.info(f"Index manifest with {len(manifest['chunks'])} chunks written to {path}.")
+
+
+class UpdatePlan(NamedTuple):
+    added: List[int]          # Rows of chunks missing from the manifest (embed + add)
+    changed: List[int]        # Rows whose text changed (re-embed, replace vector)
+    metadata_only: List[int]  # Rows whose metadata changed (rewrite record only)
+    unchanged: List[int]
+    removed_ids: List[int]    # Ids in the manifest that are no longer in the corpus
+
+    @property
+    def to_embed(self) -> List[int]:
+        return self.added + self.changed
+
+    def summary(self) -> str:
+        return (f"{len(self.added)} added, {len(self.changed)} changed, {len(self.metadata_only)} metadata-only, "
+                f"{len(self.removed_ids)} removed, {len(self.unchanged)} unchanged")
+
+
+def plan_update(manifest: Dict[str, Any], chunks: Sequence[Dict[str, Any]], keys: Sequence[str]) -> UpdatePlan:
+    previous = manifest.get("chunks", {})
+    added, changed, metadata_only, unchanged = [], [], [], []
+    for row, (key, chunk) in enumerate(zip(keys, chunks)):
+        entry = previous.get(key)
+        if entry is None:
+            added.append(row)
+        elif entry["text"] != _hash(chunk.get("text", "")):
+            changed.append(row)
+        elif entry["metadata"] != _hash(chunk.get("metadata", {})):
+            metadata_only.append(row)
+        else:
+            unchanged.append(row)
+    current = set(keys)
+    removed_ids = [int(entry["id"]) for key, entry in previous.items() if key not in current]
+    return UpdatePlan(added, changed, metadata_only, unchanged, removed_ids)
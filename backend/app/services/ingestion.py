@@ -0,0 +1,320 @@
+"""
+Corpus ingestion shared by the index build scripts.
+
+    source adapters -> entities (streamed JSON) -> chunks (process pool) -> embedding
+
+Each source adapter streams entity dicts out of its JSON file one array
+element at a time (iter_json_array), so a file is never loaded whole.
+iter_chunks() cuts the entity stream into batches, chunks them on a
+process pool with a bounded number of batches in flight and yields chunks
+in corpus order. Peak memory is therefore set by the batch sizes, not by
+the corpus size.
+
+Chunks are {'doc_id', 'text', 'metadata'} dicts: one 'name' chunk per
+entity, one per non-empty text field and one per FAQ, with the same ids
+and texts the build scripts have always produced (the stable FAISS ids in
+index_manifest are derived from those doc_ids).
+
+  INGEST_WORKERS           chunking processes (default: CPU count; 1 = in-process)
+  INGEST_BATCH_ENTITIES    entities per worker task (default 64)
+"""
+import os
+import re
+import json
+import time
+import hashlib
+import logging
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Sequence, Tuple
+
+logger = logging.getLogger(__name__)
+
+DATA_DIR = Path(__file__).resolve().parent.parent.parent / "data"
+
+TEXT_FIELDS = ("overview", "symptoms", "causes", "treatments", "prevention", "risk_factors", "complications")
+_READ_SIZE = 1 << 16
+
+# --- Cleaning rules (compiled once, applied in order) ---
+_WHITESPACE = re.compile(r"\s+")
+CLEANING_RULES = (
+    (re.compile(r"\b(?:Mon|Tue|Wed|Thu|Fri|Sat|Sun),\s+\w+\s+\d{1,2},\s+\d{4}\b"), ""),  # "Fri, Jan 5, 2024" page stamps
+    (re.compile(r"\b(?:Symptoms & causes|Diagnosis & treatment|Diseases & Conditions)\b", re.IGNORECASE), ""),  # Nav labels
+    (re.compile(r";\s*;*"), "; "),
+)
+_ID_PARENTHESIZED = re.compile(r"\s*\(.\)\s")
+_ID_PUNCTUATION = re.compile(r"[^\w\s-]")
+
+
+def clean_text(value: Any) -> str:
+    text = _WHITESPACE.sub(" ", str(value)).strip()
+    for pattern, replacement in CLEANING_RULES:
+        text = pattern.sub(replacement, text)
+    return _WHITESPACE.sub(" ", text.strip("; ")).strip()
+
+
+def normalize_id(text: Any, prefix: str) -> str:
+    original_text = str(text)
+    text = original_text.strip().lower()
+    text = _ID_PARENTHESIZED.sub("", text)
+    text = _ID_PUNCTUATION.sub("", text)
+    text = _WHITESPACE.sub("", text)
+    if not text:
+        logger.warning(f"Generated empty ID for prefix '{prefix}' and original text '{original_text}'. Using a fallback ID.")
+        text = f"unnamed_{hashlib.md5(original_text.encode()).hexdigest()[:8]}"
+    return f"{prefix}:{text}"
+
+
+# --- Streaming JSON ---
+def iter_json_array(path: Path, read_size: int = _READ_SIZE) -> Iterator[Any]:
+    """
+    Yields the elements of a top-level JSON array one at a time, reading the
+    file in read_size blocks. A file holding a single non-array value yields
+    that value (parsed whole).
+    """
+    decoder = json.JSONDecoder()
+    with open(path, "r", encoding="utf-8") as f:
+        buffer, eof = "", False
+
+        def fill(pos: int) -> int:
+            # Drops the consumed prefix and appends the next block; returns the new pos
+            nonlocal buffer, eof
+            block = f.read(read_size)
+            eof = not block
+            buffer = buffer[pos:] + block
+            return 0
+
+        def skip_whitespace(pos: int) -> int:
+            while True:
+                while pos < len(buffer) and buffer[pos].isspace():
+                    pos += 1
+                if pos < len(buffer) or eof:
+                    return pos
+                pos = fill(pos)
+
+        pos = skip_whitespace(0)
+        if pos >= len(buffer):
+            return
+        if buffer[pos] != "[":
+            f.seek(0)
+            yield json.load(f)
+            return
+        pos = skip_whitespace(pos + 1)
+        if pos < len(buffer) and buffer[pos] == "]":
+            return
+        while True:
+            try:
+                value, end = decoder.raw_decode(buffer, pos)
+                # A value ending exactly at the buffer edge may be cut short (e.g. a number)
+                if end == len(buffer) and not eof:
+                    raise json.JSONDecodeError("Value may continue in the next block", buffer, end)
+            except json.JSONDecodeError:
+                if eof:
+                    raise
+                pos = fill(pos)
+                continue
+            yield value
+            pos = skip_whitespace(end)
+            if pos >= len(buffer):
+                raise json.JSONDecodeError("Unterminated array", buffer, pos)
+            if buffer[pos] == "]":
+                return
+            if buffer[pos] != ",":
+                raise json.JSONDecodeError("Expected ',' or ']'", buffer, pos)
+            pos = skip_whitespace(pos + 1)
+            if pos > read_size:
+                pos = fill(pos) if not eof else pos
+
+
+# --- Source adapters ---
+class SourceAdapter:
+    """A corpus source: yields entity dicts carrying 'type' and 'original_name'."""
+
+    name = "source"
+
+    def iter_entities(self) -> Iterator[Dict[str, Any]]:
+        raise NotImplementedError
+
+
+class JsonEntitySource(SourceAdapter):
+    """A JSON array of entity records (the Mayo scrapes, cleaned_disfaqs.json)."""
+
+    def __init__(self, filename: str, entity_type: str, name_field: str, data_dir: Path = DATA_DIR):
+        self.path = Path(data_dir) / filename
+        self.entity_type = entity_type
+        self.name_field = name_field
+        self.name = filename
+
+    def iter_entities(self) -> Iterator[Dict[str, Any]]:
+        if not self.path.exists():
+            logger.warning(f"Source file not found, skipping: {self.path}")
+            return
+        logger.info(f"Streaming entity data from {self.path}...")
+        count = 0
+        try:
+            for item in iter_json_array(self.path):
+                if not isinstance(item, dict):
+                    logger.warning(f"Skipping non-dictionary item in {self.name}: {str(item)[:100]}...")
+                    continue
+                item["type"] = self.entity_type
+                item["original_name"] = item.get(self.name_field, "")
+                count += 1
+                yield item
+        except json.JSONDecodeError as e:
+            logger.error(f"Error decoding JSON from {self.path} after {count} items: {e}")
+        logger.info(f"Loaded {count} items of type '{self.entity_type}' from {self.name}.")
+
+
+class FaqSource(JsonEntitySource):
+    """cleaned_disfaqs.json: disease names with curated FAQ lists and no text fields."""
+
+    def __init__(self, filename: str = "cleaned_disfaqs.json", data_dir: Path = DATA_DIR):
+        super().__init__(filename, "disease", "disease_name", data_dir=data_dir)
+
+    def iter_entities(self) -> Iterator[Dict[str, Any]]:
+        for item in super().iter_entities():
+            yield {"type": item["type"], "original_name": item["original_name"],
+                   "url": item.get("url", ""), "faqs": item.get("faqs", [])}
+
+
+SOURCE_ADAPTERS = {
+    "mayo_diseases": lambda: JsonEntitySource("mayo_all_structured.json", "disease", "disease_name"),
+    "mayo_tests": lambda: JsonEntitySource("mayo_tests_all_structured.json", "test", "test_name"),
+    "mayo_drugs": lambda: JsonEntitySource("mayo_drugs_structured.json", "drug", "drug_name"),
+    "disfaqs": FaqSource,
+}
+# Missing files are skipped, so the default works with whichever of these are present
+DEFAULT_SOURCES = ("mayo_diseases", "mayo_tests", "mayo_drugs", "disfaqs")
+
+
+def get_source(spec: str) -> SourceAdapter:
+    """A registered adapter name (see SOURCE_ADAPTERS) or FILE:ENTITY_TYPE:NAME_FIELD."""
+    if spec in SOURCE_ADAPTERS:
+        return SOURCE_ADAPTERS[spec]()
+    parts = spec.split(":")
+    if len(parts) != 3:
+        raise ValueError(f"Unknown source '{spec}': expected one of {sorted(SOURCE_ADAPTERS)} or FILE:ENTITY_TYPE:NAME_FIELD")
+    return JsonEntitySource(*parts)
+
+
+def get_sources(specs: Optional[Sequence[str]] = None) -> List[SourceAdapter]:
+    return [get_source(spec) for spec in (specs or DEFAULT_SOURCES)]
+
+
+def iter_entities(sources: Iterable[SourceAdapter]) -> Iterator[Dict[str, Any]]:
+    for source in sources:
+        yield from source.iter_entities()
+
+
+# --- Chunking ---
+def chunk_entity(item: Dict[str, Any]) -> List[Dict[str, Any]]:
+    original_name = item.get("original_name", "")
+    item_type = item.get("type", "unknown")
+    base_id = normalize_id(original_name, item_type)
+    common_metadata = {"name": original_name, "url": item.get("url", ""), "entity_type": item_type}
+
+    # Chunk for the name itself
+    chunks = [{"doc_id": base_id, "text": original_name, "metadata": {**common_metadata, "type": "name", "doc_id": base_id}}]
+
+    # Chunks for text fields
+    for field in TEXT_FIELDS:
+        val = item.get(field)
+        if not val:
+            continue
+        if isinstance(val, list):
+            val = " ".join(filter(None, val))
+        cleaned_text = clean_text(val)
+        if cleaned_text:
+            chunk_id = f"{base_id}:{field}"
+            chunks.append({
+                "doc_id": chunk_id,
+                "text": field.replace("_", " ").title() + ": " + cleaned_text,
+                "metadata": {**common_metadata, "type": field, "doc_id": chunk_id},
+            })
+
+    # Chunks for entity-specific FAQs
+    faqs = item.get("faqs", [])
+    if isinstance(faqs, list):
+        for i, faq in enumerate(faqs):
+            if not isinstance(faq, dict):
+                logger.warning(f"Skipping non-dictionary FAQ item within '{original_name}': {str(faq)[:100]}...")
+                continue
+            q = faq.get("question", "").strip()
+            a = faq.get("answer", "").strip()
+            if q and a:
+                chunk_id = f"{base_id}:faq:{i}"
+                chunks.append({
+                    "doc_id": chunk_id,
+                    "text": f"Question: {q} Answer: {a}",
+                    "metadata": {**common_metadata, "type": "faq", "doc_id": chunk_id},
+                })
+    elif faqs:
+        logger.warning(f"'faqs' field in '{original_name}' is not a list: {type(faqs)}")
+    return chunks
+
+
+def chunk_entities(entities: List[Dict[str, Any]]) -> Tuple[List[Dict[str, Any]], int]:
+    """Worker task: chunks a batch of entities. Returns (chunks, skipped_count)."""
+    chunks, skipped = [], 0
+    for item in entities:
+        if not item.get("original_name"):
+            skipped += 1
+            continue
+        try:
+            chunks.extend(chunk_entity(item))
+        except Exception as e:
+            logger.error(f"Error processing item '{item.get('original_name')}': {e}", exc_info=True)
+            skipped += 1
+    return chunks, skipped
+
+
+def batched(iterable: Iterable[Any], size: int) -> Iterator[List[Any]]:
+    batch = []
+    for item in iterable:
+        batch.append(item)
+        if len(batch) >= size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+def iter_chunks(sources: Iterable[SourceAdapter], workers: Optional[int] = None,
+                batch_entities: Optional[int] = None) -> Iterator[Dict[str, Any]]:
+    """
+    Streams the chunks of every source in corpus order. With workers > 1,
+    entity batches are chunked on a process pool with at most 2 * workers
+    batches in flight, so a slow consumer (the embedding stage) holds the
+    producer back instead of letting chunks pile up.
+    """
+    workers = workers or int(os.getenv("INGEST_WORKERS", "0")) or os.cpu_count() or 1
+    batch_entities = batch_entities or int(os.getenv("INGEST_BATCH_ENTITIES", "64"))
+    batches = batched(iter_entities(sources), batch_entities)
+    start = time.perf_counter()
+    entity_count = chunk_count = skipped_count = 0
+
+    def emit(batch_size: int, result: Tuple[List[Dict[str, Any]], int]) -> List[Dict[str, Any]]:
+        nonlocal entity_count, chunk_count, skipped_count
+        chunks, skipped = result
+        entity_count += batch_size
+        chunk_count += len(chunks)
+        skipped_count += skipped
+        return chunks
+
+    if workers <= 1:
+        for batch in batches:
+            yield from emit(len(batch), chunk_entities(batch))
+    else:
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            pending = deque()
+            for batch in batches:
+                pending.append((len(batch), pool.submit(chunk_entities, batch)))
+                if len(pending) >= 2 * workers:
+                    batch_size, future = pending.popleft()
+                    yield from emit(batch_size, future.result())
+            while pending:
+                batch_size, future = pending.popleft()
+                yield from emit(batch_size, future.result())
+    logger.info(f"Chunked {entity_count} entities into {chunk_count} chunks ({skipped_count} skipped) "
+                f"with {workers} worker(s) in {time.perf_counter() - start:.1f}s.")
@@ -0,0 +1,339 @@
+"""
+Persistent prompt-level cache in front of Settings.llm.
+
+CachedLLM wraps the configured LLM and answers repeated prompts (router,
+report and RAG synthesis prompts alike) from a SQLite file in WAL mode, so
+every gunicorn worker on the host shares one cache. Keys are a SHA-256 of
+(model, temperature, max_tokens, call kind, prompt/messages, kwargs).
+LlamaIndex query engines go through the same chat/complete methods, so
+their synthesis calls are cached transparently.
+
+Call sites that must always reach the model wrap the call in
+`with llm_cache_bypass(): ...`. The router, nurse, report and RAG call
+sites run inside llm_cache_site(<name>), so a deployment opts a site out
+with LLM_CACHE_BYPASS_SITES (comma-separated, e.g. "nurse,report").
+"""
+import os
+import json
+import time
+import sqlite3
+import asyncio
+import hashlib
+import logging
+import threading
+import contextvars
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Any, Dict, FrozenSet, Optional, Sequence
+
+from llama_index.core.base.llms.types import (
+    ChatMessage,
+    ChatResponse,
+    ChatResponseAsyncGen,
+    ChatResponseGen,
+    CompletionResponse,
+    CompletionResponseAsyncGen,
+    CompletionResponseGen,
+    LLMMetadata,
+    MessageRole,
+)
+from llama_index.core.llms import LLM
+from pydantic import PrivateAttr
+
+from app.services.metrics import record_cache
+
+logger = logging.getLogger(__name__)
+
+# Runtime state lives in var/, not storage/ (published index files only; LLM_CACHE_PATH overrides)
+DEFAULT_CACHE_PATH = Path(__file__).resolve().parent.parent.parent / "var" / "llm_cache.sqlite3"
+
+# Set by llm_cache_bypass(); contextvars follow threads started via asyncio.to_thread
+_bypass = contextvars.ContextVar("llm_cache_bypass", default=False)
+
+
+@contextmanager
+def llm_cache_bypass():
+    """Per-call-site opt-out: LLM calls inside this block skip the cache (read and write)."""
+    token = _bypass.set(True)
+    try:
+        yield
+    finally:
+        _bypass.reset(token)
+
+
+# Site name of RAG synthesis calls; the chat sites use the history_compaction names (router, nurse, report)
+RAG_SITE = "rag"
+
+
+def bypassed_sites() -> FrozenSet[str]:
+    """Call sites listed in LLM_CACHE_BYPASS_SITES."""
+    return frozenset(site.strip().lower() for site in os.getenv("LLM_CACHE_BYPASS_SITES", "").split(",") if site.strip())
+
+
+@contextmanager
+def llm_cache_site(site: str):
+    """LLM calls of one call site; they skip the cache when the site is opted out in LLM_CACHE_BYPASS_SITES."""
+    if site in bypassed_sites():
+        with llm_cache_bypass():
+            yield
+    else:
+        yield
+
+
+class SQLitePromptCache:
+    """Key/value store in SQLite (WAL) with a TTL and a bound on the number of entries."""
+
+    # Eviction runs every N writes rather than on each one
+    EVICT_EVERY = 100
+
+    def __init__(self, path: Path = DEFAULT_CACHE_PATH, max_entries: int = 10000, ttl_seconds: float = 86400):
+        self.path = Path(path)
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self._local = threading.local()
+        self._writes = 0
+        self.hits = 0
+        self.misses = 0
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        with self._connect() as conn:
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS llm_cache ("
+                " key TEXT PRIMARY KEY, value TEXT NOT NULL,"
+                " created_at REAL NOT NULL, accessed_at REAL NOT NULL)"
+            )
+            conn.execute("CREATE INDEX IF NOT EXISTS llm_cache_accessed ON llm_cache (accessed_at)")
+
+    def _connect(self) -> sqlite3.Connection:
+        # One connection per thread; WAL lets workers read while another writes
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(str(self.path), timeout=5.0, isolation_level=None, check_same_thread=False)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    def get(self, key: str) -> Optional[Dict[str, Any]]:
+        now = time.time()
+        try:
+            conn = self._connect()
+            row = conn.execute(
+                "SELECT value FROM llm_cache WHERE key = ? AND created_at >= ?", (key, now - self.ttl_seconds)
+            ).fetchone()
+            if row is None:
+                self.misses += 1
+                record_cache("llm", False)
+                return None
+            conn.execute("UPDATE llm_cache SET accessed_at = ? WHERE key = ?", (now, key))
+            self.hits += 1
+            record_cache("llm", True)
+            return json.loads(row[0])
+        except sqlite3.Error as e:
+            logger.error(f"LLM cache read failed: {e}", exc_info=True)
+            return None
+
+    def put(self, key: str, value: Dict[str, Any]) -> None:
+        now = time.time()
+        try:
+            conn = self._connect()
+            conn.execute(
+                "INSERT OR REPLACE INTO llm_cache (key, value, created_at, accessed_at) VALUES (?, ?, ?, ?)",
+                (key, json.dumps(value), now, now),
+            )
+            self._writes += 1
+            if self._writes % self.EVICT_EVERY == 0:
+                self.evict()
+        except sqlite3.Error as e:
+            logger.error(f"LLM cache write failed: {e}", exc_info=True)
+
+    def evict(self) -> int:
+        """Drops expired rows, then the least recently used rows above max_entries."""
+        conn = self._connect()
+        removed = conn.execute("DELETE FROM llm_cache WHERE created_at < ?", (time.time() - self.ttl_seconds,)).rowcount
+        removed += conn.execute(
+            "DELETE FROM llm_cache WHERE key IN ("
+            " SELECT key FROM llm_cache ORDER BY accessed_at DESC LIMIT -1 OFFSET ?)",
+            (self.max_entries,),
+        ).rowcount
+        if removed:
+            logger.info(f"LLM cache evicted {removed} entries.")
+        return removed
+
+    def clear(self) -> None:
+        self._connect().execute("DELETE FROM llm_cache")
+
+    def stats(self) -> Dict[str, Any]:
+        entries = self._connect().execute("SELECT COUNT(*) FROM llm_cache").fetchone()[0]
+        return {
+            "path": str(self.path),
+            "entries": entries,
+            "max_entries": self.max_entries,
+            "ttl_seconds": self.ttl_seconds,
+            "hits": self.hits,
+            "misses": self.misses,
+        }
+
+
+def _messages_payload(messages: Sequence[ChatMessage]):
+    return [[str(message.role.value if hasattr(message.role, "value") else message.role), message.content or ""]
+            for message in messages]
+
+
+class CachedLLM(LLM):
+    """Delegates to the wrapped LLM, answering repeated prompts from a SQLitePromptCache."""
+
+    _llm: LLM = PrivateAttr()
+    _cache: SQLitePromptCache = PrivateAttr()
+
+    def __init__(self, llm: LLM, cache: SQLitePromptCache, **kwargs: Any):
+        super().__init__(callback_manager=llm.callback_manager, **kwargs)
+        self._llm = llm
+        self._cache = cache
+
+    @classmethod
+    def class_name(cls) -> str:
+        return "CachedLLM"
+
+    @property
+    def inner(self) -> LLM:
+        return self._llm
+
+    @property
+    def cache(self) -> SQLitePromptCache:
+        return self._cache
+
+    @property
+    def metadata(self) -> LLMMetadata:
+        return self._llm.metadata
+
+    # --- Keys ---
+    def _key(self, kind: str, payload: Any, kwargs: Dict[str, Any]) -> Optional[str]:
+        if _bypass.get():
+            return None
+        identity = {
+            "model": self._llm.metadata.model_name,
+            "temperature": getattr(self._llm, "temperature", None),
+            "max_tokens": getattr(self._llm, "max_tokens", None),
+            "kind": kind,
+            "payload": payload,
+            "kwargs": kwargs,
+        }
+        encoded = json.dumps(identity, sort_keys=True, default=str)
+        return hashlib.sha256(encoded.encode("utf-8")).hexdigest()
+
+    def _complete_key(self, prompt: str, formatted: bool, kwargs: Dict[str, Any]) -> Optional[str]:
+        return self._key("complete", {"prompt": prompt, "formatted": formatted}, kwargs)
+
+    def _chat_key(self, messages: Sequence[ChatMessage], kwargs: Dict[str, Any]) -> Optional[str]:
+        return self._key("chat", _messages_payload(messages), kwargs)
+
+    @staticmethod
+    def _chat_response(value: Dict[str, Any]) -> ChatResponse:
+        return ChatResponse(message=ChatMessage(role=MessageRole(value.get("role", "assistant")), content=value["content"]))
+
+    # --- Sync ---
+    def complete(self, prompt: str, formatted: bool = False, **kwargs: Any) -> CompletionResponse:
+        key = self._complete_key(prompt, formatted, kwargs)
+        cached = self._cache.get(key) if key else None
+        if cached is not None:
+            return CompletionResponse(text=cached["text"])
+        response = self._llm.complete(prompt, formatted=formatted, **kwargs)
+        if key and response.text:
+            self._cache.put(key, {"text": response.text})
+        return response
+
+    def chat(self, messages: Sequence[ChatMessage], **kwargs: Any) -> ChatResponse:
+        key = self._chat_key(messages, kwargs)
+        cached = self._cache.get(key) if key else None
+        if cached is not None:
+            return self._chat_response(cached)
+        response = self._llm.chat(messages, **kwargs)
+        if key and response.message.content:
+            self._cache.put(key, {"role": str(response.message.role.value), "content": response.message.content})
+        return response
+
+    def stream_complete(self, prompt: str, formatted: bool = False, **kwargs: Any) -> CompletionResponseGen:
+        key = self._complete_key(prompt, formatted, kwargs)
+        cached = self._cache.get(key) if key else None
+
+        def gen() -> CompletionResponseGen:
+            if cached is not None:
+                yield CompletionResponse(text=cached["text"], delta=cached["text"])
+                return
+            text = ""
+            for chunk in self._llm.stream_complete(prompt, formatted=formatted, **kwargs):
+                text += chunk.delta or ""
+                yield chunk
+            if key and text:
+                self._cache.put(key, {"text": text})
+
+        return gen()
+
+    def stream_chat(self, messages: Sequence[ChatMessage], **kwargs: Any) -> ChatResponseGen:
+        key = self._chat_key(messages, kwargs)
+        cached = self._cache.get(key) if key else None
+
+        def gen() -> ChatResponseGen:
+            if cached is not None:
+                response = self._chat_response(cached)
+                response.delta = cached["content"]
+                yield response
+                return
+            content = ""
+            role = "assistant"
+            for chunk in self._llm.stream_chat(messages, **kwargs):
+                content += chunk.delta or ""
+                role = str(chunk.message.role.value)
+                yield chunk
+            if key and content:
+                self._cache.put(key, {"role": role, "content": content})
+
+        return gen()
+
+    # --- Async (SQLite access runs in a worker thread) ---
+    async def acomplete(self, prompt: str, formatted: bool = False, **kwargs: Any) -> CompletionResponse:
+        key = self._complete_key(prompt, formatted, kwargs)
+        cached = await asyncio.to_thread(self._cache.get, key) if key else None
+        if cached is not None:
+            return CompletionResponse(text=cached["text"])
+        response = await self._llm.acomplete(prompt, formatted=formatted, **kwargs)
+        if key and response.text:
+            await asyncio.to_thread(self._cache.put, key, {"text": response.text})
+        return response
+
+    async def achat(self, messages: Sequence[ChatMessage], **kwargs: Any) -> ChatResponse:
+        key = self._chat_key(messages, kwargs)
+        cached = await asyncio.to_thread(self._cache.get, key) if key else None
+        if cached is not None:
+            return self._chat_response(cached)
+        response = await self._llm.achat(messages, **kwargs)
+        if key and response.message.content:
+            await asyncio.to_thread(
+                self._cache.put, key, {"role": str(response.message.role.value), "content": response.message.content}
+            )
+        return response
+
+    async def astream_complete(self, prompt: str, formatted: bool = False, **kwargs: Any) -> CompletionResponseAsyncGen:
+        # Streaming is latency-sensitive rather than repeated; pass through uncached
+        return await self._llm.astream_complete(prompt, formatted=formatted, **kwargs)
+
+    async def astream_chat(self, messages: Sequence[ChatMessage], **kwargs: Any) -> ChatResponseAsyncGen:
+        return await self._llm.astream_chat(messages, **kwargs)
+
+
+def wrap_llm_from_env(llm: LLM) -> LLM:
+    """Wraps llm in a CachedLLM configured from LLM_CACHE_* env vars (unchanged when disabled)."""
+    if os.getenv("LLM_CACHE_ENABLED", "true").lower() not in ("1", "true", "yes"):
+        logger.info("LLM prompt cache disabled.")
+        return llm
+    try:
+        cache = SQLitePromptCache(
+            path=Path(os.getenv("LLM_CACHE_PATH", str(DEFAULT_CACHE_PATH))),
+            max_entries=int(os.getenv("LLM_CACHE_MAX_ENTRIES", "10000")),
+            ttl_seconds=float(os.getenv("LLM_CACHE_TTL_SECONDS", "86400")),
+        )
+    except Exception as e:
+        logger.error(f"Failed to open LLM prompt cache, continuing uncached: {e}", exc_info=True)
+        return llm
+    logger.info(f"LLM prompt cache enabled at {cache.path} (max_entries={cache.max_entries}, ttl={cache.ttl_seconds}s).")
+    return CachedLLM(llm, cache)
@@ -0,0 +1,161 @@
+"""
+Prometheus metrics for the request pipeline, served at /metrics.
+
+- curaai_stage_seconds{stage}: latency of each pipeline stage -- route,
+  router_llm, embed, vector_search, kg_query, synthesis, report_section,
+  maps_api and validation (Pydantic parsing of request bodies).
+- curaai_request_seconds{endpoint} / curaai_requests_total{endpoint,status}:
+  whole-request latency and throughput per route.
+- curaai_cache_events_total{cache,result}: semantic / FAQ / LLM cache hits and misses.
+- curaai_llm_errors_total{call} and curaai_fallbacks_total{reason}.
+- curaai_in_flight_requests and curaai_index_vectors{index} gauges.
+
+Every gunicorn worker is its own process with its own values. When
+PROMETHEUS_MULTIPROC_DIR is set (gunicorn.conf.py sets it) prometheus_client
+keeps them in per-process files in that directory and /metrics sums them
+across workers, so any worker can answer the scrape. The directory must be
+set before this module is first imported and emptied on server start.
+
+Without prometheus_client installed, or with METRICS_ENABLED off, every
+function here is a no-op and /metrics returns 404.
+"""
+import os
+import time
+import logging
+import functools
+import asyncio
+from contextlib import contextmanager
+from typing import Iterator, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+try:
+    import prometheus_client
+    from prometheus_client import multiprocess
+except ImportError:  # Optional dependency: metrics are disabled
+    prometheus_client = None
+
+METRICS_ENABLED = prometheus_client is not None and os.getenv("METRICS_ENABLED", "true").lower() in ("1", "true", "yes")
+MULTIPROC_DIR = os.getenv("PROMETHEUS_MULTIPROC_DIR") or None
+
+# Stage names (the `stage` label)
+ROUTE = "route"
+ROUTER_LLM = "router_llm"
+EMBED = "embed"
+VECTOR_SEARCH = "vector_search"
+KG_QUERY = "kg_query"
+SYNTHESIS = "synthesis"
+REPORT_SECTION = "report_section"
+MAPS_API = "maps_api"
+VALIDATION = "validation"
+
+# From sub-millisecond FAISS searches up to LLM calls that hit their timeouts
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+if METRICS_ENABLED:
+    STAGE_SECONDS = prometheus_client.Histogram(
+        "curaai_stage_seconds", "Latency of one pipeline stage.", ["stage"], buckets=LATENCY_BUCKETS
+    )
+    REQUEST_SECONDS = prometheus_client.Histogram(
+        "curaai_request_seconds", "Request latency by route.", ["endpoint"], buckets=LATENCY_BUCKETS
+    )
+    REQUESTS_TOTAL = prometheus_client.Counter(
+        "curaai_requests_total", "Requests served, by route and status code.", ["endpoint", "status"]
+    )
+    CACHE_EVENTS_TOTAL = prometheus_client.Counter(
+        "curaai_cache_events_total", "Cache lookups by cache and result (hit/miss).", ["cache", "result"]
+    )
+    LLM_ERRORS_TOTAL = prometheus_client.Counter(
+        "curaai_llm_errors_total", "Failed or timed-out LLM calls, by call site.", ["call"]
+    )
+    FALLBACKS_TOTAL = prometheus_client.Counter(
+        "curaai_fallbacks_total", "Degraded answers served, by reason.", ["reason"]
+    )
+    # livesum / livemax drop the series of workers that have exited (see gunicorn.conf.py child_exit)
+    IN_FLIGHT_REQUESTS = prometheus_client.Gauge(
+        "curaai_in_flight_requests", "Requests currently being served.", multiprocess_mode="livesum"
+    )
+    INDEX_VECTORS = prometheus_client.Gauge(
+        "curaai_index_vectors", "Vectors in the loaded index.", ["index"], multiprocess_mode="livemax"
+    )
+
+
+def observe_stage(stage: str, seconds: float) -> None:
+    if METRICS_ENABLED:
+        STAGE_SECONDS.labels(stage).observe(seconds)
+
+
+@contextmanager
+def stage_timer(stage: str) -> Iterator[None]:
+    """Observes the block's duration (including when it raises) under `stage`."""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        observe_stage(stage, time.perf_counter() - start)
+
+
+def timed(stage: str):
+    """Decorator form of stage_timer(); works on plain and async functions."""
+    def decorator(func):
+        if asyncio.iscoroutinefunction(func):
+            @functools.wraps(func)
+            async def async_wrapper(*args, **kwargs):
+                with stage_timer(stage):
+                    return await func(*args, **kwargs)
+            return async_wrapper
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            with stage_timer(stage):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def record_cache(cache: str, hit: bool) -> None:
+    if METRICS_ENABLED:
+        CACHE_EVENTS_TOTAL.labels(cache, "hit" if hit else "miss").inc()
+
+
+def record_llm_error(call: str) -> None:
+    if METRICS_ENABLED:
+        LLM_ERRORS_TOTAL.labels(call).inc()
+
+
+def record_fallback(reason: str) -> None:
+    if METRICS_ENABLED:
+        FALLBACKS_TOTAL.labels(reason).inc()
+
+
+def set_index_size(index: str, vectors: Optional[int]) -> None:
+    if METRICS_ENABLED:
+        INDEX_VECTORS.labels(index).set(vectors or 0)
+
+
+def request_started() -> Optional[float]:
+    """Counts a request as in flight; pass the result to request_finished()."""
+    if not METRICS_ENABLED:
+        return None
+    IN_FLIGHT_REQUESTS.inc()
+    return time.perf_counter()
+
+
+def request_finished(started: Optional[float], endpoint: str, status: int) -> None:
+    if started is None:
+        return
+    IN_FLIGHT_REQUESTS.dec()
+    REQUEST_SECONDS.labels(endpoint).observe(time.perf_counter() - started)
+    REQUESTS_TOTAL.labels(endpoint, str(status)).inc()
+
+
+def render_metrics() -> Tuple[bytes, str]:
+    """(body, content type) in the Prometheus text format; summed over all workers in multiprocess mode."""
+    if MULTIPROC_DIR:
+        # A fresh registry per scrape: it reads every worker's files, not this process's memory
+        registry = prometheus_client.CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+    else:
+        registry = prometheus_client.REGISTRY
+    return prometheus_client.generate_latest(registry), prometheus_client.CONTENT_TYPE_LATEST
+
@@ -0,0 +1,173 @@
+"""
+Long-lived query engines for query_rag().
+
+Building the vector/KG query engines, their QueryEngineTools and the
+RouterQueryEngine is pure overhead per request, so they are built once per
+(indexes, configuration) and reused. Swapping either index drops the cache.
+
+After a vector index hot reload, requests that still hold a lease on the
+retired generation get an engine built for them alone: caching it would
+evict the new generation's engines, and keep the retired index alive.
+"""
+import logging
+import threading
+import weakref
+from typing import Any, Dict, NamedTuple, Optional, Tuple
+
+from llama_index.core.base.base_query_engine import BaseQueryEngine
+from llama_index.core.query_engine import RouterQueryEngine
+from llama_index.core.schema import QueryBundle
+from llama_index.core.tools import QueryEngineTool
+
+from app.services.metrics import stage_timer, KG_QUERY
+
+logger = logging.getLogger(__name__)
+
+VECTOR_TOOL = "vector"
+KG_TOOL = "kg"
+
+
+class EngineConfig(NamedTuple):
+    """Registry key: everything that changes how the engine is built."""
+    top_k: int = 5
+    response_mode: Optional[str] = None
+    tools: Tuple[str, ...] = (VECTOR_TOOL, KG_TOOL)
+    ef_search: Optional[int] = None  # HNSW search depth (None: index default)
+    nprobe: Optional[int] = None     # IVF lists probed (None: index default)
+    streaming: bool = False          # Engines return StreamingResponse (token generator)
+
+
+DEFAULT_ENGINE_CONFIG = EngineConfig()
+
+# Upper bound on distinct configurations kept alive at once
+MAX_CACHED_ENGINES = 32
+
+
+class TimedQueryEngine(BaseQueryEngine):
+    """Delegates to another query engine and observes each query's latency as a metrics stage."""
+
+    def __init__(self, query_engine: BaseQueryEngine, stage: str):
+        self._query_engine = query_engine
+        self._stage = stage
+        super().__init__(callback_manager=query_engine.callback_manager)
+
+    def _get_prompt_modules(self) -> Dict[str, Any]:
+        return {"query_engine": self._query_engine}
+
+    def _query(self, query_bundle: QueryBundle):
+        with stage_timer(self._stage):
+            return self._query_engine.query(query_bundle)
+
+    async def _aquery(self, query_bundle: QueryBundle):
+        with stage_timer(self._stage):
+            return await self._query_engine.aquery(query_bundle)
+
+
+def build_query_engine(vector_index: Any, kg_index: Any, config: EngineConfig = DEFAULT_ENGINE_CONFIG):
+    """Builds the (possibly routed) query engine for the given indexes. Returns None if no tool applies."""
+    query_engine_tools = []
+    vector_kwargs = {"response_mode": config.response_mode} if config.response_mode else {}
+    if config.ef_search:
+        vector_kwargs["ef_search"] = config.ef_search
+    if config.nprobe:
+        vector_kwargs["nprobe"] = config.nprobe
+    if config.streaming:
+        vector_kwargs["streaming"] = True
+
+    if vector_index and VECTOR_TOOL in config.tools:
+        vector_tool = QueryEngineTool.from_defaults(
+            query_engine=vector_index.as_query_engine(similarity_top_k=config.top_k, **vector_kwargs),
+            name="VectorLookupTool",
+            description="Use for simple lookups, definitions, FAQs, symptoms, causes, treatments, or overviews."
+        )
+        query_engine_tools.append(vector_tool)
+        logger.info("Vector Tool created.")
+
+    if kg_index and KG_TOOL in config.tools:
+        kg_query_engine = kg_index.as_query_engine(include_text=False, response_mode="tree_summarize",
+                                                   streaming=config.streaming)
+        kg_tool = QueryEngineTool.from_defaults(
+            query_engine=TimedQueryEngine(kg_query_engine, KG_QUERY),
+            name="KnowledgeGraphTool",
+            description="Use ONLY for complex questions about relationships."
+        )
+        query_engine_tools.append(kg_tool)
+        logger.info("KG Tool created.")
+
+    if not query_engine_tools:
+        return None
+
+    if len(query_engine_tools) == 1:
+        logger.info(f"Using single tool engine: {query_engine_tools[0].metadata.name}")
+        return query_engine_tools[0].query_engine
+
+    logger.info("Creating RouterQueryEngine...")
+    query_engine = RouterQueryEngine.from_defaults(
+        query_engine_tools=query_engine_tools,
+        select_multi=False
+    )
+    logger.info("RouterQueryEngine created.")
+    return query_engine
+
+
+class QueryEngineRegistry:
+    """Thread-safe cache of query engines keyed by EngineConfig."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._engines: Dict[EngineConfig, Any] = {}
+        self._vector_index = None
+        self._kg_index = None
+        # Vector index generations replaced by swap_vector_index(); never cached again
+        self._retired: "weakref.WeakSet[Any]" = weakref.WeakSet()
+
+    def get(self, vector_index: Any, kg_index: Any, config: EngineConfig = DEFAULT_ENGINE_CONFIG):
+        with self._lock:
+            retired = vector_index is not None and vector_index in self._retired
+        if retired:
+            logger.info(f"Building uncached query engine on a retired vector index for {config}...")
+            return build_query_engine(vector_index, kg_index, config)
+
+        with self._lock:
+            if vector_index is not self._vector_index or kg_index is not self._kg_index:
+                if self._engines:
+                    logger.info("Indexes changed; dropping cached query engines.")
+                self._engines.clear()
+                self._vector_index = vector_index
+                self._kg_index = kg_index
+
+            if config not in self._engines:
+                logger.info(f"Building query engine for {config}...")
+                if len(self._engines) >= MAX_CACHED_ENGINES:
+                    # Per-request knobs can create many configs; drop the oldest
+                    self._engines.pop(next(iter(self._engines)))
+                self._engines[config] = build_query_engine(vector_index, kg_index, config)
+            return self._engines[config]
+
+    def warm(self, vector_index: Any, kg_index: Any, config: EngineConfig = DEFAULT_ENGINE_CONFIG) -> None:
+        """Pre-builds the default engine so the first request doesn't pay for it."""
+        try:
+            self.get(vector_index, kg_index, config)
+        except Exception as e:
+            logger.error(f"Failed to pre-build query engine: {e}", exc_info=True)
+
+    def swap_vector_index(self, vector_index: Any) -> None:
+        """Called on a hot reload: drops the engines of the previous vector index and retires it."""
+        with self._lock:
+            previous = self._vector_index
+            if previous is vector_index:
+                return
+            if previous is not None:
+                self._retired.add(previous)
+            self._engines.clear()
+            self._vector_index = vector_index
+
+    def invalidate(self) -> None:
+        with self._lock:
+            self._engines.clear()
+            self._vector_index = None
+            self._kg_index = None
+
+
+# Process-wide registry
+query_engine_registry = QueryEngineRegistry()
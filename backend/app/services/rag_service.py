@@ -1,8 +1,12 @@
 import os
 import json
+import time
+import asyncio
 import logging
 from pathlib import Path
-from typing import Tuple, Optional, List, Dict, Any
+import threading
+from typing import Tuple, Optional, List, Dict, Any, Callable, Iterator, Union
+from contextlib import contextmanager
 import faiss
 import numpy as np
 import hashlib
@@ -14,51 +18,77 @@ from llama_index.core import (
     KnowledgeGraphIndex,
     VectorStoreIndex
 )
-from llama_index.core.query_engine import RouterQueryEngine
-from llama_index.core.tools import QueryEngineTool
-from llama_index.embeddings.huggingface import HuggingFaceEmbedding
+from llama_index.core.schema import QueryBundle
 from llama_index.graph_stores.neo4j import Neo4jGraphStore
-from llama_index.vector_stores.faiss import FaissVectorStore
-from llama_index.core.schema import TextNode
 
 # CORRECT Gemini LLM import
 from llama_index.llms.google_genai import GoogleGenAI
 
+from app.services.chunk_store import ChunkStore, convert_metadata_json
+from app.services.faiss_retriever import ChunkStoreVectorIndex
+from app.services.faiss_factory import Rescorer, read_index_info
+from app.services.faq_index import FAQ_INDEX_FILENAME, load_faq_index
+from app.services.index_manager import IndexManager
+from app.services.vector_shards import ShardedVectorIndex
+from app.services.query_engines import query_engine_registry, EngineConfig, DEFAULT_ENGINE_CONFIG
+from app.services.semantic_cache import cache_from_env
+from app.services.embedding_backend import BackendEmbedding, get_embedding_backend, EMBEDDING_DIMENSION
+from app.services.embedding_batcher import get_embedding_batcher, BATCH_RESULT_TIMEOUT
+from app.services.llm_cache import llm_cache_site, wrap_llm_from_env, RAG_SITE
+from app.services.metrics import stage_timer, record_fallback, record_llm_error, set_index_size, EMBED, SYNTHESIS
+from app.services.fakes import FakeLLM, build_fake_kg_index, env_flag
+from app.services.engine_status import (
+    engine_status, LOADING, READY, FAILED, DISABLED, LLM, EMBEDDER, VECTOR_INDEX, KG
+)
+
 logger = logging.getLogger(__name__)
 
 # --- Paths for MANUALLY SAVED files ---
 SCRIPT_DIR = Path(__file__).resolve().parent
 STORAGE_DIR = SCRIPT_DIR.parent.parent / "storage"
 FAISS_INDEX_FILE_PATH = STORAGE_DIR / "vector_index.faiss"
-DOC_METADATA_FILE_PATH = STORAGE_DIR / "vector_metadata.json"
+CHUNK_STORE_FILE_PATH = STORAGE_DIR / "vector_chunks.bin"
+DOC_METADATA_FILE_PATH = STORAGE_DIR / "vector_metadata.json"  # Legacy, converted on first load
 
-def load_rag_engines() -> Tuple[Optional[VectorStoreIndex], Optional[KnowledgeGraphIndex]]:
-    """
-    Load RAG engines with Gemini LLM
-    """
-    vector_index = None
-    kg_index = None
-    logger.info("Attempting to load RAG engines...")
+# Approximate-index knobs (see faiss_factory); requests may override ef_search / nprobe
+RESCORE_FACTOR = int(os.getenv("FAISS_RESCORE_FACTOR", "1"))  # >1 re-ranks top_k * factor candidates exactly
+DEFAULT_EF_SEARCH = int(os.getenv("FAISS_EF_SEARCH", "0")) or None
+DEFAULT_NPROBE = int(os.getenv("FAISS_NPROBE", "0")) or None
+
+# Semantic answer cache (None when SEMANTIC_CACHE_ENABLED is off); cleared when the index files change
+semantic_answer_cache = cache_from_env([FAISS_INDEX_FILE_PATH, CHUNK_STORE_FILE_PATH])
 
-    # --- Load Gemini LLM ---
+def _load_llm() -> None:
+    """Loads the Gemini LLM into Settings.llm and reports its state."""
+    engine_status.set(LLM, LOADING)
     try:
-        gemini_api_key = os.getenv("GOOGLE_API_KEY")
-        if not gemini_api_key:
-            logger.error("GOOGLE_API_KEY environment variable is required but not set")
-            raise ValueError("GOOGLE_API_KEY not found in environment variables")
-        
-        # FIXED: Use correct model name format
-        llm = GoogleGenAI(
-            model="models/gemini-2.5-flash",  # Try this model name
-            # Alternatively, you can try: "gemini-1.0-pro" or "gemini-pro"
-            api_key=gemini_api_key,
-            temperature=0.1,
-            max_tokens=2048,
-        )
-        
-        # Test the LLM with a simple call
-        test_response = llm.complete("Test")
+        if env_flag("FAKE_LLM"):
+            # Offline stand-in for load tests; never talks to Gemini. Not cached: its simulated latency
+            # is what load tests measure, and cache hits would hide it
+            llm = FakeLLM.from_env()
+            logger.warning("FAKE_LLM is set: using the offline FakeLLM instead of Gemini.")
+        else:
+            gemini_api_key = os.getenv("GOOGLE_API_KEY")
+            if not gemini_api_key:
+                logger.error("GOOGLE_API_KEY environment variable is required but not set")
+                raise ValueError("GOOGLE_API_KEY not found in environment variables")
+
+            # FIXED: Use correct model name format
+            llm = GoogleGenAI(
+                model="models/gemini-2.5-flash",  # Try this model name
+                # Alternatively, you can try: "gemini-1.0-pro" or "gemini-pro"
+                api_key=gemini_api_key,
+                temperature=0.1,
+                max_tokens=2048,
+            )
+
+            # Test the LLM with a simple call (set RAG_LLM_SMOKE_TEST=false to skip the round trip)
+            if os.getenv("RAG_LLM_SMOKE_TEST", "true").lower() in ("1", "true", "yes"):
+                test_response = llm.complete("Test")
+            # Repeated prompts are answered from the shared on-disk cache (LLM_CACHE_*)
+            llm = wrap_llm_from_env(llm)
         Settings.llm = llm
+        engine_status.set(LLM, READY)
         logger.info("Gemini LLM (GoogleGenAI) loaded and tested successfully.")
         
     except Exception as e:
@@ -66,71 +96,169 @@ def load_rag_engines() -> Tuple[Optional[VectorStoreIndex], Optional[KnowledgeGr
         # Don't return None yet - let's try to continue without LLM for now
         logger.warning("Continuing without LLM - some functionality will be limited")
         Settings.llm = None
+        engine_status.set(LLM, FAILED, str(e))
 
-    # --- Load Local Embedding Model ---
+
+def _load_embed_model() -> bool:
+    """Loads the local embedding model into Settings.embed_model. Returns True on success."""
+    engine_status.set(EMBEDDER, LOADING)
     try:
-        embed_model = HuggingFaceEmbedding(model_name='sentence-transformers/all-MiniLM-L6-v2', device='cpu')
+        # EMBEDDING_BACKEND selects PyTorch (default) or the exported ONNX/int8 model
+        embed_model = BackendEmbedding(get_embedding_backend())
         Settings.embed_model = embed_model
-        logger.info("Local embedding model loaded and set in Settings.")
+        engine_status.set(EMBEDDER, READY)
+        logger.info(f"Local embedding model ({embed_model.backend.name} backend) loaded and set in Settings.")
+        return True
     except Exception as e:
         logger.error(f"CRITICAL: Failed to load local embedding model: {e}", exc_info=True)
-        return None, None
+        engine_status.set(EMBEDDER, FAILED, str(e))
+        return False
 
-    # --- Load FAISS Vector Index (MANUAL LOAD METHOD) ---
-    logger.info("Attempting to load FAISS index and metadata from manual files...")
-    vector_store = None
-    doc_metadata = {}
 
-    if FAISS_INDEX_FILE_PATH.exists() and DOC_METADATA_FILE_PATH.exists():
+def open_vector_index(storage_dir: Path = STORAGE_DIR) -> ChunkStoreVectorIndex:
+    """
+    Loads the FAISS index and chunk store saved by the build scripts into a
+    new ChunkStoreVectorIndex. Raises on failure. Used for the startup load,
+    for every hot reload (see vector_index_manager) and by shard workers,
+    whose storage_dir is their shard directory.
+    """
+    storage_dir = Path(storage_dir)
+    index_path = storage_dir / FAISS_INDEX_FILE_PATH.name
+    chunk_store_path = storage_dir / CHUNK_STORE_FILE_PATH.name
+    legacy_metadata_path = storage_dir / DOC_METADATA_FILE_PATH.name
+    logger.info("Attempting to load FAISS index and chunk store...")
+
+    if not chunk_store_path.exists() and legacy_metadata_path.exists():
+        # Indexes built before the chunk store existed: migrate once, then mmap
+        logger.warning(f"Chunk store {chunk_store_path} not found; converting legacy {legacy_metadata_path}.")
         try:
-            logger.info(f"Loading FAISS index from {FAISS_INDEX_FILE_PATH}...")
-            faiss_index_obj = faiss.read_index(str(FAISS_INDEX_FILE_PATH))
-            logger.info(f"FAISS index loaded successfully with {faiss_index_obj.ntotal} vectors.")
-
-            logger.info(f"Loading metadata map from {DOC_METADATA_FILE_PATH}...")
-            with open(DOC_METADATA_FILE_PATH, 'r', encoding='utf-8') as f:
-                doc_metadata = json.load(f)
-            logger.info(f"Metadata map loaded successfully with {len(doc_metadata)} entries.")
-
-            vector_store = FaissVectorStore(faiss_index=faiss_index_obj)
-
-            # --- CRITICAL: Reconstruct nodes for LlamaIndex ---
-            nodes = []
-            logger.info("Reconstructing TextNode objects from metadata...")
-            sorted_faiss_ids = sorted(doc_metadata.keys(), key=int)
-
-            for faiss_id_str in sorted_faiss_ids:
-                meta_info = doc_metadata[faiss_id_str]
-                if not isinstance(meta_info, dict):
-                    logger.warning(f"Skipping invalid metadata entry for FAISS ID {faiss_id_str}")
-                    continue
-                node = TextNode(
-                    id_=meta_info.get("doc_id"),
-                    text=meta_info.get("text", ""),
-                    metadata=meta_info.get("metadata", {})
-                )
-                nodes.append(node)
-            logger.info(f"Reconstructed {len(nodes)} TextNode objects.")
+            convert_metadata_json(legacy_metadata_path, chunk_store_path)
+        except Exception as e:
+            logger.error(f"Failed to convert legacy metadata map: {e}", exc_info=True)
 
-            if not nodes:
-                raise ValueError("No TextNode objects were reconstructed from metadata.")
-            if len(nodes) != faiss_index_obj.ntotal:
-                logger.warning(f"Metadata node count ({len(nodes)}) does not match FAISS vector count ({faiss_index_obj.ntotal}).")
+    if not index_path.exists() or not chunk_store_path.exists():
+        raise FileNotFoundError(f"FAISS index file ({index_path}) or chunk store ({chunk_store_path}) not found.")
 
-            vector_index = VectorStoreIndex(
-                nodes=nodes,
-                vector_store=vector_store,
-            )
-            logger.info("LlamaIndex VectorStoreIndex initialized successfully with manually loaded data.")
+    logger.info(f"Loading FAISS index from {index_path}...")
+    faiss_index_obj = faiss.read_index(str(index_path))
+    logger.info(f"FAISS index loaded successfully with {faiss_index_obj.ntotal} vectors.")
 
-        except Exception as e:
-            logger.error(f"Failed during manual FAISS load or VectorStoreIndex init: {e}", exc_info=True)
-            vector_index = None
+    logger.info(f"Memory-mapping chunk store {chunk_store_path}...")
+    chunk_store = ChunkStore(chunk_store_path)
+    logger.info(f"Chunk store mapped with {len(chunk_store)} records ({chunk_store.nbytes} bytes).")
+    try:
+        if len(chunk_store) == 0:
+            raise ValueError("Chunk store is empty.")
+        if len(chunk_store) != faiss_index_obj.ntotal:
+            logger.warning(f"Chunk store record count ({len(chunk_store)}) does not match FAISS vector count ({faiss_index_obj.ntotal}).")
+
+        index_info = read_index_info(index_path)
+        logger.info(f"FAISS index type: {index_info.get('index_type', 'flat')}.")
+        rescorer = None
+        rescore_file = index_info.get("rescore_vectors")
+        if RESCORE_FACTOR > 1 and rescore_file and (storage_dir / rescore_file).exists():
+            rescorer = Rescorer(storage_dir / rescore_file, chunk_store, factor=RESCORE_FACTOR)
+            logger.info(f"Exact re-scoring enabled over {RESCORE_FACTOR}x candidates.")
+
+        # Nodes are materialized lazily for the top-k hits only
+        vector_index = ChunkStoreVectorIndex(
+            faiss_index_obj,
+            chunk_store,
+            rescorer=rescorer,
+            default_ef_search=DEFAULT_EF_SEARCH,
+            default_nprobe=DEFAULT_NPROBE,
+            faq_index=load_faq_index(storage_dir, chunk_store),
+        )
+    except Exception:
+        chunk_store.close()
+        raise
+    logger.info("ChunkStoreVectorIndex initialized over FAISS + chunk store.")
+    return vector_index
+
+
+def _open_serving_index() -> Union[ChunkStoreVectorIndex, ShardedVectorIndex]:
+    """The shard workers when VECTOR_SHARD_ADDRESSES is set, else the local index files."""
+    sharded_index = ShardedVectorIndex.from_env(default_ef_search=DEFAULT_EF_SEARCH, default_nprobe=DEFAULT_NPROBE)
+    return sharded_index if sharded_index is not None else open_vector_index()
+
+
+def check_vector_index(vector_index: ChunkStoreVectorIndex) -> None:
+    """FAISS and chunk store agree on the row count, and the dimension matches the embedder. Raises ValueError."""
+    chunk_store = vector_index.chunk_store
+    if vector_index.ntotal != len(chunk_store):
+        raise ValueError(f"FAISS index has {vector_index.ntotal} vectors but the chunk store has {len(chunk_store)} records.")
+    if vector_index.faiss_index.d != EMBEDDING_DIMENSION:
+        raise ValueError(f"FAISS index dimension {vector_index.faiss_index.d} does not match the embedder ({EMBEDDING_DIMENSION}).")
+
+
+def verify_vector_index(vector_index: Union[ChunkStoreVectorIndex, ShardedVectorIndex]) -> None:
+    """
+    Checks a freshly loaded index before it is swapped in: check_vector_index()
+    for a local index (the shard workers check their own), then a probe query
+    (the first chunk's own text) must retrieve a chunk end to end. Raises ValueError.
+    """
+    if isinstance(vector_index, ShardedVectorIndex):
+        if vector_index.dimension not in (None, EMBEDDING_DIMENSION):
+            raise ValueError(f"Shard dimension {vector_index.dimension} does not match the embedder ({EMBEDDING_DIMENSION}).")
+        probe = "symptoms and treatment"
     else:
-        logger.error(f"FAISS index file ({FAISS_INDEX_FILE_PATH}) or metadata file ({DOC_METADATA_FILE_PATH}) not found.")
-        vector_index = None
+        check_vector_index(vector_index)
+        probe = vector_index.chunk_store.record_at(0).get("text", "")[:500]
+    if not retrieve_chunks(vector_index, probe, top_k=1):
+        raise ValueError("Probe query returned no chunks.")
+
+
+def _on_vector_index_swap(vector_index: ChunkStoreVectorIndex) -> None:
+    """Drops everything built on the previous generation."""
+    query_engine_registry.swap_vector_index(vector_index)
+    if semantic_answer_cache is not None:
+        semantic_answer_cache.clear()
+    set_index_size("vector", vector_index.ntotal)
+    faq_index = getattr(vector_index, "faq_index", None)
+    set_index_size("faq", faq_index.faiss_index.ntotal if faq_index is not None else 0)
+    engine_status.set(VECTOR_INDEX, READY)
+
+
+# Current vector index generation; hot-reloaded when storage/ changes (see index_manager)
+vector_index_manager = IndexManager.from_env(
+    STORAGE_DIR,
+    _open_serving_index,
+    verifier=verify_vector_index,
+    heap_files=[FAISS_INDEX_FILE_PATH, STORAGE_DIR / FAQ_INDEX_FILENAME],
+)
+vector_index_manager.add_listener(_on_vector_index_swap)
+
+
+def _load_vector_index() -> Optional[ChunkStoreVectorIndex]:
+    """Startup load of the vector index as generation 1 of vector_index_manager."""
+    if not engine_status.is_ready(EMBEDDER):
+        engine_status.set(VECTOR_INDEX, FAILED, "embedding model unavailable")
+        return None
+
+    engine_status.set(VECTOR_INDEX, LOADING)
+    # Served even if verification would fail (count mismatches only warn), as before hot reload
+    vector_index = vector_index_manager.load("startup", verify=False)
+    if vector_index is None:
+        engine_status.set(VECTOR_INDEX, FAILED, "see logs for FAISS/metadata load errors")
+    return vector_index
+
+
+def _load_kg_index() -> Optional[KnowledgeGraphIndex]:
+    """Connects to Neo4j. Missing credentials disable the KG instead of failing it."""
+    engine_status.set(KG, LOADING)
+    kg_index = None
 
     # --- Connect to Neo4j (Graceful Failure Logic) ---
+    if env_flag("FAKE_NEO4J"):
+        try:
+            kg_index = build_fake_kg_index()
+            engine_status.set(KG, READY)
+            return kg_index
+        except Exception as e:
+            logger.error(f"Failed to build the fake KG index: {e}", exc_info=True)
+            engine_status.set(KG, FAILED, str(e))
+            return None
+
     logger.info("Attempting to connect to Neo4j...")
     try:
         neo4j_uri = os.getenv("NEO4J_URI")
@@ -158,12 +286,22 @@ def load_rag_engines() -> Tuple[Optional[VectorStoreIndex], Optional[KnowledgeGr
                 logger.warning(f"Neo4j connection verification failed: {conn_err}. KG index will be disabled.")
         else:
             logger.warning("Neo4j credentials missing. KG index disabled.")
+            engine_status.set(KG, DISABLED, "Neo4j credentials missing")
+            return None
     except ImportError:
         logger.error("neo4j package not installed.")
     except Exception as e:
         logger.error(f"Unexpected error during Neo4j setup: {e}", exc_info=True)
 
-    # --- Final Check & Return ---
+    if kg_index is not None:
+        engine_status.set(KG, READY)
+    else:
+        engine_status.set(KG, FAILED, "see logs for Neo4j errors")
+    return kg_index
+
+
+def _log_load_summary(vector_index, kg_index) -> None:
+    # --- Final Check ---
     if vector_index is None and kg_index is None:
         logger.error("CRITICAL: Both Vector Index and KG Index failed to load.")
     elif vector_index is None:
@@ -173,82 +311,515 @@ def load_rag_engines() -> Tuple[Optional[VectorStoreIndex], Optional[KnowledgeGr
     else:
         logger.info("RAG Engines Load Status: Both Vector and KG Indexes appear loaded.")
 
+
+def load_rag_engines() -> Tuple[Optional[ChunkStoreVectorIndex], Optional[KnowledgeGraphIndex]]:
+    """
+    Load RAG engines with Gemini LLM (synchronously, in the calling thread).
+    """
+    logger.info("Attempting to load RAG engines...")
+    _load_llm()
+    _load_embed_model()
+    vector_index = _load_vector_index()
+    kg_index = _load_kg_index()
+    _log_load_summary(vector_index, kg_index)
     return vector_index, kg_index
 
 
-def query_rag(vector_index: Optional[VectorStoreIndex], kg_index: Optional[KnowledgeGraphIndex], question: str) -> Tuple[str, List[Dict[str, str]]]:
+def start_background_load(
+    on_vector_index: Callable[[Optional[ChunkStoreVectorIndex]], None],
+    on_kg_index: Callable[[Optional[KnowledgeGraphIndex]], None],
+) -> List[threading.Thread]:
+    """
+    Loads the RAG engines in two daemon threads so the app can serve immediately:
+      - embedder -> vector index (CPU / disk bound)
+      - LLM -> KG index (network bound; the KG index resolves Settings.llm)
+    Each callback receives its index (or None) as soon as that chain finishes.
+    Progress is reported through engine_status.
+    """
+    def _vector_chain():
+        try:
+            _load_embed_model()
+            on_vector_index(_load_vector_index())
+        except Exception as e:
+            logger.error(f"Background vector index load crashed: {e}", exc_info=True)
+            for component in (EMBEDDER, VECTOR_INDEX):
+                if not engine_status.is_settled(component):
+                    engine_status.set(component, FAILED, str(e))
+
+    def _kg_chain():
+        try:
+            _load_llm()
+            on_kg_index(_load_kg_index())
+        except Exception as e:
+            logger.error(f"Background KG index load crashed: {e}", exc_info=True)
+            for component in (LLM, KG):
+                if not engine_status.is_settled(component):
+                    engine_status.set(component, FAILED, str(e))
+
+    threads = [
+        threading.Thread(target=_vector_chain, name="rag-loader-vector", daemon=True),
+        threading.Thread(target=_kg_chain, name="rag-loader-kg", daemon=True),
+    ]
+    for thread in threads:
+        thread.start()
+    logger.info("RAG engine loading started in background threads.")
+    return threads
+
+
+def _engine_config(top_k: Optional[int] = None, ef_search: Optional[int] = None, nprobe: Optional[int] = None) -> EngineConfig:
+    """Per-request retrieval knobs layered over the default engine configuration."""
+    return DEFAULT_ENGINE_CONFIG._replace(
+        top_k=top_k or DEFAULT_ENGINE_CONFIG.top_k,
+        ef_search=ef_search,
+        nprobe=nprobe,
+    )
+
+
+def _cache_variant(config: EngineConfig) -> EngineConfig:
+    """Semantic cache key part: answers are only reused under the retrieval settings that produced them."""
+    return config._replace(streaming=False)
+
+
+def _extract_sources(source_nodes) -> List[Dict[str, str]]:
+    """De-duplicated {name, url} for the source nodes of a response."""
+    sources_info = []
+    processed_urls = set()
+
+    if source_nodes:
+        logger.info(f"Processing {len(source_nodes)} source nodes...")
+        for scored_node in source_nodes:
+            node = scored_node.node
+            metadata = node.metadata or {}
+            src_name = metadata.get('name', f"Source ID: {node.node_id}")
+            src_url = metadata.get('url', '')
+            logger.debug(f"Source Node Metadata: {metadata}")
+            if src_url and src_url not in processed_urls:
+                sources_info.append({"name": src_name, "url": src_url})
+                processed_urls.add(src_url)
+            elif not src_url and src_name:
+                logger.debug(f"Source node missing URL: {src_name}")
+
+    logger.info(f"Extracted sources: {sources_info}")
+    return sources_info
+
+
+def _response_to_answer(response) -> Tuple[str, List[Dict[str, str]], bool]:
+    answer = str(response) if response else "Could not retrieve answer."
+    sources_info = _extract_sources(response.source_nodes if response else None)
+    return answer, sources_info, bool(response)
+
+
+def _faq_answer(vector_index, question: str, query_embedding: List[float]) -> Optional[Tuple[str, List[Dict[str, str]]]]:
+    """Curated (answer, sources) when the question matches a stored FAQ question closely enough."""
+    match = vector_index.faq_index.match(query_embedding)
+    if match is None:
+        return None
+    logger.info(f"FAQ fast path hit (similarity {match.score:.3f}, FAQ '{match.question}') for: '{question}'")
+    return match.answer, match.sources
+
+
+def _has_faq_index(vector_index) -> bool:
+    return getattr(vector_index, "faq_index", None) is not None
+
+
+class LLMSynthesisError(RuntimeError):
+    """The query engine failed while answering (LLM timeout, connection error, quota...)."""
+
+
+def _synthesis_failed(e: Exception, call: str = "rag_query") -> LLMSynthesisError:
+    record_llm_error(call)
+    logger.error(f"RAG synthesis failed: {e}", exc_info=True)
+    return LLMSynthesisError(str(e))
+
+
+def _query_rag(vector_index, kg_index, question: str, query_embedding: Optional[List[float]] = None,
+               config: EngineConfig = DEFAULT_ENGINE_CONFIG) -> Tuple[str, List[Dict[str, str]], bool]:
+    """
+    Runs the RAG query. Returns (answer, sources_info, ok); ok is False when
+    the answer is an error message that must not be cached. Raises
+    LLMSynthesisError when the query engine itself fails, so the caller can
+    answer retrieval-only.
+    """
+    if not vector_index and not kg_index:
+        logger.error("Query attempted but no RAG indexes are loaded.")
+        return "Error: The RAG system components are not available.", [], False
+
+    try:
+        if _has_faq_index(vector_index):
+            # The embedding is reused by the retriever when the fast path misses
+            if query_embedding is None:
+                query_embedding = _embed_question(question)
+            faq_hit = _faq_answer(vector_index, question, query_embedding)
+            if faq_hit is not None:
+                return faq_hit[0], faq_hit[1], True
+
+        # Engines are built once per (indexes, config) and reused across requests
+        query_engine = query_engine_registry.get(vector_index, kg_index, config)
+        if query_engine is None:
+            return "Error: No query tools created (Indexes failed?).", [], False
+
+        logger.info(f"Querying RAG system for: '{question}'")
+        # Passing the embedding along saves the retriever from embedding the question again
+        try:
+            with llm_cache_site(RAG_SITE):
+                response = query_engine.query(QueryBundle(query_str=question, embedding=query_embedding))
+        except Exception as e:
+            raise _synthesis_failed(e) from e
+        logger.info("RAG system query complete.")
+        return _response_to_answer(response)
+
+    except LLMSynthesisError:
+        raise
+    except Exception as e:
+        record_llm_error("rag_query")
+        logger.error(f"Error querying RAG system: {e}", exc_info=True)
+        return f"Sorry, an error occurred.", [], False
+
+
+def query_rag(vector_index: Optional[ChunkStoreVectorIndex], kg_index: Optional[KnowledgeGraphIndex], question: str,
+              top_k: Optional[int] = None, ef_search: Optional[int] = None, nprobe: Optional[int] = None) -> Tuple[str, List[Dict[str, str]]]:
     """
     Query the RAG system with a question using a Router.
     Handles cases where one or both indexes might be None.
+    top_k / ef_search / nprobe override the retrieval defaults for this call.
     Returns tuple of (answer, sources_info)
     """
+    config = _engine_config(top_k, ef_search, nprobe)
+    try:
+        answer, sources_info, _ok = _query_rag(vector_index, kg_index, question, config=config)
+    except LLMSynthesisError:
+        return "Sorry, an error occurred.", []
+    return answer, sources_info
+
+
+def _embed_question(question: str) -> List[float]:
+    with stage_timer(EMBED):
+        batcher = get_embedding_batcher()
+        if batcher is not None:
+            return batcher.embed(question, timeout=BATCH_RESULT_TIMEOUT).tolist()
+        return Settings.embed_model.get_query_embedding(question)
+
+
+def cached_query_rag(vector_index: Optional[ChunkStoreVectorIndex], kg_index: Optional[KnowledgeGraphIndex], question: str,
+                     top_k: Optional[int] = None, ef_search: Optional[int] = None, nprobe: Optional[int] = None,
+                     query_embedding: Optional[List[float]] = None) -> Tuple[str, List[Dict[str, str]]]:
+    """
+    query_rag() behind the semantic answer cache: near-duplicate questions
+    (cosine >= SEMANTIC_CACHE_THRESHOLD) reuse an earlier (answer, sources).
+    Skips the cache when it or the embedder is unavailable.
+    query_embedding skips embedding the question when the caller already has it.
+    Raises LLMSynthesisError when the query engine fails.
+    """
+    config = _engine_config(top_k, ef_search, nprobe)
+    if semantic_answer_cache is None or not engine_status.is_ready(EMBEDDER):
+        answer, sources_info, _ok = _query_rag(vector_index, kg_index, question, config=config)
+        return answer, sources_info
+
+    try:
+        if query_embedding is None:
+            query_embedding = _embed_question(question)
+    except Exception as e:
+        logger.error(f"Failed to embed question for semantic cache: {e}", exc_info=True)
+        answer, sources_info, _ok = _query_rag(vector_index, kg_index, question, config=config)
+        return answer, sources_info
+
+    cached = semantic_answer_cache.lookup(query_embedding, _cache_variant(config))
+    if cached is not None:
+        answer, sources_info, similarity = cached
+        logger.info(f"Semantic cache hit (similarity {similarity:.3f}) for: '{question}'")
+        return answer, sources_info
+
+    answer, sources_info, ok = _query_rag(vector_index, kg_index, question, query_embedding=query_embedding, config=config)
+    if ok:
+        semantic_answer_cache.store(question, query_embedding, answer, sources_info, _cache_variant(config))
+    return answer, sources_info
+
+
+def stream_query_rag(vector_index: Optional[ChunkStoreVectorIndex], kg_index: Optional[KnowledgeGraphIndex], question: str,
+                     top_k: Optional[int] = None, ef_search: Optional[int] = None, nprobe: Optional[int] = None,
+                     query_embedding: Optional[List[float]] = None) -> Iterator[Tuple[str, Any]]:
+    """
+    Streaming variant of cached_query_rag(). Yields ("sources", sources_info)
+    once retrieval is done, then ("token", text) deltas as the LLM produces
+    them. Semantic cache hits are yielded as a single token; complete
+    answers are stored in the cache once the stream finishes. Raises
+    LLMSynthesisError when the query engine fails before the first token;
+    the caller then answers retrieval-only (retrieval_fallback_events()).
+    """
     if not vector_index and not kg_index:
         logger.error("Query attempted but no RAG indexes are loaded.")
-        return "Error: The RAG system components are not available.", []
+        yield "sources", []
+        yield "token", "Error: The RAG system components are not available."
+        return
 
-    try:
-        query_engine_tools = []
+    config = _engine_config(top_k, ef_search, nprobe)._replace(streaming=True)
+    use_cache = semantic_answer_cache is not None and engine_status.is_ready(EMBEDDER)
+    if use_cache and query_embedding is None:
+        try:
+            query_embedding = _embed_question(question)
+        except Exception as e:
+            logger.error(f"Failed to embed question for semantic cache: {e}", exc_info=True)
+            use_cache = False
+
+    if use_cache:
+        cached = semantic_answer_cache.lookup(query_embedding, _cache_variant(config))
+        if cached is not None:
+            answer, sources_info, similarity = cached
+            logger.info(f"Semantic cache hit (similarity {similarity:.3f}) for: '{question}'")
+            yield "sources", sources_info
+            yield "token", answer
+            return
 
-        if vector_index:
-            vector_tool = QueryEngineTool.from_defaults(
-                query_engine=vector_index.as_query_engine(similarity_top_k=5),
-                name="VectorLookupTool",
-                description="Use for simple lookups, definitions, FAQs, symptoms, causes, treatments, or overviews."
-            )
-            query_engine_tools.append(vector_tool)
-            logger.info("Vector Tool created.")
-
-        if kg_index:
-            kg_tool = QueryEngineTool.from_defaults(
-                query_engine=kg_index.as_query_engine(include_text=False, response_mode="tree_summarize"),
-                name="KnowledgeGraphTool",
-                description="Use ONLY for complex questions about relationships."
-            )
-            query_engine_tools.append(kg_tool)
-            logger.info("KG Tool created.")
+    try:
+        if _has_faq_index(vector_index):
+            if query_embedding is None:
+                query_embedding = _embed_question(question)
+            faq_hit = _faq_answer(vector_index, question, query_embedding)
+            if faq_hit is not None:
+                yield "sources", faq_hit[1]
+                yield "token", faq_hit[0]
+                return
+        query_engine = query_engine_registry.get(vector_index, kg_index, config)
+        if query_engine is None:
+            yield "sources", []
+            yield "token", "Error: No query tools created (Indexes failed?)."
+            return
+        logger.info(f"Streaming RAG query for: '{question}'")
+        try:
+            with llm_cache_site(RAG_SITE):
+                response = query_engine.query(QueryBundle(query_str=question, embedding=query_embedding))
+        except Exception as e:
+            raise _synthesis_failed(e) from e
+    except LLMSynthesisError:
+        raise
+    except Exception as e:
+        record_llm_error("rag_query")
+        logger.error(f"Error querying RAG system: {e}", exc_info=True)
+        yield "sources", []
+        yield "token", "Sorry, an error occurred."
+        return
 
-        if not query_engine_tools:
-            return "Error: No query tools created (Indexes failed?).", []
+    sources_info = _extract_sources(getattr(response, "source_nodes", None))
+    yield "sources", sources_info
 
-        if len(query_engine_tools) == 1:
-            logger.info(f"Using single tool engine: {query_engine_tools[0].metadata.name}")
-            query_engine = query_engine_tools[0].query_engine
+    parts = []
+    try:
+        response_gen = getattr(response, "response_gen", None)
+        if response_gen is None:
+            # Engines that can't stream (e.g. empty retrieval) return a plain Response
+            parts.append(str(response) if response else "Could not retrieve answer.")
+            yield "token", parts[-1]
         else:
-            logger.info("Creating RouterQueryEngine...")
-            query_engine = RouterQueryEngine.from_defaults(
-                query_engine_tools=query_engine_tools,
-                select_multi=False
-            )
-            logger.info("RouterQueryEngine created.")
+            # The LLM call runs as the generator is drained, so this is the streamed synthesis time
+            with stage_timer(SYNTHESIS):
+                for delta in response_gen:
+                    if delta:
+                        parts.append(delta)
+                        yield "token", delta
+    except Exception as e:
+        if not parts:
+            # Only the sources went out; the caller's retrieval-only events supersede them
+            raise _synthesis_failed(e, "rag_stream") from e
+        record_llm_error("rag_stream")
+        logger.error(f"Error while streaming RAG answer: {e}", exc_info=True)
+        yield "token", " Sorry, an error occurred."
+        return
+
+    logger.info("RAG system streaming query complete.")
+    if use_cache and parts:
+        semantic_answer_cache.store(question, query_embedding, "".join(parts), sources_info, _cache_variant(config))
+
+
+# --- Retrieval-only mode (no LLM call) ---
+LLM_ERROR = "llm_error"  # fallback_reason when synthesis raised LLMSynthesisError
+RETRIEVAL_FALLBACK_ANSWER = (
+    "The AI service is unavailable right now, so no answer was generated. "
+    "The most relevant passages from our sources are listed below."
+)
 
-        logger.info(f"Querying RAG system for: '{question}'")
-        response = query_engine.query(question)
+
+class LLMBudget:
+    """Caps concurrent RAG synthesis calls; requests over the cap are served retrieval-only."""
+
+    def __init__(self, max_in_flight: int = 0):
+        self.max_in_flight = max_in_flight  # 0 = unlimited
+        self.in_flight = 0
+        self.rejected = 0
+        self._lock = threading.Lock()
+
+    def try_acquire(self) -> bool:
+        with self._lock:
+            if self.max_in_flight > 0 and self.in_flight >= self.max_in_flight:
+                self.rejected += 1
+                return False
+            self.in_flight += 1
+            return True
+
+    def release(self) -> None:
+        with self._lock:
+            self.in_flight -= 1
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            return {"max_in_flight": self.max_in_flight, "in_flight": self.in_flight, "rejected": self.rejected}
+
+
+rag_llm_budget = LLMBudget(int(os.getenv("RAG_LLM_MAX_IN_FLIGHT", "0")))
+
+
+@contextmanager
+def llm_synthesis_slot():
+    """
+    Yields None when the caller may run LLM synthesis (holding one budget
+    slot until the block exits), else the reason to answer retrieval-only:
+    'llm_unavailable' or 'llm_over_budget'. A synthesis that then fails
+    (LLMSynthesisError) is answered retrieval-only too, as LLM_ERROR.
+    """
+    if not engine_status.is_ready(LLM):
+        record_fallback("llm_unavailable")
+        yield "llm_unavailable"
+        return
+    if not rag_llm_budget.try_acquire():
+        logger.warning(f"RAG LLM budget exhausted ({rag_llm_budget.max_in_flight} in flight); serving retrieval-only.")
+        record_fallback("llm_over_budget")
+        yield "llm_over_budget"
+        return
+    try:
+        yield None
+    finally:
+        rag_llm_budget.release()
+
+
+def retrieval_fallback_events(vector_index, question: str, top_k: Optional[int] = None, ef_search: Optional[int] = None,
+                              nprobe: Optional[int] = None) -> Iterator[Tuple[str, Any]]:
+    """Stream events of a retrieval-only answer: sources, the chunks, then the fallback notice as the only token."""
+    chunks = retrieve_chunks(vector_index, question, top_k=top_k, ef_search=ef_search, nprobe=nprobe)
+    yield "sources", chunk_sources(chunks)
+    yield "chunks", chunks
+    yield "token", RETRIEVAL_FALLBACK_ANSWER
+
+
+def _chunk_from_record(record: Dict[str, Any], score: float) -> Dict[str, Any]:
+    metadata = record.get("metadata") or {}
+    return {
+        "text": record.get("text", ""),
+        "doc_id": str(record.get("doc_id", "")),
+        "entity_type": metadata.get("entity_type"),
+        "type": metadata.get("type"),
+        "score": score,
+        "name": metadata.get("name"),
+        "url": metadata.get("url"),
+    }
+
+
+def chunk_sources(chunks: List[Dict[str, Any]]) -> List[Dict[str, str]]:
+    """De-duplicated {name, url} for retrieved chunks, like _extract_sources()."""
+    sources_info = []
+    processed_urls = set()
+    for chunk in chunks:
+        if chunk["url"] and chunk["url"] not in processed_urls:
+            sources_info.append({"name": chunk["name"] or chunk["doc_id"], "url": chunk["url"]})
+            processed_urls.add(chunk["url"])
+    return sources_info
+
+
+def retrieve_chunks(vector_index: Optional[ChunkStoreVectorIndex], question: str, top_k: Optional[int] = None,
+                    ef_search: Optional[int] = None, nprobe: Optional[int] = None,
+                    query_embedding: Optional[List[float]] = None) -> List[Dict[str, Any]]:
+    """
+    Top-k chunks for the question straight from FAISS and the chunk store,
+    without LLM synthesis (the KG index needs the LLM for keyword
+    extraction, so only the vector index is searched).
+    """
+    if not vector_index:
+        logger.error("Retrieval attempted but the vector index is not loaded.")
+        return []
+    start = time.perf_counter()
+    if query_embedding is None:
+        query_embedding = _embed_question(question)
+    retriever = vector_index.as_retriever(
+        similarity_top_k=top_k or DEFAULT_ENGINE_CONFIG.top_k, ef_search=ef_search, nprobe=nprobe
+    )
+    hits = retriever.retrieve_records(QueryBundle(query_str=question, embedding=query_embedding))
+    chunks = [_chunk_from_record(record, score) for record, score in hits]
+    logger.info(f"Retrieval-only query returned {len(chunks)} chunks in {(time.perf_counter() - start) * 1000:.1f} ms.")
+    return chunks
+
+
+# --- Async variants (ASGI serving mode, see app/asgi.py) ---
+async def _aembed_question(question: str) -> List[float]:
+    with stage_timer(EMBED):
+        batcher = get_embedding_batcher()
+        if batcher is not None:
+            # Await the batcher's Future instead of blocking a thread on it
+            vector = await asyncio.wrap_future(batcher.submit(text=question))
+            return vector.tolist()
+        return await Settings.embed_model.aget_query_embedding(question)
+
+
+async def _aquery_rag(vector_index, kg_index, question: str, query_embedding: Optional[List[float]] = None,
+                      config: EngineConfig = DEFAULT_ENGINE_CONFIG) -> Tuple[str, List[Dict[str, str]], bool]:
+    """Async _query_rag(): the router selection and synthesis LLM calls are awaited (aquery)."""
+    if not vector_index and not kg_index:
+        logger.error("Query attempted but no RAG indexes are loaded.")
+        return "Error: The RAG system components are not available.", [], False
+
+    try:
+        if _has_faq_index(vector_index):
+            if query_embedding is None:
+                query_embedding = await _aembed_question(question)
+            faq_hit = _faq_answer(vector_index, question, query_embedding)
+            if faq_hit is not None:
+                return faq_hit[0], faq_hit[1], True
+
+        query_engine = query_engine_registry.get(vector_index, kg_index, config)
+        if query_engine is None:
+            return "Error: No query tools created (Indexes failed?).", [], False
+
+        logger.info(f"Querying RAG system (async) for: '{question}'")
+        try:
+            with llm_cache_site(RAG_SITE):
+                response = await query_engine.aquery(QueryBundle(query_str=question, embedding=query_embedding))
+        except Exception as e:
+            raise _synthesis_failed(e) from e
         logger.info("RAG system query complete.")
+        return _response_to_answer(response)
 
-        answer = str(response) if response else "Could not retrieve answer."
-        sources_info = []
-        processed_urls = set()
-
-        if response and response.source_nodes:
-            logger.info(f"Processing {len(response.source_nodes)} source nodes...")
-            for scored_node in response.source_nodes:
-                node = scored_node.node
-                metadata = node.metadata or {}
-                src_name = metadata.get('name', f"Source ID: {node.node_id}")
-                src_url = metadata.get('url', '')
-                logger.debug(f"Source Node Metadata: {metadata}")
-                if src_url and src_url not in processed_urls:
-                    sources_info.append({"name": src_name, "url": src_url})
-                    processed_urls.add(src_url)
-                elif not src_url and src_name:
-                    logger.debug(f"Source node missing URL: {src_name}")
-
-        logger.info(f"Extracted sources: {sources_info}")
+    except LLMSynthesisError:
+        raise
+    except Exception as e:
+        record_llm_error("rag_query")
+        logger.error(f"Error querying RAG system: {e}", exc_info=True)
+        return f"Sorry, an error occurred.", [], False
+
+
+async def aquery_rag(vector_index: Optional[ChunkStoreVectorIndex], kg_index: Optional[KnowledgeGraphIndex], question: str,
+                     top_k: Optional[int] = None, ef_search: Optional[int] = None, nprobe: Optional[int] = None,
+                     query_embedding: Optional[List[float]] = None) -> Tuple[str, List[Dict[str, str]]]:
+    """Async cached_query_rag(): same semantic cache, non-blocking LLM calls. Raises LLMSynthesisError likewise."""
+    config = _engine_config(top_k, ef_search, nprobe)
+    if semantic_answer_cache is None or not engine_status.is_ready(EMBEDDER):
+        answer, sources_info, _ok = await _aquery_rag(vector_index, kg_index, question, config=config)
         return answer, sources_info
 
+    try:
+        if query_embedding is None:
+            query_embedding = await _aembed_question(question)
     except Exception as e:
-        logger.error(f"Error querying RAG system: {e}", exc_info=True)
-        return f"Sorry, an error occurred.", []
+        logger.error(f"Failed to embed question for semantic cache: {e}", exc_info=True)
+        answer, sources_info, _ok = await _aquery_rag(vector_index, kg_index, question, config=config)
+        return answer, sources_info
+
+    cached = semantic_answer_cache.lookup(query_embedding, _cache_variant(config))
+    if cached is not None:
+        answer, sources_info, similarity = cached
+        logger.info(f"Semantic cache hit (similarity {similarity:.3f}) for: '{question}'")
+        return answer, sources_info
+
+    answer, sources_info, ok = await _aquery_rag(vector_index, kg_index, question, query_embedding=query_embedding, config=config)
+    if ok:
+        semantic_answer_cache.store(question, query_embedding, answer, sources_info, _cache_variant(config))
+    return answer, sources_info
 
 
 # --- Placeholder functions (for chat_service.py) ---
@@ -256,7 +827,6 @@ def handle_chat_message(user_id, message, history, session_id):
     logger.warning("Placeholder handle_chat_message called. Implement real logic.")
     
     from flask import current_app
-    vector_index = current_app.config.get('VECTOR_INDEX')
     kg_index = current_app.config.get('KG_INDEX')
     
     if len(message.split()) < 3 or any(w in message.lower() for w in ['hi', 'hello', 'hey']):
@@ -264,7 +834,8 @@ def handle_chat_message(user_id, message, history, session_id):
         sources = []
         chat_type = "SYMPTOM"
     else:
-        answer, sources = query_rag(vector_index, kg_index, message)
+        with vector_index_manager.lease() as vector_index:
+            answer, sources = query_rag(vector_index, kg_index, message)
         chat_type = "RAG"
 
     if not session_id:
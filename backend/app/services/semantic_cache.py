@@ -0,0 +1,195 @@
+"""
+Semantic answer cache in front of query_rag().
+
+Questions are keyed by their embedding: a lookup returns the cached
+(answer, sources) of the most similar earlier question if its cosine
+similarity clears the threshold. Each entry also carries a variant (the
+retrieval configuration that produced it), and only entries of the same
+variant can answer a lookup. Entries expire by TTL, the cache is LRU
+bounded, and everything is dropped when the FAISS index or chunk store
+files change on disk.
+"""
+import os
+import time
+import logging
+import threading
+from collections import OrderedDict
+from pathlib import Path
+from typing import Any, Dict, Hashable, Iterable, List, Optional, Tuple
+
+import numpy as np
+
+from app.services.metrics import record_cache
+
+logger = logging.getLogger(__name__)
+
+# How often (seconds) the index files are re-stat'ed for invalidation
+FINGERPRINT_CHECK_INTERVAL = 2.0
+
+
+class _CacheEntry:
+    __slots__ = ("question", "embedding", "answer", "sources", "variant", "created_at")
+
+    def __init__(self, question: str, embedding: np.ndarray, answer: str, sources: List[Dict[str, str]],
+                 variant: Hashable = None):
+        self.question = question
+        self.embedding = embedding
+        self.answer = answer
+        self.sources = sources
+        self.variant = variant
+        self.created_at = time.monotonic()
+
+
+class SemanticAnswerCache:
+    """Thread-safe LRU + TTL cache of RAG answers keyed by question embedding."""
+
+    def __init__(
+        self,
+        threshold: float = 0.92,
+        max_entries: int = 1024,
+        ttl_seconds: float = 3600.0,
+        watched_paths: Iterable[Path] = (),
+    ):
+        self.threshold = threshold
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self._watched_paths = [Path(p) for p in watched_paths]
+
+        self._lock = threading.Lock()
+        self._entries: "OrderedDict[int, _CacheEntry]" = OrderedDict()
+        self._next_key = 0
+        # Stacked embeddings per variant, rebuilt lazily after inserts/evictions
+        self._matrices: Dict[Hashable, Tuple[np.ndarray, List[int]]] = {}
+
+        self._fingerprint = self._compute_fingerprint()
+        self._fingerprint_checked_at = time.monotonic()
+
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+
+    # --- Invalidation ---
+    def _compute_fingerprint(self) -> Tuple:
+        parts = []
+        for path in self._watched_paths:
+            try:
+                stat = path.stat()
+                parts.append((str(path), stat.st_mtime_ns, stat.st_size))
+            except OSError:
+                parts.append((str(path), None, None))
+        return tuple(parts)
+
+    def _check_fingerprint_locked(self) -> None:
+        now = time.monotonic()
+        if now - self._fingerprint_checked_at < FINGERPRINT_CHECK_INTERVAL:
+            return
+        self._fingerprint_checked_at = now
+        fingerprint = self._compute_fingerprint()
+        if fingerprint != self._fingerprint:
+            logger.info("Index files changed on disk; clearing semantic answer cache.")
+            self._fingerprint = fingerprint
+            self._clear_locked()
+            self.invalidations += 1
+
+    def _clear_locked(self) -> None:
+        self._entries.clear()
+        self._matrices = {}
+
+    def clear(self) -> None:
+        with self._lock:
+            self._clear_locked()
+            self.invalidations += 1
+
+    # --- Lookup / store ---
+    def _expire_locked(self) -> None:
+        if self.ttl_seconds <= 0:
+            return
+        cutoff = time.monotonic() - self.ttl_seconds
+        expired = [key for key, entry in self._entries.items() if entry.created_at < cutoff]
+        for key in expired:
+            del self._entries[key]
+            self.evictions += 1
+        if expired:
+            self._matrices = {}
+
+    def _matrix_locked(self, variant: Hashable) -> Optional[Tuple[np.ndarray, List[int]]]:
+        if variant not in self._matrices:
+            keys = [key for key, entry in self._entries.items() if entry.variant == variant]
+            if not keys:
+                return None
+            self._matrices[variant] = (np.stack([self._entries[key].embedding for key in keys]), keys)
+        return self._matrices[variant]
+
+    @staticmethod
+    def _normalize(embedding: Any) -> np.ndarray:
+        vector = np.asarray(embedding, dtype="float32").ravel()
+        norm = np.linalg.norm(vector)
+        return vector / norm if norm > 0 else vector
+
+    def lookup(self, embedding: Any, variant: Hashable = None) -> Optional[Tuple[str, List[Dict[str, str]], float]]:
+        """Returns (answer, sources, similarity) for the closest cached question of this variant, or None."""
+        query = self._normalize(embedding)
+        with self._lock:
+            self._check_fingerprint_locked()
+            self._expire_locked()
+            stacked = self._matrix_locked(variant)
+            if stacked is None:
+                self.misses += 1
+                record_cache("semantic", False)
+                return None
+
+            matrix, matrix_keys = stacked
+            similarities = matrix @ query
+            best = int(np.argmax(similarities))
+            similarity = float(similarities[best])
+            if similarity < self.threshold:
+                self.misses += 1
+                record_cache("semantic", False)
+                return None
+
+            key = matrix_keys[best]
+            entry = self._entries[key]
+            self._entries.move_to_end(key)  # LRU touch
+            self.hits += 1
+            record_cache("semantic", True)
+            return entry.answer, list(entry.sources), similarity
+
+    def store(self, question: str, embedding: Any, answer: str, sources: List[Dict[str, str]],
+              variant: Hashable = None) -> None:
+        entry = _CacheEntry(question, self._normalize(embedding), answer, list(sources), variant)
+        with self._lock:
+            self._entries[self._next_key] = entry
+            self._next_key += 1
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+            self._matrices = {}
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "entries": len(self._entries),
+                "max_entries": self.max_entries,
+                "threshold": self.threshold,
+                "ttl_seconds": self.ttl_seconds,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": (self.hits / lookups) if lookups else 0.0,
+                "evictions": self.evictions,
+                "invalidations": self.invalidations,
+            }
+
+
+def cache_from_env(watched_paths: Iterable[Path]) -> Optional[SemanticAnswerCache]:
+    """Builds the cache from SEMANTIC_CACHE_* env vars, or None if disabled."""
+    if os.getenv("SEMANTIC_CACHE_ENABLED", "true").lower() not in ("1", "true", "yes"):
+        logger.info("Semantic answer cache disabled (SEMANTIC_CACHE_ENABLED).")
+        return None
+    return SemanticAnswerCache(
+        threshold=float(os.getenv("SEMANTIC_CACHE_THRESHOLD", "0.92")),
+        max_entries=int(os.getenv("SEMANTIC_CACHE_MAX_ENTRIES", "1024")),
+        ttl_seconds=float(os.getenv("SEMANTIC_CACHE_TTL_SECONDS", "3600")),
+        watched_paths=watched_paths,
+    )
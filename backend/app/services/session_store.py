@@ -0,0 +1,272 @@
+"""
+Server-side chat history keyed by session_id.
+
+Clients used to re-send the whole conversation on every turn. With a session
+store they send only the new message (plus the session_id returned by the
+first turn); the server appends each turn and /api/chat/report can be asked
+for a session_id alone. Sending `history` still works and takes precedence.
+
+  SESSION_STORE            memory (default, per worker) | sqlite (shared by
+                           all workers on the host) | none
+  SESSION_TTL_SECONDS      idle time before a session is evicted (default 24h)
+  SESSION_STORE_PATH       SQLite file (default var/sessions.sqlite3)
+  SESSION_MAX_MESSAGES     messages kept per session (oldest dropped)
+
+With more than one worker process SESSION_STORE=sqlite is required: each
+worker has its own memory store, so a session would only be known to the
+worker that happened to serve its first turn. gunicorn.conf.py defaults to
+sqlite when GUNICORN_WORKERS > 1; set it yourself for `uvicorn --workers N`.
+A session_id the store does not know (and sent without `history`) gets a
+404 from /api/chat/message and /api/chat/report rather than an empty
+conversation.
+"""
+import os
+import abc
+import time
+import sqlite3
+import logging
+import threading
+from collections import OrderedDict
+from pathlib import Path
+from typing import Dict, List, Optional, Sequence
+
+from app.models import ChatMessage
+
+logger = logging.getLogger(__name__)
+
+# Runtime state lives in var/, not storage/: the index watcher must not see it change
+DEFAULT_SESSION_STORE_PATH = Path(__file__).resolve().parent.parent.parent / "var" / "sessions.sqlite3"
+
+
+class SessionStore(abc.ABC):
+    """Append-only message log per session, with idle-time (TTL) eviction."""
+
+    @abc.abstractmethod
+    def get(self, session_id: str) -> Optional[List[ChatMessage]]:
+        """The session's messages in order, or None if it is unknown or expired."""
+
+    @abc.abstractmethod
+    def append(self, session_id: str, messages: Sequence[ChatMessage]) -> None:
+        """Adds messages to the session, creating it (or restarting it if expired)."""
+
+    @abc.abstractmethod
+    def delete(self, session_id: str) -> None:
+        """Forgets the session; unknown ids are ignored."""
+
+    @abc.abstractmethod
+    def evict_expired(self) -> int:
+        """Drops idle sessions; returns how many were removed."""
+
+    @abc.abstractmethod
+    def stats(self) -> Dict[str, int]:
+        """Counts of stored sessions and messages."""
+
+
+class InMemorySessionStore(SessionStore):
+    """Per-process store; fine for a single worker or sticky sessions."""
+
+    def __init__(self, ttl_seconds: float = 86400, max_sessions: int = 10000, max_messages: int = 200):
+        self.ttl_seconds = ttl_seconds
+        self.max_sessions = max_sessions
+        self.max_messages = max_messages
+        self._lock = threading.Lock()
+        # session_id -> (last_access, messages); ordered oldest access first
+        self._sessions: "OrderedDict[str, tuple]" = OrderedDict()
+
+    def _expired(self, last_access: float, now: float) -> bool:
+        return now - last_access > self.ttl_seconds
+
+    def get(self, session_id: str) -> Optional[List[ChatMessage]]:
+        now = time.time()
+        with self._lock:
+            entry = self._sessions.get(session_id)
+            if entry is None:
+                return None
+            if self._expired(entry[0], now):
+                del self._sessions[session_id]
+                return None
+            self._sessions[session_id] = (now, entry[1])
+            self._sessions.move_to_end(session_id)
+            return list(entry[1])
+
+    def append(self, session_id: str, messages: Sequence[ChatMessage]) -> None:
+        now = time.time()
+        with self._lock:
+            entry = self._sessions.pop(session_id, None)
+            history = entry[1] if entry is not None and not self._expired(entry[0], now) else []
+            history = (history + list(messages))[-self.max_messages:]
+            self._sessions[session_id] = (now, history)
+            while len(self._sessions) > self.max_sessions:
+                self._sessions.popitem(last=False)
+
+    def delete(self, session_id: str) -> None:
+        with self._lock:
+            self._sessions.pop(session_id, None)
+
+    def evict_expired(self) -> int:
+        now = time.time()
+        with self._lock:
+            expired = [sid for sid, (last_access, _) in self._sessions.items() if self._expired(last_access, now)]
+            for sid in expired:
+                del self._sessions[sid]
+        return len(expired)
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            return {"sessions": len(self._sessions), "messages": sum(len(m) for _, m in self._sessions.values())}
+
+
+class SQLiteSessionStore(SessionStore):
+    """Shared store in a SQLite file (WAL); every worker on the host sees the same sessions."""
+
+    EVICT_EVERY = 200  # Expired sessions are purged every N appends
+
+    def __init__(self, path: Path = DEFAULT_SESSION_STORE_PATH, ttl_seconds: float = 86400, max_messages: int = 200):
+        self.path = Path(path)
+        self.ttl_seconds = ttl_seconds
+        self.max_messages = max_messages
+        self._local = threading.local()
+        self._appends = 0
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        conn = self._connect()
+        conn.execute("CREATE TABLE IF NOT EXISTS sessions (session_id TEXT PRIMARY KEY, updated_at REAL NOT NULL)")
+        conn.execute(
+            "CREATE TABLE IF NOT EXISTS session_messages ("
+            " id INTEGER PRIMARY KEY AUTOINCREMENT, session_id TEXT NOT NULL,"
+            " role TEXT NOT NULL, content TEXT NOT NULL)"
+        )
+        conn.execute("CREATE INDEX IF NOT EXISTS session_messages_sid ON session_messages (session_id, id)")
+        conn.execute("CREATE INDEX IF NOT EXISTS sessions_updated ON sessions (updated_at)")
+
+    def _connect(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(str(self.path), timeout=5.0, isolation_level=None, check_same_thread=False)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    def get(self, session_id: str) -> Optional[List[ChatMessage]]:
+        conn = self._connect()
+        now = time.time()
+        row = conn.execute("SELECT updated_at FROM sessions WHERE session_id = ?", (session_id,)).fetchone()
+        if row is None or now - row[0] > self.ttl_seconds:
+            return None
+        conn.execute("UPDATE sessions SET updated_at = ? WHERE session_id = ?", (now, session_id))
+        rows = conn.execute(
+            "SELECT role, content FROM session_messages WHERE session_id = ? ORDER BY id DESC LIMIT ?",
+            (session_id, self.max_messages),
+        ).fetchall()
+        return [ChatMessage(role=role, content=content) for role, content in reversed(rows)]
+
+    def append(self, session_id: str, messages: Sequence[ChatMessage]) -> None:
+        conn = self._connect()
+        now = time.time()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            row = conn.execute("SELECT updated_at FROM sessions WHERE session_id = ?", (session_id,)).fetchone()
+            if row is not None and now - row[0] > self.ttl_seconds:
+                # Expired: start over rather than extend a stale conversation
+                conn.execute("DELETE FROM session_messages WHERE session_id = ?", (session_id,))
+            conn.execute(
+                "INSERT INTO sessions (session_id, updated_at) VALUES (?, ?)"
+                " ON CONFLICT(session_id) DO UPDATE SET updated_at = excluded.updated_at",
+                (session_id, now),
+            )
+            conn.executemany(
+                "INSERT INTO session_messages (session_id, role, content) VALUES (?, ?, ?)",
+                [(session_id, message.role, message.content) for message in messages],
+            )
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+        self._appends += 1
+        if self._appends % self.EVICT_EVERY == 0:
+            self.evict_expired()
+
+    def delete(self, session_id: str) -> None:
+        conn = self._connect()
+        conn.execute("DELETE FROM session_messages WHERE session_id = ?", (session_id,))
+        conn.execute("DELETE FROM sessions WHERE session_id = ?", (session_id,))
+
+    def evict_expired(self) -> int:
+        conn = self._connect()
+        cutoff = time.time() - self.ttl_seconds
+        conn.execute(
+            "DELETE FROM session_messages WHERE session_id IN (SELECT session_id FROM sessions WHERE updated_at < ?)",
+            (cutoff,),
+        )
+        removed = conn.execute("DELETE FROM sessions WHERE updated_at < ?", (cutoff,)).rowcount
+        if removed:
+            logger.info(f"Evicted {removed} expired chat sessions.")
+        return removed
+
+    def stats(self) -> Dict[str, int]:
+        conn = self._connect()
+        return {
+            "sessions": conn.execute("SELECT COUNT(*) FROM sessions").fetchone()[0],
+            "messages": conn.execute("SELECT COUNT(*) FROM session_messages").fetchone()[0],
+        }
+
+
+def session_store_from_env() -> Optional[SessionStore]:
+    kind = os.getenv("SESSION_STORE", "memory").lower()
+    ttl_seconds = float(os.getenv("SESSION_TTL_SECONDS", "86400"))
+    max_messages = int(os.getenv("SESSION_MAX_MESSAGES", "200"))
+    if kind in ("none", "off", "false"):
+        logger.info("Server-side session store disabled; clients must send the full history.")
+        return None
+    if kind == "sqlite":
+        path = Path(os.getenv("SESSION_STORE_PATH", str(DEFAULT_SESSION_STORE_PATH)))
+        logger.info(f"Using SQLite session store at {path} (ttl={ttl_seconds}s).")
+        return SQLiteSessionStore(path, ttl_seconds=ttl_seconds, max_messages=max_messages)
+    logger.info(f"Using in-memory session store (ttl={ttl_seconds}s).")
+    return InMemorySessionStore(ttl_seconds=ttl_seconds, max_messages=max_messages)
+
+
+# Process-wide store (None when SESSION_STORE=none)
+session_store = session_store_from_env()
+
+
+def resolve_history(session_id: Optional[str], history: Optional[List[ChatMessage]]) -> List[ChatMessage]:
+    """The client's history when it sent one (compatibility mode), else the stored session."""
+    if history is not None:
+        return history
+    if session_id and session_store is not None:
+        return session_store.get(session_id) or []
+    return []
+
+
+def unknown_session(session_id: Optional[str], history: Optional[List[ChatMessage]]) -> bool:
+    """
+    True for a chat turn that names a session_id, sends no history, and whose
+    session the store does not have (expired, evicted, never created, or held
+    by another worker's memory store). Such a turn must not silently start over.
+    """
+    return history is None and bool(session_id) and session_history(session_id) is None
+
+
+def session_history(session_id: Optional[str]) -> Optional[List[ChatMessage]]:
+    """Stored messages for a report request, or None if the session is unknown (or storage is off)."""
+    if not session_id or session_store is None:
+        return None
+    return session_store.get(session_id)
+
+
+def record_turn(session_id: str, history: Optional[List[ChatMessage]], message: str, answer: str) -> None:
+    """
+    Appends the user message and the answer to the session. A client in
+    full-history mode seeds an empty session with its history first, so it
+    can switch to sending only new messages (or ask for a report) later.
+    """
+    if session_store is None:
+        return
+    try:
+        turn = [ChatMessage(role="user", content=message), ChatMessage(role="assistant", content=answer)]
+        if history and session_store.get(session_id) is None:
+            turn = list(history) + turn
+        session_store.append(session_id, turn)
+    except Exception as e:
+        logger.error(f"Failed to record chat turn for session {session_id}: {e}", exc_info=True)
@@ -0,0 +1,46 @@
+"""
+Server-Sent Events helpers for the chat and RAG routes.
+
+Services yield (event, data) tuples; the routes wrap them in a
+text/event-stream response when the client asks for streaming, either
+with "Accept: text/event-stream" or "stream": true in the JSON body.
+"""
+import json
+import logging
+from typing import Any, Dict, Iterable, Iterator, Optional, Tuple
+
+from flask import Response, request, stream_with_context
+
+logger = logging.getLogger(__name__)
+
+EVENT_STREAM_MIMETYPE = "text/event-stream"
+
+
+def wants_stream(data: Optional[Dict[str, Any]] = None) -> bool:
+    """True when the request negotiated a streaming response."""
+    if data and data.get("stream") is not None:
+        return bool(data.get("stream"))
+    # Only an explicit text/event-stream counts; */* keeps the JSON response
+    return any(mimetype == EVENT_STREAM_MIMETYPE and quality > 0 for mimetype, quality in request.accept_mimetypes)
+
+
+def format_sse(event: str, data: Any) -> str:
+    """One SSE frame; data is JSON encoded so tokens with newlines stay intact."""
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+
+def sse_response(events: Iterable[Tuple[str, Any]]) -> Response:
+    """Streams (event, data) tuples as SSE, keeping the request/app context alive."""
+    def generate() -> Iterator[str]:
+        try:
+            for event, data in events:
+                yield format_sse(event, data)
+        except Exception as e:
+            logger.error(f"Error while streaming response: {e}", exc_info=True)
+            yield format_sse("error", {"error": "Internal server error"})
+
+    response = Response(stream_with_context(generate()), mimetype=EVENT_STREAM_MIMETYPE)
+    response.headers["Cache-Control"] = "no-cache"
+    # Stop reverse proxies (nginx) from buffering the stream
+    response.headers["X-Accel-Buffering"] = "no"
+    return response
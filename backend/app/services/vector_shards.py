@@ -0,0 +1,465 @@
+"""
+Sharded vector index: scatter-gather search over shard worker processes.
+
+`scripts/build_faiss_from_vectors.py --shards N` splits the corpus by
+stable-id hash (or by entity type) into storage/shards/shard-NN/, each a
+complete storage directory (FAISS index, sidecar, chunk store, re-scoring
+vectors). `scripts/serve_shards.py` serves every shard from its own process
+(ShardServer) on a multiprocessing.connection socket authenticated with
+VECTOR_SHARD_AUTHKEY. The addresses are plain host:port pairs, so a shard can
+run on another node unchanged.
+
+With VECTOR_SHARD_ADDRESSES=host:port,host:port,... the app serves a
+ShardedVectorIndex instead of loading the index itself. Its retriever embeds
+the query once, sends the vector to every shard in parallel and merges the
+per-shard top-k by cosine score. Each shard gets VECTOR_SHARD_DEADLINE_MS,
+connect and authkey handshake included; a shard that misses it is left out
+of that answer, and an unreachable or stalled shard is skipped for
+VECTOR_SHARD_RETRY_SECONDS instead of being retried on every query. A shard
+whose previous call is still outstanding past its deadline gets no new work. Shards return chunk records with their hits, so the coordinator never
+maps a chunk store. Every shard worker hot-reloads its own directory through
+an IndexManager (see index_manager).
+
+The FAQ fast path needs the chunk store next to the FAQ index, so it is off
+while the index is sharded.
+"""
+import os
+import time
+import socket
+import struct
+import asyncio
+import logging
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor, wait
+from multiprocessing import AuthenticationError
+from multiprocessing.connection import Connection, Listener, answer_challenge, deliver_challenge
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+from llama_index.core import Settings
+from llama_index.core.retrievers import BaseRetriever
+from llama_index.core.schema import NodeWithScore, QueryBundle, TextNode
+
+from app.services.embedding_batcher import get_embedding_batcher, BATCH_RESULT_TIMEOUT
+from app.services.faiss_retriever import TimedRetrieverQueryEngine
+from app.services.metrics import record_fallback, stage_timer, timed, EMBED, VECTOR_SEARCH
+
+logger = logging.getLogger(__name__)
+
+SHARDS_DIRNAME = "shards"
+SHARD_LAYOUT_FILENAME = "shards.json"
+DEFAULT_DEADLINE_MS = 250.0
+DEFAULT_RETRY_SECONDS = 5.0
+HANDSHAKE_TIMEOUT_SECONDS = 5.0  # Server side: a client that stalls its handshake is dropped
+
+Address = Tuple[str, int]
+ChunkHit = Tuple[Dict[str, Any], float]
+
+
+class ShardUnavailable(Exception):
+    """A shard could not answer in time (down, unreachable or past its deadline)."""
+
+
+def shard_authkey_from_env() -> bytes:
+    """The shared secret both sides authenticate with; the protocol unpickles, so it is required."""
+    authkey = os.getenv("VECTOR_SHARD_AUTHKEY")
+    if not authkey:
+        raise ValueError("VECTOR_SHARD_AUTHKEY must be set to serve or query vector shards.")
+    return authkey.encode("utf-8")
+
+
+def parse_address(text: str) -> Address:
+    host, _, port = text.strip().rpartition(":")
+    if not host or not port.isdigit():
+        raise ValueError(f"Invalid shard address '{text}' (expected host:port).")
+    return host, int(port)
+
+
+def set_io_timeout(conn: Connection, seconds: Optional[float]) -> None:
+    """Bounds every blocking read and write on the connection's socket; None removes the bound."""
+    seconds = max(seconds, 0.001) if seconds else 0.0
+    timeval = struct.pack("ll", int(seconds), int(seconds % 1 * 1_000_000))
+    sock = socket.socket(fileno=conn.fileno())
+    try:
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVTIMEO, timeval)
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_SNDTIMEO, timeval)
+    finally:
+        sock.detach()  # The Connection keeps owning the descriptor
+
+
+def connect(address: Address, authkey: bytes, timeout: float) -> Connection:
+    """multiprocessing Client(), but the TCP connect and the authkey handshake both give up after timeout."""
+    sock = socket.create_connection(address, timeout=timeout)
+    sock.settimeout(None)  # Connection needs a blocking descriptor; set_io_timeout bounds it instead
+    conn = Connection(sock.detach())
+    try:
+        set_io_timeout(conn, timeout)
+        answer_challenge(conn, authkey)
+        deliver_challenge(conn, authkey)
+    except BaseException:
+        conn.close()
+        raise
+    return conn
+
+
+def shard_of(faiss_id: int, shard_count: int) -> int:
+    """Hash sharding: the stable ids are already uniform 63-bit hashes."""
+    return int(faiss_id) % shard_count
+
+
+# --- Shard worker ---
+class ShardServer:
+    """
+    Serves one shard directory. Requests are (op, kwargs) tuples answered
+    with ("ok", result) or ("error", message):
+
+      ("info", {})                                  -> {"name", "ntotal", "dimension", "generation"}
+      ("search", {vector, k, ef_search, nprobe})    -> [(record, cosine score), ...]
+
+    Each connection is handled on its own thread; concurrent searches are
+    batched into one FAISS call by the embedding batcher when it is enabled.
+    """
+
+    def __init__(self, shard_dir: Path, address: Address, authkey: bytes, name: Optional[str] = None):
+        # Imported here: rag_service imports this module for the coordinator side
+        from app.services.index_manager import IndexManager
+        from app.services.rag_service import check_vector_index, open_vector_index
+
+        self.shard_dir = Path(shard_dir)
+        self.address = address
+        self.authkey = authkey
+        self.name = name or self.shard_dir.name
+        self.manager = IndexManager.from_env(
+            self.shard_dir,
+            lambda: open_vector_index(self.shard_dir),
+            verifier=check_vector_index,
+            heap_files=[self.shard_dir / "vector_index.faiss"],
+        )
+        self.searches = 0
+
+    def serve_forever(self) -> None:
+        if self.manager.load("startup", verify=True) is None:
+            raise SystemExit(f"Shard {self.name}: failed to load {self.shard_dir}.")
+        self.manager.start_watcher_from_env()
+        # No authkey on the Listener: its accept() would run the handshake on this thread,
+        # and one client that stalls mid-handshake would block every other connection
+        with Listener(self.address) as listener:
+            logger.info(f"Shard {self.name} ({self.manager.current.ntotal} vectors) listening on "
+                        f"{self.address[0]}:{self.address[1]}.")
+            while True:
+                try:
+                    conn = listener.accept()
+                except OSError as e:
+                    logger.warning(f"Shard {self.name}: accept failed: {e}")
+                    continue
+                threading.Thread(target=self._handle, args=(conn,), name=f"shard-{self.name}-conn", daemon=True).start()
+
+    def _authenticate(self, conn: Connection) -> bool:
+        try:
+            set_io_timeout(conn, HANDSHAKE_TIMEOUT_SECONDS)
+            deliver_challenge(conn, self.authkey)
+            answer_challenge(conn, self.authkey)
+            set_io_timeout(conn, None)  # Pooled connections sit idle between queries
+            return True
+        except (AuthenticationError, OSError, EOFError) as e:
+            # Wrong authkey, port scans and stalled clients must not stop the shard
+            logger.warning(f"Shard {self.name}: rejected connection: {e}")
+            return False
+
+    def _handle(self, conn: Connection) -> None:
+        with conn:
+            if not self._authenticate(conn):
+                return
+            while True:
+                try:
+                    op, kwargs = conn.recv()
+                except (EOFError, OSError):
+                    return
+                try:
+                    reply = ("ok", self._dispatch(op, kwargs))
+                except Exception as e:
+                    logger.error(f"Shard {self.name}: {op} failed: {e}", exc_info=True)
+                    reply = ("error", str(e))
+                try:
+                    conn.send(reply)
+                except (OSError, ValueError):
+                    return
+
+    def _dispatch(self, op: str, kwargs: Dict[str, Any]) -> Any:
+        if op == "search":
+            return self._search(**kwargs)
+        if op == "info":
+            current = self.manager.stats()["current"] or {}
+            return {
+                "name": self.name,
+                "ntotal": current.get("vectors") or 0,
+                "dimension": int(self.manager.current.faiss_index.d) if self.manager.current else None,
+                "generation": current.get("generation"),
+            }
+        raise ValueError(f"Unknown shard op '{op}'.")
+
+    def _search(self, vector: np.ndarray, k: int, ef_search: Optional[int] = None,
+                nprobe: Optional[int] = None) -> List[ChunkHit]:
+        with self.manager.lease() as vector_index:
+            if vector_index is None:
+                raise RuntimeError("shard index not loaded")
+            retriever = vector_index.as_retriever(similarity_top_k=k, ef_search=ef_search, nprobe=nprobe)
+            self.searches += 1
+            return retriever.retrieve_records(QueryBundle(query_str="", embedding=list(map(float, vector))))
+
+
+def serve_shard(shard_dir: Path, address: Address, name: Optional[str] = None) -> None:
+    """Process entry point used by scripts/serve_shards.py."""
+    ShardServer(shard_dir, address, shard_authkey_from_env(), name=name).serve_forever()
+
+
+# --- Coordinator side ---
+class ShardClient:
+    """Pooled connections to one shard worker, with a deadline per call."""
+
+    def __init__(self, address: Address, authkey: bytes, retry_seconds: float = DEFAULT_RETRY_SECONDS):
+        self.address = address
+        self.name = f"{address[0]}:{address[1]}"
+        self._authkey = authkey
+        self.retry_seconds = retry_seconds
+        self._idle: List[Connection] = []
+        self._lock = threading.Lock()
+        self._down_until = 0.0
+        # Calls the coordinator stopped waiting for; while any runs, the shard gets no new work
+        self._overdue: "set[Future]" = set()
+        self.info: Dict[str, Any] = {}
+
+        self.calls = 0
+        self.timeouts = 0
+        self.failures = 0
+        self.last_latency_ms: Optional[float] = None
+
+    def _checkout(self, timeout: float) -> Connection:
+        with self._lock:
+            if self._idle:
+                return self._idle.pop()
+        return connect(self.address, self._authkey, timeout)
+
+    def _checkin(self, conn: Connection) -> None:
+        with self._lock:
+            self._idle.append(conn)
+
+    def call(self, op: str, timeout: float, **kwargs: Any) -> Any:
+        if time.monotonic() < self._down_until:
+            raise ShardUnavailable(f"shard {self.name} marked down")
+        start = time.perf_counter()
+        deadline = time.monotonic() + timeout
+        self.calls += 1
+        conn = None
+        try:
+            conn = self._checkout(timeout)
+            # One bound for the whole call: a reply that starts but never finishes fails too
+            set_io_timeout(conn, timeout)
+            conn.send((op, kwargs))
+            if not conn.poll(max(0.0, deadline - time.monotonic())):
+                # A late reply would answer the next request on this connection; drop it
+                conn.close()
+                self.timeouts += 1
+                raise ShardUnavailable(f"shard {self.name} missed its {timeout * 1000:.0f} ms deadline")
+            status, payload = conn.recv()
+        except ShardUnavailable:
+            raise
+        except (OSError, EOFError, AuthenticationError) as e:
+            # Gone, restarted, stalled (socket timeouts are OSErrors) or misconfigured:
+            # every pooled connection is suspect, and the shard is skipped for a while
+            if conn is not None:
+                conn.close()
+            self.close()
+            if isinstance(e, (TimeoutError, BlockingIOError)):
+                self.timeouts += 1
+            else:
+                self.failures += 1
+            self._down_until = time.monotonic() + self.retry_seconds
+            raise ShardUnavailable(f"shard {self.name} unreachable: {e!r}") from e
+        self._checkin(conn)
+        self.last_latency_ms = (time.perf_counter() - start) * 1000
+        if status != "ok":
+            self.failures += 1
+            raise ShardUnavailable(f"shard {self.name} error: {payload}")
+        return payload
+
+    @property
+    def busy(self) -> bool:
+        """True while a call the coordinator gave up on is still running."""
+        with self._lock:
+            return bool(self._overdue)
+
+    def mark_overdue(self, future: Future) -> None:
+        with self._lock:
+            self._overdue.add(future)
+        future.add_done_callback(self._overdue_done)
+
+    def _overdue_done(self, future: Future) -> None:
+        with self._lock:
+            self._overdue.discard(future)
+
+    def close(self) -> None:
+        with self._lock:
+            idle, self._idle = self._idle, []
+        for conn in idle:
+            conn.close()
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "address": self.name,
+            "shard": self.info.get("name"),
+            "vectors": self.info.get("ntotal"),
+            "up": time.monotonic() >= self._down_until,
+            "busy": self.busy,
+            "calls": self.calls,
+            "timeouts": self.timeouts,
+            "failures": self.failures,
+            "last_latency_ms": self.last_latency_ms,
+        }
+
+
+def merge_hits(per_shard: Sequence[List[ChunkHit]], k: int) -> List[ChunkHit]:
+    """Global top-k of the shards' top-k lists by cosine score (higher is closer)."""
+    merged = [hit for hits in per_shard for hit in hits]
+    merged.sort(key=lambda hit: hit[1], reverse=True)
+    return merged[:k]
+
+
+class ShardedRetriever(BaseRetriever):
+    """Embeds the query, fans it out to every shard and merges their top-k."""
+
+    def __init__(self, index: "ShardedVectorIndex", similarity_top_k: int = 5,
+                 ef_search: Optional[int] = None, nprobe: Optional[int] = None, **kwargs: Any):
+        self._index = index
+        self._similarity_top_k = similarity_top_k
+        self._ef_search = ef_search
+        self._nprobe = nprobe
+        super().__init__(**kwargs)
+
+    def _embed_query(self, query_bundle: QueryBundle) -> np.ndarray:
+        if query_bundle.embedding is not None:
+            return np.asarray(query_bundle.embedding, dtype="float32")
+        with stage_timer(EMBED):
+            batcher = get_embedding_batcher()
+            if batcher is not None:
+                return batcher.embed(query_bundle.query_str, timeout=BATCH_RESULT_TIMEOUT)
+            return np.asarray(Settings.embed_model.get_query_embedding(query_bundle.query_str), dtype="float32")
+
+    def retrieve_records(self, query_bundle: QueryBundle) -> List[ChunkHit]:
+        vector = self._embed_query(query_bundle)
+        return self._index.search(vector, self._similarity_top_k, ef_search=self._ef_search, nprobe=self._nprobe)
+
+    def _retrieve(self, query_bundle: QueryBundle) -> List[NodeWithScore]:
+        return [
+            NodeWithScore(
+                node=TextNode(id_=record.get("doc_id") or "", text=record.get("text", ""),
+                              metadata=record.get("metadata") or {}),
+                score=score,
+            )
+            for record, score in self.retrieve_records(query_bundle)
+        ]
+
+    async def _aretrieve(self, query_bundle: QueryBundle) -> List[NodeWithScore]:
+        # Embedding and the fan-out block; keep them off the event loop
+        return await asyncio.to_thread(self._retrieve, query_bundle)
+
+
+class ShardedVectorIndex:
+    """ChunkStoreVectorIndex stand-in whose searches run on the shard workers."""
+
+    faq_index = None  # FAQ fast path needs a local chunk store
+
+    def __init__(
+        self,
+        shards: Sequence[ShardClient],
+        deadline_ms: float = DEFAULT_DEADLINE_MS,
+        default_ef_search: Optional[int] = None,
+        default_nprobe: Optional[int] = None,
+    ):
+        self.shards = list(shards)
+        self.deadline = deadline_ms / 1000.0
+        self.default_ef_search = default_ef_search
+        self.default_nprobe = default_nprobe
+        self._executor = ThreadPoolExecutor(max_workers=max(4, 4 * len(self.shards)), thread_name_prefix="shard-fanout")
+        self.partial_results = 0
+        self.refresh_info()
+
+    @classmethod
+    def from_env(cls, **kwargs: Any) -> Optional["ShardedVectorIndex"]:
+        """The sharded index for VECTOR_SHARD_ADDRESSES, or None when unset (local index)."""
+        addresses = [text for text in os.getenv("VECTOR_SHARD_ADDRESSES", "").split(",") if text.strip()]
+        if not addresses:
+            return None
+        authkey = shard_authkey_from_env()
+        retry_seconds = float(os.getenv("VECTOR_SHARD_RETRY_SECONDS", str(DEFAULT_RETRY_SECONDS)))
+        shards = [ShardClient(parse_address(text), authkey, retry_seconds=retry_seconds) for text in addresses]
+        return cls(shards, deadline_ms=float(os.getenv("VECTOR_SHARD_DEADLINE_MS", str(DEFAULT_DEADLINE_MS))), **kwargs)
+
+    def refresh_info(self) -> None:
+        """Asks every shard for its size; unreachable shards are reported and skipped."""
+        for shard in self.shards:
+            try:
+                shard.info = shard.call("info", timeout=max(self.deadline, 5.0))
+            except ShardUnavailable as e:
+                logger.warning(f"Vector shard not available: {e}")
+        reachable = [shard for shard in self.shards if shard.info]
+        logger.info(f"Sharded vector index: {len(reachable)}/{len(self.shards)} shards reachable, {self.ntotal} vectors.")
+
+    @property
+    def ntotal(self) -> int:
+        return sum(int(shard.info.get("ntotal") or 0) for shard in self.shards)
+
+    @property
+    def dimension(self) -> Optional[int]:
+        return next((shard.info["dimension"] for shard in self.shards if shard.info.get("dimension")), None)
+
+    @timed(VECTOR_SEARCH)
+    def search(self, vector: np.ndarray, k: int, ef_search: Optional[int] = None,
+               nprobe: Optional[int] = None) -> List[ChunkHit]:
+        """Scatter-gather top-k; shards that miss the deadline are left out."""
+        kwargs = dict(vector=np.asarray(vector, dtype="float32"), k=k,
+                      ef_search=ef_search or self.default_ef_search, nprobe=nprobe or self.default_nprobe)
+        per_shard, missing, futures = [], [], {}
+        for shard in self.shards:
+            if shard.busy:
+                missing.append(f"shard {shard.name} still busy with an overdue call")
+            else:
+                futures[self._executor.submit(shard.call, "search", self.deadline, **kwargs)] = shard
+        # Each call is bounded by its own deadline; the slack covers unpickling
+        done, _ = wait(futures, timeout=self.deadline + 0.05)
+        for future, shard in futures.items():
+            if future in done and future.exception() is None:
+                per_shard.append(future.result())
+            elif future in done:
+                missing.append(str(future.exception()))
+            else:
+                shard.mark_overdue(future)
+                missing.append(f"shard {shard.name} still running")
+        if missing:
+            self.partial_results += 1
+            record_fallback("partial_shards")
+            logger.warning(f"Partial retrieval from {len(per_shard)}/{len(self.shards)} shards: {'; '.join(missing)}.")
+        return merge_hits(per_shard, k)
+
+    def as_retriever(self, similarity_top_k: int = 5, ef_search: Optional[int] = None,
+                     nprobe: Optional[int] = None, **kwargs: Any) -> ShardedRetriever:
+        return ShardedRetriever(self, similarity_top_k=similarity_top_k, ef_search=ef_search, nprobe=nprobe, **kwargs)
+
+    def as_query_engine(self, similarity_top_k: int = 5, ef_search: Optional[int] = None,
+                        nprobe: Optional[int] = None, **kwargs: Any) -> TimedRetrieverQueryEngine:
+        retriever = self.as_retriever(similarity_top_k=similarity_top_k, ef_search=ef_search, nprobe=nprobe)
+        return TimedRetrieverQueryEngine.from_args(retriever, **kwargs)
+
+    def close(self) -> None:
+        self._executor.shutdown(wait=False)
+        for shard in self.shards:
+            shard.close()
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "shards": [shard.stats() for shard in self.shards],
+            "vectors": self.ntotal,
+            "deadline_ms": self.deadline * 1000,
+            "partial_results": self.partial_results,
+        }
@@ -0,0 +1,143 @@
+"""
+Compact on-disk formats for embedding vectors (temp_embeddings/embeddings.npy
+and the re-scoring vectors next to the index).
+
+  float32  the original format, 4 bytes per dimension
+  float16  half precision, 2 bytes per dimension
+  int8     symmetric scalar quantization with one scale per dimension
+           (scale_d = max |x_d| / 127), 1 byte per dimension plus a
+           <name>.scales.npy sidecar
+
+Every format is a plain .npy file, so it stays memory-mappable and shared
+through the page cache; StoredVectors decodes only the rows that are read.
+VECTOR_STORAGE_DTYPE picks the format the build scripts write (default
+float32). The FAISS index itself is compacted with FAISS_INDEX_TYPE=fp16
+or sq8. Measure the recall cost with
+`scripts/benchmark_retrieval.py --storage-validation`.
+"""
+import os
+import logging
+from pathlib import Path
+from typing import Any, Optional
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+VECTOR_DTYPES = ("float32", "float16", "int8")
+_BLOCK_ROWS = 65536
+
+
+def vector_dtype_from_env() -> str:
+    dtype = os.getenv("VECTOR_STORAGE_DTYPE", "float32").lower()
+    if dtype not in VECTOR_DTYPES:
+        raise ValueError(f"Unknown VECTOR_STORAGE_DTYPE '{dtype}' (expected one of {VECTOR_DTYPES}).")
+    return dtype
+
+
+def scales_path(path: Path) -> Path:
+    """embeddings.npy -> embeddings.scales.npy"""
+    path = Path(path)
+    return path.with_name(f"{path.stem}.scales.npy")
+
+
+def int8_scales(vectors: Any) -> np.ndarray:
+    """Per-dimension scales mapping max |x_d| to 127, computed block by block."""
+    max_abs = np.zeros(vectors.shape[1], dtype="float32")
+    for start in range(0, len(vectors), _BLOCK_ROWS):
+        block = np.asarray(vectors[start:start + _BLOCK_ROWS], dtype="float32")
+        np.maximum(max_abs, np.abs(block).max(axis=0), out=max_abs)
+    scales = max_abs / 127.0
+    scales[scales == 0] = 1.0
+    return scales
+
+
+def quantize(block: np.ndarray, dtype: str, scales: Optional[np.ndarray] = None) -> np.ndarray:
+    block = np.asarray(block, dtype="float32")
+    if dtype == "int8":
+        return np.clip(np.rint(block / scales), -127, 127).astype("int8")
+    return block.astype(dtype)
+
+
+def dequantize(codes: np.ndarray, scales: Optional[np.ndarray] = None) -> np.ndarray:
+    if codes.dtype == np.int8:
+        return codes.astype("float32") * scales
+    return np.asarray(codes, dtype="float32")
+
+
+def write_vectors(path: Path, vectors: Any, dtype: str = "float32", order: Optional[np.ndarray] = None) -> None:
+    """
+    Writes vectors (rows permuted by order, when given) in the requested
+    format. Rows are copied block by block, so vectors may be a memmap or a
+    StoredVectors, and the file is written under a temp name and swapped in,
+    so a process mapping the old file never sees it truncated.
+    """
+    if dtype not in VECTOR_DTYPES:
+        raise ValueError(f"Unknown vector dtype '{dtype}' (expected one of {VECTOR_DTYPES}).")
+    path = Path(path)
+    rows = len(order) if order is not None else len(vectors)
+    dimension = vectors.shape[1]
+    scales = int8_scales(vectors) if dtype == "int8" else None
+
+    tmp_path = path.with_name(path.name + ".tmp")
+    target = np.lib.format.open_memmap(tmp_path, mode="w+", dtype=dtype, shape=(rows, dimension))
+    for start in range(0, rows, _BLOCK_ROWS):
+        block = vectors[order[start:start + _BLOCK_ROWS]] if order is not None else vectors[start:start + _BLOCK_ROWS]
+        target[start:start + _BLOCK_ROWS] = quantize(block, dtype, scales)
+    target.flush()
+    del target
+
+    sidecar = scales_path(path)
+    if scales is not None:
+        tmp_scales = sidecar.with_name(sidecar.name + ".tmp")
+        with open(tmp_scales, "wb") as f:
+            np.save(f, scales)
+        os.replace(tmp_scales, sidecar)
+    os.replace(tmp_path, path)
+    if scales is None and sidecar.exists():
+        os.remove(sidecar)  # Left over from an earlier int8 build
+    logger.info(f"Wrote {rows} x {dimension} {dtype} vectors to {path} ({path.stat().st_size / 1e6:.1f} MB).")
+
+
+class StoredVectors:
+    """Memory-mapped vectors in any VECTOR_DTYPES format; indexing returns float32 rows."""
+
+    def __init__(self, path: Path):
+        self.path = Path(path)
+        self.codes = np.load(self.path, mmap_mode="r")
+        self.dtype = str(self.codes.dtype)
+        if self.dtype not in VECTOR_DTYPES:
+            raise ValueError(f"Unsupported vector dtype {self.dtype} in {self.path}.")
+        self.scales = None
+        if self.dtype == "int8":
+            sidecar = scales_path(self.path)
+            if not sidecar.exists():
+                raise ValueError(f"int8 vectors {self.path} have no scales sidecar {sidecar}.")
+            self.scales = np.load(sidecar).astype("float32")
+
+    @property
+    def shape(self):
+        return self.codes.shape
+
+    @property
+    def nbytes(self) -> int:
+        return int(self.codes.nbytes) + (int(self.scales.nbytes) if self.scales is not None else 0)
+
+    def __len__(self) -> int:
+        return len(self.codes)
+
+    def __getitem__(self, rows: Any) -> np.ndarray:
+        return dequantize(np.asarray(self.codes[rows]), self.scales)
+
+    def to_float32(self) -> np.ndarray:
+        """All rows as float32: the memmap itself for float32 files, else decoded block by block."""
+        if self.dtype == "float32":
+            return self.codes
+        out = np.empty(self.shape, dtype="float32")
+        for start in range(0, len(self), _BLOCK_ROWS):
+            out[start:start + _BLOCK_ROWS] = self[start:start + _BLOCK_ROWS]
+        return out
+
+
+def load_vectors(path: Path) -> StoredVectors:
+    return StoredVectors(path)
@@ -0,0 +1,48 @@
+"""
+Gunicorn settings for the WSGI app. Run from backend/:
+
+    gunicorn -c gunicorn.conf.py
+
+Each worker writes its metrics to PROMETHEUS_MULTIPROC_DIR, so /metrics on
+any worker reports the totals for the whole server (app/services/metrics.py).
+The directory is emptied when the server starts, and a worker's live gauges
+are dropped when it exits. Under `uvicorn app.asgi:app --workers N`, set
+PROMETHEUS_MULTIPROC_DIR to an empty directory yourself.
+
+Chat sessions must be shared by all workers, so with more than one worker
+SESSION_STORE defaults to sqlite (app/services/session_store.py); the
+per-worker memory store would lose a session whenever another worker
+answers. Under `uvicorn --workers N`, set SESSION_STORE=sqlite yourself.
+"""
+import os
+import shutil
+import tempfile
+
+bind = os.getenv("GUNICORN_BIND", f"0.0.0.0:{os.getenv('PORT', '5050')}")
+workers = int(os.getenv("GUNICORN_WORKERS", "2"))
+threads = int(os.getenv("GUNICORN_THREADS", "4"))
+timeout = int(os.getenv("GUNICORN_TIMEOUT", "120"))  # Report and RAG calls wait on the LLM
+wsgi_app = "app.main:app"
+
+# Set here, before any worker imports prometheus_client
+os.environ.setdefault("PROMETHEUS_MULTIPROC_DIR", os.path.join(tempfile.gettempdir(), "curaai-prometheus"))
+# Sessions must be visible to every worker (a SESSION_STORE in .env is read too late to win)
+if workers > 1:
+    os.environ.setdefault("SESSION_STORE", "sqlite")
+
+
+def on_starting(server):
+    if workers > 1 and os.environ["SESSION_STORE"].lower() == "memory":
+        server.log.warning(f"SESSION_STORE=memory with {workers} workers: sessions are lost when another worker answers.")
+    # Files left by a previous run would be summed into this one's metrics
+    multiproc_dir = os.environ["PROMETHEUS_MULTIPROC_DIR"]
+    shutil.rmtree(multiproc_dir, ignore_errors=True)
+    os.makedirs(multiproc_dir, exist_ok=True)
+
+
+def child_exit(server, worker):
+    try:
+        from prometheus_client import multiprocess
+    except ImportError:
+        return
+    multiprocess.mark_process_dead(worker.pid)
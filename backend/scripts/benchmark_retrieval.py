@@ -0,0 +1,444 @@
+import sys
+import json
+import time
+import random
+import logging
+import argparse
+import tempfile
+import subprocess
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+
+import numpy as np
+import faiss
+
+# --- Configuration ---
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(name)s - %(message)s')
+logger = logging.getLogger(__name__)
+
+# --- Paths ---
+SCRIPT_DIR = Path(__file__).resolve().parent
+PROJECT_ROOT = SCRIPT_DIR.parent.parent
+# Make the backend 'app' package importable when run as `python scripts/...`
+if str(SCRIPT_DIR.parent) not in sys.path:
+    sys.path.insert(0, str(SCRIPT_DIR.parent))
+from app.services.embedding_backend import get_embedding_backend
+from app.services.faiss_factory import INDEX_TYPES, build_faiss_index, make_search_params
+from app.services.faq_index import FAQ_INFO_FILENAME, split_faq_text
+from app.services.atomic_files import write_json
+from app.services.index_manager import process_rss_bytes, publish_index
+from app.services.chunk_store import ChunkStore, write_chunk_store
+from app.services.vector_storage import VECTOR_DTYPES, load_vectors, write_vectors
+from app.services.ingestion import get_source, iter_chunks
+
+BENCHMARK_SOURCE = "disfaqs"  # cleaned_disfaqs.json, shipped in backend/data
+K_VALUES = (1, 5, 10)
+STORAGE_DIR = PROJECT_ROOT / "backend" / "storage"
+FAQ_THRESHOLDS = np.round(np.arange(0.50, 1.0, 0.01), 2)
+_FAQ_STOPWORDS = {"a", "an", "the", "of", "for", "to", "do", "i", "my", "is", "are", "can"}
+
+
+# --- Corpus ---
+def load_benchmark_corpus(max_queries=None, seed=0):
+    """
+    Chunks cleaned_disfaqs.json the same way as the index build, and uses each
+    FAQ question as a query whose ground truth is its own FAQ chunk.
+    Returns (chunks, queries) with queries = [(question, chunk_row)].
+    """
+    chunks = list(iter_chunks([get_source(BENCHMARK_SOURCE)]))
+
+    queries = []
+    for row, chunk in enumerate(chunks):
+        if chunk["metadata"].get("type") != "faq":
+            continue
+        # "Question: <q> Answer: <a>" -> <q>
+        question = chunk["text"].split(" Answer: ", 1)[0][len("Question: "):].strip()
+        if question:
+            queries.append((question, row))
+
+    if max_queries and len(queries) > max_queries:
+        queries = random.Random(seed).sample(queries, max_queries)
+    logger.info(f"Benchmark corpus: {len(chunks)} chunks, {len(queries)} queries.")
+    return chunks, queries
+
+
+# --- Measurements ---
+def rss_mb():
+    rss = process_rss_bytes()
+    return rss / (1024 * 1024) if rss is not None else None
+
+
+def _index_memory_probe(vectors_path, queries_path, index_type, pq_m, ef_search, nprobe, k):
+    """Runs in a fresh process: the memory one index variant adds on top of the loaded vectors."""
+    corpus_vectors = np.load(vectors_path)
+    query_vectors = np.load(queries_path)
+    baseline = rss_mb()  # Current, not high-water: importing the app peaks above small indexes
+    index, _info = build_faiss_index(corpus_vectors, np.arange(len(corpus_vectors), dtype="int64"),
+                                     index_type=index_type, pq_m=pq_m)
+    search_params = make_search_params(index, ef_search=ef_search, nprobe=nprobe)
+    if search_params is not None:
+        index.search(query_vectors, k, params=search_params)
+    else:
+        index.search(query_vectors, k)
+    # The index is still alive here, so the increase is what it keeps resident after build and search
+    return {"rss_increase_mb": rss_mb() - baseline}
+
+
+def measure_index_memory(vectors_path, queries_path, index_type, pq_m, ef_search, nprobe, k):
+    """
+    In the benchmark process, memory freed by one variant is reused by the
+    next and a high-water mark only grows, so each variant is built again in
+    its own spawned process instead.
+    """
+    with ProcessPoolExecutor(max_workers=1, mp_context=multiprocessing.get_context("spawn")) as pool:
+        return pool.submit(_index_memory_probe, str(vectors_path), str(queries_path), index_type, pq_m,
+                           ef_search, nprobe, k).result()
+
+
+def percentiles_ms(latencies):
+    values = np.asarray(latencies) * 1000.0
+    return {f"p{p}": float(np.percentile(values, p)) for p in (50, 95, 99)}
+
+
+def evaluate_index(index, query_vectors, truth_rows, k=10, search_params=None, rescorer=None):
+    """
+    Runs one search per query (the serving pattern) and returns recall@k,
+    MRR@k and latency percentiles. IDs in the index are chunk rows.
+    rescorer(query_vector, ids, k) -> (distances, ids) re-ranks candidates.
+    """
+    hits = {kv: 0 for kv in K_VALUES if kv <= k}
+    reciprocal_ranks = []
+    latencies = []
+    fetch_k = k * (rescorer.factor if rescorer else 1)
+
+    for query_vector, truth in zip(query_vectors, truth_rows):
+        x = query_vector[None, :]
+        start = time.perf_counter()
+        if search_params is not None:
+            distances, ids = index.search(x, fetch_k, params=search_params)
+        else:
+            distances, ids = index.search(x, fetch_k)
+        if rescorer is not None:
+            distances, ids = rescorer.rescore(query_vector, ids, k)
+        latencies.append(time.perf_counter() - start)
+
+        ranked = [int(i) for i in ids[0][:k]]
+        rank = ranked.index(truth) + 1 if truth in ranked else None
+        reciprocal_ranks.append(1.0 / rank if rank else 0.0)
+        for kv in hits:
+            if rank and rank <= kv:
+                hits[kv] += 1
+
+    n = len(truth_rows)
+    result = {f"recall@{kv}": hits[kv] / n for kv in hits}
+    result[f"mrr@{k}"] = float(np.mean(reciprocal_ranks))
+    result["search_latency_ms"] = percentiles_ms(latencies)
+    return result
+
+
+class ArrayRescorer:
+    """Exact L2 re-ranking against the in-memory float32 vectors (ids are rows)."""
+
+    def __init__(self, vectors, factor):
+        self.vectors = vectors
+        self.factor = factor
+
+    def rescore(self, query_vector, ids, k):
+        candidates = np.asarray([i for i in ids[0] if i >= 0], dtype="int64")
+        distances = np.sum((self.vectors[candidates] - query_vector) ** 2, axis=1)
+        order = np.argsort(distances)[:k]
+        return distances[order][None, :], candidates[order][None, :]
+
+
+# --- Compact storage validation ---
+def chunk_store_stats(chunks, compression, directory, lookups=2000):
+    path = Path(directory) / f"chunks_{compression}.bin"
+    write_chunk_store(path, enumerate(chunks), compression=compression)
+    store = ChunkStore(path)
+    rows = np.random.default_rng(0).integers(0, len(chunks), size=min(lookups, len(chunks)))
+    start = time.perf_counter()
+    for row in rows:
+        store.get(int(row))
+    lookup_us = (time.perf_counter() - start) / len(rows) * 1e6
+    store.close()
+    return {"compression": compression, "bytes": path.stat().st_size, "lookup_us": lookup_us}
+
+
+def validate_compact_storage(corpus_vectors, query_vectors, truth_rows, chunks, k=10):
+    """
+    Recall cost of the compact artifact formats against float32 on the
+    benchmark queries:
+      - stored vectors: each VECTOR_DTYPES format written and read back through
+        vector_storage, then searched exactly (what re-scoring sees)
+      - index codes: the fp16 and sq8 index types against the flat index
+    Reports recall@k, the loss against float32, the share of float32's top-k
+    each format returns, and the storage size. Also sizes the chunk store
+    with and without zstd.
+    """
+    ids = np.arange(len(corpus_vectors), dtype="int64")
+    baseline_index, _ = build_faiss_index(corpus_vectors, ids, index_type="flat")
+    baseline = evaluate_index(baseline_index, query_vectors, truth_rows, k=k)
+    _, baseline_top = baseline_index.search(np.asarray(query_vectors, dtype="float32"), k)
+
+    def compare(index, label, kind, size_bytes):
+        metrics = evaluate_index(index, query_vectors, truth_rows, k=k)
+        _, top = index.search(np.asarray(query_vectors, dtype="float32"), k)
+        agreement = np.mean([len(set(a) & set(b)) / k for a, b in zip(top, baseline_top)])
+        row = {
+            "format": label, "kind": kind, "bytes": int(size_bytes),
+            "bytes_per_vector": size_bytes / len(corpus_vectors),
+            f"recall@{k}": metrics[f"recall@{k}"],
+            f"recall@{k}_loss": baseline[f"recall@{k}"] - metrics[f"recall@{k}"],
+            f"mrr@{k}_loss": baseline[f"mrr@{k}"] - metrics[f"mrr@{k}"],
+            f"top{k}_agreement_with_float32": float(agreement),
+        }
+        logger.info(f"  {kind} {label}: {row['bytes_per_vector']:.0f} B/vector, recall@{k} loss {row[f'recall@{k}_loss']:+.4f}, "
+                    f"top-{k} agreement {agreement:.4f}")
+        return row
+
+    results = []
+    with tempfile.TemporaryDirectory() as directory:
+        for dtype in VECTOR_DTYPES:
+            path = Path(directory) / f"vectors_{dtype}.npy"
+            write_vectors(path, corpus_vectors, dtype=dtype)
+            stored = load_vectors(path)
+            index, _ = build_faiss_index(stored.to_float32(), ids, index_type="flat")
+            results.append(compare(index, dtype, "stored_vectors", stored.nbytes))
+            del stored
+        for index_type in ("flat", "fp16", "sq8"):
+            index, _ = build_faiss_index(corpus_vectors, ids, index_type=index_type)
+            results.append(compare(index, index_type, "index", faiss.serialize_index(index).nbytes))
+
+        compressions = ["none"]
+        try:
+            import zstandard  # noqa: F401
+            compressions.append("zstd")
+        except ImportError:
+            logger.warning("zstandard not installed; skipping the compressed chunk store.")
+        chunk_stores = [chunk_store_stats(chunks, compression, directory) for compression in compressions]
+
+    return {"baseline": {f"recall@{k}": baseline[f"recall@{k}"], f"mrr@{k}": baseline[f"mrr@{k}"]},
+            "formats": results, "chunk_store": chunk_stores}
+
+
+# --- FAQ fast path calibration ---
+def perturb_question(question, rng):
+    """Light rewording of an FAQ question (case, contractions, a dropped function word)."""
+    text = question.lower().rstrip("?").strip()
+    text = text.replace("what is ", "what's ").replace("how do i ", "how can i ") if rng.random() < 0.5 else text
+    words = text.split()
+    droppable = [i for i, word in enumerate(words) if i > 0 and word in _FAQ_STOPWORDS]
+    if droppable and rng.random() < 0.7:
+        del words[rng.choice(droppable)]
+    return " ".join(words)
+
+
+def calibrate_faq_threshold(backend, chunks, max_queries=2000, holdout=0.2, target_precision=0.98, seed=0):
+    """
+    Simulates the FAQ fast path on the benchmark corpus. A held-out share of
+    the FAQs is left out of the question index: reworded questions of indexed
+    FAQs should hit their own FAQ, held-out questions should not hit at all
+    (unless the matched FAQ has the same answer). For each threshold, reports
+    the fast-path hit rate and its precision; the calibrated threshold is
+    the lowest one whose precision reaches target_precision.
+    """
+    rng = random.Random(seed)
+    faqs = []  # (row, question, answer)
+    for row, chunk in enumerate(chunks):
+        parts = split_faq_text(chunk["text"]) if chunk["metadata"].get("type") == "faq" else None
+        if parts:
+            faqs.append((row, parts[0], parts[1]))
+    rng.shuffle(faqs)
+    n_holdout = int(len(faqs) * holdout)
+    held_out, indexed = faqs[:n_holdout], faqs[n_holdout:]
+
+    answers = {row: answer for row, _, answer in faqs}
+    index_vectors = backend.encode([question for _, question, _ in indexed], batch_size=64)
+    index, _ = build_faiss_index(index_vectors, np.asarray([row for row, _, _ in indexed], dtype="int64"), index_type="flat")
+
+    positives = rng.sample(indexed, min(len(indexed), max_queries))
+    negatives = rng.sample(held_out, min(len(held_out), max(1, max_queries // 4)))
+    queries = [(perturb_question(q, rng), row, True) for row, q, _ in positives]
+    queries += [(q, row, False) for row, q, _ in negatives]
+    query_vectors = backend.encode([q for q, _, _ in queries], batch_size=64)
+    distances, ids = index.search(np.asarray(query_vectors, dtype="float32"), 1)
+    scores = 1.0 - distances[:, 0] / 2.0
+
+    correct = np.asarray([
+        int(hit) == row if indexed_query else answers.get(int(hit)) == answers[row]
+        for (_, row, indexed_query), hit in zip(queries, ids[:, 0])
+    ])
+    is_positive = np.asarray([indexed_query for _, _, indexed_query in queries])
+
+    sweep = []
+    for threshold in FAQ_THRESHOLDS:
+        taken = scores >= threshold
+        n_taken = int(taken.sum())
+        sweep.append({
+            "threshold": float(threshold),
+            "hit_rate": n_taken / len(queries),
+            "hit_rate_indexed": float(taken[is_positive].mean()) if is_positive.any() else 0.0,
+            "hit_rate_held_out": float(taken[~is_positive].mean()) if (~is_positive).any() else 0.0,
+            "precision": float(correct[taken].mean()) if n_taken else 1.0,
+        })
+    calibrated = next((row for row in sweep if row["precision"] >= target_precision), sweep[-1])
+    logger.info(f"FAQ calibration: threshold {calibrated['threshold']:.2f} -> hit rate {calibrated['hit_rate']:.3f}, "
+                f"precision {calibrated['precision']:.3f}")
+    return {
+        "faqs": len(faqs),
+        "indexed": len(indexed),
+        "held_out": len(held_out),
+        "queries": {"reworded_indexed": len(positives), "held_out": len(negatives)},
+        "target_precision": target_precision,
+        "calibrated_threshold": calibrated["threshold"],
+        "calibrated": calibrated,
+        "sweep": sweep,
+    }
+
+
+def write_faq_threshold(calibration, backend_name):
+    """Records the calibrated threshold in storage/faq_index.json, read by the server."""
+    info_path = STORAGE_DIR / FAQ_INFO_FILENAME
+    info = {}
+    if info_path.exists():
+        with open(info_path, "r", encoding="utf-8") as f:
+            info = json.load(f)
+    info["threshold"] = calibration["calibrated_threshold"]
+    info["calibration"] = {
+        "backend": backend_name,
+        "target_precision": calibration["target_precision"],
+        "hit_rate": calibration["calibrated"]["hit_rate"],
+        "precision": calibration["calibrated"]["precision"],
+        "git_commit": git_commit(),
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()),
+    }
+    write_json(info_path, info, indent=2)
+    logger.info(f"FAQ threshold {info['threshold']:.2f} written to {info_path}.")
+    publish_index(STORAGE_DIR)
+
+
+def git_commit():
+    try:
+        return subprocess.check_output(["git", "rev-parse", "HEAD"], cwd=SCRIPT_DIR, text=True).strip()
+    except Exception:
+        return None
+
+
+# --- Main Execution ---
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Retrieval benchmark (recall@k, MRR, latency) over FAQ questions.")
+    parser.add_argument("--backends", default="torch", help="Comma separated embedding backends (torch,onnx).")
+    parser.add_argument("--index-types", default=",".join(INDEX_TYPES), help="Comma separated FAISS index types.")
+    parser.add_argument("--max-queries", type=int, default=2000)
+    parser.add_argument("--k", type=int, default=10)
+    parser.add_argument("--ef-search", type=int, default=None, help="HNSW efSearch for the search phase.")
+    parser.add_argument("--nprobe", type=int, default=None, help="IVF nprobe for the search phase.")
+    parser.add_argument("--rescore-factor", type=int, default=1, help=">1 adds an exact re-scoring run per approximate index.")
+    parser.add_argument("--pq-m", type=int, default=48)
+    parser.add_argument("--faq-calibration", action="store_true", help="Also calibrate the FAQ fast-path threshold.")
+    parser.add_argument("--faq-holdout", type=float, default=0.2, help="Share of FAQs left out of the question index.")
+    parser.add_argument("--faq-target-precision", type=float, default=0.98)
+    parser.add_argument("--write-faq-threshold", action="store_true",
+                        help="Store the calibrated threshold (first backend) in storage/faq_index.json.")
+    parser.add_argument("--storage-validation", action="store_true",
+                        help="Also report the recall loss of float16/int8 vectors and compact index codes vs float32.")
+    parser.add_argument("--output", default=None, help="Write the JSON report here (default: stdout only).")
+    args = parser.parse_args()
+
+    chunks, queries = load_benchmark_corpus(max_queries=args.max_queries)
+    texts = [chunk["text"] for chunk in chunks]
+    ids = np.arange(len(chunks), dtype="int64")  # ids are chunk rows
+    truth_rows = [row for _, row in queries]
+
+    report = {
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()),
+        "git_commit": git_commit(),
+        "corpus": {"source": BENCHMARK_SOURCE, "chunks": len(chunks), "queries": len(queries)},
+        "params": vars(args),
+        "results": [],
+    }
+    if args.faq_calibration:
+        report["faq_calibration"] = {}
+    if args.storage_validation:
+        report["storage_validation"] = {}
+
+    for backend_name in [b.strip() for b in args.backends.split(",") if b.strip()]:
+        logger.info(f"Embedding corpus with '{backend_name}' backend...")
+        rss_before = rss_mb()
+        backend = get_embedding_backend(backend_name)
+        start = time.perf_counter()
+        corpus_vectors = backend.encode(texts, batch_size=64)
+        corpus_seconds = time.perf_counter() - start
+        start = time.perf_counter()
+        query_vectors = backend.encode([q for q, _ in queries], batch_size=64)
+        query_seconds = time.perf_counter() - start
+        embedding_stats = {
+            "corpus_embed_seconds": corpus_seconds,
+            "corpus_texts_per_second": len(texts) / corpus_seconds,
+            "query_embed_seconds": query_seconds,
+            # Model plus corpus vectors; a fresh process per variant measures the indexes (measure_index_memory)
+            "rss_increase_mb": rss_mb() - rss_before if rss_before is not None else None,
+        }
+        memory_dir = tempfile.TemporaryDirectory(prefix="benchmark_vectors_")
+        vectors_path = Path(memory_dir.name) / "corpus.npy"
+        queries_path = Path(memory_dir.name) / "queries.npy"
+        np.save(vectors_path, np.asarray(corpus_vectors, dtype="float32"))
+        np.save(queries_path, np.asarray(query_vectors, dtype="float32"))
+
+        for index_type in [t.strip() for t in args.index_types.split(",") if t.strip()]:
+            logger.info(f"Building '{index_type}' index...")
+            start = time.perf_counter()
+            index, info = build_faiss_index(corpus_vectors, ids, index_type=index_type, pq_m=args.pq_m)
+            build_seconds = time.perf_counter() - start
+            index_bytes = int(faiss.serialize_index(index).nbytes)
+            search_params = make_search_params(index, ef_search=args.ef_search, nprobe=args.nprobe)
+            memory = measure_index_memory(vectors_path, queries_path, index_type, args.pq_m,
+                                          args.ef_search, args.nprobe, args.k)
+
+            runs = [("none", None)]
+            if args.rescore_factor > 1 and index_type != "flat":
+                runs.append((f"exact_x{args.rescore_factor}", ArrayRescorer(corpus_vectors, args.rescore_factor)))
+
+            for rescore_label, rescorer in runs:
+                logger.info(f"Evaluating {backend_name}/{index_type} (rescore={rescore_label})...")
+                metrics = evaluate_index(index, query_vectors, truth_rows, k=args.k,
+                                         search_params=search_params, rescorer=rescorer)
+                report["results"].append({
+                    "backend": backend_name,
+                    "index_type": index_type,
+                    "index_info": info,
+                    "rescore": rescore_label,
+                    "build_seconds": build_seconds,
+                    "index_bytes": index_bytes,
+                    "embedding": embedding_stats,
+                    "memory": memory,
+                    **metrics,
+                })
+                logger.info(f"  recall@1={metrics.get('recall@1', 0):.3f} recall@10={metrics.get('recall@10', 0):.3f} "
+                            f"p95={metrics['search_latency_ms']['p95']:.3f}ms")
+            del index
+        memory_dir.cleanup()
+
+        if args.storage_validation:
+            logger.info(f"Validating compact storage formats with '{backend_name}' backend...")
+            report["storage_validation"][backend_name] = validate_compact_storage(
+                np.asarray(corpus_vectors, dtype="float32"), np.asarray(query_vectors, dtype="float32"),
+                truth_rows, chunks, k=args.k,
+            )
+
+        if args.faq_calibration:
+            logger.info(f"Calibrating FAQ fast-path threshold with '{backend_name}' backend...")
+            calibration = calibrate_faq_threshold(
+                backend, chunks, max_queries=args.max_queries, holdout=args.faq_holdout,
+                target_precision=args.faq_target_precision,
+            )
+            report["faq_calibration"][backend_name] = calibration
+            if args.write_faq_threshold and len(report["faq_calibration"]) == 1:
+                write_faq_threshold(calibration, backend_name)
+
+    output = json.dumps(report, indent=2)
+    if args.output:
+        Path(args.output).write_text(output, encoding="utf-8")
+        logger.info(f"Benchmark report written to {args.output}.")
+    print(output)
@@ -1,6 +1,8 @@
 import os
+import sys
 import json
 import logging
+import argparse
 from pathlib import Path
 import faiss # Only need faiss and numpy here
 import numpy as np
@@ -12,30 +14,101 @@ logger = logging.getLogger(__name__)
 # --- Paths ---
 SCRIPT_DIR = Path(__file__).resolve().parent
 PROJECT_ROOT = SCRIPT_DIR.parent.parent
+# Make the backend 'app' package importable when run as `python scripts/...`
+if str(SCRIPT_DIR.parent) not in sys.path:
+    sys.path.insert(0, str(SCRIPT_DIR.parent))
+from app.services.chunk_store import write_chunk_store
+from app.services.faiss_factory import build_faiss_index, index_options_from_env, write_index_artifacts
+from app.services.embedding_backend import EMBEDDING_MODEL_NAME
+from app.services.index_manifest import MANIFEST_FILENAME, assign_ids, build_manifest, chunk_keys, write_manifest
+from app.services.index_manager import publish_index
+from app.services.atomic_files import write_json
+from app.services.vector_storage import load_vectors
+from app.services.vector_shards import SHARDS_DIRNAME, SHARD_LAYOUT_FILENAME, shard_of
 # Input: Where generate_embeddings.py saved its output
 TEMP_INPUT_DIR = PROJECT_ROOT / "backend" / "storage" / "temp_embeddings"
 VECTORS_FILE = TEMP_INPUT_DIR / "embeddings.npy"
 DOCUMENTS_FILE = TEMP_INPUT_DIR / "documents_with_ids.json"
+CHECKPOINT_FILE = TEMP_INPUT_DIR / "embeddings.checkpoint.json" # Present while generate_embeddings.py is unfinished
 # Output: Final files for main.py
 OUTPUT_DIR = PROJECT_ROOT / "backend" / "storage"
 OUTPUT_DIR.mkdir(parents=True, exist_ok=True)
 FAISS_INDEX_FILE = OUTPUT_DIR / "vector_index.faiss"
-DOC_METADATA_FILE = OUTPUT_DIR / "vector_metadata.json"
+CHUNK_STORE_FILE = OUTPUT_DIR / "vector_chunks.bin" # Memory-mapped chunk store read by rag_service
+MANIFEST_FILE = OUTPUT_DIR / MANIFEST_FILENAME # Per-chunk hashes for update_faiss_index.py
+SHARDS_DIR = OUTPUT_DIR / SHARDS_DIRNAME # One storage directory per shard (scripts/serve_shards.py)
 
 # --- Dimension (Must match model used in generate_embeddings.py) ---
 EXPECTED_DIMENSION = 384 # For all-MiniLM-L6-v2
 
+def shard_rows(document_chunks, faiss_ids, shard_count, shard_by):
+    """{shard name: row numbers}, by stable-id hash or by the chunks' entity type."""
+    if shard_by == "hash":
+        names = [f"shard-{shard_of(faiss_id, shard_count):02d}" for faiss_id in faiss_ids]
+    else:
+        names = [f"shard-{chunk_data.get('metadata', {}).get('entity_type') or 'other'}" for chunk_data in document_chunks]
+    groups = {}
+    for row, name in enumerate(names):
+        groups.setdefault(name, []).append(row)
+    return {name: np.asarray(rows, dtype="int64") for name, rows in sorted(groups.items())}
+
+
+def write_shards(vectors, document_chunks, faiss_ids, index_options, shard_count, shard_by):
+    """Builds one complete storage directory (index, sidecar, chunk store) per shard under SHARDS_DIR."""
+    layout = {"shard_by": shard_by, "index_type": index_options["index_type"], "shards": []}
+    for name, rows in shard_rows(document_chunks, faiss_ids, shard_count, shard_by).items():
+        shard_dir = SHARDS_DIR / name
+        shard_dir.mkdir(parents=True, exist_ok=True)
+        shard_vectors = np.ascontiguousarray(vectors[rows]) # One shard's rows in memory at a time
+        shard_ids = faiss_ids[rows]
+        index_mapped, index_info = build_faiss_index(shard_vectors, shard_ids, **index_options)
+        write_index_artifacts(
+            index_mapped, index_info, shard_dir / FAISS_INDEX_FILE.name,
+            vectors=shard_vectors if index_options["write_rescore_vectors"] else None, ids=shard_ids,
+        )
+        records = (
+            (int(faiss_ids[row]), {
+                "doc_id": document_chunks[row].get("doc_id", f"missing_id_{row}"),
+                "text": document_chunks[row].get("text", ""),
+                "metadata": document_chunks[row].get("metadata", {}),
+            })
+            for row in rows
+        )
+        record_count = write_chunk_store(shard_dir / CHUNK_STORE_FILE.name, records)
+        publish_index(shard_dir) # The shard worker reloads once all of its files are in place
+        layout["shards"].append({"name": name, "vectors": record_count})
+        logger.info(f"Shard {name}: {record_count} chunks written to {shard_dir}.")
+
+    stale = sorted(path.name for path in SHARDS_DIR.glob("shard-*") if path.name not in {shard["name"] for shard in layout["shards"]})
+    if stale:
+        logger.warning(f"Shard directories from an earlier build are not part of this layout: {', '.join(stale)}.")
+    write_json(SHARDS_DIR / SHARD_LAYOUT_FILENAME, layout, indent=2)
+    logger.info(f"Shard layout ({len(layout['shards'])} shards by {shard_by}) written to {SHARDS_DIR / SHARD_LAYOUT_FILENAME}.")
+
+
 # --- Main Execution ---
 if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Build the FAISS index (or index shards) from precomputed vectors.")
+    parser.add_argument("--shards", type=int, default=1,
+                        help="Split the index into this many shards by stable-id hash (see scripts/serve_shards.py).")
+    parser.add_argument("--shard-by", choices=("hash", "entity_type"), default="hash",
+                        help="hash: --shards equal shards; entity_type: one shard per disease/test/drug corpus.")
+    args = parser.parse_args()
+    sharded = args.shards > 1 or args.shard_by == "entity_type"
+
     logger.info("--- Starting Step B: Build FAISS Index from Precomputed Vectors ---")
 
     # --- Load Precomputed Data ---
     logger.info(f"Step 1: Loading vectors from {VECTORS_FILE}...")
     if not VECTORS_FILE.exists():
         raise SystemExit(f"ERROR: Vectors file not found. Run generate_embeddings.py first: {VECTORS_FILE}")
+    if CHECKPOINT_FILE.exists():
+        raise SystemExit(f"ERROR: Embedding generation is unfinished ({CHECKPOINT_FILE}). Re-run generate_embeddings.py to resume it.")
     try:
-        vectors = np.load(VECTORS_FILE)
-        logger.info(f"Loaded vectors with shape: {vectors.shape}")
+        # Memory-mapped, not copied: FAISS reads float32 rows straight from the page cache
+        stored_vectors = load_vectors(VECTORS_FILE) # float16/int8 files are decoded below
+        vectors = stored_vectors.to_float32()
+        logger.info(f"Mapped vectors with shape: {vectors.shape} (stored as {stored_vectors.dtype})")
     except Exception as e:
         logger.error(f"Failed to load vectors: {e}", exc_info=True)
         raise SystemExit("Loading vectors failed.")
@@ -58,51 +131,64 @@ if __name__ == "__main__":
         raise SystemExit(f"ERROR: Embedding dimension mismatch ({vectors.shape[1]} vs {EXPECTED_DIMENSION})")
 
     # --- Build FAISS Index ---
-    logger.info(f"Step 3: Building FAISS index (IndexFlatL2 + IndexIDMap)...")
+    index_options = index_options_from_env() # FAISS_INDEX_TYPE=flat|hnsw|ivf_flat|ivf_pq|sq8
+    # Stable 64-bit IDs hashed from doc_id, so a corpus change doesn't renumber every chunk
+    chunk_key_list = chunk_keys([chunk_data.get("doc_id", f"missing_id_{i}") for i, chunk_data in enumerate(document_chunks)])
+    faiss_ids = np.asarray(assign_ids(chunk_key_list), dtype="int64")
+
+    if sharded:
+        # Shards are served by scripts/serve_shards.py; the single index and manifest are left as they are
+        logger.info(f"Step 3-5: Building {args.shard_by} shards ({index_options['index_type']}) under {SHARDS_DIR}...")
+        try:
+            write_shards(vectors, document_chunks, faiss_ids, index_options, args.shards, args.shard_by)
+        except Exception as e:
+            logger.error(f"Failed to build index shards: {e}", exc_info=True)
+            raise SystemExit("Shard building failed.")
+        logger.info("--- Step B: FAISS Index Shards Built Successfully ---")
+        raise SystemExit(0)
+
+    logger.info(f"Step 3: Building FAISS index ({index_options['index_type']}, IDs via add_with_ids)...")
     try:
-        faiss_index = faiss.IndexFlatL2(EXPECTED_DIMENSION)
-        faiss_ids = np.arange(len(vectors)) # Sequential IDs 0, 1, 2...
-        index_mapped = faiss.IndexIDMap(faiss_index)
-        index_mapped.add_with_ids(vectors.astype('float32'), faiss_ids) # Ensure float32
+        index_mapped, index_info = build_faiss_index(vectors, faiss_ids, **index_options) # float32 memmaps pass through uncopied
         logger.info(f"Successfully added {index_mapped.ntotal} vectors to FAISS index.")
     except Exception as e:
         logger.error(f"Failed to build FAISS index object: {e}", exc_info=True)
         raise SystemExit("FAISS index building failed.")
 
-    # --- Save FAISS Index ---
+    # --- Save FAISS Index (+ sidecar and re-scoring vectors for approximate types) ---
     logger.info(f"Step 4: Saving FAISS index to {FAISS_INDEX_FILE}...")
     try:
-        faiss.write_index(index_mapped, str(FAISS_INDEX_FILE))
+        write_index_artifacts(
+            index_mapped, index_info, FAISS_INDEX_FILE,
+            vectors=vectors if index_options["write_rescore_vectors"] else None, ids=faiss_ids,
+        )
         logger.info("FAISS index saved successfully.")
     except Exception as e:
         logger.error(f"Failed to save FAISS index file: {e}", exc_info=True)
         raise SystemExit("Saving FAISS index failed.")
 
-    # --- Create and Save Final Metadata Map ---
-    logger.info(f"Step 5: Creating final metadata map...")
-    final_metadata_map = {}
+    # --- Write the Chunk Store (replaces vector_metadata.json) ---
+    logger.info(f"Step 5: Writing chunk store to {CHUNK_STORE_FILE}...")
     try:
-        for i, chunk_data in enumerate(document_chunks):
-            faiss_id = i # The sequential ID used in add_with_ids
-            # Extract required fields for main.py
-            final_metadata_map[str(faiss_id)] = {
+        records = (
+            (faiss_id, {
                 "doc_id": chunk_data.get("doc_id", f"missing_id_{i}"),
                 "text": chunk_data.get("text", ""), # Store original text for LlamaIndex
                 "metadata": chunk_data.get("metadata", {}) # Store LlamaIndex metadata
-            }
-        logger.info(f"Created metadata map with {len(final_metadata_map)} entries.")
+            })
+            for i, (faiss_id, chunk_data) in enumerate(zip(faiss_ids, document_chunks))
+        )
+        record_count = write_chunk_store(CHUNK_STORE_FILE, records)
+        logger.info(f"Chunk store saved successfully with {record_count} records.")
     except Exception as e:
-        logger.error(f"Failed during metadata map creation: {e}", exc_info=True)
-        raise SystemExit("Metadata map creation failed.")
+        logger.error(f"Failed to write chunk store: {e}", exc_info=True)
+        raise SystemExit("Chunk store writing failed.")
 
-    logger.info(f"Step 6: Saving metadata map to {DOC_METADATA_FILE}...")
-    try:
-        with open(DOC_METADATA_FILE, "w", encoding="utf-8") as f:
-            json.dump(final_metadata_map, f, indent=2, ensure_ascii=False)
-        logger.info("Metadata map saved successfully.")
-    except Exception as e:
-        logger.error(f"Failed to save metadata map: {e}", exc_info=True)
-        raise SystemExit("Metadata saving failed.")
+    # --- Manifest for incremental updates (scripts/update_faiss_index.py) ---
+    write_manifest(MANIFEST_FILE, build_manifest(document_chunks, chunk_key_list, faiss_ids, EMBEDDING_MODEL_NAME, vectors.shape[1], index_info))
+
+    # --- Publish: running servers reload only now, with every file of this build in place ---
+    publish_index(OUTPUT_DIR)
 
     # --- Optional: Clean up temporary files ---
     # logger.info("Cleaning up temporary embedding files...")
@@ -0,0 +1,55 @@
+"""
+Builds the FAQ question index used by the FAQ fast path (app/services/faq_index.py).
+
+Run after build_faiss_from_vectors.py (update_faiss_index.py rebuilds it
+itself): reads the faq chunks from the chunk
+store, embeds only their question half and writes faq_index.faiss (ids are
+the chunk-store ids) plus the faq_index.json sidecar with the match
+threshold. Calibrate the threshold with
+`scripts/benchmark_retrieval.py --faq-calibration`.
+"""
+import sys
+import logging
+import argparse
+from pathlib import Path
+
+# --- Configuration ---
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(name)s - %(message)s')
+logger = logging.getLogger(__name__)
+
+# --- Paths ---
+SCRIPT_DIR = Path(__file__).resolve().parent
+PROJECT_ROOT = SCRIPT_DIR.parent.parent
+# Make the backend 'app' package importable when run as `python scripts/...`
+if str(SCRIPT_DIR.parent) not in sys.path:
+    sys.path.insert(0, str(SCRIPT_DIR.parent))
+from app.services.chunk_store import ChunkStore
+from app.services.embedding_backend import get_embedding_backend
+from app.services.faq_index import DEFAULT_FAQ_THRESHOLD, build_faq_index
+from app.services.index_manager import publish_index
+
+STORAGE_DIR = PROJECT_ROOT / "backend" / "storage"
+CHUNK_STORE_FILE = STORAGE_DIR / "vector_chunks.bin"
+
+
+# --- Main Execution ---
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Build the FAQ question index for the FAQ fast path.")
+    parser.add_argument("--threshold", type=float, default=None,
+                        help=f"Match threshold to record (default: keep the current one, else {DEFAULT_FAQ_THRESHOLD}).")
+    parser.add_argument("--backend", default=None, help="Embedding backend (default: EMBEDDING_BACKEND).")
+    parser.add_argument("--batch-size", type=int, default=64)
+    args = parser.parse_args()
+
+    if not CHUNK_STORE_FILE.exists():
+        raise SystemExit(f"ERROR: Chunk store not found. Run build_faiss_from_vectors.py first: {CHUNK_STORE_FILE}")
+
+    logger.info(f"Building the FAQ question index from {CHUNK_STORE_FILE}...")
+    chunk_store = ChunkStore(CHUNK_STORE_FILE)
+    try:
+        info = build_faq_index(STORAGE_DIR, chunk_store, get_embedding_backend(args.backend), args.batch_size, args.threshold)
+    finally:
+        chunk_store.close()
+    if info is None:
+        raise SystemExit("No faq chunks found in the chunk store.")
+    publish_index(STORAGE_DIR)
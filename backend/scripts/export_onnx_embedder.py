@@ -0,0 +1,76 @@
+import sys
+import json
+import random
+import logging
+import argparse
+from pathlib import Path
+
+# --- Configuration ---
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(name)s - %(message)s')
+logger = logging.getLogger(__name__)
+
+# --- Paths ---
+SCRIPT_DIR = Path(__file__).resolve().parent
+PROJECT_ROOT = SCRIPT_DIR.parent.parent
+# Make the backend 'app' package importable when run as `python scripts/...`
+if str(SCRIPT_DIR.parent) not in sys.path:
+    sys.path.insert(0, str(SCRIPT_DIR.parent))
+from app.services.embedding_backend import (
+    DEFAULT_ONNX_MODEL_DIR, EMBEDDING_MODEL_NAME,
+    OnnxEmbeddingBackend, TorchEmbeddingBackend, check_parity, export_onnx_model,
+)
+
+PARITY_SOURCE_FILE = PROJECT_ROOT / "backend" / "data" / "cleaned_disfaqs.json"
+# Minimum mean cosine between torch and onnx vectors before the export is accepted
+MIN_MEAN_COSINE = 0.99
+
+
+def load_parity_texts(limit):
+    """FAQ questions and answers from the shipped corpus, sampled deterministically."""
+    with open(PARITY_SOURCE_FILE, "r", encoding="utf-8") as f:
+        data = json.load(f)
+    texts = []
+    for item in data:
+        for faq in item.get("faqs", []) if isinstance(item, dict) else []:
+            if isinstance(faq, dict):
+                texts.extend(t for t in (faq.get("question"), faq.get("answer")) if t)
+    random.Random(0).shuffle(texts)
+    return texts[:limit]
+
+
+# --- Main Execution ---
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Export all-MiniLM-L6-v2 to ONNX (+int8) and check parity with PyTorch.")
+    parser.add_argument("--output-dir", default=str(DEFAULT_ONNX_MODEL_DIR))
+    parser.add_argument("--no-quantize", action="store_true", help="Skip the dynamic int8 quantized model.")
+    parser.add_argument("--parity-only", action="store_true", help="Only run the parity check on an existing export.")
+    parser.add_argument("--parity-samples", type=int, default=1000)
+    parser.add_argument("--threads", type=int, default=None)
+    args = parser.parse_args()
+
+    output_dir = Path(args.output_dir)
+    if not args.parity_only:
+        logger.info(f"Step 1: Exporting {EMBEDDING_MODEL_NAME} to {output_dir}...")
+        export_onnx_model(output_dir, quantize=not args.no_quantize)
+    else:
+        logger.info("Step 1: Skipped export (--parity-only).")
+
+    logger.info(f"Step 2: Parity check against PyTorch on {args.parity_samples} corpus texts...")
+    texts = load_parity_texts(args.parity_samples)
+    reference = TorchEmbeddingBackend(num_threads=args.threads)
+    variants = [("onnx_fp32", False)] + ([] if args.no_quantize else [("onnx_int8", True)])
+
+    report = {}
+    failed = False
+    for label, quantized in variants:
+        candidate = OnnxEmbeddingBackend(model_dir=output_dir, quantized=quantized, num_threads=args.threads)
+        report[label] = check_parity(reference, candidate, texts)
+        logger.info(f"Parity {label}: {report[label]}")
+        if report[label]["mean_cosine"] < MIN_MEAN_COSINE:
+            logger.error(f"{label} mean cosine {report[label]['mean_cosine']:.4f} is below {MIN_MEAN_COSINE}.")
+            failed = True
+
+    print(json.dumps(report, indent=2))
+    if failed:
+        raise SystemExit("Parity check failed.")
+    logger.info("--- ONNX export and parity check completed successfully ---")
@@ -1,15 +1,30 @@
+"""
+Step A of the index build: chunk the corpus and embed every chunk.
+
+Chunks stream from the shared ingestion pipeline into
+documents_with_ids.json; the chunk count then sizes a preallocated
+embeddings.npy that is filled through np.memmap one shard at a time.
+After each shard the rows are flushed and embeddings.checkpoint.json
+records it as done, so a crashed run resumes from the last completed shard
+(same documents, model and shard size) instead of starting over.
+--restart ignores the checkpoint.
+
+Texts are length-sorted within a shard so batches pad to similar lengths,
+and with the torch backend encoding is spread over --processes
+sentence-transformers worker processes. Shards are float32; with
+--vector-dtype float16|int8 (default VECTOR_STORAGE_DTYPE) the finished
+file is compacted at the end.
+"""
 import os
+import sys
 import json
-import re
+import math
 import logging
+import argparse
 from pathlib import Path
 import numpy as np
-import hashlib
 import time
 
-# ONLY import embedding model here
-from sentence_transformers import SentenceTransformer
-
 # --- Configuration ---
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(name)s - %(message)s')
 logger = logging.getLogger(__name__)
@@ -17,159 +32,173 @@ logger = logging.getLogger(__name__)
 # --- Paths ---
 SCRIPT_DIR = Path(__file__).resolve().parent
 PROJECT_ROOT = SCRIPT_DIR.parent.parent
-INPUT_DIR = PROJECT_ROOT / "backend" / "data"
+# Make the backend 'app' package importable when run as `python scripts/...`
+if str(SCRIPT_DIR.parent) not in sys.path:
+    sys.path.insert(0, str(SCRIPT_DIR.parent))
+# Embedding backend (torch or onnx) is chosen via EMBEDDING_BACKEND, same as the server
+from app.services.embedding_backend import get_embedding_backend, EMBEDDING_MODEL_NAME, EMBEDDING_DIMENSION
+from app.services.ingestion import SOURCE_ADAPTERS, batched, get_sources, iter_chunks, iter_json_array
+from app.services.vector_storage import VECTOR_DTYPES, load_vectors, vector_dtype_from_env, write_vectors
 # Temporary output for this script
 TEMP_OUTPUT_DIR = PROJECT_ROOT / "backend" / "storage" / "temp_embeddings"
 TEMP_OUTPUT_DIR.mkdir(parents=True, exist_ok=True)
 VECTORS_FILE = TEMP_OUTPUT_DIR / "embeddings.npy"
 DOCUMENTS_FILE = TEMP_OUTPUT_DIR / "documents_with_ids.json" # Store text + metadata needed by next script
+CHECKPOINT_FILE = TEMP_OUTPUT_DIR / "embeddings.checkpoint.json" # Completed shards of an unfinished run
 
 # --- Embedding Model ---
-EMBEDDING_MODEL_NAME = "sentence-transformers/all-MiniLM-L6-v2"
-EXPECTED_DIMENSION = 384
-
-# --- Helper functions ---
-def normalize_id(text, prefix):
-    # (Same robust normalize_id function)
-    original_text = str(text); text = str(text).strip().lower()
-    text = re.sub(r'\s*\(.\)\s', '', text); text = re.sub(r'[^\w\s-]', '', text)
-    text = re.sub(r'\s+', '', text); text = text.strip('')
-    if not text:
-        logger.warning(f"Generated empty ID for prefix '{prefix}' and original text '{original_text}'. Fallback needed.")
-        fallback_hash = hashlib.md5(original_text.encode()).hexdigest()[:8]
-        text = f"unnamed_{fallback_hash}"
-    return f"{prefix}:{text}"
-
-def load_json_data(filename, entity_type, name_field):
-    # (Same robust load_json_data function)
-    path = INPUT_DIR / filename; logger.info(f"Loading entity data from {path}...")
+EXPECTED_DIMENSION = EMBEDDING_DIMENSION
+
+
+def write_documents(sources, workers):
+    """Streams the sources' chunks into DOCUMENTS_FILE; returns the chunk count."""
+    tmp_path = DOCUMENTS_FILE.with_name(DOCUMENTS_FILE.name + ".tmp")
+    count = 0
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        f.write("[")
+        for chunk in iter_chunks(sources, workers=workers):
+            f.write((", " if count else "") + json.dumps(chunk, ensure_ascii=False))
+            count += 1
+        f.write("]")
+    os.replace(tmp_path, DOCUMENTS_FILE)
+    return count
+
+
+def documents_fingerprint():
+    stat = DOCUMENTS_FILE.stat()
+    return f"{stat.st_size}:{stat.st_mtime_ns}"
+
+
+def load_checkpoint(backend_name, shard_size):
+    """The checkpoint of an unfinished run that this run can continue, else None."""
+    if not CHECKPOINT_FILE.exists() or not VECTORS_FILE.exists() or not DOCUMENTS_FILE.exists():
+        return None
     try:
-        with open(path, "r", encoding="utf-8") as f: data = json.load(f)
-        count = 0;
-        if not isinstance(data, list): data = [data]
-        for item in data:
-            if isinstance(item, dict): item["type"] = entity_type; item["original_name"] = item.get(name_field, ""); count += 1
-            else: logger.warning(f"Skipping non-dictionary item in {filename}: {str(item)[:100]}...")
-        logger.info(f"Loaded {count} items of type '{entity_type}' from {filename}.")
-        return data
-    except FileNotFoundError: logger.error(f"Error: File not found at {path}"); return []
-    except json.JSONDecodeError as e: logger.error(f"Error decoding JSON from {path}: {e}"); return []
-    except Exception as e: logger.error(f"An unexpected error occurred loading {path}: {e}"); return []
-
-# --- Chunking Logic (Returns list of dictionaries) ---
-def create_document_chunks(entities):
-    chunks = [] # List to hold dictionaries: {'doc_id': str, 'text': str, 'metadata': dict}
-    logger.info(f"Creating document chunks from {len(entities)} entities...")
-    processed_count = 0; skipped_count = 0
-    for item_index, item in enumerate(entities):
-        if not isinstance(item, dict): skipped_count += 1; continue
-        original_name = item.get("original_name", ""); item_type = item.get("type", "unknown")
-        if not original_name: skipped_count +=1; continue
-        try:
-            base_id = normalize_id(original_name, item_type); url = item.get("url", "")
-            common_metadata = {'name': original_name, 'url': url, 'entity_type': item_type}
-
-            # Chunk for the Name itself
-            name_id = base_id
-            chunks.append({
-                'doc_id': name_id,
-                'text': original_name,
-                'metadata': {**common_metadata, 'type': 'name', 'doc_id': name_id}
-            })
-
-            # Chunks for Text Fields
-            for field in ["overview", "symptoms", "causes", "treatments", "prevention", "risk_factors", "complications"]:
-                val = item.get(field)
-                if not val: continue
-                if isinstance(val, list): val = " ".join(filter(None, val))
-                val_str = str(val); cleaned_text = re.sub(r'\s+', ' ', val_str).strip()
-                # Basic cleaning
-                cleaned_text = re.sub(r'\b(?:Mon|Tue|Wed|Thu|Fri|Sat|Sun),\s+\w+\s+\d{1,2},\s+\d{4}\b', '', cleaned_text)
-                cleaned_text = re.sub(r'\b(?:Symptoms & causes|Diagnosis & treatment|Diseases & Conditions)\b', '', cleaned_text, flags=re.IGNORECASE)
-                cleaned_text = re.sub(r';\s*;*', '; ', cleaned_text).strip('; '); cleaned_text = re.sub(r'\s+', ' ', cleaned_text).strip()
-                if cleaned_text:
-                    chunk_id = f"{base_id}:{field}"; context_prefix = field.replace('_',' ').title() + ": "
-                    chunks.append({
-                        'doc_id': chunk_id,
-                        'text': context_prefix + cleaned_text,
-                        'metadata': {**common_metadata, 'type': field, 'doc_id': chunk_id}
-                    })
-
-            # Chunks for Entity-Specific FAQs
-            faqs = item.get("faqs", [])
-            if isinstance(faqs, list):
-                for i, faq in enumerate(faqs):
-                    if isinstance(faq, dict):
-                        q = faq.get("question", "").strip(); a = faq.get("answer", "").strip()
-                        if q and a:
-                            text = f"Question: {q} Answer: {a}"; chunk_id = f"{base_id}:faq:{i}"
-                            chunks.append({
-                                'doc_id': chunk_id,
-                                'text': text,
-                                'metadata': {**common_metadata, 'type': 'faq', 'doc_id': chunk_id}
-                            })
-                    else: logger.warning(f"Skipping non-dictionary FAQ item within '{original_name}': {str(faq)[:100]}...")
-            elif faqs: logger.warning(f"'faqs' field in '{original_name}' is not a list: {type(faqs)}")
-            processed_count += 1
-        except Exception as e: logger.error(f"Error processing item #{item_index} ('{original_name}'): {e}", exc_info=True); skipped_count += 1
-    logger.info(f"Finished creating {len(chunks)} document chunks from {processed_count} entities. Skipped {skipped_count} items.")
-    return chunks
+        with open(CHECKPOINT_FILE, "r", encoding="utf-8") as f:
+            checkpoint = json.load(f)
+    except (OSError, json.JSONDecodeError) as e:
+        logger.warning(f"Ignoring unreadable checkpoint {CHECKPOINT_FILE}: {e}")
+        return None
+    expected = {
+        "model": EMBEDDING_MODEL_NAME, "backend": backend_name, "dimension": EXPECTED_DIMENSION,
+        "shard_size": shard_size, "documents": documents_fingerprint(),
+    }
+    mismatched = [key for key, value in expected.items() if checkpoint.get(key) != value]
+    if mismatched:
+        logger.warning(f"Checkpoint does not match this run ({', '.join(mismatched)} differ); starting over.")
+        return None
+    return checkpoint
+
+
+def save_checkpoint(checkpoint):
+    tmp_path = CHECKPOINT_FILE.with_name(CHECKPOINT_FILE.name + ".tmp")
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(checkpoint, f)
+    os.replace(tmp_path, CHECKPOINT_FILE)
+
+
+def encode_shard(model, texts, batch_size):
+    """Encodes texts shortest-first (less padding per batch) and returns rows in input order."""
+    order = np.argsort([len(text) for text in texts], kind="stable")
+    encoded = np.asarray(model.encode([texts[i] for i in order], batch_size=batch_size), dtype="float32")
+    if encoded.shape != (len(texts), EXPECTED_DIMENSION):
+        raise SystemExit(f"ERROR: Unexpected embedding shard shape {encoded.shape} for {len(texts)} chunks")
+    vectors = np.empty_like(encoded)
+    vectors[order] = encoded
+    return vectors
+
 
 # --- Main Execution ---
 if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Chunk the corpus and embed it into a checkpointed memmap.")
+    parser.add_argument("--source", action="append", default=None,
+                        help=f"Source adapter ({', '.join(SOURCE_ADAPTERS)}) or FILE:ENTITY_TYPE:NAME_FIELD "
+                             f"in backend/data (repeatable; default: all adapters whose file exists).")
+    parser.add_argument("--batch-size", type=int, default=32, help="Model batch size.")
+    parser.add_argument("--shard-size", type=int, default=8192, help="Chunks per checkpointed shard.")
+    parser.add_argument("--processes", type=int, default=os.cpu_count() or 1,
+                        help="Encoding processes for the torch backend, splitting the cores between them (default: CPU count; 1 = in-process).")
+    parser.add_argument("--workers", type=int, default=None, help="Chunking processes (default: INGEST_WORKERS or CPU count).")
+    parser.add_argument("--restart", action="store_true", help="Ignore any checkpoint and start over.")
+    parser.add_argument("--vector-dtype", choices=VECTOR_DTYPES, default=None,
+                        help="Storage format of embeddings.npy (default: VECTOR_STORAGE_DTYPE or float32).")
+    args = parser.parse_args()
+
     logger.info("--- Starting Step A: Embedding Generation ---")
 
     logger.info("Step 1: Initializing Embedding Model...")
     try:
-        # Load model ONCE
-        model = SentenceTransformer(EMBEDDING_MODEL_NAME, device='cpu') # Force CPU
-        logger.info("Embedding model initialized successfully.")
+        # Load model ONCE (CPU; torch or onnx per EMBEDDING_BACKEND)
+        model = get_embedding_backend()
+        logger.info(f"Embedding model {EMBEDDING_MODEL_NAME} initialized successfully ({model.name} backend).")
     except Exception as e:
         logger.error(f"Failed to initialize embedding model: {e}", exc_info=True)
         raise SystemExit("Embedding model init failed.")
 
-    logger.info("Step 2: Loading entities...")
-    diseases = load_json_data("mayo_all_structured.json", "disease", "disease_name")
-    tests = load_json_data("mayo_tests_all_structured.json", "test", "test_name")
-    drugs = load_json_data("mayo_drugs_structured.json", "drug", "drug_name")
-    all_entities = diseases + tests + drugs
-    if not all_entities: raise SystemExit("No entities loaded.")
-    logger.info(f"Step 2 Completed: Loaded {len(all_entities)} entities.")
-
-    logger.info("Step 3: Creating document chunks...")
-    document_chunks = create_document_chunks(all_entities) # List of dictionaries
-    if not document_chunks: raise SystemExit("No document chunks created.")
-    texts_to_embed = [chunk['text'] for chunk in document_chunks]
-    logger.info(f"Step 3 Completed: Created {len(document_chunks)} chunks.")
-
-    logger.info(f"Step 4: Generating embeddings for {len(texts_to_embed)} texts (using CPU)...")
+    checkpoint = None if args.restart else load_checkpoint(model.name, args.shard_size)
+    if checkpoint is not None:
+        logger.info(f"Step 2: Resuming from checkpoint: {checkpoint['completed_shards']} shard(s) "
+                    f"of {checkpoint['rows']} chunks already embedded.")
+        vectors = np.load(VECTORS_FILE, mmap_mode="r+")
+    else:
+        try:
+            sources = get_sources(args.source)
+        except ValueError as e:
+            raise SystemExit(f"ERROR: {e}")
+        logger.info(f"Step 2: Chunking {', '.join(source.name for source in sources)} into {DOCUMENTS_FILE}...")
+        rows = write_documents(sources, args.workers)
+        if not rows:
+            raise SystemExit("No document chunks created.")
+        # Preallocated on disk; shards are written straight into it
+        vectors = np.lib.format.open_memmap(VECTORS_FILE, mode="w+", dtype="float32", shape=(rows, EXPECTED_DIMENSION))
+        checkpoint = {
+            "model": EMBEDDING_MODEL_NAME, "backend": model.name, "dimension": EXPECTED_DIMENSION,
+            "shard_size": args.shard_size, "documents": documents_fingerprint(),
+            "rows": rows, "completed_shards": 0,
+        }
+        save_checkpoint(checkpoint)
+        logger.info(f"Step 2 Completed: {rows} chunks; vectors preallocated in {VECTORS_FILE}.")
+
+    rows, shard_size = checkpoint["rows"], checkpoint["shard_size"]
+    shard_count = math.ceil(rows / shard_size)
+    logger.info(f"Step 3: Embedding shards {checkpoint['completed_shards'] + 1}-{shard_count} (using CPU)...")
+    use_pool = args.processes > 1 and checkpoint["completed_shards"] < shard_count and model.start_multi_process_pool(args.processes)
+    if args.processes > 1 and not use_pool:
+        logger.info(f"{model.name} backend encodes in-process.")
+    start_time = time.time()
+    embedded = 0
     try:
-        # Generate embeddings (consider batching if RAM is still an issue, but maybe not needed now)
-        start_time = time.time()
-        vectors = model.encode(texts_to_embed, show_progress_bar=True, batch_size=32) # Use batches
-        end_time = time.time()
-        logger.info(f"Embedding generation completed in {end_time - start_time:.2f} seconds.")
-        vectors_np = np.array(vectors).astype("float32")
+        for shard_no, shard in enumerate(batched(iter_json_array(DOCUMENTS_FILE), shard_size)):
+            if shard_no < checkpoint["completed_shards"]:
+                continue
+            start = shard_no * shard_size
+            vectors[start:start + len(shard)] = encode_shard(model, [chunk["text"] for chunk in shard], args.batch_size)
+            vectors.flush()
+            checkpoint["completed_shards"] = shard_no + 1
+            save_checkpoint(checkpoint)
+            embedded += len(shard)
+            elapsed = time.time() - start_time
+            remaining = rows - start - len(shard)
+            logger.info(f"Shard {shard_no + 1}/{shard_count} done ({embedded / elapsed:.0f} chunks/s, "
+                        f"~{remaining * elapsed / embedded:.0f}s left).")
+    except SystemExit:
+        raise
     except Exception as e:
-        logger.error(f"Failed during embedding generation: {e}", exc_info=True)
+        logger.error(f"Failed during embedding generation (re-run to resume): {e}", exc_info=True)
         raise SystemExit("Embedding generation failed.")
-
-    if vectors_np.shape[0] != len(document_chunks):
-        raise SystemExit(f"ERROR: Mismatch in vector count ({vectors_np.shape[0]}) vs document count ({len(document_chunks)})")
-    if vectors_np.shape[1] != EXPECTED_DIMENSION:
-        raise SystemExit(f"ERROR: Embedding dimension mismatch ({vectors_np.shape[1]} vs {EXPECTED_DIMENSION})")
-
-    logger.info(f"Step 5: Saving {vectors_np.shape[0]} vectors to {VECTORS_FILE}...")
-    np.save(VECTORS_FILE, vectors_np)
-    logger.info("Vectors saved successfully.")
-
-    logger.info(f"Step 6: Saving {len(document_chunks)} document chunks/metadata to {DOCUMENTS_FILE}...")
-    try:
-        with open(DOCUMENTS_FILE, "w", encoding="utf-8") as f:
-            json.dump(document_chunks, f, ensure_ascii=False) # Save the list of chunk dicts
-        logger.info("Document chunks saved successfully.")
-    except Exception as e:
-        logger.error(f"Failed to save document chunks: {e}", exc_info=True)
-        raise SystemExit("Saving document chunks failed.")
-
-    logger.info("--- Step A: Embedding Generation Completed Successfully ---")
\ No newline at end of file
+    finally:
+        if use_pool:
+            model.stop_multi_process_pool()
+
+    if checkpoint["completed_shards"] != shard_count:
+        raise SystemExit(f"ERROR: {DOCUMENTS_FILE} holds fewer chunks than the checkpoint expects; run with --restart.")
+    del vectors
+    vector_dtype = args.vector_dtype or vector_dtype_from_env()
+    if vector_dtype != "float32":
+        logger.info(f"Compacting {VECTORS_FILE} to {vector_dtype}...")
+        write_vectors(VECTORS_FILE, load_vectors(VECTORS_FILE), dtype=vector_dtype)
+    os.remove(CHECKPOINT_FILE)
+    logger.info(f"Step 3 Completed: {rows} vectors in {VECTORS_FILE}, {rows} document chunks/metadata in {DOCUMENTS_FILE} "
+                f"({time.time() - start_time:.2f} seconds).")
+
+    logger.info("--- Step A: Embedding Generation Completed Successfully ---")
@@ -0,0 +1,233 @@
+"""
+Closed-loop load generator for the backend API.
+
+Runs fully offline against a local server started with the stand-ins and
+the answer caches off (the FakeLLM is never cached; the semantic cache
+would still answer the repeated hot questions without any synthesis):
+
+    FAKE_LLM=true FAKE_NEO4J=true FAKE_MAPS=true EMBEDDING_BACKEND=hashing \
+    LLM_CACHE_ENABLED=false SEMANTIC_CACHE_ENABLED=false \
+        python app/main.py            # or: gunicorn / uvicorn app.asgi:app
+    python scripts/load_test.py --base-url http://localhost:5050 --duration 60 --concurrency 32
+
+The run refuses to start while the server reports a cache enabled, unless
+--allow-caches is given (to measure the cached path on purpose).
+
+Each worker thread picks an endpoint from the traffic mix, sends a realistic
+request and records status and latency. Prints (and optionally writes) a JSON
+report with throughput, error rate and latency percentiles per endpoint.
+"""
+import sys
+import json
+import time
+import random
+import logging
+import argparse
+import threading
+from pathlib import Path
+from collections import defaultdict
+
+import numpy as np
+import requests
+
+# --- Configuration ---
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(name)s - %(message)s')
+logger = logging.getLogger(__name__)
+
+# --- Paths ---
+SCRIPT_DIR = Path(__file__).resolve().parent
+PROJECT_ROOT = SCRIPT_DIR.parent.parent
+QUESTIONS_SOURCE_FILE = PROJECT_ROOT / "backend" / "data" / "cleaned_disfaqs.json"
+
+DEFAULT_MIX = "chat=50,rag=25,report=15,hospitals=10"
+ENDPOINTS = {
+    "chat": "/api/chat/message",
+    "rag": "/api/rag/rag_query",
+    "report": "/api/chat/report",
+    "hospitals": "/api/misc/find_hospitals",
+}
+
+SYMPTOM_MESSAGES = (
+    "I have a headache and feel dizzy.",
+    "My stomach has been hurting since yesterday.",
+    "I've had a fever for three days.",
+    "It gets worse at night.",
+    "The pain is on the left side of my chest.",
+    "I feel tired all the time.",
+    "My throat is sore and it hurts to swallow.",
+    "I keep coughing and sometimes I feel short of breath.",
+)
+# A few popular questions repeat, like real traffic (exercises the caches)
+HOT_QUESTION_SHARE = 0.2
+HOT_QUESTIONS = 20
+
+
+def load_questions():
+    with open(QUESTIONS_SOURCE_FILE, "r", encoding="utf-8") as f:
+        data = json.load(f)
+    questions = [faq["question"] for item in data for faq in item.get("faqs", []) if faq.get("question")]
+    random.Random(0).shuffle(questions)
+    logger.info(f"Loaded {len(questions)} FAQ questions for traffic generation.")
+    return questions
+
+
+def parse_mix(mix):
+    weights = {}
+    for part in mix.split(","):
+        name, _, weight = part.partition("=")
+        name = name.strip()
+        if name not in ENDPOINTS:
+            raise SystemExit(f"Unknown endpoint '{name}' in --mix (expected {sorted(ENDPOINTS)}).")
+        weights[name] = float(weight or 1)
+    return weights
+
+
+class TrafficGenerator:
+    """Builds request bodies for each endpoint."""
+
+    def __init__(self, questions, seed):
+        self.questions = questions
+        self.rng = random.Random(seed)
+
+    def question(self):
+        if self.rng.random() < HOT_QUESTION_SHARE:
+            return self.questions[self.rng.randrange(min(HOT_QUESTIONS, len(self.questions)))]
+        return self.rng.choice(self.questions)
+
+    def history(self, turns):
+        history = []
+        for _ in range(turns):
+            history.append({"role": "user", "content": self.rng.choice(SYMPTOM_MESSAGES)})
+            history.append({"role": "assistant", "content": "How long have you felt this way?"})
+        return history
+
+    def body(self, endpoint):
+        if endpoint == "chat":
+            message = self.question() if self.rng.random() < 0.5 else self.rng.choice(SYMPTOM_MESSAGES)
+            return {"message": message, "history": self.history(self.rng.randint(0, 4))}
+        if endpoint == "rag":
+            return {"user_question": self.question()}
+        if endpoint == "report":
+            return {"history": self.history(self.rng.randint(2, 6))}
+        return {"latitude": self.rng.uniform(8.0, 30.0), "longitude": self.rng.uniform(70.0, 88.0)}
+
+
+def wait_until_ready(base_url, timeout):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            if requests.get(f"{base_url}/readyz", timeout=2).status_code == 200:
+                return True
+        except requests.RequestException:
+            pass
+        time.sleep(1)
+    return False
+
+
+def enabled_caches(base_url):
+    """Names of the answer caches the server reports as enabled."""
+    enabled = []
+    for name, path in (("semantic", "/api/rag/cache_stats"), ("llm", "/api/rag/llm_cache_stats")):
+        response = requests.get(base_url + path, timeout=5)
+        response.raise_for_status()
+        if response.json().get("enabled"):
+            enabled.append(name)
+    return enabled
+
+
+def run_load(base_url, weights, duration, concurrency, request_timeout, questions, seed=0):
+    names = list(weights)
+    cumulative = np.cumsum([weights[name] for name in names])
+    results = defaultdict(list)  # endpoint -> [(status, latency_seconds)]
+    lock = threading.Lock()
+    deadline = time.monotonic() + duration
+
+    def worker(worker_id):
+        traffic = TrafficGenerator(questions, seed + worker_id)
+        session = requests.Session()
+        while time.monotonic() < deadline:
+            endpoint = names[int(np.searchsorted(cumulative, traffic.rng.random() * cumulative[-1], side="right"))]
+            body = traffic.body(endpoint)
+            start = time.perf_counter()
+            try:
+                status = session.post(base_url + ENDPOINTS[endpoint], json=body, timeout=request_timeout).status_code
+            except requests.RequestException:
+                status = 0  # Connection error / timeout
+            latency = time.perf_counter() - start
+            with lock:
+                results[endpoint].append((status, latency))
+
+    threads = [threading.Thread(target=worker, args=(i,), daemon=True) for i in range(concurrency)]
+    started = time.monotonic()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return results, time.monotonic() - started
+
+
+def summarize(samples, elapsed):
+    if not samples:
+        return {"requests": 0}
+    statuses = [status for status, _ in samples]
+    latencies_ms = np.asarray([latency for _, latency in samples]) * 1000.0
+    errors = sum(1 for status in statuses if status == 0 or status >= 500)
+    status_counts = defaultdict(int)
+    for status in statuses:
+        status_counts[str(status)] += 1
+    return {
+        "requests": len(samples),
+        "throughput_rps": len(samples) / elapsed,
+        "error_rate": errors / len(samples),
+        "status_counts": dict(status_counts),
+        "latency_ms": {
+            "mean": float(latencies_ms.mean()),
+            **{f"p{p}": float(np.percentile(latencies_ms, p)) for p in (50, 95, 99)},
+            "max": float(latencies_ms.max()),
+        },
+    }
+
+
+# --- Main Execution ---
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Offline load generator for the chat / RAG / report / hospitals endpoints.")
+    parser.add_argument("--base-url", default="http://localhost:5050")
+    parser.add_argument("--duration", type=float, default=30.0, help="Seconds to run.")
+    parser.add_argument("--concurrency", type=int, default=16, help="Concurrent closed-loop clients.")
+    parser.add_argument("--mix", default=DEFAULT_MIX, help="Traffic mix, e.g. chat=50,rag=25,report=15,hospitals=10.")
+    parser.add_argument("--request-timeout", type=float, default=60.0)
+    parser.add_argument("--ready-timeout", type=float, default=300.0, help="Wait this long for /readyz before starting.")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--allow-caches", action="store_true",
+                        help="Run even if the server has the semantic or LLM cache enabled (results are optimistic).")
+    parser.add_argument("--output", default=None, help="Write the JSON report here (default: stdout only).")
+    args = parser.parse_args()
+
+    base_url = args.base_url.rstrip("/")
+    weights = parse_mix(args.mix)
+    logger.info(f"Waiting for {base_url}/readyz...")
+    if not wait_until_ready(base_url, args.ready_timeout):
+        sys.exit(f"Server at {base_url} did not become ready within {args.ready_timeout}s.")
+    caches = enabled_caches(base_url)
+    if caches and not args.allow_caches:
+        sys.exit(f"Server has the {' and '.join(caches)} cache enabled; restart it with LLM_CACHE_ENABLED=false "
+                 f"SEMANTIC_CACHE_ENABLED=false, or pass --allow-caches.")
+
+    logger.info(f"Running {args.duration}s with {args.concurrency} clients, mix {weights}...")
+    results, elapsed = run_load(base_url, weights, args.duration, args.concurrency, args.request_timeout,
+                                load_questions(), seed=args.seed)
+
+    report = {
+        "base_url": base_url,
+        "duration_seconds": elapsed,
+        "concurrency": args.concurrency,
+        "mix": weights,
+        "caches_enabled": caches,
+        "overall": summarize([sample for samples in results.values() for sample in samples], elapsed),
+        "endpoints": {endpoint: summarize(results.get(endpoint, []), elapsed) for endpoint in weights},
+    }
+    output = json.dumps(report, indent=2)
+    if args.output:
+        Path(args.output).write_text(output, encoding="utf-8")
+        logger.info(f"Load test report written to {args.output}.")
+    print(output)
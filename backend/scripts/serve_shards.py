@@ -0,0 +1,88 @@
+"""
+Runs the vector shard workers built by `build_faiss_from_vectors.py --shards N`.
+
+Each shard in storage/shards/shards.json is served by its own process on
+--base-port + its position in the layout. Point the app at them with the
+VECTOR_SHARD_ADDRESSES line this script logs; both sides need the same
+VECTOR_SHARD_AUTHKEY. To spread shards over several nodes, run this script
+on each node with --host 0.0.0.0 and the --shard names that node serves.
+"""
+import sys
+import json
+import time
+import signal
+import logging
+import argparse
+import multiprocessing
+from pathlib import Path
+
+# --- Configuration ---
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(name)s - %(message)s')
+logger = logging.getLogger(__name__)
+
+# --- Paths ---
+SCRIPT_DIR = Path(__file__).resolve().parent
+PROJECT_ROOT = SCRIPT_DIR.parent.parent
+# Make the backend 'app' package importable when run as `python scripts/...`
+if str(SCRIPT_DIR.parent) not in sys.path:
+    sys.path.insert(0, str(SCRIPT_DIR.parent))
+from app.services.vector_shards import SHARDS_DIRNAME, SHARD_LAYOUT_FILENAME, serve_shard, shard_authkey_from_env
+SHARDS_DIR = PROJECT_ROOT / "backend" / "storage" / SHARDS_DIRNAME
+RESTART_DELAY_SECONDS = 2 # Poll interval for crashed shard workers
+
+
+# --- Main Execution ---
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Serve vector index shards to the app over local sockets.")
+    parser.add_argument("--shards-dir", type=Path, default=SHARDS_DIR, help="Directory holding shards.json and the shard directories.")
+    parser.add_argument("--shard", action="append", default=None, help="Shard name to serve (repeatable; default: every shard).")
+    parser.add_argument("--host", default="127.0.0.1", help="Interface to listen on (0.0.0.0 to serve other nodes).")
+    parser.add_argument("--base-port", type=int, default=6100, help="Port of the first shard in the layout.")
+    args = parser.parse_args()
+
+    try:
+        shard_authkey_from_env()
+    except ValueError as e:
+        raise SystemExit(f"ERROR: {e}")
+    layout_file = args.shards_dir / SHARD_LAYOUT_FILENAME
+    if not layout_file.exists():
+        raise SystemExit(f"ERROR: No shard layout at {layout_file}. Run build_faiss_from_vectors.py --shards N first.")
+    with open(layout_file, "r", encoding="utf-8") as f:
+        layout = json.load(f)
+
+    # Ports follow the layout order, so every node agrees on where each shard lives
+    ports = {shard["name"]: args.base_port + position for position, shard in enumerate(layout["shards"])}
+    names = args.shard or list(ports)
+    unknown = [name for name in names if name not in ports]
+    if unknown:
+        raise SystemExit(f"ERROR: Unknown shard(s) {', '.join(unknown)}; layout has {', '.join(ports)}.")
+
+    def start_worker(name):
+        process = multiprocessing.Process(
+            target=serve_shard, args=(args.shards_dir / name, (args.host, ports[name]), name),
+            name=f"shard-{name}", daemon=True,
+        )
+        process.start()
+        return process
+
+    processes = {name: start_worker(name) for name in names}
+    advertised = "127.0.0.1" if args.host in ("127.0.0.1", "0.0.0.0") else args.host
+    logger.info(f"Serving {len(processes)} shard(s) ({layout['shard_by']}). "
+                f"VECTOR_SHARD_ADDRESSES={','.join(f'{advertised}:{ports[name]}' for name in names)}")
+
+    # systemd / docker stop send SIGTERM; exit through the finally below so the workers go too
+    signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+    try:
+        while True:
+            time.sleep(RESTART_DELAY_SECONDS)
+            # The app skips a missing shard, so a crashed worker is restarted without touching the others
+            for name, process in processes.items():
+                if not process.is_alive():
+                    logger.error(f"Shard worker {name} exited with code {process.exitcode}; restarting it.")
+                    processes[name] = start_worker(name)
+    except KeyboardInterrupt:
+        logger.info("Stopping shard workers...")
+    finally:
+        for process in processes.values():
+            if process.is_alive():
+                process.terminate()
@@ -0,0 +1,217 @@
+"""
+Incremental index build: re-embeds only new or changed chunks.
+
+Chunks the corpus with the shared ingestion pipeline (app/services/ingestion.py),
+then compares it with
+storage/vector_manifest.json (written by every build):
+
+  - new / changed text  -> embedded, old vector removed (remove_ids), new one added (add_with_ids)
+  - deleted chunks      -> removed from the index
+  - metadata-only edits -> chunk-store record rewritten, no embedding
+
+Ids are stable 64-bit hashes of doc_id, so unchanged chunks keep their ids.
+The FAQ question index is rebuilt after every update, and everything is
+published together (index_manager.publish_index).
+The first run (no manifest), a changed embedding model or index type, or
+--full does a complete build instead.
+
+    python scripts/update_faiss_index.py            # nightly refresh
+    python scripts/update_faiss_index.py --dry-run  # only print the plan
+"""
+import sys
+import time
+import logging
+import argparse
+from pathlib import Path
+
+import numpy as np
+import faiss
+
+# --- Configuration ---
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(name)s - %(message)s')
+logger = logging.getLogger(__name__)
+
+# --- Paths ---
+SCRIPT_DIR = Path(__file__).resolve().parent
+PROJECT_ROOT = SCRIPT_DIR.parent.parent
+# Make the backend 'app' package importable when run as `python scripts/...`
+if str(SCRIPT_DIR.parent) not in sys.path:
+    sys.path.insert(0, str(SCRIPT_DIR.parent))
+from app.services.chunk_store import ChunkStore, write_chunk_store
+from app.services.embedding_backend import get_embedding_backend, EMBEDDING_MODEL_NAME, EMBEDDING_DIMENSION
+from app.services.faiss_factory import build_faiss_index, index_options_from_env, read_index_info, write_index_artifacts
+from app.services.index_manifest import (
+    MANIFEST_FILENAME, assign_ids, build_manifest, chunk_keys, load_manifest, plan_update, write_manifest
+)
+from app.services.faq_index import build_faq_index
+from app.services.index_manager import publish_index
+from app.services.ingestion import SOURCE_ADAPTERS, get_sources, iter_chunks
+from app.services.vector_storage import load_vectors
+
+STORAGE_DIR = PROJECT_ROOT / "backend" / "storage"
+FAISS_INDEX_FILE = STORAGE_DIR / "vector_index.faiss"
+CHUNK_STORE_FILE = STORAGE_DIR / "vector_chunks.bin"
+MANIFEST_FILE = STORAGE_DIR / MANIFEST_FILENAME
+
+# Parameters build_faiss_index() needs to rebuild an index like the current one
+_REBUILD_KEYS = ("index_type", "nlist", "pq_m", "pq_nbits", "hnsw_m", "ef_construction")
+
+
+def load_corpus(source_specs):
+    try:
+        chunks = list(iter_chunks(get_sources(source_specs)))
+    except ValueError as e:
+        raise SystemExit(f"ERROR: {e}")
+    if not chunks:
+        raise SystemExit("No document chunks created.")
+    return chunks
+
+
+def embed(backend, texts, batch_size):
+    if not texts:
+        return np.zeros((0, EMBEDDING_DIMENSION), dtype="float32")
+    start = time.perf_counter()
+    vectors = np.asarray(backend.encode(texts, batch_size=batch_size), dtype="float32")
+    logger.info(f"Embedded {len(texts)} chunks in {time.perf_counter() - start:.1f}s.")
+    if vectors.shape[1] != EMBEDDING_DIMENSION:
+        raise SystemExit(f"ERROR: Embedding dimension mismatch ({vectors.shape[1]} vs {EMBEDDING_DIMENSION})")
+    return vectors
+
+
+def chunk_records(chunks, ids):
+    return (
+        (faiss_id, {"doc_id": chunk.get("doc_id"), "text": chunk.get("text", ""), "metadata": chunk.get("metadata", {})})
+        for faiss_id, chunk in zip(ids, chunks)
+    )
+
+
+def full_build(chunks, keys, ids, backend, batch_size):
+    index_options = index_options_from_env()
+    vectors = embed(backend, [chunk["text"] for chunk in chunks], batch_size)
+    index, info = build_faiss_index(vectors, ids, **index_options)
+    write_index_artifacts(index, info, FAISS_INDEX_FILE,
+                          vectors=vectors if index_options["write_rescore_vectors"] else None, ids=ids)
+    write_chunk_store(CHUNK_STORE_FILE, chunk_records(chunks, ids))
+    write_manifest(MANIFEST_FILE, build_manifest(chunks, keys, ids, EMBEDDING_MODEL_NAME, EMBEDDING_DIMENSION, info))
+
+
+def merge_rescore_vectors(info, all_ids, new_ids, new_vectors):
+    """
+    Re-scoring vectors for the updated corpus in ascending id order: kept
+    rows come from the current file (matched through the old chunk store's
+    ids), embedded rows from new_vectors. None when the index has none.
+    """
+    rescore_file = info.get("rescore_vectors")
+    if not rescore_file or not (STORAGE_DIR / rescore_file).exists():
+        return None
+    old_store = ChunkStore(CHUNK_STORE_FILE)
+    old_ids = np.array(old_store.ids)
+    old_store.close()
+    old_vectors = load_vectors(STORAGE_DIR / rescore_file)  # Decoded to float32 rows on read
+
+    sorted_ids = np.sort(all_ids)
+    merged = np.zeros((len(sorted_ids), old_vectors.shape[1]), dtype="float32")
+    filled = np.zeros(len(sorted_ids), dtype=bool)
+    positions = np.minimum(np.searchsorted(old_ids, sorted_ids), max(len(old_ids) - 1, 0))
+    kept = old_ids[positions] == sorted_ids if len(old_ids) else filled.copy()
+    merged[kept] = old_vectors[positions[kept]]
+    filled |= kept
+    new_rows = np.searchsorted(sorted_ids, new_ids)
+    merged[new_rows] = new_vectors
+    filled[new_rows] = True
+    del old_vectors  # Drop the mmap before the file is rewritten
+    if not filled.all():
+        raise SystemExit(f"ERROR: {int((~filled).sum())} chunks have no stored vector; run with --full.")
+    return merged
+
+
+def incremental_update(chunks, keys, ids, plan, backend, batch_size):
+    info = read_index_info(FAISS_INDEX_FILE)
+    index = faiss.read_index(str(FAISS_INDEX_FILE))
+    new_ids = np.asarray([ids[row] for row in plan.to_embed], dtype="int64")
+    new_vectors = embed(backend, [chunks[row]["text"] for row in plan.to_embed], batch_size)
+    all_ids = np.asarray(ids, dtype="int64")
+    rescore_vectors = merge_rescore_vectors(info, all_ids, new_ids, new_vectors)
+
+    # Added ids are removed too, so re-running after an interrupted update can't duplicate vectors
+    stale_ids = np.asarray(plan.removed_ids + new_ids.tolist(), dtype="int64")
+    try:
+        removed = index.remove_ids(stale_ids) if len(stale_ids) else 0
+        if len(new_ids):
+            index.add_with_ids(new_vectors, new_ids)
+        logger.info(f"Removed {removed} vectors and added {len(new_ids)} in place ({info.get('index_type', 'flat')} index).")
+    except RuntimeError as e:
+        # HNSW graphs don't support removal: rebuild from the stored vectors, still without re-embedding
+        if rescore_vectors is None:
+            raise SystemExit(f"ERROR: index does not support remove_ids ({e}) and no stored vectors exist; run with --full.")
+        logger.warning(f"Index does not support remove_ids ({e}); rebuilding it from stored vectors.")
+        rebuild_options = {key: info[key] for key in _REBUILD_KEYS if key in info}
+        index, info = build_faiss_index(rescore_vectors, np.sort(all_ids), **rebuild_options)
+
+    info["ntotal"] = int(index.ntotal)
+    write_index_artifacts(index, info, FAISS_INDEX_FILE,
+                          vectors=rescore_vectors, ids=np.sort(all_ids) if rescore_vectors is not None else None)
+    # Records are rewritten for every chunk; this is where metadata-only edits land
+    write_chunk_store(CHUNK_STORE_FILE, chunk_records(chunks, ids))
+    write_manifest(MANIFEST_FILE, build_manifest(chunks, keys, ids, EMBEDDING_MODEL_NAME, EMBEDDING_DIMENSION, info))
+
+
+def incremental_blocker(manifest):
+    """Why an incremental update isn't possible (None when it is)."""
+    if manifest is None:
+        return "no manifest from a previous build"
+    if not FAISS_INDEX_FILE.exists() or not CHUNK_STORE_FILE.exists():
+        return "index or chunk store missing"
+    if manifest.get("embedding_model") != EMBEDDING_MODEL_NAME or manifest.get("dimension") != EMBEDDING_DIMENSION:
+        return f"embedding model changed ({manifest.get('embedding_model')} -> {EMBEDDING_MODEL_NAME})"
+    if manifest.get("index_type") != index_options_from_env()["index_type"]:
+        return f"index type changed ({manifest.get('index_type')} -> {index_options_from_env()['index_type']})"
+    return None
+
+
+# --- Main Execution ---
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Incrementally update the FAISS index and chunk store.")
+    parser.add_argument("--source", action="append", default=None,
+                        help=f"Source adapter ({', '.join(SOURCE_ADAPTERS)}) or FILE:ENTITY_TYPE:NAME_FIELD "
+                             f"in backend/data (repeatable; default: all adapters whose file exists).")
+    parser.add_argument("--full", action="store_true", help="Ignore the manifest and rebuild everything.")
+    parser.add_argument("--dry-run", action="store_true", help="Print the update plan without writing anything.")
+    parser.add_argument("--batch-size", type=int, default=32)
+    args = parser.parse_args()
+
+    started = time.perf_counter()
+    STORAGE_DIR.mkdir(parents=True, exist_ok=True)
+    chunks = load_corpus(args.source)
+    keys = chunk_keys([chunk.get("doc_id", f"missing_id_{row}") for row, chunk in enumerate(chunks)])
+    ids = assign_ids(keys)
+    logger.info(f"Corpus: {len(chunks)} chunks.")
+
+    manifest = None if args.full else load_manifest(MANIFEST_FILE)
+    blocker = "--full" if args.full else incremental_blocker(manifest)
+    if blocker is not None:
+        logger.info(f"Full build ({blocker}).")
+        if args.dry_run:
+            sys.exit(0)
+        full_build(chunks, keys, ids, get_embedding_backend(), args.batch_size)
+    else:
+        plan = plan_update(manifest, chunks, keys)
+        logger.info(f"Update plan: {plan.summary()}.")
+        if args.dry_run:
+            sys.exit(0)
+        if not (plan.to_embed or plan.removed_ids or plan.metadata_only):
+            logger.info("Index is up to date; nothing to do.")
+            sys.exit(0)
+        incremental_update(chunks, keys, ids, plan, get_embedding_backend() if plan.to_embed else None, args.batch_size)
+
+    # The FAQ index maps to chunk-store ids, so it is rebuilt with every update (it only embeds the questions)
+    chunk_store = ChunkStore(CHUNK_STORE_FILE)
+    try:
+        build_faq_index(STORAGE_DIR, chunk_store, get_embedding_backend(), args.batch_size)
+    finally:
+        chunk_store.close()
+
+    # Running servers reload only now, with the index, chunk store, manifest and FAQ index of this update all in place
+    publish_index(STORAGE_DIR)
+
+    logger.info(f"Index update finished in {time.perf_counter() - started:.1f}s.")
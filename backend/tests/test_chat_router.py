@@ -0,0 +1,40 @@
+import pytest
+
+from app.services.chat_router import RAG, SYMPTOM, keyword_route
+
+# None: no rule is sure, so the embedding classifier (then the LLM router) decides
+KEYWORD_ROUTES = [
+    # Greetings open a symptom conversation
+    ("Hello", SYMPTOM),
+    ("thanks!", SYMPTOM),
+    # First-person symptom reports
+    ("I have a headache and feel dizzy", SYMPTOM),
+    ("My stomach has been hurting since yesterday", SYMPTOM),
+    ("I've had a fever for three days", SYMPTOM),
+    ("It makes me dizzy when I stand up", SYMPTOM),
+    # Factual questions, including ones that name a symptom or say "me"
+    ("What is an MRI?", RAG),
+    ("What are the symptoms of asthma?", RAG),
+    ("How is pneumonia treated?", RAG),
+    ("Define hypertension", RAG),
+    ("Tell me about fever", RAG),
+    ("Tell me about migraine pain", RAG),
+    ("Can you explain to me what a headache is?", RAG),
+    ("Could you tell me about Lyme disease?", RAG),
+    # Ambiguous or rule-free messages are deferred
+    ("What does it mean if I feel dizzy?", None),
+    ("What is wrong with my knee, it hurts", None),
+    ("Is hepatitis B contagious?", None),
+    ("It started two days ago", None),
+    # Questions that mention a symptom in the first person ask for information, not triage
+    ("How do I treat a fever?", None),
+    ("Can I take ibuprofen for a headache?", None),
+    ("Should I feel worried about high cholesterol?", None),
+    ("What should I do if my child has a rash?", None),
+    ("I have a rash, is that serious?", None),
+]
+
+
+@pytest.mark.parametrize("message, expected", KEYWORD_ROUTES)
+def test_keyword_route(message, expected):
+    assert keyword_route(message) == expected
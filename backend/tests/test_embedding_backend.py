@@ -0,0 +1,32 @@
+import asyncio
+import time
+
+from app.services.embedding_backend import BackendEmbedding, HashingEmbeddingBackend
+
+
+class SlowBackend(HashingEmbeddingBackend):
+    def encode(self, texts, batch_size=32, show_progress_bar=False):
+        time.sleep(0.2)
+        return super().encode(texts, batch_size=batch_size)
+
+
+def test_async_query_embedding_leaves_event_loop_free():
+    embed_model = BackendEmbedding(SlowBackend())
+
+    async def main():
+        ticks = 0
+
+        async def ticker():
+            nonlocal ticks
+            while True:
+                await asyncio.sleep(0.01)
+                ticks += 1
+
+        task = asyncio.create_task(ticker())
+        vector = await embed_model.aget_query_embedding("What is an MRI?")
+        task.cancel()
+        return vector, ticks
+
+    vector, ticks = asyncio.run(main())
+    assert len(vector) == embed_model.backend.dimension
+    assert ticks >= 5
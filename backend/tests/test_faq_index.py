@@ -0,0 +1,39 @@
+import json
+
+import faiss
+
+from app.services.chunk_store import ChunkStore, write_chunk_store
+from app.services.embedding_backend import get_embedding_backend
+from app.services.faq_index import FAQ_INDEX_FILENAME, FAQ_INFO_FILENAME, build_faq_index
+
+
+def faq(question, answer):
+    return {"doc_id": question, "text": f"Question: {question} Answer: {answer}", "metadata": {"type": "faq"}}
+
+
+def build(tmp_path, records):
+    write_chunk_store(tmp_path / "vector_chunks.bin", records)
+    chunk_store = ChunkStore(tmp_path / "vector_chunks.bin")
+    try:
+        return build_faq_index(tmp_path, chunk_store, get_embedding_backend("hashing"))
+    finally:
+        chunk_store.close()
+
+
+def test_rebuild_keeps_threshold_and_follows_chunk_ids(tmp_path):
+    build(tmp_path, [(11, faq("What is flu?", "A virus.")), (12, {"doc_id": "p", "text": "prose", "metadata": {}})])
+    info_path = tmp_path / FAQ_INFO_FILENAME
+    info = json.loads(info_path.read_text())
+    info["threshold"] = 0.8
+    info_path.write_text(json.dumps(info))
+
+    info = build(tmp_path, [(21, faq("What is flu?", "A virus.")), (22, faq("What is a cold?", "Also a virus."))])
+    assert info["threshold"] == 0.8 and info["questions"] == 2
+    index = faiss.read_index(str(tmp_path / FAQ_INDEX_FILENAME))
+    assert sorted(faiss.vector_to_array(index.id_map)) == [21, 22]
+
+
+def test_no_faq_chunks_removes_stale_index(tmp_path):
+    build(tmp_path, [(11, faq("What is flu?", "A virus."))])
+    assert build(tmp_path, [(12, {"doc_id": "p", "text": "prose", "metadata": {}})]) is None
+    assert not (tmp_path / FAQ_INDEX_FILENAME).exists() and not (tmp_path / FAQ_INFO_FILENAME).exists()
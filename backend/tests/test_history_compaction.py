@@ -0,0 +1,48 @@
+from app.models import ChatMessage
+from app.services.history_compaction import NURSE, ConversationSummary, compact_history, count_tokens, format_messages
+
+HISTORY = [
+    ChatMessage(role="user", content="I'm 67, diabetic, on warfarin, coughing up blood"),
+    ChatMessage(role="assistant", content="How long has this been going on?"),
+    ChatMessage(role="user", content="For two days"),
+    ChatMessage(role="assistant", content="Any fever?"),
+    ChatMessage(role="user", content="No"),
+    ChatMessage(role="assistant", content="Any chest pain?"),
+    ChatMessage(role="user", content="A little, it's sharp"),
+    ChatMessage(role="assistant", content="Thank you."),
+]
+
+
+def test_history_within_budget_stays_verbatim():
+    assert compact_history(HISTORY, NURSE, "s1") == format_messages(HISTORY)
+
+
+def test_over_budget_folds_only_the_oldest_messages():
+    text = compact_history(HISTORY, NURSE, "s2", budget=60)
+    assert count_tokens(text) <= 60
+    assert text.startswith("Summary of the 6 earlier messages:")
+    assert text.endswith(format_messages(HISTORY[-2:]))
+
+
+def test_summary_keeps_background_facts():
+    text = compact_history(HISTORY, NURSE, "s3", budget=45)
+    assert count_tokens(text) <= 45
+    for fact in ("67", "diabetic", "warfarin", "coughing up blood"):
+        assert fact in text
+
+
+def test_fold_point_resumes_on_the_next_turn():
+    first = compact_history(HISTORY, NURSE, "s4", budget=60)
+    longer = HISTORY + [ChatMessage(role="user", content="It started after a cold")]
+    second = compact_history(longer, NURSE, "s4", budget=60)
+    assert second == compact_history(longer, NURSE, None, budget=60)
+    assert first != second
+
+
+def test_allergies_are_not_listed_as_medications():
+    summary = ConversationSummary().update([
+        ChatMessage(role="user", content="I am 45 years old, allergic to penicillin, taking lisinopril and atorvastatin"),
+    ])
+    assert summary.items["age"] == ["45"]
+    assert summary.items["allergies"] == ["penicillin"]
+    assert summary.items["medications"] == ["lisinopril", "atorvastatin"]
@@ -0,0 +1,180 @@
+import os
+
+import pytest
+
+from app.services.atomic_files import atomic_path
+from app.services.index_manager import IndexManager, check_published, publish_fingerprint, publish_index, storage_fingerprint
+
+
+class FakeIndex:
+    def __init__(self, name):
+        self.name = name
+        self.ntotal = 1
+        self.closed = False
+
+    def close(self):
+        self.closed = True
+
+
+def make_manager(tmp_path, **kwargs):
+    built = []
+
+    def loader():
+        built.append(FakeIndex(f"gen{len(built) + 1}"))
+        return built[-1]
+
+    return IndexManager(tmp_path, loader, **kwargs), built
+
+
+def touch(path, data=b"x"):
+    with open(path, "ab") as f:
+        f.write(data)
+
+
+def test_fingerprint_covers_index_artifacts_only(tmp_path):
+    touch(tmp_path / "vector_index.faiss")
+    touch(tmp_path / "vector_chunks.bin")
+    before = storage_fingerprint(tmp_path)
+
+    # Runtime files and build scratch space in storage/ must not look like a new index
+    touch(tmp_path / "llm_cache.sqlite3")
+    touch(tmp_path / "llm_cache.sqlite3-wal")
+    touch(tmp_path / "sessions.sqlite3")
+    (tmp_path / "temp_embeddings").mkdir()
+    touch(tmp_path / "temp_embeddings" / "embeddings.npy")
+    assert storage_fingerprint(tmp_path) == before
+
+    touch(tmp_path / "vector_chunks.bin")
+    assert storage_fingerprint(tmp_path) != before
+
+
+def test_fingerprint_sees_new_and_removed_artifacts(tmp_path):
+    touch(tmp_path / "vector_index.faiss")
+    before = storage_fingerprint(tmp_path)
+    touch(tmp_path / "faq_index.faiss")
+    with_faq = storage_fingerprint(tmp_path)
+    assert with_faq != before
+    os.remove(tmp_path / "faq_index.faiss")
+    assert storage_fingerprint(tmp_path) == before
+
+
+def test_swap_closes_unleased_generation_immediately(tmp_path):
+    manager, built = make_manager(tmp_path)
+    first = manager.load("startup")
+    second = manager.load("reload")
+
+    assert manager.current is second
+    assert first.closed and not second.closed
+    assert manager.stats()["retired"] == []
+    assert manager.swaps == 2
+
+
+def test_leased_generation_survives_swap_until_released(tmp_path):
+    manager, built = make_manager(tmp_path)
+    manager.load("startup")
+
+    with manager.lease() as leased:
+        new = manager.load("reload")
+        assert manager.current is new
+        assert leased is built[0] and not leased.closed
+        assert [g["generation"] for g in manager.stats()["retired"]] == [1]
+
+    assert built[0].closed
+    assert manager.stats()["retired"] == []
+
+
+def test_reload_waits_for_retired_generation_to_drain(tmp_path):
+    manager, built = make_manager(tmp_path, drain_timeout=0.05)
+    manager.load("startup")
+
+    with manager.lease():
+        manager.load("reload")
+        # Generation 1 is still leased: a third generation would make three alive at once
+        assert manager.load("another") is None
+        assert manager.failed_reloads == 1
+        assert manager.last_reload["status"] == "failed"
+        assert manager.current is built[1]
+
+    assert manager.load("another") is built[2]
+
+
+def test_failed_verification_keeps_current_generation(tmp_path):
+    def verifier(index):
+        if index.name != "gen1":
+            raise ValueError("probe query returned no chunks")
+
+    manager, built = make_manager(tmp_path, verifier=verifier)
+    first = manager.load("startup")
+    assert manager.load("reload") is None
+
+    assert manager.current is first and not first.closed
+    assert built[1].closed  # The rejected index is released
+    assert manager.failed_reloads == 1
+
+
+def test_swap_listeners_see_new_index(tmp_path):
+    manager, _ = make_manager(tmp_path)
+    seen = []
+    manager.add_listener(seen.append)
+    index = manager.load("startup")
+    assert seen == [index]
+
+
+@pytest.mark.parametrize("max_overhead_bytes, expect_swap", [(0, True), (4, False), (1024, True)])
+def test_overhead_cap_refuses_oversized_reload(tmp_path, max_overhead_bytes, expect_swap):
+    heap_file = tmp_path / "vector_index.faiss"
+    heap_file.write_bytes(b"0123456789")
+    manager, built = make_manager(tmp_path, heap_files=[heap_file], max_overhead_bytes=max_overhead_bytes)
+    manager.load("startup")  # The first load is never capped
+
+    result = manager.load("reload")
+    assert (result is not None) == expect_swap
+    assert manager.current is (built[1] if expect_swap else built[0])
+
+
+def test_watcher_fingerprint_ignores_unpublished_artifacts(tmp_path):
+    touch(tmp_path / "vector_index.faiss")
+    publish_index(tmp_path)
+    published = publish_fingerprint(tmp_path)
+
+    # A build half-way through its files must not trigger a reload
+    touch(tmp_path / "vector_chunks.bin")
+    assert publish_fingerprint(tmp_path) == published
+    with pytest.raises(ValueError):
+        check_published(tmp_path)
+
+    publish_index(tmp_path)
+    assert publish_fingerprint(tmp_path) != published
+    check_published(tmp_path)
+
+
+def test_reload_refused_while_artifacts_differ_from_publish(tmp_path):
+    touch(tmp_path / "vector_index.faiss")
+    publish_index(tmp_path)
+    manager, built = make_manager(tmp_path)
+    first = manager.load("startup")
+
+    touch(tmp_path / "vector_index.faiss")
+    assert manager.load("reload") is None
+    assert manager.current is first and manager.failed_reloads == 1
+
+    publish_index(tmp_path)
+    assert manager.load("reload") is built[-1] is manager.current
+
+
+def test_atomic_path_leaves_target_untouched_on_error(tmp_path):
+    target = tmp_path / "vector_index.faiss"
+    target.write_bytes(b"old")
+    with pytest.raises(RuntimeError):
+        with atomic_path(target) as tmp_name:
+            with open(tmp_name, "wb") as f:
+                f.write(b"partial")
+            raise RuntimeError("build failed")
+    assert target.read_bytes() == b"old"
+    assert os.listdir(tmp_path) == ["vector_index.faiss"]
+
+    with atomic_path(target) as tmp_name:
+        with open(tmp_name, "wb") as f:
+            f.write(b"new")
+    assert target.read_bytes() == b"new"
+    assert os.listdir(tmp_path) == ["vector_index.faiss"]
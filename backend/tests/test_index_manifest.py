@@ -0,0 +1,65 @@
+import os
+import stat
+
+from app.services.index_manifest import (
+    assign_ids, build_manifest, chunk_keys, load_manifest, plan_update, stable_id, write_manifest,
+)
+
+
+def chunk(text, **metadata):
+    return {"text": text, "metadata": metadata}
+
+
+def manifest_for(chunks, doc_ids):
+    keys = chunk_keys(doc_ids)
+    return build_manifest(chunks, keys, assign_ids(keys), "model", 4, {"index_type": "flat"})
+
+
+def test_chunk_keys_suffix_repeated_doc_ids():
+    assert chunk_keys(["a", "b", "a", "a"]) == ["a", "b", "a#1", "a#2"]
+
+
+def test_stable_ids_are_deterministic_and_non_negative():
+    assert stable_id("doc-1") == stable_id("doc-1")
+    assert stable_id("doc-1") != stable_id("doc-2")
+    assert all(0 <= faiss_id < 2 ** 63 for faiss_id in assign_ids(chunk_keys(["a", "a", "b"])))
+
+
+def test_plan_update_classifies_rows():
+    old_chunks = [chunk("flu text", name="Flu"), chunk("cold text", name="Cold"),
+                  chunk("acne text", name="Acne"), chunk("gout text", name="Gout")]
+    manifest = manifest_for(old_chunks, ["flu", "cold", "acne", "gout"])
+
+    new_chunks = [
+        chunk("flu text", name="Flu"),             # unchanged
+        chunk("cold text, revised", name="Cold"),  # text changed
+        chunk("acne text", name="Acne (vulgaris)"),  # metadata only
+        chunk("mumps text", name="Mumps"),         # new
+    ]
+    plan = plan_update(manifest, new_chunks, chunk_keys(["flu", "cold", "acne", "mumps"]))
+
+    assert plan.unchanged == [0]
+    assert plan.changed == [1]
+    assert plan.metadata_only == [2]
+    assert plan.added == [3]
+    assert plan.to_embed == [3, 1]
+    assert plan.removed_ids == [stable_id("gout")]
+
+
+def test_plan_update_against_empty_manifest_adds_everything():
+    plan = plan_update({}, [chunk("a"), chunk("b")], ["a", "b"])
+    assert plan.added == [0, 1]
+    assert plan.removed_ids == []
+
+
+def test_write_manifest_round_trips_with_readable_mode(tmp_path):
+    path = tmp_path / "vector_manifest.json"
+    manifest = manifest_for([chunk("flu text")], ["flu"])
+    old_umask = os.umask(0o022)
+    try:
+        write_manifest(path, manifest)
+    finally:
+        os.umask(old_umask)
+    assert load_manifest(path) == manifest
+    assert stat.S_IMODE(os.stat(path).st_mode) == 0o644
+    assert not [name for name in os.listdir(tmp_path) if name.endswith(".tmp")]
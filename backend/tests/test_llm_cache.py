@@ -0,0 +1,51 @@
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+from app.services import chat_service
+from app.services.fakes import FakeLLM
+from app.services.llm_cache import CachedLLM, SQLitePromptCache
+
+
+class CountingLLM(FakeLLM):
+    calls: int = 0
+
+    def complete(self, prompt, formatted=False, **kwargs):
+        self.calls += 1
+        return super().complete(prompt, formatted=formatted, **kwargs)
+
+
+@pytest.fixture
+def cached_llm(tmp_path):
+    llm = CountingLLM(latency_ms=0.0, latency_sigma=0.0)
+    return llm, CachedLLM(llm, SQLitePromptCache(tmp_path / "llm_cache.sqlite3"))
+
+
+@pytest.fixture
+def report_pool(monkeypatch):
+    pool = ThreadPoolExecutor(max_workers=2)
+    monkeypatch.setattr(chat_service, "_report_executor", pool)
+    yield pool
+    pool.shutdown(wait=True)
+
+
+def test_cached_site_reaches_llm_once(cached_llm, monkeypatch):
+    monkeypatch.delenv("LLM_CACHE_BYPASS_SITES", raising=False)
+    llm, cached = cached_llm
+    for _ in range(3):
+        chat_service._llm_route(cached, "What is an MRI?", "")
+    assert llm.calls == 1
+
+
+def test_opted_out_site_always_reaches_llm(cached_llm, report_pool, monkeypatch):
+    monkeypatch.setenv("LLM_CACHE_BYPASS_SITES", "router, report")
+    llm, cached = cached_llm
+    for _ in range(3):
+        chat_service._llm_route(cached, "What is an MRI?", "")
+    assert llm.calls == 3
+
+    # Report sections run on pool threads and still honour the opt-out
+    for _ in range(2):
+        chat_service.generate_report_sections(cached, "user: I have a headache")
+    assert llm.calls == 3 + 2 * len(chat_service.REPORT_SECTIONS)
+    assert cached.cache.stats()["hits"] == 0
@@ -0,0 +1,58 @@
+import pytest
+
+from app.services import query_engines
+from app.services.query_engines import EngineConfig, QueryEngineRegistry
+
+
+class Index:
+    pass
+
+
+@pytest.fixture
+def builds(monkeypatch):
+    built = []
+
+    def fake_build(vector_index, kg_index, config):
+        built.append((vector_index, kg_index, config))
+        return object()
+
+    monkeypatch.setattr(query_engines, "build_query_engine", fake_build)
+    return built
+
+
+def test_engines_are_reused_per_config(builds):
+    registry = QueryEngineRegistry()
+    vector, kg = Index(), Index()
+    engine = registry.get(vector, kg)
+    assert registry.get(vector, kg) is engine
+    assert registry.get(vector, kg, EngineConfig(top_k=3)) is not engine
+    assert len(builds) == 2
+
+
+def test_retired_generation_does_not_evict_current_engines(builds):
+    registry = QueryEngineRegistry()
+    old, new, kg = Index(), Index(), Index()
+    registry.swap_vector_index(old)
+    registry.get(old, kg)
+
+    registry.swap_vector_index(new)
+    current = registry.get(new, kg)
+    # Requests still leasing the old generation interleave with new ones
+    for _ in range(3):
+        assert registry.get(old, kg) is not current
+        assert registry.get(new, kg) is current
+
+    new_builds = [b for b in builds if b[0] is new]
+    assert len(new_builds) == 1
+    assert len(builds) == 1 + 1 + 3  # old (cached), new (cached), three uncached builds on old
+
+
+def test_kg_index_change_rebuilds(builds):
+    registry = QueryEngineRegistry()
+    vector = Index()
+    registry.swap_vector_index(vector)
+    registry.get(vector, None)
+    kg = Index()
+    engine = registry.get(vector, kg)
+    assert registry.get(vector, kg) is engine
+    assert len(builds) == 2
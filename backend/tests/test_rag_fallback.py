@@ -0,0 +1,62 @@
+import pytest
+
+from app.services import rag_service
+from app.services.rag_service import LLMSynthesisError
+
+
+class FailingEngine:
+    """Query engine whose LLM call fails, up front or after some streamed tokens."""
+
+    def __init__(self, tokens_before_error=None):
+        self.tokens_before_error = tokens_before_error
+
+    def query(self, query_bundle):
+        if self.tokens_before_error is None:
+            raise ConnectionError("LLM unreachable")
+        return StreamingResponse(self.tokens_before_error)
+
+
+class StreamingResponse:
+    source_nodes = []
+
+    def __init__(self, tokens):
+        self.tokens = tokens
+
+    @property
+    def response_gen(self):
+        for n in range(self.tokens):
+            yield f"t{n} "
+        raise TimeoutError("LLM stream timed out")
+
+
+@pytest.fixture
+def engine(monkeypatch):
+    def use(query_engine):
+        monkeypatch.setattr(rag_service, "semantic_answer_cache", None)
+        monkeypatch.setattr(rag_service.query_engine_registry, "get", lambda *args: query_engine)
+    return use
+
+
+def test_failed_synthesis_raises_for_retrieval_fallback(engine):
+    engine(FailingEngine())
+    with pytest.raises(LLMSynthesisError):
+        rag_service.cached_query_rag(object(), None, "What is an MRI?")
+    with pytest.raises(LLMSynthesisError):
+        list(rag_service.stream_query_rag(object(), None, "What is an MRI?"))
+    # The legacy entry point keeps answering with an apology
+    assert rag_service.query_rag(object(), None, "What is an MRI?") == ("Sorry, an error occurred.", [])
+
+
+def test_stream_failing_before_first_token_raises(engine):
+    engine(FailingEngine(tokens_before_error=0))
+    events = []
+    with pytest.raises(LLMSynthesisError):
+        for event in rag_service.stream_query_rag(object(), None, "What is an MRI?"):
+            events.append(event)
+    assert events == [("sources", [])]
+
+
+def test_stream_failing_mid_answer_keeps_partial_answer(engine):
+    engine(FailingEngine(tokens_before_error=2))
+    events = list(rag_service.stream_query_rag(object(), None, "What is an MRI?"))
+    assert [data for event, data in events if event == "token"] == ["t0 ", "t1 ", " Sorry, an error occurred."]
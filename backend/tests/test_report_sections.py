@@ -0,0 +1,38 @@
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+from app.services import chat_service
+
+
+class SlowLLM:
+    def __init__(self, delay):
+        self.delay = delay
+
+    def complete(self, prompt):
+        time.sleep(self.delay)
+        return '["item"]'
+
+
+@pytest.fixture
+def single_thread_pool(monkeypatch):
+    pool = ThreadPoolExecutor(max_workers=1)
+    monkeypatch.setattr(chat_service, "_report_executor", pool)
+    yield pool
+    pool.shutdown(wait=True)
+
+
+def test_queue_time_does_not_count_against_timeout(single_thread_pool):
+    # The second section waits 0.2s for the only thread, then runs well inside its own 0.3s
+    sections = chat_service.generate_report_sections(SlowLLM(0.2), "history", timeout=0.3)
+    assert sections == {"disease_list": ["item"], "question_list": ["item"]}
+
+
+def test_running_call_past_timeout_falls_back(single_thread_pool):
+    sections = chat_service.generate_report_sections(SlowLLM(0.3), "history", timeout=0.1)
+    assert sections == {section.name: [section.error_fallback] for section in chat_service.REPORT_SECTIONS}
+
+
+def test_pool_covers_every_request_thread():
+    assert chat_service.REPORT_MAX_WORKERS >= 4 * len(chat_service.REPORT_SECTIONS)
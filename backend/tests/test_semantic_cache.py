@@ -0,0 +1,14 @@
+from app.services.query_engines import DEFAULT_ENGINE_CONFIG
+from app.services.semantic_cache import SemanticAnswerCache
+
+
+def test_answers_are_only_reused_under_the_same_variant():
+    cache = SemanticAnswerCache(threshold=0.9)
+    deep = DEFAULT_ENGINE_CONFIG._replace(top_k=20, ef_search=256)
+    cache.store("What is flu?", [1.0, 0.0], "default answer", [])
+    cache.store("What is flu?", [1.0, 0.0], "deep answer", [], deep)
+
+    assert cache.lookup([1.0, 0.01])[0] == "default answer"
+    assert cache.lookup([1.0, 0.01], deep)[0] == "deep answer"
+    assert cache.lookup([1.0, 0.01], DEFAULT_ENGINE_CONFIG._replace(nprobe=64)) is None
+    assert cache.stats()["hits"] == 2 and cache.stats()["misses"] == 1
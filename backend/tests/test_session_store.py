@@ -0,0 +1,43 @@
+import pytest
+
+from app.models import ChatMessage
+from app.services import session_store
+from app.services.session_store import InMemorySessionStore, SessionStore, SQLiteSessionStore, unknown_session
+
+TURN = [ChatMessage(role="user", content="I have a cough"), ChatMessage(role="assistant", content="Since when?")]
+
+
+def test_session_store_is_abstract():
+    with pytest.raises(TypeError):
+        SessionStore()
+
+
+@pytest.mark.parametrize("make_store", [
+    lambda tmp_path: InMemorySessionStore(),
+    lambda tmp_path: SQLiteSessionStore(tmp_path / "sessions.sqlite3"),
+])
+def test_store_round_trip(tmp_path, make_store):
+    store = make_store(tmp_path)
+    assert store.get("s1") is None
+    store.append("s1", TURN)
+    assert store.get("s1") == TURN
+    assert store.stats() == {"sessions": 1, "messages": 2}
+    store.delete("s1")
+    assert store.get("s1") is None
+
+
+def test_unknown_session(monkeypatch):
+    store = InMemorySessionStore()
+    store.append("known", TURN)
+    monkeypatch.setattr(session_store, "session_store", store)
+
+    assert unknown_session("missing", None)
+    assert not unknown_session("known", None)
+    assert not unknown_session("missing", [])  # Full-history clients seed the session themselves
+    assert not unknown_session(None, None)  # First turn: the server assigns a session_id
+
+
+def test_unknown_session_without_store(monkeypatch):
+    monkeypatch.setattr(session_store, "session_store", None)
+    assert unknown_session("s1", None)
+    assert not unknown_session("s1", TURN)
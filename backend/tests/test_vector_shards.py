@@ -0,0 +1,118 @@
+import socket
+import threading
+import time
+from multiprocessing.connection import Listener
+
+import numpy as np
+import pytest
+
+from app.services import vector_shards
+from app.services.vector_shards import (
+    ShardClient, ShardServer, ShardUnavailable, ShardedVectorIndex, merge_hits, shard_of
+)
+
+
+def hit(chunk_id, score):
+    return ({"id": chunk_id, "text": f"chunk {chunk_id}"}, score)
+
+
+def ids(hits):
+    return [record["id"] for record, _ in hits]
+
+
+def test_merge_hits_is_global_top_k_by_score():
+    per_shard = [
+        [hit(1, 0.91), hit(4, 0.40)],
+        [hit(2, 0.95), hit(5, 0.30)],
+        [hit(3, 0.60)],
+    ]
+    assert ids(merge_hits(per_shard, 3)) == [2, 1, 3]
+
+
+def test_merge_hits_handles_empty_and_short_shards():
+    assert merge_hits([], 5) == []
+    assert merge_hits([[], []], 5) == []
+    assert ids(merge_hits([[], [hit(7, 0.2)], [hit(8, 0.9)]], 5)) == [8, 7]
+
+
+def test_merge_hits_keeps_shard_order_on_ties():
+    per_shard = [[hit(1, 0.5)], [hit(2, 0.5)], [hit(3, 0.5)]]
+    assert ids(merge_hits(per_shard, 2)) == [1, 2]
+
+
+@pytest.mark.parametrize("shard_count", [1, 2, 5])
+def test_shard_of_is_in_range_for_python_and_numpy_ids(shard_count):
+    faiss_ids = [0, 1, 17, 2**62 + 3, 2**63 - 1]
+    shards = [shard_of(faiss_id, shard_count) for faiss_id in faiss_ids]
+    assert all(0 <= shard < shard_count for shard in shards)
+    # Ids read back from FAISS are numpy int64
+    assert shards == [shard_of(faiss_id, shard_count) for faiss_id in np.array(faiss_ids, dtype="int64")]
+
+
+AUTHKEY = b"test-shard-key"
+
+
+class FakeShardServer(ShardServer):
+    """ShardServer's connection handling over a canned result instead of an index."""
+
+    def __init__(self, hits):
+        self.name = "fake"
+        self.authkey = AUTHKEY
+        self.hits = hits
+        self.listener = Listener(("127.0.0.1", 0))
+        self.address = self.listener.address
+        threading.Thread(target=self._accept_loop, daemon=True).start()
+
+    def _accept_loop(self):
+        while True:
+            conn = self.listener.accept()
+            threading.Thread(target=self._handle, args=(conn,), daemon=True).start()
+
+    def _dispatch(self, op, kwargs):
+        return self.hits if op == "search" else {"name": self.name, "ntotal": len(self.hits)}
+
+
+@pytest.fixture
+def stalled_address():
+    """Accepts TCP connections and never says a word."""
+    server = socket.create_server(("127.0.0.1", 0))
+    accepted = []
+    threading.Thread(target=lambda: accepted.extend(iter(server.accept, None)), daemon=True).start()
+    yield server.getsockname()
+    server.close()
+
+
+def test_stalled_shard_does_not_starve_healthy_ones(monkeypatch, stalled_address):
+    monkeypatch.setattr(ShardedVectorIndex, "refresh_info", lambda self: None)
+    healthy = FakeShardServer([hit(1, 0.9)])
+    index = ShardedVectorIndex(
+        [ShardClient(stalled_address, AUTHKEY, retry_seconds=60), ShardClient(healthy.address, AUTHKEY)],
+        deadline_ms=200,
+    )
+    started = time.monotonic()
+    for _ in range(12):
+        assert ids(index.search(np.zeros(4, dtype="float32"), 5)) == [1]
+    # The stalled shard costs one deadline; afterwards it is marked down and skipped
+    assert time.monotonic() - started < 2.0
+    stalled_stats = index.stats()["shards"][0]
+    assert not stalled_stats["up"] and stalled_stats["timeouts"] == 1
+    index.close()
+
+
+def test_stalled_handshake_does_not_block_other_clients(monkeypatch):
+    monkeypatch.setattr(vector_shards, "HANDSHAKE_TIMEOUT_SECONDS", 0.5)
+    server = FakeShardServer([hit(2, 0.5)])
+    silent = socket.create_connection(server.address)  # Connects, never answers the challenge
+    try:
+        client = ShardClient(server.address, AUTHKEY)
+        assert ids(client.call("search", timeout=0.3, vector=None, k=1)) == [2]
+    finally:
+        silent.close()
+
+
+def test_wrong_authkey_marks_shard_down():
+    server = FakeShardServer([])
+    client = ShardClient(server.address, b"wrong-key", retry_seconds=60)
+    with pytest.raises(ShardUnavailable):
+        client.call("info", timeout=1.0)
+    assert not client.stats()["up"]